@@ -68,6 +68,48 @@ class Settings(BaseSettings):
     REDIS_URL: str = "redis://localhost:6379/0"
     REDIS_LOCATION_TTL: int = 60  # seconds for location cache
 
+    # Active tracking-session context cache (in process and Redis)
+    TRACKING_CONTEXT_CACHE_ENABLED: bool = True
+    TRACKING_CONTEXT_TTL_SECONDS: int = 43200  # Redis entries, written when a session starts (12 h)
+    TRACKING_CONTEXT_LOCAL_TTL_SECONDS: int = 30  # How long other workers may still see an ended session
+    TRACKING_CONTEXT_LOCAL_MAX_ENTRIES: int = 10_000
+
+    # Location history compaction of ended tracking sessions
+    TRACK_COMPACTION_TOLERANCE_METERS: float = 10.0  # Largest deviation of a dropped fix from the track
+    TRACK_COMPACTION_DELAY_MINUTES: int = 10  # Wait this long after a session ends (late buffered fixes)
+    TRACK_COMPACTION_BATCH_SIZE: int = 200  # Sessions per run
+
+    # Location update write-behind (rows are inserted in bulk by a background thread)
+    LOCATION_WRITE_BEHIND: bool = False
+    LOCATION_FLUSH_INTERVAL_MS: int = 500  # Flush at least this often
+    LOCATION_FLUSH_ROWS: int = 500  # Flush early once this many rows are buffered
+    LOCATION_BUFFER_MAX_ROWS: int = 20_000  # Writers flush inline beyond this (~300 bytes per row)
+
+    # Matching engine spatial index
+    MATCHING_INDEX_ENABLED: bool = True
+    MATCHING_SNAPSHOT_ENABLED: bool = True  # Match routes against the shared columnar snapshot
+    MATCHING_BACKEND: str = "auto"  # "auto" (PostGIS when detected) or "python" (in-process only)
+    MATCHING_INDEX_CELL_DEG: float = 0.05  # Grid cell size in degrees (~5.5 km)
+    MATCHING_INDEX_MAX_AGE_SECONDS: int = 300  # Full rebuild interval (backstop for changes the feed misses)
+    MATCHING_CHANGE_FEED_ENABLED: bool = True  # Share committed package/route changes across workers via Redis
+    MATCHING_FAST_DISTANCE: bool = False  # Haversine instead of geodesic (<=0.6% error)
+    MATCHING_ROUTE_INDEX_CELL_DEG: float = 0.25  # Route corridor grid cell size (~28 km)
+    MATCHING_INCREMENTAL_ENABLED: bool = True  # Match new packages/routes as they are created
+    MATCHING_JOB_WORKERS: int = 1  # Processes the periodic matching job shards routes across
+    ROUTE_OPTIMIZER_TIME_BUDGET_MS: int = 250  # Local search limit for optimized stop order
+    BATCH_ASSIGNMENT_MAX_CANDIDATES_PER_ROUTE: int = 50  # Shortest-detour candidates per route in batch assignment
+    ROUTE_MAX_WAYPOINTS: int = 500  # Intermediate vertices accepted on a courier route
+
+    # Geodesic distance cache (per process)
+    DISTANCE_CACHE_MAX_ENTRIES: int = 200_000  # ~250 bytes per entry
+    DISTANCE_CACHE_TTL_SECONDS: int = 3600
+    DISTANCE_CACHE_PRECISION: int = 6  # Coordinate decimals in cache keys (~11 cm)
+
+    # Per-route match result cache (Redis)
+    MATCH_CACHE_ENABLED: bool = True
+    MATCH_CACHE_TTL_SECONDS: int = 300  # Backstop for changes that don't invalidate
+    MATCH_CACHE_RETRY_SECONDS: int = 30  # Skip Redis for this long after an error
+
     # AWS S3 Configuration
     AWS_ACCESS_KEY_ID: Optional[str] = None
     AWS_SECRET_ACCESS_KEY: Optional[str] = None
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, Enum as SQLEnum, Text, Boolean
+from sqlalchemy import Column, Integer, String, Float, DateTime, ForeignKey, Enum as SQLEnum, Text, Boolean, Index, JSON, event
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from app.models.base import Base
@@ -47,6 +47,14 @@ class Package(Base):
     dropoff_contact_name = Column(String)
     dropoff_contact_phone = Column(String)
 
+    # Geohash cells of pickup and dropoff (kept in sync on write, see _sync_package_cells)
+    pickup_geohash_4 = Column(String(4))
+    pickup_geohash_5 = Column(String(5))
+    pickup_geohash_6 = Column(String(6))
+    dropoff_geohash_4 = Column(String(4))
+    dropoff_geohash_5 = Column(String(5))
+    dropoff_geohash_6 = Column(String(6))
+
     # Status and pricing
     status = Column(SQLEnum(PackageStatus), default=PackageStatus.NEW)
     price = Column(Float)  # Price sender is willing to pay
@@ -79,6 +87,18 @@ class Package(Base):
     # sender = relationship("User", foreign_keys=[sender_id])
     # courier = relationship("User", foreign_keys=[courier_id])
 
+    # Composite indexes for the route corridor bounding-box and cell prefilters
+    __table_args__ = (
+        Index("ix_packages_status_pickup_location", "status", "is_active", "pickup_lat", "pickup_lng"),
+        Index("ix_packages_status_dropoff_location", "status", "is_active", "dropoff_lat", "dropoff_lng"),
+        Index("ix_packages_status_pickup_geohash_4", "status", "is_active", "pickup_geohash_4"),
+        Index("ix_packages_status_pickup_geohash_5", "status", "is_active", "pickup_geohash_5"),
+        Index("ix_packages_status_pickup_geohash_6", "status", "is_active", "pickup_geohash_6"),
+        Index("ix_packages_status_dropoff_geohash_4", "status", "is_active", "dropoff_geohash_4"),
+        Index("ix_packages_status_dropoff_geohash_5", "status", "is_active", "dropoff_geohash_5"),
+        Index("ix_packages_status_dropoff_geohash_6", "status", "is_active", "dropoff_geohash_6"),
+    )
+
     def __repr__(self):
         return f"<Package {self.tracking_id} - {self.status}>"
 
@@ -99,6 +119,20 @@ class CourierRoute(Base):
     end_lat = Column(Float, nullable=False)
     end_lng = Column(Float, nullable=False)
 
+    # Geohash cells of start and end (kept in sync on write, see _sync_route_cells)
+    start_geohash_4 = Column(String(4), index=True)
+    start_geohash_5 = Column(String(5), index=True)
+    start_geohash_6 = Column(String(6), index=True)
+    end_geohash_4 = Column(String(4), index=True)
+    end_geohash_5 = Column(String(5), index=True)
+    end_geohash_6 = Column(String(6), index=True)
+
+    # Intermediate vertices as an encoded polyline (start and end excluded); NULL = straight line
+    waypoints = Column(Text, nullable=True)
+
+    # Precomputed corridor geometry (see app.services.route_corridor); NULL = computed on use
+    corridor = Column(JSON, nullable=True)
+
     # Route preferences
     max_deviation_km = Column(Integer, default=5)
     departure_time = Column(DateTime(timezone=True))
@@ -112,3 +146,28 @@ class CourierRoute(Base):
 
     def __repr__(self):
         return f"<CourierRoute {self.id} - Courier {self.courier_id}>"
+
+
+def _set_cells(target, prefix: str, lat, lng) -> None:
+    # Imported here: app.utils pulls in the auth dependencies, which import the models
+    from app.utils.geohash import cell_columns
+
+    if lat is None or lng is None:
+        return
+    for column, value in cell_columns(prefix, lat, lng).items():
+        setattr(target, column, value)
+
+
+# Keep the geohash cell columns in sync with the coordinates on every ORM write
+@event.listens_for(Package, "before_insert")
+@event.listens_for(Package, "before_update")
+def _sync_package_cells(mapper, connection, target: Package) -> None:
+    _set_cells(target, "pickup", target.pickup_lat, target.pickup_lng)
+    _set_cells(target, "dropoff", target.dropoff_lat, target.dropoff_lng)
+
+
+@event.listens_for(CourierRoute, "before_insert")
+@event.listens_for(CourierRoute, "before_update")
+def _sync_route_cells(mapper, connection, target: CourierRoute) -> None:
+    _set_cells(target, "start", target.start_lat, target.start_lng)
+    _set_cells(target, "end", target.end_lat, target.end_lng)
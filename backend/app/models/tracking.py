@@ -3,7 +3,7 @@ Real-time tracking models for courier location and package tracking.
 """
 import enum
 from datetime import datetime
-from sqlalchemy import Column, Integer, Float, String, DateTime, ForeignKey, Enum, Index, Boolean
+from sqlalchemy import Column, Integer, Float, String, DateTime, ForeignKey, Enum, Index, Boolean, JSON
 from sqlalchemy.orm import relationship
 from app.models.base import Base
 
@@ -49,6 +49,9 @@ class TrackingSession(Base):
     share_live_location = Column(Boolean, default=True, nullable=False)
     update_interval_seconds = Column(Integer, default=30, nullable=False)
 
+    # Simplified location history once the session has ended (see services/trajectory.py)
+    track = Column(JSON, nullable=True)
+
     # Relationships
     package = relationship("Package", backref="tracking_sessions")
     courier = relationship("User", backref="tracking_sessions")
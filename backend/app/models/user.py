@@ -1,6 +1,7 @@
 from sqlalchemy import Column, Integer, String, Boolean, DateTime, Enum as SQLEnum, Float
 from sqlalchemy.sql import func
 from app.models.base import Base
+from app.models.package import PackageSize
 import enum
 
 class UserRole(str, enum.Enum):
@@ -39,6 +40,8 @@ class User(Base):
 
     # Courier-specific fields
     max_deviation_km = Column(Integer, default=5)  # Default 5km deviation
+    vehicle_max_weight_kg = Column(Float, nullable=True)  # Total load limit; None = unlimited
+    vehicle_max_size = Column(SQLEnum(PackageSize), nullable=True)  # Largest size class; None = any
 
     # Language preference (en, fr, es)
     preferred_language = Column(String(5), default='en', nullable=False)
@@ -842,6 +842,125 @@ async def run_matching_job_endpoint(
     )
 
 
+class RunBatchAssignmentRequest(BaseModel):
+    max_candidates_per_route: Optional[int] = Field(
+        default=None, ge=1, le=1000,
+        description="Shortest-detour candidates kept per route (default from settings)"
+    )
+
+
+class SuggestedAssignment(BaseModel):
+    route_id: int
+    courier_id: int
+    package_id: int
+    tracking_id: str | None
+    distance_km: float
+    detour_km: float
+
+
+class BatchAssignmentJobResult(BaseModel):
+    started_at: str
+    completed_at: str
+    routes_considered: int
+    packages_considered: int
+    candidate_pairs: int
+    assignments_made: int
+    total_detour_km: float
+    solve_ms: float
+    assignments: List[SuggestedAssignment]
+
+
+@router.post("/jobs/run-assignment", response_model=BatchAssignmentJobResult)
+async def run_batch_assignment_endpoint(
+    request: RunBatchAssignmentRequest,
+    db: Session = Depends(get_db),
+    admin: User = Depends(get_current_admin_user)
+):
+    """
+    Suggest a one-to-one assignment of open packages to active routes (admin only).
+
+    Pairs as many packages with routes as possible, each route taking at
+    most one package, with the smallest total detour. Nothing is changed
+    and no notifications are sent.
+
+    Args:
+        request: Job configuration options
+        admin: Current admin user
+
+    Returns:
+        Suggested route-package pairs with their detour
+    """
+    from app.services.batch_assignment import run_batch_assignment_job
+
+    results = run_batch_assignment_job(
+        max_candidates_per_route=request.max_candidates_per_route,
+        db=db
+    )
+
+    return BatchAssignmentJobResult(
+        started_at=results['started_at'],
+        completed_at=results['completed_at'],
+        routes_considered=results['routes_considered'],
+        packages_considered=results['packages_considered'],
+        candidate_pairs=results['candidate_pairs'],
+        assignments_made=results['assignments_made'],
+        total_detour_km=results['total_detour_km'],
+        solve_ms=results['solve_ms'],
+        assignments=[SuggestedAssignment(**a) for a in results['assignments']]
+    )
+
+
+class MatchCacheStats(BaseModel):
+    enabled: bool
+    hits: int
+    misses: int
+    hit_rate: float
+    invalidations: int
+    errors: int
+
+
+@router.get("/matching/cache-stats", response_model=MatchCacheStats)
+async def get_match_cache_stats(
+    admin: User = Depends(get_current_admin_user)
+):
+    """
+    Get hit/miss counters of the per-route match cache (admin only).
+
+    Counters are per API process and reset on restart.
+    """
+    from app.services.match_cache import match_cache
+
+    return MatchCacheStats(**match_cache.stats())
+
+
+class DistanceCacheStats(BaseModel):
+    hits: int
+    misses: int
+    hit_rate: float
+    size: int
+    max_entries: int
+    evictions: int
+    expirations: int
+    ttl_seconds: float
+    precision: int
+
+
+@router.get("/matching/distance-cache-stats", response_model=DistanceCacheStats)
+async def get_distance_cache_stats(
+    admin: User = Depends(get_current_admin_user)
+):
+    """
+    Get hit rate and occupancy of the geodesic distance cache (admin only).
+
+    Use these to size DISTANCE_CACHE_MAX_ENTRIES: a high eviction count with
+    a low hit rate means the working set does not fit. Counters are per API
+    process and reset on restart.
+    """
+    from app.utils.geo import distance_cache
+
+    return DistanceCacheStats(**distance_cache.stats())
+
+
 # Audit Log Endpoints
 @router.get("/audit-logs", response_model=AuditLogListResponse)
 async def get_audit_logs(
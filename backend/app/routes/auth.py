@@ -12,6 +12,7 @@ from slowapi.util import get_remote_address
 from app.config import settings
 from app.database import get_db
 from app.models.user import User, UserRole
+from app.models.package import PackageSize
 from app.models.rating import Rating
 from app.utils.auth import get_password_hash, verify_password, create_access_token
 from app.utils.dependencies import get_current_user
@@ -97,6 +98,8 @@ class UserResponse(BaseModel):
     is_active: bool
     is_verified: bool
     max_deviation_km: int
+    vehicle_max_weight_kg: float | None = None
+    vehicle_max_size: str | None = None
     default_address: str | None = None
     default_address_lat: float | None = None
     default_address_lng: float | None = None
@@ -113,6 +116,8 @@ class UserUpdate(BaseModel):
     full_name: str | None = None
     phone_number: str | None = None
     max_deviation_km: int | None = Field(default=None, ge=1, le=50)
+    vehicle_max_weight_kg: float | None = Field(default=None, gt=0)
+    vehicle_max_size: str | None = Field(default=None, pattern="^(small|medium|large|extra_large)$")
     default_address: str | None = None
     default_address_lat: float | None = None
     default_address_lng: float | None = None
@@ -282,6 +287,8 @@ async def get_current_user_info(
         is_active=current_user.is_active,
         is_verified=current_user.is_verified,
         max_deviation_km=current_user.max_deviation_km,
+        vehicle_max_weight_kg=current_user.vehicle_max_weight_kg,
+        vehicle_max_size=current_user.vehicle_max_size.value if current_user.vehicle_max_size else None,
         default_address=current_user.default_address,
         default_address_lat=current_user.default_address_lat,
         default_address_lng=current_user.default_address_lng,
@@ -304,6 +311,8 @@ async def update_current_user(
     - **full_name**: User's full name
     - **phone_number**: Phone number
     - **max_deviation_km**: Maximum deviation distance for couriers (1-50 km)
+    - **vehicle_max_weight_kg**: Heaviest total load the courier's vehicle carries (null removes the limit)
+    - **vehicle_max_size**: Largest package size the vehicle carries (null removes the limit)
     - **default_address**: Default address for package pickup
     - **default_address_lat**: Latitude of default address
     - **default_address_lng**: Longitude of default address
@@ -315,6 +324,13 @@ async def update_current_user(
         current_user.phone_number = user_data.phone_number
     if user_data.max_deviation_km is not None:
         current_user.max_deviation_km = user_data.max_deviation_km
+    # Vehicle limits can be cleared with an explicit null
+    if "vehicle_max_weight_kg" in user_data.model_fields_set:
+        current_user.vehicle_max_weight_kg = user_data.vehicle_max_weight_kg
+    if "vehicle_max_size" in user_data.model_fields_set:
+        current_user.vehicle_max_size = (
+            PackageSize(user_data.vehicle_max_size) if user_data.vehicle_max_size else None
+        )
     if user_data.default_address is not None:
         current_user.default_address = user_data.default_address
     if user_data.default_address_lat is not None:
@@ -342,6 +358,8 @@ async def update_current_user(
         is_active=current_user.is_active,
         is_verified=current_user.is_verified,
         max_deviation_km=current_user.max_deviation_km,
+        vehicle_max_weight_kg=current_user.vehicle_max_weight_kg,
+        vehicle_max_size=current_user.vehicle_max_size.value if current_user.vehicle_max_size else None,
         default_address=current_user.default_address,
         default_address_lat=current_user.default_address_lat,
         default_address_lng=current_user.default_address_lng,
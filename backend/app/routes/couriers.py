@@ -6,23 +6,30 @@ from app.models.package import CourierRoute, Package, PackageStatus
 from app.models.user import User, UserRole
 from app.models.notification import NotificationType
 from app.utils.dependencies import get_current_user
-from app.utils.geo import haversine_distance
 from app.routes.notifications import create_notification, create_notification_with_broadcast
 from app.utils.email import send_route_match_found_email
+from app.services.matching_engine import matching_engine
+from app.services.incremental_matching import record_route_matches
+from app.services.spatial_index import route_index
+from app.services.route_corridor import store_corridor
 from app.services.audit_service import log_route_create, log_route_update, log_route_delete
 from app.services.route_deactivation_service import (
     has_active_deliveries,
     handle_route_deactivation
 )
-from pydantic import BaseModel, Field
+from app.config import settings
+from app.utils.polyline import decode_polyline, encode_polyline
+from pydantic import BaseModel, Field, field_validator
 from typing import List
 from datetime import datetime
-from shapely.geometry import LineString, Point
-from shapely.ops import nearest_points
 
 router = APIRouter()
 
 # Pydantic Schemas
+class RouteWaypoint(BaseModel):
+    lat: float = Field(..., ge=-90, le=90)
+    lng: float = Field(..., ge=-180, le=180)
+
 class RouteCreate(BaseModel):
     start_address: str = Field(..., min_length=1)
     start_lat: float = Field(..., ge=-90, le=90)
@@ -30,6 +37,8 @@ class RouteCreate(BaseModel):
     end_address: str = Field(..., min_length=1)
     end_lat: float = Field(..., ge=-90, le=90)
     end_lng: float = Field(..., ge=-180, le=180)
+    # Intermediate points in driving order, start and end excluded
+    waypoints: List[RouteWaypoint] = Field(default_factory=list, max_length=settings.ROUTE_MAX_WAYPOINTS)
     max_deviation_km: int = Field(default=5, ge=1, le=50)
     departure_time: datetime | None = None
     trip_date: datetime | None = None
@@ -38,6 +47,7 @@ class RouteUpdate(BaseModel):
     end_address: str | None = Field(None, min_length=1)
     end_lat: float | None = Field(None, ge=-90, le=90)
     end_lng: float | None = Field(None, ge=-180, le=180)
+    waypoints: List[RouteWaypoint] | None = Field(None, max_length=settings.ROUTE_MAX_WAYPOINTS)
     max_deviation_km: int | None = Field(None, ge=1, le=50)
     departure_time: datetime | None = None
     trip_date: datetime | None = None
@@ -51,6 +61,7 @@ class RouteResponse(BaseModel):
     end_address: str
     end_lat: float
     end_lng: float
+    waypoints: List[RouteWaypoint] = []
     max_deviation_km: int
     departure_time: datetime | None
     trip_date: datetime | None
@@ -60,6 +71,23 @@ class RouteResponse(BaseModel):
     class Config:
         from_attributes = True
 
+    @field_validator("waypoints", mode="before")
+    @classmethod
+    def decode_waypoints(cls, value):
+        """Routes store their waypoints as an encoded polyline."""
+        if value is None:
+            return []
+        if isinstance(value, str):
+            return [{"lat": lat, "lng": lng} for lat, lng in decode_polyline(value)]
+        return value
+
+
+def encode_waypoints(waypoints: List[RouteWaypoint]) -> str | None:
+    """Encoded polyline stored on CourierRoute.waypoints (None for a straight route)."""
+    if not waypoints:
+        return None
+    return encode_polyline([(point.lat, point.lng) for point in waypoints])
+
 
 def verify_courier_role(user: User):
     """Helper function to verify user has courier role"""
@@ -70,44 +98,6 @@ def verify_courier_role(user: User):
         )
 
 
-def count_matching_packages(db: Session, route: CourierRoute) -> int:
-    """Count packages that match a courier route."""
-    route_line = LineString([
-        (route.start_lng, route.start_lat),
-        (route.end_lng, route.end_lat)
-    ])
-
-    available_packages = db.query(Package).filter(
-        and_(
-            Package.status == PackageStatus.OPEN_FOR_BIDS,
-            Package.is_active == True
-        )
-    ).all()
-
-    count = 0
-    for package in available_packages:
-        pickup_point = Point(package.pickup_lng, package.pickup_lat)
-        dropoff_point = Point(package.dropoff_lng, package.dropoff_lat)
-
-        pickup_nearest = nearest_points(route_line, pickup_point)[0]
-        dropoff_nearest = nearest_points(route_line, dropoff_point)[0]
-
-        pickup_distance = haversine_distance(
-            pickup_point.y, pickup_point.x,
-            pickup_nearest.y, pickup_nearest.x
-        )
-        dropoff_distance = haversine_distance(
-            dropoff_point.y, dropoff_point.x,
-            dropoff_nearest.y, dropoff_nearest.x
-        )
-
-        max_distance = max(pickup_distance, dropoff_distance)
-        if max_distance <= route.max_deviation_km:
-            count += 1
-
-    return count
-
-
 @router.post("/routes", status_code=status.HTTP_201_CREATED, response_model=RouteResponse)
 async def create_route(
     request: Request,
@@ -158,26 +148,41 @@ async def create_route(
         end_address=route.end_address,
         end_lat=route.end_lat,
         end_lng=route.end_lng,
+        waypoints=encode_waypoints(route.waypoints),
         max_deviation_km=route.max_deviation_km,
         departure_time=route.departure_time,
         trip_date=route.trip_date,
         is_active=True
     )
+    store_corridor(new_route)
 
     db.add(new_route)
     db.commit()
     db.refresh(new_route)
 
+    # Keep the reverse-matching route index in sync
+    for existing_route in existing_routes:
+        route_index.remove(existing_route.id)
+    route_index.sync_route(new_route)
+
     # Audit log route creation
     log_route_create(
         db, current_user, new_route.id,
-        {"start": route.start_address, "end": route.end_address, "max_deviation_km": route.max_deviation_km},
+        {
+            "start": route.start_address,
+            "end": route.end_address,
+            "waypoints": len(route.waypoints),
+            "max_deviation_km": route.max_deviation_km
+        },
         request
     )
 
-    # Check for matching packages and notify courier
-    matching_count = count_matching_packages(db, new_route)
+    # Match the route against open packages and notify courier
+    matches = matching_engine.match_route(db, new_route)
+    matching_count = len(matches)
     if matching_count > 0:
+        # Per-package notifications are committed with the summary below
+        record_route_matches(db, new_route, matches)
         # Create in-app notification with WebSocket broadcast
         await create_notification_with_broadcast(
             db=db,
@@ -257,8 +262,9 @@ async def update_route(
     """
     Update route details.
 
-    Only end address, deviation, and departure time can be updated.
-    Start address is locked once route is created.
+    Only end address, waypoints, deviation, and departure time can be updated.
+    Start address is locked once route is created. An empty waypoints list
+    turns the route back into a straight line.
     """
     verify_courier_role(current_user)
 
@@ -288,6 +294,13 @@ async def update_route(
     if route_update.end_lng is not None:
         changes["end_lng"] = {"old": route.end_lng, "new": route_update.end_lng}
         route.end_lng = route_update.end_lng
+    if route_update.waypoints is not None:
+        waypoints = encode_waypoints(route_update.waypoints)
+        changes["waypoints"] = {
+            "old": len(decode_polyline(route.waypoints)) if route.waypoints else 0,
+            "new": len(route_update.waypoints)
+        }
+        route.waypoints = waypoints
     if route_update.max_deviation_km is not None:
         changes["max_deviation_km"] = {"old": route.max_deviation_km, "new": route_update.max_deviation_km}
         route.max_deviation_km = route_update.max_deviation_km
@@ -297,9 +310,11 @@ async def update_route(
     if route_update.trip_date is not None:
         changes["trip_date"] = {"old": str(route.trip_date), "new": str(route_update.trip_date)}
         route.trip_date = route_update.trip_date
+    store_corridor(route)
 
     db.commit()
     db.refresh(route)
+    route_index.sync_route(route)
 
     # Audit log route update
     if changes:
@@ -346,6 +361,7 @@ async def delete_route(
     # Soft delete
     route.is_active = False
     db.commit()
+    route_index.remove(route_id)
 
     # Audit log route deletion
     log_route_delete(db, current_user, route_id, request)
@@ -423,9 +439,17 @@ async def activate_route(
     db.commit()
     db.refresh(route)
 
-    # Check for matching packages and notify courier
-    matching_count = count_matching_packages(db, route)
+    # Keep the reverse-matching route index in sync
+    for existing_route in existing_routes:
+        route_index.remove(existing_route.id)
+    route_index.sync_route(route)
+
+    # Match the route against open packages and notify courier
+    matches = matching_engine.match_route(db, route)
+    matching_count = len(matches)
     if matching_count > 0:
+        # Per-package notifications are committed with the summary below
+        record_route_matches(db, route, matches)
         # Create in-app notification with WebSocket broadcast
         await create_notification_with_broadcast(
             db=db,
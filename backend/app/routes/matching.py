@@ -1,47 +1,24 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, status
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 from sqlalchemy import and_
 from app.database import get_db
 from pydantic import BaseModel
-from typing import List
-from shapely.geometry import LineString, Point
-from shapely.ops import nearest_points
+from typing import Iterable, List, Optional, Tuple
+from datetime import datetime
+import base64
+import time
 
 from app.models.package import Package, PackageStatus, CourierRoute
 from app.models.user import User, UserRole
 from app.utils.dependencies import get_current_user
-from app.utils.geo import haversine_distance
 from app.services.route_deactivation_service import is_route_expired
+from app.services.matching_engine import matching_engine
+from app.services.match_cache import match_cache
 
 router = APIRouter()
 
 
-def calculate_detour(route_line: LineString, pickup_point: Point, dropoff_point: Point) -> float:
-    """
-    Calculate the detour distance required to pickup and deliver a package.
-    Returns the additional distance in km compared to the direct route.
-    """
-    # Find nearest points on route to pickup and dropoff
-    pickup_on_route = nearest_points(route_line, pickup_point)[0]
-    dropoff_on_route = nearest_points(route_line, dropoff_point)[0]
-
-    # Calculate distances
-    pickup_detour = haversine_distance(
-        pickup_point.y, pickup_point.x,
-        pickup_on_route.y, pickup_on_route.x
-    )
-    dropoff_detour = haversine_distance(
-        dropoff_point.y, dropoff_point.x,
-        dropoff_on_route.y, dropoff_on_route.x
-    )
-    delivery_distance = haversine_distance(
-        pickup_point.y, pickup_point.x,
-        dropoff_point.y, dropoff_point.x
-    )
-
-    return pickup_detour + dropoff_detour + delivery_distance
-
-
 class MatchedPackageResponse(BaseModel):
     package_id: int
     tracking_id: str
@@ -64,9 +41,83 @@ class MatchedPackageResponse(BaseModel):
     dropoff_contact_phone: str | None
 
 
+class MatchedRouteResponse(BaseModel):
+    route_id: int
+    courier_id: int
+    courier_name: str | None
+    start_address: str
+    start_lat: float
+    start_lng: float
+    end_address: str
+    end_lat: float
+    end_lng: float
+    max_deviation_km: int
+    departure_time: datetime | None
+    trip_date: datetime | None
+    distance_from_route_km: float
+    estimated_detour_km: float
+
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def encode_match_cursor(estimated_detour_km: float, package_id: int) -> str:
+    """Opaque cursor pointing after a match in (detour, package id) order."""
+    return base64.urlsafe_b64encode(f"{estimated_detour_km!r}:{package_id}".encode()).decode().rstrip("=")
+
+
+def decode_match_cursor(cursor: str) -> Tuple[float, int]:
+    """
+    Decode a cursor from encode_match_cursor().
+
+    Raises:
+        ValueError: If the cursor is malformed
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        detour, package_id = raw.split(":")
+        return float(detour), int(package_id)
+    except Exception as e:
+        raise ValueError(f"Invalid cursor: {cursor!r}") from e
+
+
+def matched_package_response(match) -> MatchedPackageResponse:
+    package = match['package']
+    return MatchedPackageResponse(
+        package_id=package.id,
+        tracking_id=package.tracking_id,
+        sender_id=package.sender_id,
+        description=package.description,
+        size=package.size.value,
+        weight_kg=package.weight_kg,
+        pickup_address=package.pickup_address,
+        pickup_lat=package.pickup_lat,
+        pickup_lng=package.pickup_lng,
+        dropoff_address=package.dropoff_address,
+        dropoff_lat=package.dropoff_lat,
+        dropoff_lng=package.dropoff_lng,
+        price=package.price,
+        distance_from_route_km=match['distance_from_route_km'],
+        estimated_detour_km=match['estimated_detour_km'],
+        pickup_contact_name=package.pickup_contact_name,
+        pickup_contact_phone=package.pickup_contact_phone,
+        dropoff_contact_name=package.dropoff_contact_name,
+        dropoff_contact_phone=package.dropoff_contact_phone,
+    )
+
+
+def _ndjson_lines(items: Iterable[MatchedPackageResponse]):
+    for item in items:
+        yield item.model_dump_json() + "\n"
+
+
 @router.get("/packages-along-route/{route_id}", response_model=List[MatchedPackageResponse])
 async def get_packages_along_route(
     route_id: int,
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=500),
+    cursor: Optional[str] = None,
+    format: str = Query("json", pattern="^(json|ndjson)$"),
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
@@ -75,12 +126,20 @@ async def get_packages_along_route(
 
     Algorithm:
     1. Get courier route and validate ownership
-    2. Create LineString from route coordinates
-    3. Query all pending packages
-    4. For each package:
-       - Calculate distance from pickup/dropoff to route line
-       - If within max_deviation_km, calculate detour distance
-    5. Sort by detour distance (shortest first)
+    2. Run the shared matching engine:
+       - Load open packages inside the route corridor
+       - Calculate distance from pickup/dropoff to route line and detour
+       - Keep packages within max_deviation_km
+    3. Sort by detour distance (shortest first)
+
+    Results are cached per route in Redis until the route changes or a
+    package inside its corridor changes status, so repeat views skip matching.
+
+    Pagination: with `limit`, only the `limit` shortest-detour packages are
+    returned (top-K, ties broken by package id). If there are more, the
+    X-Next-Cursor response header holds a cursor; pass it back as `cursor`
+    for the next page. With `format=ndjson` the matches are streamed as
+    newline-delimited JSON, one package per line.
     """
     # Verify courier role
     if current_user.role not in [UserRole.COURIER, UserRole.BOTH]:
@@ -112,71 +171,120 @@ async def get_packages_along_route(
             detail=f"This route has expired. Trip date {trip_date_str} has passed."
         )
 
-    # Create route line (Shapely uses lng, lat order)
-    route_line = LineString([
-        (route.start_lng, route.start_lat),
-        (route.end_lng, route.end_lat)
-    ])
-
-    # Get all packages open for bids
-    pending_packages = db.query(Package).filter(
-        and_(
-            Package.status == PackageStatus.OPEN_FOR_BIDS,
-            Package.is_active == True
+    try:
+        after = decode_match_cursor(cursor) if cursor else None
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+    paged = limit is not None or after is not None
+    # One extra match tells whether there is a next page
+    fetch = limit + 1 if limit is not None else None
+
+    cached, cache_version = await match_cache.get(route)
+    looked_up_at = time.monotonic()
+    if cached is not None:
+        # Cached matches are already in (detour, package id) order
+        if after is not None:
+            cached = [m for m in cached if (m['estimated_detour_km'], m['package_id']) > after]
+        if fetch is not None:
+            cached = cached[:fetch]
+        if not paged and format == "json":
+            return cached
+        matched_packages = [MatchedPackageResponse(**m) for m in cached]
+    elif paged:
+        # Only the requested page is materialized; the cache only stores full results
+        matched_packages = [
+            matched_package_response(m)
+            for m in matching_engine.match_route_top(db, route, fetch, after)
+        ]
+    else:
+        matched_packages = [matched_package_response(m) for m in matching_engine.match_route(db, route)]
+        # Changes behind a newer version may not have reached this process's snapshot or index yet
+        synced_at = matching_engine.synced_at(db)
+        if synced_at is not None and synced_at >= looked_up_at:
+            await match_cache.set(route.id, cache_version, [m.model_dump() for m in matched_packages])
+
+    headers = {}
+    if limit is not None and len(matched_packages) > limit:
+        matched_packages = matched_packages[:limit]
+        last = matched_packages[-1]
+        headers[NEXT_CURSOR_HEADER] = encode_match_cursor(last.estimated_detour_km, last.package_id)
+
+    if format == "ndjson":
+        return StreamingResponse(
+            _ndjson_lines(matched_packages),
+            media_type="application/x-ndjson",
+            headers=headers
         )
-    ).all()
 
-    matched_packages = []
+    response.headers.update(headers)
+    # Matches are already ranked by detour distance (shortest first)
+    return matched_packages
 
-    for package in pending_packages:
-        pickup_point = Point(package.pickup_lng, package.pickup_lat)
-        dropoff_point = Point(package.dropoff_lng, package.dropoff_lat)
 
-        # Calculate distance from route to pickup and dropoff
-        pickup_nearest = nearest_points(route_line, pickup_point)[0]
-        dropoff_nearest = nearest_points(route_line, dropoff_point)[0]
+@router.get("/routes-for-package/{package_id}", response_model=List[MatchedRouteResponse])
+async def get_routes_for_package(
+    package_id: int,
+    limit: int = Query(50, ge=1, le=500),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Find active courier routes that can carry a package, shortest detour first.
 
-        pickup_distance = haversine_distance(
-            pickup_point.y, pickup_point.x,
-            pickup_nearest.y, pickup_nearest.x
+    Only the package's sender and admins can run reverse matching. Candidate
+    routes come from the in-memory route corridor index, so only routes that
+    pass the distance check are loaded from the database.
+    """
+    package = db.query(Package).filter(
+        and_(
+            Package.id == package_id,
+            Package.is_active == True
         )
-        dropoff_distance = haversine_distance(
-            dropoff_point.y, dropoff_point.x,
-            dropoff_nearest.y, dropoff_nearest.x
+    ).first()
+
+    if not package:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Package not found"
         )
 
-        # Check if within deviation
-        max_distance = max(pickup_distance, dropoff_distance)
-
-        if max_distance <= route.max_deviation_km:
-            detour = calculate_detour(route_line, pickup_point, dropoff_point)
-
-            matched_packages.append(MatchedPackageResponse(
-                package_id=package.id,
-                tracking_id=package.tracking_id,
-                sender_id=package.sender_id,
-                description=package.description,
-                size=package.size.value,
-                weight_kg=package.weight_kg,
-                pickup_address=package.pickup_address,
-                pickup_lat=package.pickup_lat,
-                pickup_lng=package.pickup_lng,
-                dropoff_address=package.dropoff_address,
-                dropoff_lat=package.dropoff_lat,
-                dropoff_lng=package.dropoff_lng,
-                price=package.price,
-                distance_from_route_km=round(max_distance, 2),
-                estimated_detour_km=round(detour, 2),
-                pickup_contact_name=package.pickup_contact_name,
-                pickup_contact_phone=package.pickup_contact_phone,
-                dropoff_contact_name=package.dropoff_contact_name,
-                dropoff_contact_phone=package.dropoff_contact_phone,
-            ))
-
-    # Sort by detour distance (optimize for shortest detours first)
-    matched_packages.sort(key=lambda x: x.estimated_detour_km)
+    if current_user.role != UserRole.ADMIN and package.sender_id != current_user.id:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Only the package sender can view matching routes"
+        )
 
-    return matched_packages
+    # A sender has at most one active route of their own, which is skipped
+    matches = [
+        match for match in matching_engine.match_package(db, package, limit + 1)
+        if match['route'].courier_id != package.sender_id
+    ][:limit]
+
+    courier_ids = {match['route'].courier_id for match in matches}
+    courier_names = dict(
+        db.query(User.id, User.full_name).filter(User.id.in_(courier_ids)).all()
+    ) if courier_ids else {}
+
+    return [
+        MatchedRouteResponse(
+            route_id=match['route'].id,
+            courier_id=match['route'].courier_id,
+            courier_name=courier_names.get(match['route'].courier_id),
+            start_address=match['route'].start_address,
+            start_lat=match['route'].start_lat,
+            start_lng=match['route'].start_lng,
+            end_address=match['route'].end_address,
+            end_lat=match['route'].end_lat,
+            end_lng=match['route'].end_lng,
+            max_deviation_km=match['route'].max_deviation_km,
+            departure_time=match['route'].departure_time,
+            trip_date=match['route'].trip_date,
+            distance_from_route_km=match['distance_from_route_km'],
+            estimated_detour_km=match['estimated_detour_km'],
+        )
+        for match in matches
+    ]
 
 
 @router.get("/optimized-route/{route_id}")
@@ -186,9 +294,13 @@ async def get_optimized_route(
     db: Session = Depends(get_db)
 ):
     """
-    Get optimized route with all accepted packages ordered by position along the route.
+    Get optimized route with all accepted packages in driving order.
+
+    Stops are ordered to minimize total distance from the route start to
+    the route end, with every pickup before its package's dropoff. Packages
+    already in transit only contribute their dropoff.
     """
-    from app.services.route_optimizer import optimize_package_order
+    from app.services.route_optimizer import optimize_package_order, route_distance_km
 
     # Verify courier role
     if current_user.role not in [UserRole.COURIER, UserRole.BOTH]:
@@ -226,7 +338,10 @@ async def get_optimized_route(
             "start": {"address": route.start_address, "lat": route.start_lat, "lng": route.start_lng},
             "end": {"address": route.end_address, "lat": route.end_lat, "lng": route.end_lng},
             "stops": [],
-            "total_stops": 0
+            "total_stops": 0,
+            "total_distance_km": round(route_distance_km(
+                (route.start_lat, route.start_lng), (route.end_lat, route.end_lng), []
+            ), 2)
         }
 
     # Optimize order
@@ -241,5 +356,8 @@ async def get_optimized_route(
         "start": {"address": route.start_address, "lat": route.start_lat, "lng": route.start_lng},
         "end": {"address": route.end_address, "lat": route.end_lat, "lng": route.end_lng},
         "stops": optimized_stops,
-        "total_stops": len(optimized_stops)
+        "total_stops": len(optimized_stops),
+        "total_distance_km": round(route_distance_km(
+            (route.start_lat, route.start_lng), (route.end_lat, route.end_lng), optimized_stops
+        ), 2)
     }
@@ -1,3 +1,5 @@
+import logging
+
 from fastapi import APIRouter, Depends, HTTPException, status, BackgroundTasks, Request
 from sqlalchemy.orm import Session
 from app.database import get_db
@@ -11,6 +13,7 @@ from app.utils.email import (
     send_package_delivered_email,
     send_package_cancelled_email,
 )
+from app.services.incremental_matching import match_new_package
 from app.services.audit_service import (
     log_package_create,
     log_package_update,
@@ -33,6 +36,7 @@ from geopy.exc import GeocoderTimedOut, GeocoderServiceError
 from app.utils.tracking_id import generate_tracking_id, is_valid_tracking_id
 
 router = APIRouter()
+logger = logging.getLogger(__name__)
 
 # Initialize geocoder
 geolocator = Nominatim(user_agent="chaski")
@@ -237,6 +241,13 @@ async def create_package(
         request
     )
 
+    # Notify couriers whose active route fits this package right away
+    try:
+        await match_new_package(db, new_package)
+    except Exception as e:
+        logger.error(f"Incremental matching failed for package {new_package.id}: {e}")
+        db.rollback()
+
     return new_package
 
 
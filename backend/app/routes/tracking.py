@@ -12,8 +12,10 @@ from app.models.user import User
 from app.models.package import Package, PackageStatus
 from app.models.tracking import TrackingSession, TrackingEventType
 from app.utils.dependencies import get_current_user
-from app.services.tracking_service import TrackingService
+from app.services.location_buffer import LocationBufferFull
+from app.services.tracking_service import LocationRecord, TrackingService
 from app.services.redis_client import RedisClient, get_redis
+from app.schemas.tracking import LocationBatchRequest, LocationUpdateRequest
 
 router = APIRouter()
 
@@ -27,18 +29,6 @@ def get_package_by_tracking_id(db: Session, tracking_id: str) -> Package | None:
 
 
 # Pydantic models
-class LocationUpdateRequest(BaseModel):
-    """Request model for location update."""
-    latitude: float = Field(..., ge=-90, le=90)
-    longitude: float = Field(..., ge=-180, le=180)
-    accuracy_meters: Optional[float] = Field(None, ge=0)
-    altitude_meters: Optional[float] = None
-    heading: Optional[float] = Field(None, ge=0, le=360)
-    speed_mps: Optional[float] = Field(None, ge=0)
-    battery_level: Optional[float] = Field(None, ge=0, le=100)
-    source: str = Field(default="gps")
-
-
 class StartTrackingRequest(BaseModel):
     """Request model for starting a tracking session."""
     initial_latitude: Optional[float] = Field(None, ge=-90, le=90)
@@ -65,6 +55,12 @@ class LocationResponse(BaseModel):
     distance_remaining_meters: Optional[float]
 
 
+class LocationBatchResponse(BaseModel):
+    """Response model for a batch location upload."""
+    accepted: int
+    location: LocationResponse
+
+
 class TrackingSessionResponse(BaseModel):
     """Response model for tracking session."""
     id: int
@@ -99,8 +95,8 @@ class TrackingEventResponse(BaseModel):
 
 
 class LocationHistoryResponse(BaseModel):
-    """Response model for location history entry."""
-    id: int
+    """Response model for location history entry (no id for fixes from a compacted track)."""
+    id: Optional[int]
     latitude: float
     longitude: float
     accuracy_meters: Optional[float]
@@ -210,49 +206,28 @@ async def update_location(
     Update courier location for a tracking session.
     Only the courier can update their location.
     """
-    session = await tracking_service.get_session_by_id(session_id)
-    if not session:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Tracking session not found"
-        )
+    record = await _record_locations(tracking_service, session_id, [request.model_dump()], current_user)
+    return _location_to_response(record)
 
-    if session.courier_id != current_user.id:
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="You are not authorized to update this session"
-        )
 
-    if not session.is_active:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Tracking session is not active"
-        )
+@router.post("/sessions/{session_id}/locations", response_model=LocationBatchResponse)
+async def upload_locations(
+    session_id: int,
+    request: LocationBatchRequest,
+    current_user: User = Depends(get_current_user),
+    tracking_service: TrackingService = Depends(get_tracking_service),
+    db: Session = Depends(get_db)
+):
+    """
+    Upload several location fixes for a tracking session, e.g. fixes
+    buffered while the courier was offline.
+    All fixes are stored; the session and live subscribers get the latest one.
+    Only the courier can update their location.
+    """
+    fixes = [fix.model_dump() for fix in request.fixes]
+    record = await _record_locations(tracking_service, session_id, fixes, current_user)
 
-    location_update = await tracking_service.update_location(
-        session_id=session_id,
-        latitude=request.latitude,
-        longitude=request.longitude,
-        accuracy_meters=request.accuracy_meters,
-        altitude_meters=request.altitude_meters,
-        heading=request.heading,
-        speed_mps=request.speed_mps,
-        battery_level=request.battery_level,
-        source=request.source
-    )
-
-    # Refresh session to get updated ETA
-    session = await tracking_service.get_session_by_id(session_id)
-
-    return LocationResponse(
-        latitude=location_update.latitude,
-        longitude=location_update.longitude,
-        heading=location_update.heading,
-        speed_mps=location_update.speed_mps,
-        timestamp=location_update.timestamp.isoformat(),
-        estimated_arrival=session.estimated_arrival.isoformat() if session.estimated_arrival else None,
-        distance_remaining_meters=session.distance_remaining_meters
-    )
+    return LocationBatchResponse(accepted=len(fixes), location=_location_to_response(record))
 
 
 @router.post("/sessions/{session_id}/delay", response_model=TrackingEventResponse)
@@ -463,6 +438,64 @@ async def get_tracking_events(
 
 
 # Helper functions
+async def _record_locations(
+    tracking_service: TrackingService,
+    session_id: int,
+    fixes: List[dict],
+    current_user: User
+) -> LocationRecord:
+    """
+    Record a courier's fixes for their active session.
+
+    The session is only loaded to tell why an update was refused, so
+    accepted updates can be served from the tracking context cache (the
+    service already retried stale cached contexts from the database).
+    """
+    try:
+        return await tracking_service.record_locations(session_id, fixes, courier_id=current_user.id)
+    except ValueError:
+        pass
+    except LocationBufferFull:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Location updates are backed up, send them again shortly",
+            headers={"Retry-After": "1"}
+        )
+
+    session = await tracking_service.get_session_by_id(session_id)
+    if not session:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Tracking session not found"
+        )
+
+    if session.courier_id != current_user.id:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="You are not authorized to update this session"
+        )
+
+    # Not active, or ended since it was refused
+    raise HTTPException(
+        status_code=status.HTTP_400_BAD_REQUEST,
+        detail="Tracking session is not active"
+    )
+
+
+def _location_to_response(record: LocationRecord) -> LocationResponse:
+    """Convert a recorded fix and its session's new ETA to a response."""
+    location, session = record
+    return LocationResponse(
+        latitude=location.latitude,
+        longitude=location.longitude,
+        heading=location.heading,
+        speed_mps=location.speed_mps,
+        timestamp=location.timestamp.isoformat(),
+        estimated_arrival=session.estimated_arrival.isoformat() if session.estimated_arrival else None,
+        distance_remaining_meters=session.distance_remaining_meters
+    )
+
+
 def _session_to_response(session: TrackingSession) -> TrackingSessionResponse:
     """Convert tracking session model to response."""
     return TrackingSessionResponse(
@@ -5,16 +5,22 @@ Provides authenticated WebSocket connections for:
 - Real-time notification delivery
 - Package status updates
 - Matching event notifications
+- Courier location updates sent over the open socket
 """
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Query, status, Depends
 from sqlalchemy.orm import Session
 from jose import jwt, JWTError
+from pydantic import ValidationError
 import asyncio
 import logging
 
 from app.config import settings
 from app.database import get_db
 from app.services.websocket_manager import manager
+from app.services.redis_client import get_redis
+from app.schemas.tracking import LocationBatchRequest, LocationUpdateRequest
+from app.services.location_buffer import LocationBufferFull
+from app.services.tracking_service import TrackingService
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
@@ -93,6 +99,8 @@ async def websocket_endpoint(
     Events received from client:
     - pong: Response to ping
     - mark_read: Mark notification as read
+    - location_update: Courier location for a tracking session, answered
+      with location_ack (see handle_location_update)
     """
     # Try to get token from query param first, then from cookie
     auth_token = token
@@ -224,9 +232,87 @@ async def handle_client_message(websocket: WebSocket, user_id: int, data: dict):
             if _test_db_session is None:
                 db.close()
 
+    elif action == "location_update":
+        await handle_location_update(websocket, user_id, data)
+
     else:
         # Unknown action type
         await websocket.send_json({
             "event_type": "error",
             "message": f"Unknown action: {action}"
         })
+
+
+async def handle_location_update(websocket: WebSocket, user_id: int, data: dict):
+    """
+    Record a courier location fix, or a batch of buffered fixes, sent over the socket.
+
+    The message carries session_id and either the fields of a single
+    location update (latitude, longitude, heading, ...) or a "fixes" list
+    as accepted by POST /api/tracking/sessions/{session_id}/locations.
+    The socket is already authenticated, so the fix goes straight to the
+    tracking service; only the courier's own active sessions are accepted.
+
+    Replies with location_ack carrying the session's new ETA, or with an
+    error event.
+    """
+    session_id = data.get("session_id")
+    if not isinstance(session_id, int):
+        await websocket.send_json({
+            "event_type": "error",
+            "message": "location_update requires an integer session_id"
+        })
+        return
+
+    try:
+        if "fixes" in data:
+            fixes = [fix.model_dump() for fix in LocationBatchRequest.model_validate(data).fixes]
+        else:
+            fixes = [LocationUpdateRequest.model_validate(data).model_dump()]
+    except ValidationError as e:
+        await websocket.send_json({
+            "event_type": "error",
+            "message": f"Invalid location_update: {e.errors()[0]['msg']}"
+        })
+        return
+
+    try:
+        redis = await get_redis()
+    except Exception:
+        # Redis might not be available in dev/test
+        redis = None
+
+    db = get_websocket_db()
+    try:
+        tracking_service = TrackingService(db, redis)
+        location, session = await tracking_service.record_locations(session_id, fixes, courier_id=user_id)
+    except ValueError:
+        await websocket.send_json({
+            "event_type": "error",
+            "message": f"No active tracking session {session_id} for this courier"
+        })
+    except LocationBufferFull:
+        await websocket.send_json({
+            "event_type": "error",
+            "message": "Location updates are backed up, send them again shortly"
+        })
+    except Exception as e:
+        # Keep the socket open; the courier can send the fix again
+        db.rollback()
+        logger.error(f"Failed to record location update for session {session_id}: {e}")
+        await websocket.send_json({
+            "event_type": "error",
+            "message": "Location update could not be recorded"
+        })
+    else:
+        await websocket.send_json({
+            "event_type": "location_ack",
+            "session_id": session_id,
+            "accepted": len(fixes),
+            "timestamp": location.timestamp.isoformat(),
+            "estimated_arrival": session.estimated_arrival.isoformat() if session.estimated_arrival else None,
+            "distance_remaining_meters": session.distance_remaining_meters
+        })
+    finally:
+        if _test_db_session is None:
+            db.close()
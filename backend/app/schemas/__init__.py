@@ -0,0 +1 @@
+"""Request and response models shared by several route modules."""
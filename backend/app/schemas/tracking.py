@@ -0,0 +1,32 @@
+"""
+Request models for courier location updates, shared by the HTTP and WebSocket routes.
+"""
+from datetime import datetime
+from typing import List, Optional
+
+from pydantic import BaseModel, Field
+
+# Maximum number of fixes accepted in one batch upload
+MAX_LOCATION_BATCH = 500
+
+
+class LocationUpdateRequest(BaseModel):
+    """Request model for location update."""
+    latitude: float = Field(..., ge=-90, le=90)
+    longitude: float = Field(..., ge=-180, le=180)
+    accuracy_meters: Optional[float] = Field(None, ge=0)
+    altitude_meters: Optional[float] = None
+    heading: Optional[float] = Field(None, ge=0, le=360)
+    speed_mps: Optional[float] = Field(None, ge=0)
+    battery_level: Optional[float] = Field(None, ge=0, le=100)
+    source: str = Field(default="gps")
+
+
+class LocationFixRequest(LocationUpdateRequest):
+    """A location fix in a batch upload, with the time it was recorded on the device."""
+    timestamp: Optional[datetime] = None
+
+
+class LocationBatchRequest(BaseModel):
+    """Request model for uploading several location fixes at once."""
+    fixes: List[LocationFixRequest] = Field(..., min_length=1, max_length=MAX_LOCATION_BATCH)
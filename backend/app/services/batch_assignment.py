@@ -0,0 +1,305 @@
+"""
+Global one-to-one assignment of open packages to active courier routes.
+
+The periodic matching job tells every courier about every package along
+their route, so at peak hours several couriers chase the same packages.
+This service suggests a single dispatch plan instead: each route gets at
+most one package and each package at most one route, chosen to pair up as
+many packages as possible and, among those plans, to minimize total detour.
+
+Candidate pairs come from the same corridor matching the job uses (the
+package snapshot with each courier's remaining capacity), keeping only the
+shortest-detour candidates of each route, so the cost matrix stays sparse.
+The assignment is solved with an auction algorithm (Bertsekas) with
+epsilon scaling, in which all unassigned bidders bid at once on vectorized
+CSR arrays. Detours are compared in 0.01 km units, the precision matches
+are reported in, and with the final epsilon the result is optimal for
+those units.
+"""
+import logging
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.database import SessionLocal
+from app.models.package import Package, PackageStatus, CourierRoute
+from app.services.courier_capacity import courier_capacities
+from app.services.matching_job import match_routes_sharded
+from app.services.package_snapshot import PackageSnapshot, route_spec
+from app.services.spatial_index import ID_BATCH_SIZE, active_routes_query
+
+logger = logging.getLogger(__name__)
+
+# Detours are compared in units of 0.01 km
+COST_SCALE = 100
+
+# Epsilon shrinks by this factor between auction phases
+EPSILON_FACTOR = 6
+
+# With this few unassigned persons left, bid one at a time instead of all at once
+SEQUENTIAL_BIDDERS = 16
+
+# Masks a person's best choice when looking for the second best (every person has two)
+EXCLUDED = np.iinfo(np.int64).min
+
+
+def _auction(indptr: np.ndarray, objects: np.ndarray, benefits: np.ndarray) -> np.ndarray:
+    """
+    Maximum-benefit perfect assignment of a square sparse problem by auction.
+
+    Person i may take the objects objects[indptr[i]:indptr[i+1]] with the
+    matching integer benefits; every person must have at least two choices
+    and a perfect assignment must exist. Benefits are scaled by n + 1 so
+    that the last phase runs with an integer epsilon of 1, which makes the
+    assignment optimal.
+
+    Returns:
+        Object assigned to each person
+    """
+    n = len(indptr) - 1
+    lengths = np.diff(indptr)
+    benefits = benefits.astype(np.int64) * (n + 1)
+    spread = int(benefits.max() - benefits.min())
+
+    prices = np.zeros(n, dtype=np.int64)
+    epsilon = max(1, spread // EPSILON_FACTOR)
+    while True:
+        assigned = np.full(n, -1, dtype=np.int64)
+        owner = np.full(n, -1, dtype=np.int64)
+        bidders = np.arange(n)
+
+        while len(bidders):
+            # Edges of every unassigned person, segment by segment
+            starts, counts = indptr[bidders], lengths[bidders]
+            segment_starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+            edges = np.repeat(starts - segment_starts, counts) + np.arange(counts.sum())
+            values = benefits[edges] - prices[objects[edges]]
+
+            best = np.maximum.reduceat(values, segment_starts)
+            segment = np.repeat(np.arange(len(bidders)), counts)
+            candidates = np.flatnonzero(values == best[segment])
+            _, first = np.unique(segment[candidates], return_index=True)
+            best_position = candidates[first]
+
+            values[best_position] = EXCLUDED
+            second = np.maximum.reduceat(values, segment_starts)
+
+            targets = objects[edges[best_position]]
+            bids = prices[targets] + (best - second) + epsilon
+
+            # Highest bid per object wins
+            order = np.lexsort((-bids, targets))
+            winners = order[np.concatenate(([True], targets[order][1:] != targets[order][:-1]))]
+            won, winning_bidders = targets[winners], bidders[winners]
+
+            outbid = owner[won]
+            assigned[outbid[outbid >= 0]] = -1
+            owner[won] = winning_bidders
+            assigned[winning_bidders] = won
+            prices[won] = bids[winners]
+
+            bidders = np.flatnonzero(assigned < 0)
+            if len(bidders) <= SEQUENTIAL_BIDDERS:
+                # The tail is mostly chains of single displacements, where
+                # the per-round overhead of the vectorized step dominates
+                _bid_sequentially(bidders.tolist(), indptr, objects, benefits, prices, assigned, owner, epsilon)
+                break
+
+        if epsilon == 1:
+            return assigned
+        epsilon = max(1, epsilon // EPSILON_FACTOR)
+
+
+def _bid_sequentially(
+    queue: List[int],
+    indptr: np.ndarray,
+    objects: np.ndarray,
+    benefits: np.ndarray,
+    prices: np.ndarray,
+    assigned: np.ndarray,
+    owner: np.ndarray,
+    epsilon: int
+) -> None:
+    """Gauss-Seidel auction: unassigned persons bid one at a time until all are assigned."""
+    while queue:
+        person = queue.pop()
+        choices = objects[indptr[person]:indptr[person + 1]]
+        values = benefits[indptr[person]:indptr[person + 1]] - prices[choices]
+        k = int(values.argmax())
+        best = values[k]
+        values[k] = EXCLUDED
+        target = choices[k]
+
+        outbid = owner[target]
+        if outbid >= 0:
+            assigned[outbid] = -1
+            queue.append(int(outbid))
+        owner[target] = person
+        assigned[person] = target
+        prices[target] += best - values.max() + epsilon
+
+
+def solve_assignment(
+    route_ids: Sequence[int],
+    package_ids: Sequence[int],
+    detours_km: Sequence[float]
+) -> List[Tuple[int, int]]:
+    """
+    Pick a one-to-one assignment from candidate (route, package, detour) pairs.
+
+    The assignment pairs as many packages as the candidates allow and, among
+    such assignments, has the smallest total detour.
+
+    Returns:
+        List of (route_id, package_id) pairs, ordered by route id
+    """
+    if len(route_ids) == 0:
+        return []
+
+    route_keys, rows = np.unique(np.asarray(route_ids, dtype=np.int64), return_inverse=True)
+    package_keys, cols = np.unique(np.asarray(package_ids, dtype=np.int64), return_inverse=True)
+    costs = np.rint(np.asarray(detours_km, dtype=np.float64) * COST_SCALE).astype(np.int64)
+    costs -= costs.min()
+    routes, packages = len(route_keys), len(package_keys)
+
+    # Every extra pair must be worth more than any detour saving: an augmenting
+    # path changes total cost by at most its length times the largest cost
+    reward = 2 * min(routes, packages) * (int(costs.max()) + 1) + 1
+
+    # Square problem with routes and "package stays unassigned" dummies as
+    # persons, packages and "route stays unassigned" dummies as objects:
+    #   route r   -> package p (reward - cost) or its own dummy P + r (0)
+    #   dummy R+p -> package p (0) or the dummy P + r of any route r of p (0)
+    route_persons = np.concatenate((rows, np.arange(routes)))
+    route_objects = np.concatenate((cols, packages + np.arange(routes)))
+    route_benefits = np.concatenate((reward - costs, np.zeros(routes, dtype=np.int64)))
+    dummy_persons = routes + np.concatenate((np.arange(packages), cols))
+    dummy_objects = np.concatenate((np.arange(packages), packages + rows))
+
+    persons = np.concatenate((route_persons, dummy_persons))
+    objects = np.concatenate((route_objects, dummy_objects))
+    benefits = np.concatenate((route_benefits, np.zeros(len(dummy_persons), dtype=np.int64)))
+
+    order = np.argsort(persons, kind="stable")
+    indptr = np.concatenate(([0], np.cumsum(np.bincount(persons, minlength=routes + packages))))
+    assigned = _auction(indptr, objects[order], benefits[order])
+
+    matched = np.flatnonzero(assigned[:routes] < packages)
+    return [(int(route_keys[r]), int(package_keys[assigned[r]])) for r in matched]
+
+
+def run_batch_assignment_job(
+    max_candidates_per_route: Optional[int] = None,
+    workers: Optional[int] = None,
+    db: Optional[Session] = None
+) -> Dict[str, Any]:
+    """
+    Suggest a one-to-one assignment of open packages to active routes.
+
+    Nothing is written: the result is a dispatch suggestion for admins.
+    Packages are never suggested to a route of the courier who sent them.
+
+    Args:
+        max_candidates_per_route: Shortest-detour candidates kept per route
+            (defaults to BATCH_ASSIGNMENT_MAX_CANDIDATES_PER_ROUTE)
+        workers: Worker processes for candidate matching (defaults to MATCHING_JOB_WORKERS)
+        db: Session to use (defaults to a new SessionLocal session)
+
+    Returns:
+        Summary with the suggested assignments
+    """
+    owns_session = db is None
+    if owns_session:
+        db = SessionLocal()
+    max_candidates_per_route = max_candidates_per_route or settings.BATCH_ASSIGNMENT_MAX_CANDIDATES_PER_ROUTE
+    workers = workers or settings.MATCHING_JOB_WORKERS
+
+    try:
+        started_at = datetime.utcnow().isoformat()
+        logger.info("Starting batch assignment job...")
+
+        routes = active_routes_query(db).order_by(CourierRoute.id).all()
+        capacities = courier_capacities(db, [route.courier_id for route in routes])
+        snapshot = PackageSnapshot.load(db)
+
+        route_matches = match_routes_sharded(
+            snapshot,
+            [route_spec(route, capacities[route.courier_id]) for route in routes],
+            workers
+        )
+
+        # Couriers cannot carry their own packages
+        couriers = {route.id: route.courier_id for route in routes}
+        courier_ids = sorted(set(couriers.values()))
+        senders = {}
+        for i in range(0, len(courier_ids), ID_BATCH_SIZE):
+            senders.update(
+                db.query(Package.id, Package.sender_id)
+                .filter(
+                    Package.sender_id.in_(courier_ids[i:i + ID_BATCH_SIZE]),
+                    Package.status == PackageStatus.OPEN_FOR_BIDS
+                )
+                .all()
+            )
+
+        # Matches come shortest detour first
+        candidates = {}
+        for route_id, matches in route_matches.items():
+            allowed = [match for match in matches if senders.get(match[0]) != couriers[route_id]]
+            for package_id, distance_km, detour_km in allowed[:max_candidates_per_route]:
+                candidates[(route_id, package_id)] = (distance_km, detour_km)
+
+        solve_started = time.perf_counter()
+        pairs = solve_assignment(
+            [route_id for route_id, _ in candidates],
+            [package_id for _, package_id in candidates],
+            [detour_km for _, detour_km in candidates.values()]
+        )
+        solve_ms = (time.perf_counter() - solve_started) * 1000
+
+        package_ids = sorted(package_id for _, package_id in pairs)
+        tracking_ids = {}
+        for i in range(0, len(package_ids), ID_BATCH_SIZE):
+            tracking_ids.update(
+                db.query(Package.id, Package.tracking_id)
+                .filter(Package.id.in_(package_ids[i:i + ID_BATCH_SIZE]))
+                .all()
+            )
+
+        assignments = []
+        for route_id, package_id in pairs:
+            distance_km, detour_km = candidates[(route_id, package_id)]
+            assignments.append({
+                'route_id': route_id,
+                'courier_id': couriers[route_id],
+                'package_id': package_id,
+                'tracking_id': tracking_ids.get(package_id),
+                'distance_km': distance_km,
+                'detour_km': detour_km,
+            })
+
+        results = {
+            'started_at': started_at,
+            'completed_at': datetime.utcnow().isoformat(),
+            'routes_considered': len(routes),
+            'packages_considered': len(snapshot),
+            'candidate_pairs': len(candidates),
+            'assignments_made': len(assignments),
+            'total_detour_km': round(sum(a['detour_km'] for a in assignments), 2),
+            'solve_ms': round(solve_ms, 1),
+            'assignments': assignments,
+        }
+
+        logger.info(
+            f"Batch assignment completed: {results['assignments_made']} assignments from "
+            f"{results['candidate_pairs']} candidate pairs in {results['solve_ms']}ms"
+        )
+        return results
+
+    finally:
+        if owns_session:
+            db.close()
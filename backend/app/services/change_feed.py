@@ -0,0 +1,184 @@
+"""
+Cross-process feed of committed package and route changes.
+
+The in-process package and route indexes and the open package snapshot see
+commits made through this process's sessions as they happen. Commits made by
+other web or Celery worker processes reach them through a Redis stream per
+entity: the commit hook appends the changed ids, and each structure reads
+the entries added since its last read before it answers a query, then
+re-reads just those rows.
+
+The streams are capped at FEED_MAX_LENGTH entries. A reader that fell
+further behind, or whose position no longer exists (Redis restarted), loads
+its structure in full instead. While Redis is unreachable, changes from
+other processes are only picked up by the periodic full reload, every
+MATCHING_INDEX_MAX_AGE_SECONDS.
+
+Publishing runs from SQLAlchemy commit hooks and reading from synchronous
+query paths, so the feed uses a small synchronous Redis connection.
+"""
+import logging
+import threading
+import time
+from typing import Callable, Iterable, Optional, Set, Tuple
+
+import redis
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+STREAM_PREFIX = "changes:"
+
+# Entries kept per stream (approximately); older ones are trimmed
+FEED_MAX_LENGTH = 10_000
+
+# Readers this many entries behind reload in full rather than re-read rows
+FEED_READ_LIMIT = 1_000
+
+# Position before the first entry of a stream
+START = "0-0"
+
+
+class ChangeFeed:
+    """Redis stream of ids of one entity changed by committed sessions, in any process."""
+
+    def __init__(self, name: str):
+        self.stream = f"{STREAM_PREFIX}{name}"
+        self._sync_client: Optional[redis.Redis] = None
+        self._unavailable_until = 0.0
+
+    def _available(self) -> bool:
+        return settings.MATCHING_CHANGE_FEED_ENABLED and time.monotonic() >= self._unavailable_until
+
+    def _record_error(self, action: str, error: Exception) -> None:
+        self._unavailable_until = time.monotonic() + settings.MATCH_CACHE_RETRY_SECONDS
+        logger.warning(f"Change feed {action} on {self.stream} failed, bypassing Redis: {error}")
+
+    def _client(self) -> redis.Redis:
+        if self._sync_client is None:
+            self._sync_client = redis.Redis.from_url(
+                settings.REDIS_URL,
+                decode_responses=True,
+                socket_connect_timeout=0.5,
+                socket_timeout=0.5
+            )
+        return self._sync_client
+
+    def publish(self, ids: Iterable[int]) -> None:
+        """Append committed changes to the given ids."""
+        ids = sorted(set(ids))
+        if not ids or not self._available():
+            return
+        try:
+            self._client().xadd(
+                self.stream,
+                {"ids": ",".join(map(str, ids))},
+                maxlen=FEED_MAX_LENGTH,
+                approximate=True
+            )
+        except Exception as e:
+            self._record_error("publish", e)
+
+    def position(self) -> Optional[str]:
+        """Id of the newest entry (START if there is none), or None if Redis is unreachable."""
+        if not self._available():
+            return None
+        try:
+            newest = self._client().xrevrange(self.stream, "+", "-", count=1)
+        except Exception as e:
+            self._record_error("read", e)
+            return None
+        return newest[0][0] if newest else START
+
+    def read(self, position: str) -> Optional[Tuple[str, Optional[Set[int]]]]:
+        """
+        Ids changed after a position.
+
+        Returns:
+            (new position, ids), with ids None when entries after position
+            are missing and the reader must reload in full; None if Redis is
+            unreachable
+        """
+        if not self._available():
+            return None
+        try:
+            # XRANGE is inclusive, so the entry at position comes back first
+            entries = self._client().xrange(self.stream, min=position, max="+", count=FEED_READ_LIMIT + 1)
+        except Exception as e:
+            self._record_error("read", e)
+            return None
+
+        if position != START:
+            if not entries or entries[0][0] != position:
+                return position, None
+            entries = entries[1:]
+        if len(entries) >= FEED_READ_LIMIT:
+            return position, None
+        if not entries:
+            return position, set()
+
+        ids = {int(i) for _, fields in entries for i in fields["ids"].split(",")}
+        return entries[-1][0], ids
+
+
+class FeedReader:
+    """
+    One in-process structure's position in a ChangeFeed.
+
+    synced_at is the time.monotonic() at which the structure last confirmed it
+    had every change published so far; None while that is unknown (never
+    loaded, or loaded while Redis was unreachable).
+    """
+
+    def __init__(self, feed: ChangeFeed):
+        self.feed = feed
+        self._lock = threading.Lock()
+        self._position: Optional[str] = None
+        self.synced_at: Optional[float] = None
+
+    def begin_load(self) -> Tuple[Optional[str], float]:
+        """Call before a full load reads the database; pass the result to loaded()."""
+        return self.feed.position(), time.monotonic()
+
+    def loaded(self, mark: Tuple[Optional[str], float]) -> None:
+        """Record a finished full load that started at mark."""
+        position, started = mark
+        with self._lock:
+            self._position = position
+            self.synced_at = started if position is not None else None
+
+    def reset(self) -> None:
+        with self._lock:
+            self._position = None
+            self.synced_at = None
+
+    def catch_up(self, mark_dirty: Callable[[Set[int]], None]) -> bool:
+        """
+        Pass the ids changed by any process since the last call to mark_dirty.
+
+        Returns:
+            False if the structure must be reloaded in full: entries were
+            trimmed, or it was loaded while Redis was unreachable and changes
+            may have been missed
+        """
+        with self._lock:
+            started = time.monotonic()
+            if self._position is None:
+                return self.feed.position() is None
+            result = self.feed.read(self._position)
+            if result is None:
+                return True
+            self._position, ids = result
+            if ids is None:
+                return False
+            if ids:
+                # Marked before synced_at moves, so no reader sees the new time without them
+                mark_dirty(ids)
+            self.synced_at = started
+            return True
+
+
+# Shared feeds, published to by the spatial_index commit hook
+package_changes = ChangeFeed("packages")
+route_changes = ChangeFeed("routes")
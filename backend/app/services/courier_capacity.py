@@ -0,0 +1,130 @@
+"""
+Courier vehicle capacity for package-route matching.
+
+Couriers may set the heaviest load (User.vehicle_max_weight_kg) and the
+largest package size class (User.vehicle_max_size) their vehicle carries;
+unset limits are unlimited. The weight limit is shared by every package the
+courier currently holds, so packages already PENDING_PICKUP or IN_TRANSIT
+for the courier reduce the weight still available. The size class limits
+each package on its own.
+
+Matching applies the resulting CourierCapacity before any geometry runs:
+in the SQL prefilter, in the package spatial index and in the matching
+job's package snapshot.
+"""
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set
+
+from sqlalchemy import and_, func
+from sqlalchemy.orm import Session
+
+from app.models.package import Package, PackageStatus, PackageSize
+from app.models.user import User
+
+# Size classes from smallest to largest
+SIZE_ORDER = (PackageSize.SMALL, PackageSize.MEDIUM, PackageSize.LARGE, PackageSize.EXTRA_LARGE)
+SIZE_RANK = {size: rank for rank, size in enumerate(SIZE_ORDER)}
+LARGEST_SIZE_RANK = len(SIZE_ORDER) - 1
+
+# Packages that occupy space in the courier's vehicle
+COMMITTED_STATUSES = (PackageStatus.PENDING_PICKUP, PackageStatus.IN_TRANSIT)
+
+
+class CourierCapacity(NamedTuple):
+    """What a courier can still take on; None means no limit."""
+    max_weight_kg: Optional[float] = None  # Remaining weight after committed packages
+    max_size: Optional[PackageSize] = None
+
+    @property
+    def unlimited(self) -> bool:
+        return self.max_weight_kg is None and self.max_size is None
+
+    @property
+    def max_size_rank(self) -> int:
+        return LARGEST_SIZE_RANK if self.max_size is None else SIZE_RANK[self.max_size]
+
+    def allowed_sizes(self) -> List[PackageSize]:
+        return list(SIZE_ORDER[:self.max_size_rank + 1])
+
+    def can_carry(self, weight_kg: float, size: PackageSize) -> bool:
+        if self.max_weight_kg is not None and weight_kg > self.max_weight_kg:
+            return False
+        return SIZE_RANK[size] <= self.max_size_rank
+
+    def package_conditions(self) -> list:
+        """SQL conditions selecting the packages this capacity allows."""
+        conditions = []
+        if self.max_weight_kg is not None:
+            conditions.append(Package.weight_kg <= self.max_weight_kg)
+        if self.max_size is not None:
+            conditions.append(Package.size.in_(self.allowed_sizes()))
+        return conditions
+
+
+UNLIMITED = CourierCapacity()
+
+
+def courier_capacities(db: Session, courier_ids: Iterable[int]) -> Dict[int, CourierCapacity]:
+    """
+    Remaining capacity of several couriers.
+
+    Uses one query for the vehicle limits and, for couriers with a weight
+    limit, one grouped query for the weight of their committed packages,
+    each per ID_BATCH_SIZE couriers.
+
+    Returns:
+        Dict of courier id -> CourierCapacity (UNLIMITED for unknown ids)
+    """
+    from app.services.spatial_index import ID_BATCH_SIZE
+
+    courier_ids = sorted({courier_id for courier_id in courier_ids if courier_id is not None})
+    if not courier_ids:
+        return {}
+
+    limits = {}
+    for i in range(0, len(courier_ids), ID_BATCH_SIZE):
+        limits.update(
+            (user_id, (max_weight, max_size))
+            for user_id, max_weight, max_size in db.query(
+                User.id, User.vehicle_max_weight_kg, User.vehicle_max_size
+            ).filter(User.id.in_(courier_ids[i:i + ID_BATCH_SIZE]))
+        )
+
+    weight_limited = [user_id for user_id, (max_weight, _) in limits.items() if max_weight is not None]
+    loads = {}
+    for i in range(0, len(weight_limited), ID_BATCH_SIZE):
+        loads.update(
+            db.query(Package.courier_id, func.sum(Package.weight_kg)).filter(
+                and_(
+                    Package.courier_id.in_(weight_limited[i:i + ID_BATCH_SIZE]),
+                    Package.status.in_(COMMITTED_STATUSES),
+                    Package.is_active == True
+                )
+            ).group_by(Package.courier_id).all()
+        )
+
+    capacities = {}
+    for courier_id in courier_ids:
+        max_weight, max_size = limits.get(courier_id, (None, None))
+        if max_weight is not None:
+            max_weight = max_weight - (loads.get(courier_id) or 0.0)
+        capacities[courier_id] = CourierCapacity(max_weight, max_size)
+    return capacities
+
+
+def courier_capacity(db: Session, courier_id: int) -> CourierCapacity:
+    """Remaining capacity of one courier."""
+    return courier_capacities(db, [courier_id]).get(courier_id, UNLIMITED)
+
+
+def couriers_able_to_carry(
+    db: Session,
+    courier_ids: Iterable[int],
+    weight_kg: float,
+    size: PackageSize
+) -> Set[int]:
+    """Return the couriers among courier_ids with room for a package."""
+    return {
+        courier_id
+        for courier_id, capacity in courier_capacities(db, courier_ids).items()
+        if capacity.can_carry(weight_kg, size)
+    }
@@ -0,0 +1,143 @@
+"""
+Incremental, event-driven package-route matching.
+
+Instead of waiting for the periodic matching job to rescan every route
+against every open package, matching runs as soon as something changes:
+
+- A package that becomes OPEN_FOR_BIDS is matched against the active route
+  index only, and the matching couriers are notified immediately.
+- A newly created or reactivated route is matched against open packages
+  only, and its per-package match notifications are recorded right away.
+
+Both paths write the same PACKAGE_MATCH_FOUND notifications as the job, so
+the job's recent-notification check turns it into a reconciliation pass
+that only picks up what the incremental path missed.
+"""
+
+import logging
+from typing import Any, Dict, List
+
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.models.notification import Notification
+from app.models.package import Package, CourierRoute
+from app.services.matching_engine import matching_engine
+from app.services.matching_job import (
+    recent_match_notification_pairs,
+    create_match_notification,
+)
+
+logger = logging.getLogger(__name__)
+
+
+async def match_new_package(
+    db: Session,
+    package: Package,
+    notify_hours_threshold: int = 24
+) -> List[Dict[str, Any]]:
+    """
+    Match a package that just opened for bids and notify the matching couriers.
+
+    Couriers are not notified about their own packages, and at most once per
+    package within notify_hours_threshold.
+
+    Returns:
+        The route matches (dicts with 'route' key), ranked by detour
+    """
+    from app.services.websocket_manager import broadcast_notification, broadcast_unread_count
+
+    if not settings.MATCHING_INCREMENTAL_ENABLED:
+        return []
+
+    matches = [
+        match for match in matching_engine.match_package(db, package)
+        if match['route'].courier_id != package.sender_id
+    ]
+
+    notified = recent_match_notification_pairs(
+        db, [match['route'].courier_id for match in matches], notify_hours_threshold
+    )
+
+    notifications: List[Notification] = []
+    for match in matches:
+        courier_id = match['route'].courier_id
+        if (courier_id, package.id) in notified:
+            continue
+        notified.add((courier_id, package.id))
+
+        notifications.append(create_match_notification(
+            db,
+            courier_id,
+            package,
+            match['distance_from_route_km'],
+            match['estimated_detour_km']
+        ))
+
+    if not notifications:
+        return matches
+
+    db.commit()
+
+    for notification in notifications:
+        await broadcast_notification(notification.user_id, {
+            "id": notification.id,
+            "user_id": notification.user_id,
+            "type": notification.type.value,
+            "message": notification.message,
+            "read": notification.read,
+            "package_id": notification.package_id,
+            "created_at": notification.created_at.isoformat()
+        })
+        unread_count = db.query(Notification).filter(
+            Notification.user_id == notification.user_id,
+            Notification.read == False
+        ).count()
+        await broadcast_unread_count(notification.user_id, unread_count)
+
+    logger.info(
+        f"Package {package.id} matched {len(matches)} route(s), "
+        f"{len(notifications)} courier(s) notified"
+    )
+
+    return matches
+
+
+def record_route_matches(
+    db: Session,
+    route: CourierRoute,
+    matches: List[Dict[str, Any]],
+    notify_hours_threshold: int = 24
+) -> int:
+    """
+    Record per-package match notifications for a new or reactivated route.
+
+    The notifications are added to the session but not committed or
+    broadcast; the caller sends a single route summary instead.
+
+    Returns:
+        Number of notifications added
+    """
+    if not settings.MATCHING_INCREMENTAL_ENABLED:
+        return 0
+
+    notified = recent_match_notification_pairs(db, [route.courier_id], notify_hours_threshold)
+
+    created = 0
+    for match in matches:
+        package = match['package']
+        if package.sender_id == route.courier_id:
+            continue
+        if (route.courier_id, package.id) in notified:
+            continue
+
+        create_match_notification(
+            db,
+            route.courier_id,
+            package,
+            match['distance_from_route_km'],
+            match['estimated_detour_km']
+        )
+        created += 1
+
+    return created
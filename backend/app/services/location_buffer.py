@@ -0,0 +1,304 @@
+"""
+Write-behind persistence for courier location updates.
+
+With LOCATION_WRITE_BEHIND enabled, TrackingService caches and broadcasts
+each fix right away and hands the durable part to this buffer instead of
+committing: the location_updates row, and the session's latest position
+and ETA. A background thread inserts the buffered rows in one statement and
+updates each session once, every LOCATION_FLUSH_INTERVAL_MS or as soon as
+LOCATION_FLUSH_ROWS rows are waiting. A session only moves to a buffered
+position that is newer than the one it has.
+
+Rows leave the buffer only after their flush committed; a flush that fails
+because of the database (connection, timeout) puts them back for the next
+one, so every accepted fix is written at least once while the process runs,
+and close() (on application shutdown) flushes what is left. A flush that
+fails on the data itself (integrity or data error, e.g. a session deleted
+meanwhile) is retried one session at a time, and the rows of sessions that
+still fail on their own are logged and dropped, so one bad row cannot hold
+up everyone else's. Memory is bounded by LOCATION_BUFFER_MAX_ROWS: a writer
+that would go beyond it wakes the flush thread and is rejected with
+LocationBufferFull instead of flushing on the caller's (event loop) thread;
+the courier app sends its fixes again.
+"""
+import logging
+import threading
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+from sqlalchemy import bindparam, insert, or_, update
+from sqlalchemy.exc import DataError, IntegrityError
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.models.tracking import LocationUpdate, TrackingSession
+
+logger = logging.getLogger(__name__)
+
+# Session columns kept in sync with the latest buffered fix
+SESSION_LOCATION_FIELDS = (
+    "last_latitude",
+    "last_longitude",
+    "last_location_at",
+    "estimated_arrival",
+    "distance_remaining_meters",
+)
+
+# Errors caused by the rows themselves rather than the database; retrying the same rows cannot help
+ROW_ERRORS = (IntegrityError, DataError)
+
+
+def _merge_state(sessions: Dict[int, Dict[str, Any]], session_id: int, state: Dict[str, Any]) -> None:
+    """Merge a session's new position into sessions unless the buffered one is of a newer fix."""
+    buffered = sessions.get(session_id)
+    if buffered is None:
+        sessions[session_id] = dict(state)
+        return
+
+    buffered_at, state_at = buffered.get("last_location_at"), state.get("last_location_at")
+    if buffered_at is not None and state_at is not None and buffered_at > state_at:
+        return
+    buffered.update(state)
+
+
+class LocationBufferFull(Exception):
+    """The buffer is at LOCATION_BUFFER_MAX_ROWS; the fixes were not accepted."""
+    pass
+
+
+class LocationWriteBuffer:
+    """Bounded in-process buffer of location rows, flushed in bulk by a background thread."""
+
+    def __init__(
+        self,
+        session_factory: Optional[Callable[[], Session]] = None,
+        interval_ms: Optional[int] = None,
+        flush_rows: Optional[int] = None,
+        max_rows: Optional[int] = None
+    ):
+        self._session_factory = session_factory
+        self._interval_ms = interval_ms
+        self._flush_rows = flush_rows
+        self._max_rows = max_rows
+        self._rows: List[Dict[str, Any]] = []
+        self._sessions: Dict[int, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._flush_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = False
+        self._flush_requested = False
+        self.written = 0
+        self.dropped = 0
+
+    @property
+    def interval_ms(self) -> int:
+        return self._interval_ms if self._interval_ms is not None else settings.LOCATION_FLUSH_INTERVAL_MS
+
+    @property
+    def flush_rows(self) -> int:
+        return self._flush_rows if self._flush_rows is not None else settings.LOCATION_FLUSH_ROWS
+
+    @property
+    def max_rows(self) -> int:
+        return self._max_rows if self._max_rows is not None else settings.LOCATION_BUFFER_MAX_ROWS
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._rows)
+
+    def stats(self) -> Dict[str, int]:
+        """Buffered, written and dropped (dead-lettered) row counts for this process."""
+        with self._lock:
+            return {"buffered": len(self._rows), "written": self.written, "dropped": self.dropped}
+
+    def latest_at(self, session_id: int) -> Optional[datetime]:
+        """Time of the session's buffered position, if one is waiting for the flush."""
+        with self._lock:
+            state = self._sessions.get(session_id)
+            return state.get("last_location_at") if state is not None else None
+
+    def add(self, rows: List[Dict[str, Any]], session_id: int, session_state: Dict[str, Any]) -> None:
+        """
+        Buffer location_updates rows and the session's new latest position.
+
+        A position older (by last_location_at) than the one already buffered
+        for the session, e.g. from a late offline batch, is ignored; its rows
+        are still buffered.
+
+        Args:
+            rows: Column values of LocationUpdate rows, oldest first
+            session_id: Tracking session the rows belong to
+            session_state: New values of (some of) SESSION_LOCATION_FIELDS
+
+        Raises:
+            LocationBufferFull: If the rows do not fit; nothing is buffered and
+                the flush thread is woken to make room
+        """
+        with self._lock:
+            full = len(self._rows) + len(rows) > self.max_rows
+            if not full:
+                self._rows.extend(rows)
+                _merge_state(self._sessions, session_id, session_state)
+            if full:
+                # Kept until the thread runs, so the wakeup is not lost if it is not waiting yet
+                self._flush_requested = True
+            if full or len(self._rows) >= self.flush_rows:
+                self._wakeup.notify()
+        self.start()
+        if full:
+            raise LocationBufferFull(f"Location write-behind buffer is full ({self.max_rows} rows)")
+
+    def flush(self) -> int:
+        """
+        Write all buffered rows and session positions in one transaction.
+
+        If the rows are rejected for their content, each session is written
+        on its own and those that still fail are dropped (see ROW_ERRORS).
+
+        Returns:
+            Number of location rows written
+
+        Raises:
+            Exception: From the database; the rows stay buffered for the next flush
+        """
+        with self._flush_lock:
+            with self._lock:
+                rows, self._rows = self._rows, []
+                sessions, self._sessions = self._sessions, {}
+            if not rows and not sessions:
+                return 0
+
+            try:
+                self._write(rows, sessions)
+            except ROW_ERRORS as e:
+                logger.warning(f"Location write-behind flush rejected, retrying per session: {e}")
+                written = self._write_per_session(rows, sessions)
+            except Exception:
+                self._restore(rows, sessions)
+                raise
+            else:
+                written = len(rows)
+
+            with self._lock:
+                self.written += written
+            return written
+
+    def _write_per_session(self, rows: List[Dict[str, Any]], sessions: Dict[int, Dict[str, Any]]) -> int:
+        """Write each session's rows on its own, dropping sessions whose rows are rejected."""
+        rows_by_session: Dict[int, List[Dict[str, Any]]] = {}
+        for row in rows:
+            rows_by_session.setdefault(row["session_id"], []).append(row)
+
+        written = 0
+        pending = list(dict.fromkeys([*rows_by_session, *sessions]))
+        while pending:
+            session_id = pending[0]
+            session_rows = rows_by_session.get(session_id, [])
+            session_state = {session_id: sessions[session_id]} if session_id in sessions else {}
+            try:
+                self._write(session_rows, session_state)
+            except ROW_ERRORS as e:
+                logger.error(
+                    f"Dropping {len(session_rows)} buffered location updates of tracking session "
+                    f"{session_id}: {e}"
+                )
+                with self._lock:
+                    self.dropped += len(session_rows)
+            except Exception:
+                # The database itself failed; keep this and the remaining sessions for the next flush
+                self._restore(
+                    [row for pending_id in pending for row in rows_by_session.get(pending_id, [])],
+                    {pending_id: sessions[pending_id] for pending_id in pending if pending_id in sessions}
+                )
+                raise
+            else:
+                written += len(session_rows)
+            pending.pop(0)
+        return written
+
+    def _restore(self, rows: List[Dict[str, Any]], sessions: Dict[int, Dict[str, Any]]) -> None:
+        """Put rows and session positions of a failed flush back in front of newer ones."""
+        with self._lock:
+            self._rows[:0] = rows
+            for session_id, state in self._sessions.items():
+                _merge_state(sessions, session_id, state)
+            self._sessions = sessions
+
+    def _write(self, rows: List[Dict[str, Any]], sessions: Dict[int, Dict[str, Any]]) -> None:
+        factory = self._session_factory
+        if factory is None:
+            from app.database import SessionLocal
+            factory = SessionLocal
+
+        db = factory()
+        try:
+            if rows:
+                db.execute(insert(LocationUpdate), rows)
+            if sessions:
+                # Sessions ended meanwhile keep the position and ETA they ended with,
+                # and sessions with a newer fix stored by another process keep theirs
+                db.execute(
+                    update(TrackingSession).where(
+                        TrackingSession.is_active == True,
+                        or_(
+                            TrackingSession.last_location_at.is_(None),
+                            bindparam("fix_at").is_(None),
+                            TrackingSession.last_location_at < bindparam("fix_at")
+                        )
+                    ).execution_options(synchronize_session=None),
+                    [
+                        {"id": session_id, "fix_at": state.get("last_location_at"), **state}
+                        for session_id, state in sessions.items()
+                    ]
+                )
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def start(self) -> None:
+        """Start the background flush thread if it is not running."""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stopping = False
+            self._thread = threading.Thread(target=self._run, name="location-write-behind", daemon=True)
+            self._thread.start()
+
+    def close(self) -> None:
+        """Stop the background thread and flush what is left."""
+        with self._lock:
+            thread = self._thread
+            self._stopping = True
+            self._wakeup.notify()
+        if thread is not None:
+            thread.join()
+        try:
+            written = self.flush()
+            if written:
+                logger.info(f"Flushed {written} buffered location updates on shutdown")
+        except Exception as e:
+            logger.error(f"Failed to flush {len(self)} buffered location updates on shutdown: {e}")
+
+    def _run(self) -> None:
+        while True:
+            with self._lock:
+                if not self._stopping and not self._flush_requested and len(self._rows) < self.flush_rows:
+                    self._wakeup.wait(self.interval_ms / 1000)
+                if self._stopping:
+                    return
+                self._flush_requested = False
+            try:
+                self.flush()
+            except Exception as e:
+                logger.warning(f"Location write-behind flush failed, retrying: {e}")
+                with self._lock:
+                    if not self._stopping:
+                        self._wakeup.wait(self.interval_ms / 1000)
+
+
+# Shared buffer used by TrackingService when LOCATION_WRITE_BEHIND is enabled
+location_buffer = LocationWriteBuffer()
@@ -0,0 +1,349 @@
+"""
+Per-route cache of packages-along-route match results.
+
+Entries live in Redis under matches:route:{route_id} and hold the
+serialized matches together with the versions they were computed at. A
+route's entry depends on version counters, all shared in Redis:
+
+- the route's own (matches:version:{route_id}), bumped when the route
+  changes (edit, activate, deactivate, expire)
+- its courier's (matches:courier:{courier_id}), bumped when the courier
+  changes their vehicle capacity or takes on or releases a package
+- those of the geohash cells its corridor covers (matches:cell:{geohash}),
+  bumped when a package with its pickup or dropoff in the cell is created,
+  changes status, is_active, weight or size, or moves
+
+Lookups read the entry and its counters in one MGET and ignore the entry
+unless all counters still have the values it was stored with, so a lookup
+that raced with an invalidation cannot store a stale result either.
+Callers only store matches computed after the lookup from data that caught
+up with the change feed (app.services.change_feed) since then, see
+MatchingEngine.synced_at(): commits publish to the feed before they bump
+the counters here, so those matches include every change behind the
+versions they are stored with.
+Invalidation is a few INCRs, with no route index or key scan, so every
+process (web and Celery workers alike) invalidates exactly the affected
+routes. Corridors are covered at geohash precision 4 (~39 x 20 km cells),
+precision 3 for long routes, or by a single global counter bumped on every
+package change for routes too long for that. MATCH_CACHE_TTL_SECONDS
+bounds staleness from changes made outside SQLAlchemy sessions.
+
+Invalidation runs from SQLAlchemy commit hooks, so it uses a small
+synchronous Redis connection; reads and writes go through RedisClient.
+"""
+import json
+import logging
+import threading
+import time
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+import redis
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.models.package import Package, CourierRoute
+from app.models.user import User
+from app.services.redis_client import RedisClient
+from app.services.spatial_index import corridor_geohash_cover, route_path
+from app.utils import geohash
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = "matches:route:"
+VERSION_PREFIX = "matches:version:"
+COURIER_PREFIX = "matches:courier:"
+CELL_PREFIX = "matches:cell:"
+
+# Counter bumped by every package change, for routes without a cell cover
+ALL_CELLS = "*"
+
+# Cell precisions tried for a route's cover, finest first; packages bump each
+CELL_PRECISIONS = (4, 3)
+
+# Package columns whose change can add a package to or drop it from route matches
+MATCH_COLUMNS = (
+    "status", "is_active", "pickup_lat", "pickup_lng", "dropoff_lat", "dropoff_lng", "weight_kg", "size"
+)
+
+# Package columns whose change alters the remaining capacity of its courier
+LOAD_COLUMNS = ("courier_id", "status", "is_active", "weight_kg")
+
+# User columns that define a courier's vehicle capacity
+CAPACITY_COLUMNS = ("vehicle_max_weight_kg", "vehicle_max_size")
+
+Location = Tuple[float, float, float, float]
+
+_PENDING_ROUTES_KEY = "match_cache_route_ids"
+_PENDING_LOCATIONS_KEY = "match_cache_package_locations"
+_PENDING_COURIERS_KEY = "match_cache_courier_ids"
+
+
+class MatchCache:
+    """Redis-backed cache of per-route match results with hit/miss counters."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sync_client: Optional[redis.Redis] = None
+        self._unavailable_until = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.errors = 0
+
+    @staticmethod
+    def key(route_id: int) -> str:
+        return f"{KEY_PREFIX}{route_id}"
+
+    @staticmethod
+    def version_key(route_id: int) -> str:
+        return f"{VERSION_PREFIX}{route_id}"
+
+    @staticmethod
+    def courier_key(courier_id: int) -> str:
+        return f"{COURIER_PREFIX}{courier_id}"
+
+    @staticmethod
+    def cell_key(cell: str) -> str:
+        return f"{CELL_PREFIX}{cell}"
+
+    def dependency_keys(self, route: CourierRoute) -> List[str]:
+        """Version keys a route's cached matches depend on."""
+        cells = _corridor_cells(
+            route.start_lat, route.start_lng, route.end_lat, route.end_lng,
+            route.max_deviation_km, route.waypoints
+        )
+        return [
+            self.version_key(route.id),
+            self.courier_key(route.courier_id),
+            *(self.cell_key(cell) for cell in cells),
+        ]
+
+    def _available(self) -> bool:
+        return settings.MATCH_CACHE_ENABLED and time.monotonic() >= self._unavailable_until
+
+    def _record_error(self, action: str, error: Exception) -> None:
+        with self._lock:
+            self.errors += 1
+        self._unavailable_until = time.monotonic() + settings.MATCH_CACHE_RETRY_SECONDS
+        logger.warning(f"Match cache {action} failed, bypassing Redis: {error}")
+
+    # Reads and writes
+    async def get(self, route: CourierRoute) -> Tuple[Optional[List[Dict[str, Any]]], Optional[str]]:
+        """
+        Look up cached matches for a route.
+
+        Returns:
+            Tuple of (matches or None on a miss, version to pass to set())
+        """
+        cached, version = None, None
+        if self._available():
+            try:
+                redis_client = await RedisClient.get_instance()
+                raw, *versions = await redis_client.client.mget(
+                    self.key(route.id), *self.dependency_keys(route)
+                )
+                version = ",".join(v or "0" for v in versions)
+                if raw:
+                    entry = json.loads(raw)
+                    if entry.get("version") == version:
+                        cached = entry["matches"]
+            except Exception as e:
+                self._record_error("read", e)
+                version = None
+
+        with self._lock:
+            if cached is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return cached, version
+
+    async def set(self, route_id: int, version: Optional[str], matches: List[Dict[str, Any]]) -> None:
+        """Store matches computed after a get() miss that returned version."""
+        if version is None or not self._available():
+            return
+        try:
+            redis_client = await RedisClient.get_instance()
+            await redis_client.set_json(
+                self.key(route_id),
+                {"version": version, "matches": matches},
+                settings.MATCH_CACHE_TTL_SECONDS
+            )
+        except Exception as e:
+            self._record_error("write", e)
+
+    # Invalidation
+    def _client(self) -> redis.Redis:
+        if self._sync_client is None:
+            self._sync_client = redis.Redis.from_url(
+                settings.REDIS_URL,
+                decode_responses=True,
+                socket_connect_timeout=0.5,
+                socket_timeout=0.5
+            )
+        return self._sync_client
+
+    def _bump(self, keys: Iterable[str], delete: Iterable[str] = ()) -> bool:
+        """Increment version keys (and delete entries) in one round trip."""
+        keys, delete = sorted(set(keys)), list(delete)
+        if not keys or not self._available():
+            return False
+        try:
+            pipe = self._client().pipeline(transaction=False)
+            for key in keys:
+                # No expiry: a counter that restarted could match an old entry again
+                pipe.incr(key)
+            if delete:
+                pipe.delete(*delete)
+            pipe.execute()
+        except Exception as e:
+            self._record_error("invalidation", e)
+            return False
+        return True
+
+    def invalidate_routes(self, route_ids: Iterable[int]) -> None:
+        """Drop the cached matches of the given routes."""
+        route_ids = sorted(set(route_ids))
+        if self._bump(
+            (self.version_key(route_id) for route_id in route_ids),
+            [self.key(route_id) for route_id in route_ids]
+        ):
+            with self._lock:
+                self.invalidations += len(route_ids)
+
+    def invalidate_packages(self, locations: Iterable[Location]) -> None:
+        """Invalidate the cached matches of every route whose corridor covers one of the locations."""
+        keys = {self.cell_key(cell) for location in locations for cell in _location_cells(location)}
+        if keys:
+            keys.add(self.cell_key(ALL_CELLS))
+        if self._bump(keys):
+            with self._lock:
+                self.invalidations += 1
+
+    def invalidate_couriers(self, courier_ids: Iterable[int]) -> None:
+        """Invalidate the cached matches of every route of the given couriers."""
+        courier_ids = set(courier_ids)
+        if self._bump(self.courier_key(courier_id) for courier_id in courier_ids):
+            with self._lock:
+                self.invalidations += len(courier_ids)
+
+    # Metrics
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters for this process."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": settings.MATCH_CACHE_ENABLED,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "invalidations": self.invalidations,
+                "errors": self.errors,
+            }
+
+    def reset_stats(self) -> None:
+        with self._lock:
+            self.hits = self.misses = self.invalidations = self.errors = 0
+
+
+# Shared cache for this process
+match_cache = MatchCache()
+
+
+@lru_cache(maxsize=4096)
+def _corridor_cells(
+    start_lat: float,
+    start_lng: float,
+    end_lat: float,
+    end_lng: float,
+    deviation_km: float,
+    waypoints: Optional[str]
+) -> Tuple[str, ...]:
+    """Cells whose counters guard a route's entry: its corridor cover, or ALL_CELLS."""
+    path = route_path(start_lat, start_lng, end_lat, end_lng, waypoints)
+    for precision in CELL_PRECISIONS:
+        cells = corridor_geohash_cover(precision, start_lat, start_lng, end_lat, end_lng, deviation_km, path)
+        if cells is not None:
+            return tuple(cells)
+    return (ALL_CELLS,)
+
+
+def _location_cells(location: Location) -> Set[str]:
+    """Cells of a package's pickup and dropoff at every precision routes are covered at."""
+    pickup_lat, pickup_lng, dropoff_lat, dropoff_lng = location
+    return {
+        geohash.encode(lat, lng, precision)
+        for lat, lng in ((pickup_lat, pickup_lng), (dropoff_lat, dropoff_lng))
+        for precision in CELL_PRECISIONS
+    }
+
+
+def _package_locations(package: Package) -> List[Location]:
+    """Current and, if it moved in this flush, previous location of a package."""
+    state = inspect(package)
+    current = (package.pickup_lat, package.pickup_lng, package.dropoff_lat, package.dropoff_lng)
+    previous = []
+    for column in ("pickup_lat", "pickup_lng", "dropoff_lat", "dropoff_lng"):
+        history = state.attrs[column].history
+        previous.append(history.deleted[0] if history.deleted else getattr(package, column))
+    locations = [current]
+    if tuple(previous) != current:
+        locations.append(tuple(previous))
+    return [location for location in locations if None not in location]
+
+
+def _columns_changed(obj, columns: Tuple[str, ...]) -> bool:
+    state = inspect(obj)
+    return any(state.attrs[column].history.has_changes() for column in columns)
+
+
+def _package_couriers(package: Package) -> Set[int]:
+    """Current and, if it was reassigned in this flush, previous courier of a package."""
+    history = inspect(package).attrs.courier_id.history
+    couriers = {package.courier_id, *history.deleted}
+    couriers.discard(None)
+    return couriers
+
+
+# Invalidate cached matches when committed changes affect them
+@event.listens_for(Session, "after_flush")
+def _collect_match_changes(session: Session, flush_context) -> None:
+    route_ids = session.info.setdefault(_PENDING_ROUTES_KEY, set())
+    locations = session.info.setdefault(_PENDING_LOCATIONS_KEY, set())
+    courier_ids = session.info.setdefault(_PENDING_COURIERS_KEY, set())
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, CourierRoute) and obj.id is not None:
+            route_ids.add(obj.id)
+        elif isinstance(obj, Package):
+            dirty = obj in session.dirty
+            if not dirty or _columns_changed(obj, LOAD_COLUMNS):
+                courier_ids.update(_package_couriers(obj))
+            if dirty and not _columns_changed(obj, MATCH_COLUMNS):
+                continue
+            locations.update(_package_locations(obj))
+        elif isinstance(obj, User) and obj in session.dirty and _columns_changed(obj, CAPACITY_COLUMNS):
+            courier_ids.add(obj.id)
+
+
+# Registered after the spatial_index hooks (imported above), so the change
+# feed has a commit's ids before the counters it bumps move
+@event.listens_for(Session, "after_commit")
+def _apply_match_changes(session: Session) -> None:
+    route_ids = session.info.pop(_PENDING_ROUTES_KEY, None)
+    locations = session.info.pop(_PENDING_LOCATIONS_KEY, None)
+    courier_ids = session.info.pop(_PENDING_COURIERS_KEY, None)
+    if route_ids:
+        match_cache.invalidate_routes(route_ids)
+    if locations:
+        match_cache.invalidate_packages(locations)
+    if courier_ids:
+        match_cache.invalidate_couriers(courier_ids)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_match_changes(session: Session) -> None:
+    session.info.pop(_PENDING_ROUTES_KEY, None)
+    session.info.pop(_PENDING_LOCATIONS_KEY, None)
+    session.info.pop(_PENDING_COURIERS_KEY, None)
@@ -0,0 +1,617 @@
+"""
+Shared package-route matching engine.
+
+Every place that needs "which open packages fit this courier route" goes
+through MatchingEngine, which runs three pluggable stages:
+
+1. Candidate prefilter - loads the open packages that may lie in the route
+   corridor and that the courier's vehicle has room for, with PostGIS when
+   the database has it and the in-process spatial index otherwise
+2. Scoring - computes distance to the route and detour, and drops packages
+   outside the route's max deviation
+3. Ranking - orders the remaining matches
+
+Matches are dicts with 'package', 'distance_from_route_km' and
+'estimated_detour_km' keys. Routes with waypoints are scored against their
+polyline, segment by segment.
+
+The shared engine can skip the stages and match against the process-wide
+columnar snapshot of open packages instead (MATCHING_SNAPSHOT_ENABLED,
+unless PostGIS is in use); only the matched packages are then loaded.
+
+MatchingEngine.backend() names the layer that serves route matching, picked
+in this order:
+
+- "postgis": PostGISPrefilter, on a PostGIS database with MATCHING_BACKEND
+  "auto"; the snapshot is never used there
+- "snapshot": the shared snapshot, the default everywhere else
+- "spatial_index": SpatialIndexPrefilter, with MATCHING_SNAPSHOT_ENABLED off
+- "bounding_box": the SQL corridor query (BoundingBoxPrefilter), with
+  MATCHING_INDEX_ENABLED off as well; the index also falls back to it for
+  corridors too large for its grid
+
+FullScanPrefilter is the reference the others are tested and benchmarked
+against. The in-process snapshot and index are only loaded once a query
+uses them, so the ones a deployment does not use cost nothing.
+
+match_package() runs the same scoring in the reverse direction, for one
+package against the active routes from the route index, skipping routes
+whose courier cannot carry it. Its matches carry a 'route' key instead of
+'package'.
+"""
+import bisect
+import heapq
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import and_
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.models.package import Package, PackageStatus, CourierRoute
+from app.services.courier_capacity import UNLIMITED, CourierCapacity, courier_capacity, couriers_able_to_carry
+from app.services.package_snapshot import (
+    OpenPackageSnapshot,
+    PackageMatch,
+    load_open_packages,
+    open_package_snapshot,
+    route_spec,
+)
+from app.services.postgis_matching import find_open_packages_within_route, postgis_available
+from app.services.route_corridor import corridor_of
+from app.services.spatial_index import (
+    ID_BATCH_SIZE,
+    RouteGeometry,
+    RoutePath,
+    active_routes_query,
+    find_open_packages_near_route,
+    find_route_candidates_for_package,
+    load_active_routes,
+    open_packages_in_corridor_query,
+    package_index,
+    path_of,
+    route_index,
+)
+from app.utils.geo import (
+    HAVERSINE_MAX_RELATIVE_ERROR,
+    polyline_corridor_distances_batch,
+    route_corridor_distances_batch,
+)
+
+
+# Candidate prefilter stage
+class CandidatePrefilter:
+    """Selects the open packages that may match a route."""
+
+    name = "custom"
+
+    def candidates(
+        self,
+        db: Session,
+        route: CourierRoute,
+        capacity: CourierCapacity = UNLIMITED
+    ) -> List[Package]:
+        raise NotImplementedError
+
+    def backend(self, db: Session) -> str:
+        """Name of the layer that selects candidates on this database."""
+        return self.name
+
+    def synced_at(self, db: Session) -> Optional[float]:
+        """time.monotonic() since which candidates reflect every committed change, if known."""
+        # Database queries always see the latest commits
+        return time.monotonic()
+
+
+class FullScanPrefilter(CandidatePrefilter):
+    """Loads every active package open for bids."""
+
+    name = "full_scan"
+
+    def candidates(
+        self,
+        db: Session,
+        route: CourierRoute,
+        capacity: CourierCapacity = UNLIMITED
+    ) -> List[Package]:
+        return db.query(Package).filter(
+            and_(
+                Package.status == PackageStatus.OPEN_FOR_BIDS,
+                Package.is_active == True,
+                *capacity.package_conditions()
+            )
+        ).order_by(Package.id).all()
+
+
+class BoundingBoxPrefilter(CandidatePrefilter):
+    """Loads packages whose pickup and dropoff fall in the corridor bounding box (SQL-side)."""
+
+    name = "bounding_box"
+
+    def candidates(
+        self,
+        db: Session,
+        route: CourierRoute,
+        capacity: CourierCapacity = UNLIMITED
+    ) -> List[Package]:
+        return open_packages_in_corridor_query(db, route, capacity).order_by(Package.id).all()
+
+
+class SpatialIndexPrefilter(CandidatePrefilter):
+    """
+    Loads only packages inside the route corridor using the in-process spatial index.
+
+    Falls back to the SQL bounding-box prefilter when the index is disabled.
+    """
+
+    name = "spatial_index"
+
+    def candidates(
+        self,
+        db: Session,
+        route: CourierRoute,
+        capacity: CourierCapacity = UNLIMITED
+    ) -> List[Package]:
+        return find_open_packages_near_route(db, route, capacity)
+
+    def backend(self, db: Session) -> str:
+        return self.name if settings.MATCHING_INDEX_ENABLED else BoundingBoxPrefilter.name
+
+    def synced_at(self, db: Session) -> Optional[float]:
+        if not settings.MATCHING_INDEX_ENABLED:
+            return super().synced_at(db)
+        return package_index.synced_at
+
+
+class PostGISPrefilter(CandidatePrefilter):
+    """
+    Loads packages within the route's deviation with ST_DWithin on PostGIS geography columns.
+
+    Falls back to another prefilter (the in-process spatial index by default)
+    when the database has no PostGIS or MATCHING_BACKEND is "python". Scoring
+    stays in CorridorScorer, so both produce the same ranked matches.
+    """
+
+    name = "postgis"
+
+    def __init__(self, fallback: Optional[CandidatePrefilter] = None):
+        self.fallback = fallback or SpatialIndexPrefilter()
+
+    def candidates(
+        self,
+        db: Session,
+        route: CourierRoute,
+        capacity: CourierCapacity = UNLIMITED
+    ) -> List[Package]:
+        if not postgis_available(db):
+            return self.fallback.candidates(db, route, capacity)
+        return find_open_packages_within_route(db, route, capacity)
+
+    def backend(self, db: Session) -> str:
+        return self.name if postgis_available(db) else self.fallback.backend(db)
+
+    def synced_at(self, db: Session) -> Optional[float]:
+        if not postgis_available(db):
+            return self.fallback.synced_at(db)
+        return super().synced_at(db)
+
+
+# Scoring stage
+class CorridorScorer:
+    """Scores packages by distance to the route line and detour."""
+
+    def __init__(self, fast: Optional[bool] = None):
+        self.fast = fast
+
+    def score(self, route: CourierRoute, packages: List[Package]) -> List[Dict[str, Any]]:
+        """Return matches for packages whose pickup and dropoff are within the route's deviation."""
+        if not packages:
+            return []
+
+        fast = settings.MATCHING_FAST_DISTANCE if self.fast is None else self.fast
+        points = (
+            [p.pickup_lat for p in packages],
+            [p.pickup_lng for p in packages],
+            [p.dropoff_lat for p in packages],
+            [p.dropoff_lng for p in packages],
+        )
+        corridor = corridor_of(route)
+        path = corridor.path
+        if path is None:
+            pickup_distances, dropoff_distances, detours = route_corridor_distances_batch(
+                route.start_lat, route.start_lng,
+                route.end_lat, route.end_lng,
+                *points,
+                fast=fast,
+                max_distance_km=route.max_deviation_km,
+                cached=True
+            )
+        else:
+            pickup_distances, dropoff_distances, detours = polyline_corridor_distances_batch(
+                *path, *points,
+                fast=fast,
+                max_distance_km=route.max_deviation_km,
+                segments=corridor.segments,
+                cached=True
+            )
+
+        max_distances = np.maximum(pickup_distances, dropoff_distances)
+        within = np.flatnonzero(max_distances <= route.max_deviation_km)
+
+        return [
+            {
+                'package': packages[i],
+                'distance_from_route_km': round(float(max_distances[i]), 2),
+                'estimated_detour_km': round(float(detours[i]), 2)
+            }
+            for i in within
+        ]
+
+    def score_routes(self, package: Package, routes: List[CourierRoute]) -> List[Dict[str, Any]]:
+        """Return matches for routes whose corridor contains the package's pickup and dropoff."""
+        paths = {r.id: path_of(r) for r in routes}
+        scores = self.score_route_geometry(package, {
+            r.id: (r.start_lat, r.start_lng, r.end_lat, r.end_lng, r.max_deviation_km or 0)
+            for r in routes
+        }, paths={route_id: path for route_id, path in paths.items() if path is not None})
+        return [
+            {
+                'route': route,
+                'distance_from_route_km': scores[route.id][0],
+                'estimated_detour_km': scores[route.id][1]
+            }
+            for route in routes
+            if route.id in scores
+        ]
+
+    def score_route_geometry(
+        self,
+        package: Package,
+        geometries: Dict[int, RouteGeometry],
+        limit: Optional[int] = None,
+        paths: Optional[Dict[int, RoutePath]] = None
+    ) -> Dict[int, Tuple[float, float]]:
+        """
+        Score a package against route geometries without loading the routes.
+
+        Straight routes are scored together in one vectorized pass; routes
+        with a waypoint path in `paths` are scored against their polyline.
+
+        With a limit, exact distances are only computed for straight routes
+        that can still be among the `limit` shortest detours according to the
+        haversine bound; the result is still a superset of those routes.
+
+        Returns:
+            Dict of route id -> (distance_from_route_km, estimated_detour_km)
+            for routes within their max deviation
+        """
+        if not geometries:
+            return {}
+
+        fast = settings.MATCHING_FAST_DISTANCE if self.fast is None else self.fast
+        paths = paths or {}
+        scores = {}
+        for route_id, path in paths.items():
+            if route_id not in geometries:
+                continue
+            max_deviation = geometries[route_id][4]
+            pickup_distance, dropoff_distance, detour = polyline_corridor_distances_batch(
+                *path,
+                package.pickup_lat, package.pickup_lng,
+                package.dropoff_lat, package.dropoff_lng,
+                fast=fast,
+                max_distance_km=max_deviation,
+                cached=True
+            )
+            max_distance = max(float(pickup_distance), float(dropoff_distance))
+            if max_distance <= max_deviation:
+                scores[route_id] = (round(max_distance, 2), round(float(detour), 2))
+
+        route_ids = [route_id for route_id in geometries if route_id not in paths]
+        if not route_ids:
+            return scores
+        geometry = np.array([geometries[route_id] for route_id in route_ids], dtype=np.float64)
+
+        if limit is not None and not fast and len(route_ids) > limit:
+            keep = _top_detour_candidates(package, geometry, limit)
+            route_ids = [route_ids[i] for i in keep]
+            geometry = geometry[keep]
+
+        start_lat, start_lng, end_lat, end_lng, max_deviations = geometry.T
+        pickup_distances, dropoff_distances, detours = route_corridor_distances_batch(
+            start_lat, start_lng, end_lat, end_lng,
+            package.pickup_lat, package.pickup_lng,
+            package.dropoff_lat, package.dropoff_lng,
+            fast=fast,
+            max_distance_km=max_deviations,
+            cached=True
+        )
+
+        max_distances = np.maximum(pickup_distances, dropoff_distances)
+        within = np.flatnonzero(max_distances <= max_deviations)
+
+        scores.update(
+            (route_ids[i], (round(float(max_distances[i]), 2), round(float(detours[i]), 2)))
+            for i in within
+        )
+        return scores
+
+
+def _top_detour_candidates(package: Package, geometry: np.ndarray, limit: int) -> np.ndarray:
+    """
+    Indices of routes that may rank among the `limit` shortest exact detours.
+
+    Haversine distances are within HAVERSINE_MAX_RELATIVE_ERROR of geodesic
+    ones, so once `limit` routes are certainly within their deviation, any
+    route whose haversine detour exceeds the limit-th of theirs by more than
+    the error bound cannot make the cut.
+    """
+    start_lat, start_lng, end_lat, end_lng, max_deviations = geometry.T
+    pickup_distances, dropoff_distances, detours = route_corridor_distances_batch(
+        start_lat, start_lng, end_lat, end_lng,
+        package.pickup_lat, package.pickup_lng,
+        package.dropoff_lat, package.dropoff_lng,
+        fast=True
+    )
+    bound = (1 + HAVERSINE_MAX_RELATIVE_ERROR) / (1 - HAVERSINE_MAX_RELATIVE_ERROR)
+    max_distances = np.maximum(pickup_distances, dropoff_distances)
+
+    possible = max_distances <= max_deviations * bound
+    certain = max_distances * bound <= max_deviations
+    if np.count_nonzero(certain) < limit:
+        return np.flatnonzero(possible)
+
+    kth_detour = np.partition(detours[certain], limit - 1)[limit - 1]
+    return np.flatnonzero(possible & (detours <= kth_detour * bound))
+
+
+# Ranking stage
+class DetourRanker:
+    """Orders matches by estimated detour, shortest first."""
+
+    def rank(self, matches: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        return sorted(matches, key=lambda m: m['estimated_detour_km'])
+
+    def top(
+        self,
+        matches: List[Dict[str, Any]],
+        limit: Optional[int] = None,
+        after: Optional[Tuple[float, int]] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        The `limit` best package matches ranked after a cursor.
+
+        Matches are ordered by (estimated detour, package id), which is the
+        order rank() gives packages loaded in id order. Only a heap of
+        `limit` matches is kept while scanning.
+
+        Args:
+            after: (estimated_detour_km, package_id) of the last match already returned
+        """
+        keyed = (
+            ((m['estimated_detour_km'], m['package'].id), m)
+            for m in matches
+        )
+        if after is not None:
+            keyed = (item for item in keyed if item[0] > after)
+        if limit is None:
+            return [m for _, m in sorted(keyed, key=lambda item: item[0])]
+        return [m for _, m in heapq.nsmallest(limit, keyed, key=lambda item: item[0])]
+
+
+class MatchingEngine:
+    """
+    Runs the prefilter, scoring and ranking stages for a route.
+
+    With a snapshot, route matching runs on the columnar snapshot of open
+    packages instead when MATCHING_SNAPSHOT_ENABLED is set and PostGIS is
+    not in use; results are the same as the default stages give. backend()
+    tells which one runs.
+    """
+
+    def __init__(
+        self,
+        prefilter: Optional[CandidatePrefilter] = None,
+        scorer: Optional[CorridorScorer] = None,
+        ranker: Optional[DetourRanker] = None,
+        snapshot: Optional[OpenPackageSnapshot] = None
+    ):
+        self.prefilter = prefilter or PostGISPrefilter()
+        self.scorer = scorer or CorridorScorer()
+        self.ranker = ranker or DetourRanker()
+        self.snapshot = snapshot
+
+    def _uses_snapshot(self, db: Session) -> bool:
+        return (
+            self.snapshot is not None
+            and settings.MATCHING_SNAPSHOT_ENABLED
+            and not postgis_available(db)
+        )
+
+    def backend(self, db: Session) -> str:
+        """Name of the layer match_route(), match_route_top() and count_matches() run on."""
+        return "snapshot" if self._uses_snapshot(db) else self.prefilter.backend(db)
+
+    def synced_at(self, db: Session) -> Optional[float]:
+        """
+        time.monotonic() since which route matches reflect every committed change, if known.
+
+        Read it after matching: results computed from an in-process snapshot
+        or index that has not caught up with other processes' commits since
+        a point in time must not be cached as current for that time.
+        """
+        if self._uses_snapshot(db):
+            return self.snapshot.synced_at
+        return self.prefilter.synced_at(db)
+
+    def _snapshot_matches(
+        self,
+        db: Session,
+        route: CourierRoute,
+        capacity: CourierCapacity
+    ) -> List[PackageMatch]:
+        """(package_id, distance, detour) matches from the snapshot, in rank order."""
+        return self.snapshot.current(db).match_route(route_spec(route, capacity), self.scorer.fast)
+
+    def _load_matches(self, db: Session, matches: List[PackageMatch]) -> List[Dict[str, Any]]:
+        """Load the packages of snapshot matches, dropping any no longer open."""
+        packages = load_open_packages(db, (package_id for package_id, _, _ in matches))
+        gone = [package_id for package_id, _, _ in matches if package_id not in packages]
+        if gone:
+            # Changed by another process since the snapshot was loaded
+            self.snapshot.mark_dirty(gone)
+        return [
+            {
+                'package': packages[package_id],
+                'distance_from_route_km': distance,
+                'estimated_detour_km': detour
+            }
+            for package_id, distance, detour in matches
+            if package_id in packages
+        ]
+
+    def _load_page(
+        self,
+        db: Session,
+        matches: List[PackageMatch],
+        limit: Optional[int],
+        after: Optional[Tuple[float, int]]
+    ) -> List[Dict[str, Any]]:
+        """
+        Load the first `limit` still-open packages of rank-ordered snapshot matches after a cursor.
+
+        Matches closed since the snapshot was loaded are skipped and the
+        following ones loaded in their place, so a page is only short when
+        the matches run out.
+        """
+        # Snapshot matches are sorted by (detour, package id), the cursor order
+        start = bisect.bisect_right(matches, after, key=lambda m: (m[2], m[0])) if after is not None else 0
+        if limit is None:
+            return self._load_matches(db, matches[start:])
+
+        page: List[Dict[str, Any]] = []
+        while len(page) < limit and start < len(matches):
+            end = start + limit - len(page)
+            page.extend(self._load_matches(db, matches[start:end]))
+            start = end
+        return page
+
+    def match_route(
+        self,
+        db: Session,
+        route: CourierRoute,
+        capacity: Optional[CourierCapacity] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Find open packages along a courier route.
+
+        Args:
+            capacity: The courier's remaining capacity (looked up when omitted)
+
+        Returns:
+            List of matches sorted by the ranking stage
+        """
+        if capacity is None:
+            capacity = courier_capacity(db, route.courier_id)
+        if self._uses_snapshot(db):
+            return self._load_matches(db, self._snapshot_matches(db, route, capacity))
+        candidates = self.prefilter.candidates(db, route, capacity)
+        return self.ranker.rank(self.scorer.score(route, candidates))
+
+    def match_route_top(
+        self,
+        db: Session,
+        route: CourierRoute,
+        limit: Optional[int] = None,
+        after: Optional[Tuple[float, int]] = None,
+        capacity: Optional[CourierCapacity] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Find the best `limit` open packages along a route, after a cursor.
+
+        Pages through the same ranking as match_route(). Scored candidates
+        are kept in a heap of `limit`; with the snapshot, matches are light
+        tuples and only the page's packages are loaded.
+
+        Args:
+            after: (estimated_detour_km, package_id) of the last match of the previous page
+        """
+        if capacity is None:
+            capacity = courier_capacity(db, route.courier_id)
+        if self._uses_snapshot(db):
+            return self._load_page(db, self._snapshot_matches(db, route, capacity), limit, after)
+        candidates = self.prefilter.candidates(db, route, capacity)
+        return self.ranker.top(self.scorer.score(route, candidates), limit, after)
+
+    def count_matches(
+        self,
+        db: Session,
+        route: CourierRoute,
+        capacity: Optional[CourierCapacity] = None
+    ) -> int:
+        """Count open packages along a courier route (skips ranking)."""
+        if capacity is None:
+            capacity = courier_capacity(db, route.courier_id)
+        if self._uses_snapshot(db):
+            matches = self._snapshot_matches(db, route, capacity)
+            return len(_open_ids(db, [package_id for package_id, _, _ in matches]))
+        candidates = self.prefilter.candidates(db, route, capacity)
+        return len(self.scorer.score(route, candidates))
+
+    def match_package(
+        self,
+        db: Session,
+        package: Package,
+        limit: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Find active, non-expired courier routes that can carry a package.
+
+        Routes whose courier lacks the weight or size capacity for the
+        package are skipped before scoring.
+
+        Args:
+            limit: Only return the `limit` shortest-detour matches
+
+        Returns:
+            List of matches with a 'route' key, sorted by the ranking stage
+        """
+        candidates = find_route_candidates_for_package(db, package)
+        if candidates is None:
+            routes = active_routes_query(db).order_by(CourierRoute.id).all()
+            able = couriers_able_to_carry(db, {r.courier_id for r in routes}, package.weight_kg, package.size)
+            routes = [r for r in routes if r.courier_id in able]
+            return self.ranker.rank(self.scorer.score_routes(package, routes))[:limit]
+
+        # Only routes that pass the distance check are loaded from the database
+        scores = self.scorer.score_route_geometry(package, candidates, limit, route_index.paths(candidates))
+        matches = [
+            {
+                'route': route,
+                'distance_from_route_km': scores[route.id][0],
+                'estimated_detour_km': scores[route.id][1]
+            }
+            for route in load_active_routes(db, scores)
+        ]
+        return self.ranker.rank(matches)[:limit]
+
+
+def _open_ids(db: Session, package_ids: List[int]) -> List[int]:
+    """The given package ids that are still active and open for bids."""
+    open_ids = []
+    for i in range(0, len(package_ids), ID_BATCH_SIZE):
+        open_ids.extend(
+            package_id for (package_id,) in db.query(Package.id).filter(
+                and_(
+                    Package.id.in_(package_ids[i:i + ID_BATCH_SIZE]),
+                    Package.status == PackageStatus.OPEN_FOR_BIDS,
+                    Package.is_active == True
+                )
+            )
+        )
+    return open_ids
+
+
+# Shared engine used by the matching routes, route creation and the matching job
+matching_engine = MatchingEngine(snapshot=open_package_snapshot)
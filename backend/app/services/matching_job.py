@@ -2,50 +2,32 @@
 Background job service for automatic package-route matching.
 
 This service runs periodically to find and notify couriers about packages
-that match their active routes.
+that match their active routes. New packages and routes are matched as they
+are created (see incremental_matching), so this job mostly reconciles: the
+recent-notification check skips matches that were already notified.
 """
 
 import logging
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timedelta, timezone
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterable, Optional, Set, Tuple
 from sqlalchemy.orm import Session
-from sqlalchemy import and_, or_
-from shapely.geometry import LineString, Point
-from shapely.ops import nearest_points
+from sqlalchemy import and_, or_, insert
 
+from app.config import settings
 from app.database import SessionLocal
 from app.models.package import Package, PackageStatus, CourierRoute
 from app.models.user import User
 from app.models.notification import Notification, NotificationType
 from app.utils.geo import haversine_distance
+from app.services.matching_engine import matching_engine
+from app.services.courier_capacity import SIZE_RANK, courier_capacities
+from app.services.package_snapshot import PackageSnapshot, PackageMatch, RouteSpec, route_spec
+from app.services.spatial_index import ID_BATCH_SIZE
 
 logger = logging.getLogger(__name__)
 
 
-def calculate_detour(route_line: LineString, pickup_point: Point, dropoff_point: Point) -> float:
-    """
-    Calculate the detour distance required to pickup and deliver a package.
-    Returns the additional distance in km compared to the direct route.
-    """
-    pickup_on_route = nearest_points(route_line, pickup_point)[0]
-    dropoff_on_route = nearest_points(route_line, dropoff_point)[0]
-
-    pickup_detour = haversine_distance(
-        pickup_point.y, pickup_point.x,
-        pickup_on_route.y, pickup_on_route.x
-    )
-    dropoff_detour = haversine_distance(
-        dropoff_point.y, dropoff_point.x,
-        dropoff_on_route.y, dropoff_on_route.x
-    )
-    delivery_distance = haversine_distance(
-        pickup_point.y, pickup_point.x,
-        dropoff_point.y, dropoff_point.x
-    )
-
-    return pickup_detour + dropoff_detour + delivery_distance
-
-
 def find_matching_packages_for_route(
     db: Session,
     route: CourierRoute
@@ -55,52 +37,7 @@ def find_matching_packages_for_route(
 
     Returns a list of matching package info with distance/detour metrics.
     """
-    # Create route line (Shapely uses lng, lat order)
-    route_line = LineString([
-        (route.start_lng, route.start_lat),
-        (route.end_lng, route.end_lat)
-    ])
-
-    # Get all packages open for bids
-    pending_packages = db.query(Package).filter(
-        and_(
-            Package.status == PackageStatus.OPEN_FOR_BIDS,
-            Package.is_active == True
-        )
-    ).all()
-
-    matched_packages = []
-
-    for package in pending_packages:
-        pickup_point = Point(package.pickup_lng, package.pickup_lat)
-        dropoff_point = Point(package.dropoff_lng, package.dropoff_lat)
-
-        # Calculate distance from route to pickup and dropoff
-        pickup_nearest = nearest_points(route_line, pickup_point)[0]
-        dropoff_nearest = nearest_points(route_line, dropoff_point)[0]
-
-        pickup_distance = haversine_distance(
-            pickup_point.y, pickup_point.x,
-            pickup_nearest.y, pickup_nearest.x
-        )
-        dropoff_distance = haversine_distance(
-            dropoff_point.y, dropoff_point.x,
-            dropoff_nearest.y, dropoff_nearest.x
-        )
-
-        max_distance = max(pickup_distance, dropoff_distance)
-
-        if max_distance <= route.max_deviation_km:
-            detour = calculate_detour(route_line, pickup_point, dropoff_point)
-            matched_packages.append({
-                'package': package,
-                'distance_from_route_km': round(max_distance, 2),
-                'estimated_detour_km': round(detour, 2)
-            })
-
-    # Sort by detour distance (shortest first)
-    matched_packages.sort(key=lambda x: x['estimated_detour_km'])
-    return matched_packages
+    return matching_engine.match_route(db, route)
 
 
 def has_recent_match_notification(
@@ -127,6 +64,52 @@ def has_recent_match_notification(
     return existing is not None
 
 
+def recent_match_notification_pairs(
+    db: Session,
+    courier_ids: Iterable[int],
+    hours: int = 24
+) -> Set[Tuple[int, int]]:
+    """
+    Fetch every (courier_id, package_id) notified about a match recently.
+
+    Set-based counterpart of has_recent_match_notification: one query per
+    ID_BATCH_SIZE couriers, with de-duplication done in memory.
+    """
+    courier_ids = sorted(set(courier_ids))
+    if not courier_ids:
+        return set()
+
+    cutoff_time = datetime.utcnow() - timedelta(hours=hours)
+
+    pairs = set()
+    for i in range(0, len(courier_ids), ID_BATCH_SIZE):
+        pairs.update(
+            db.query(Notification.user_id, Notification.package_id).filter(
+                and_(
+                    Notification.user_id.in_(courier_ids[i:i + ID_BATCH_SIZE]),
+                    Notification.type == NotificationType.PACKAGE_MATCH_FOUND,
+                    Notification.created_at >= cutoff_time,
+                    Notification.package_id.isnot(None)
+                )
+            ).distinct().all()
+        )
+    return pairs
+
+
+def match_notification_message(
+    description: str,
+    price: Optional[float],
+    distance_km: float,
+    detour_km: float
+) -> str:
+    """Build the message of a PACKAGE_MATCH_FOUND notification."""
+    return (
+        f"New package match found! '{description[:40]}' "
+        f"is {distance_km}km from your route with ~{detour_km}km detour. "
+        f"Price: ${price:.2f}" if price else f"Price: TBD"
+    )
+
+
 def create_match_notification(
     db: Session,
     courier_id: int,
@@ -135,16 +118,10 @@ def create_match_notification(
     detour_km: float
 ) -> Notification:
     """Create a notification for a courier about a matching package."""
-    message = (
-        f"New package match found! '{package.description[:40]}' "
-        f"is {distance_km}km from your route with ~{detour_km}km detour. "
-        f"Price: ${package.price:.2f}" if package.price else f"Price: TBD"
-    )
-
     notification = Notification(
         user_id=courier_id,
         type=NotificationType.PACKAGE_MATCH_FOUND,
-        message=message,
+        message=match_notification_message(package.description, package.price, distance_km, detour_km),
         package_id=package.id,
         read=False
     )
@@ -153,28 +130,88 @@ def create_match_notification(
     return notification
 
 
+# Package snapshot shared by the shard worker processes (set by _init_shard_worker)
+_worker_snapshot: Optional[PackageSnapshot] = None
+
+
+def _init_shard_worker(snapshot: PackageSnapshot) -> None:
+    global _worker_snapshot
+    _worker_snapshot = snapshot
+
+
+def _match_shard(routes: List[RouteSpec]) -> List[Tuple[int, List[PackageMatch]]]:
+    return _worker_snapshot.match_routes(routes)
+
+
+def match_routes_sharded(
+    snapshot: PackageSnapshot,
+    routes: List[RouteSpec],
+    workers: int = 1
+) -> Dict[int, List[PackageMatch]]:
+    """
+    Match routes against a package snapshot, sharded across worker processes.
+
+    Every worker receives the snapshot once at start-up and then matches
+    shards of routes against it. With one worker (or few routes) everything
+    runs in this process.
+
+    Returns:
+        Dict of route id -> (package_id, distance_km, detour_km) matches
+    """
+    if workers <= 1 or len(routes) < 2 * workers:
+        return dict(snapshot.match_routes(routes))
+
+    # Several shards per worker so uneven routes still balance out
+    shard_count = workers * 4
+    shards = [routes[i::shard_count] for i in range(shard_count)]
+
+    results: Dict[int, List[PackageMatch]] = {}
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=_init_shard_worker,
+        initargs=(snapshot,)
+    ) as executor:
+        for shard_result in executor.map(_match_shard, [shard for shard in shards if shard]):
+            results.update(shard_result)
+    return results
+
+
 def run_matching_job(
     notify_hours_threshold: int = 24,
-    dry_run: bool = False
+    dry_run: bool = False,
+    workers: Optional[int] = None,
+    db: Optional[Session] = None
 ) -> Dict[str, Any]:
     """
     Main job function that matches packages with courier routes.
 
+    Open packages are loaded once into a PackageSnapshot, active routes are
+    sharded across MATCHING_JOB_WORKERS processes, and the new notifications
+    are bulk-inserted in a single statement at the end. Couriers are not
+    notified about their own packages.
+
     Args:
         notify_hours_threshold: Don't re-notify about same package within this many hours
         dry_run: If True, don't create notifications, just report what would happen
+        workers: Number of worker processes (defaults to MATCHING_JOB_WORKERS)
+        db: Session to use (defaults to a new SessionLocal session)
 
     Returns:
         Summary of matching results
     """
-    db = SessionLocal()
+    owns_session = db is None
+    if owns_session:
+        db = SessionLocal()
+    workers = workers or settings.MATCHING_JOB_WORKERS
 
     try:
         logger.info("Starting package-route matching job...")
 
-        # Get all active, non-expired courier routes
+        # Get all active, non-expired courier routes with their courier names
         now = datetime.now(timezone.utc)
-        active_routes = db.query(CourierRoute).filter(
+        active_routes = db.query(CourierRoute, User.full_name).outerjoin(
+            User, User.id == CourierRoute.courier_id
+        ).filter(
             and_(
                 CourierRoute.is_active == True,
                 or_(
@@ -182,10 +219,58 @@ def run_matching_job(
                     CourierRoute.trip_date >= now       # Trip date not yet passed
                 )
             )
-        ).all()
+        ).order_by(CourierRoute.id).all()
 
         logger.info(f"Found {len(active_routes)} active non-expired courier routes")
 
+        routes = []
+        for route, courier_name in active_routes:
+            if courier_name is None:
+                logger.warning(f"Courier not found for route {route.id}")
+                continue
+            routes.append((route, courier_name))
+
+        # Load open packages once for all routes
+        package_rows = db.query(
+            Package.id,
+            Package.pickup_lat,
+            Package.pickup_lng,
+            Package.dropoff_lat,
+            Package.dropoff_lng,
+            Package.weight_kg,
+            Package.size,
+            Package.tracking_id,
+            Package.description,
+            Package.price,
+            Package.sender_id,
+        ).filter(
+            and_(
+                Package.status == PackageStatus.OPEN_FOR_BIDS,
+                Package.is_active == True
+            )
+        ).all()
+        snapshot = PackageSnapshot.from_rows([(*row[:6], SIZE_RANK[row[6]]) for row in package_rows])
+        package_info = {row[0]: row[7:] for row in package_rows}
+
+        # Remaining vehicle capacity of every courier, in two queries
+        capacities = courier_capacities(db, [route.courier_id for route, _ in routes])
+
+        route_matches = match_routes_sharded(
+            snapshot,
+            [route_spec(route, capacities[route.courier_id]) for route, _ in routes],
+            workers
+        )
+
+        logger.info(
+            f"Matched {len(routes)} routes against {len(snapshot)} open packages "
+            f"using {workers} worker(s)"
+        )
+
+        # One query for every recent (courier, package) notification in this batch
+        notified = recent_match_notification_pairs(
+            db, [route.courier_id for route, _ in routes], notify_hours_threshold
+        )
+
         results = {
             'started_at': datetime.utcnow().isoformat(),
             'routes_processed': 0,
@@ -194,72 +279,71 @@ def run_matching_job(
             'notifications_skipped': 0,
             'route_details': []
         }
+        new_notifications = []
 
-        for route in active_routes:
-            courier = db.query(User).filter(User.id == route.courier_id).first()
-            if not courier:
-                logger.warning(f"Courier not found for route {route.id}")
-                continue
-
-            matches = find_matching_packages_for_route(db, route)
+        for route, courier_name in routes:
+            # Couriers are never notified about their own packages
+            matches = [
+                match for match in route_matches.get(route.id, [])
+                if package_info[match[0]][3] != route.courier_id
+            ]
 
             route_result = {
                 'route_id': route.id,
-                'courier_id': courier.id,
-                'courier_name': courier.full_name,
+                'courier_id': route.courier_id,
+                'courier_name': courier_name,
                 'route': f"{route.start_address} -> {route.end_address}",
                 'matches_found': len(matches),
                 'notifications_sent': 0,
                 'matched_packages': []
             }
 
-            for match in matches:
-                package = match['package']
+            for package_id, distance_km, detour_km in matches:
+                tracking_id, description, price, _ = package_info[package_id]
 
-                # Check if we've already notified recently
-                was_skipped = has_recent_match_notification(
-                    db, courier.id, package.id, notify_hours_threshold
-                )
+                # Skip if notified recently, or already by another of the courier's routes
+                was_skipped = (route.courier_id, package_id) in notified
+                notified.add((route.courier_id, package_id))
 
-                package_info = {
-                    'package_id': package.id,
-                    'tracking_id': package.tracking_id,
-                    'description': package.description[:50],
-                    'distance_km': match['distance_from_route_km'],
-                    'detour_km': match['estimated_detour_km'],
+                package_info_result = {
+                    'package_id': package_id,
+                    'tracking_id': tracking_id,
+                    'description': description[:50],
+                    'distance_km': distance_km,
+                    'detour_km': detour_km,
                     'notified': False
                 }
 
                 if was_skipped:
                     results['notifications_skipped'] += 1
-                    package_info['notified'] = False
-                elif not dry_run:
-                    create_match_notification(
-                        db,
-                        courier.id,
-                        package,
-                        match['distance_from_route_km'],
-                        match['estimated_detour_km']
-                    )
-                    route_result['notifications_sent'] += 1
-                    results['notifications_created'] += 1
-                    package_info['notified'] = True
                 else:
-                    logger.info(
-                        f"[DRY RUN] Would notify {courier.full_name} about "
-                        f"package {package.id}: {package.description[:30]}"
-                    )
+                    if dry_run:
+                        logger.info(
+                            f"[DRY RUN] Would notify {courier_name} about "
+                            f"package {package_id}: {description[:30]}"
+                        )
+                    else:
+                        new_notifications.append({
+                            'user_id': route.courier_id,
+                            'type': NotificationType.PACKAGE_MATCH_FOUND,
+                            'message': match_notification_message(description, price, distance_km, detour_km),
+                            'package_id': package_id,
+                            'read': False
+                        })
                     route_result['notifications_sent'] += 1
                     results['notifications_created'] += 1
-                    package_info['notified'] = True
+                    package_info_result['notified'] = True
 
-                route_result['matched_packages'].append(package_info)
+                route_result['matched_packages'].append(package_info_result)
 
             results['total_matches_found'] += len(matches)
             results['routes_processed'] += 1
             results['route_details'].append(route_result)
 
         if not dry_run:
+            # Single bulk insert for every new notification
+            if new_notifications:
+                db.execute(insert(Notification), new_notifications)
             db.commit()
 
         results['completed_at'] = datetime.utcnow().isoformat()
@@ -277,7 +361,8 @@ def run_matching_job(
         db.rollback()
         raise
     finally:
-        db.close()
+        if owns_session:
+            db.close()
 
 
 # For running directly as a script
@@ -296,6 +381,12 @@ if __name__ == "__main__":
         default=24,
         help="Don't re-notify about same package within this many hours (default: 24)"
     )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Worker processes to shard routes across (default: MATCHING_JOB_WORKERS)"
+    )
 
     args = parser.parse_args()
 
@@ -307,7 +398,8 @@ if __name__ == "__main__":
 
     results = run_matching_job(
         notify_hours_threshold=args.hours,
-        dry_run=args.dry_run
+        dry_run=args.dry_run,
+        workers=args.workers
     )
 
     print("\n=== Matching Job Results ===")
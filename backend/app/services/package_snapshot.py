@@ -0,0 +1,439 @@
+"""
+Columnar snapshot of open packages for batch matching.
+
+The periodic matching job loads every open package once into read-only
+NumPy arrays sorted by pickup latitude, then matches any number of routes
+against that snapshot without further queries. Each route only looks at
+the slice of packages whose pickup latitude falls in its corridor bounding
+box (a binary search), and the remaining bounding-box and corridor checks
+are vectorized. Routes with waypoints are checked against the boxes of their
+polyline corridor and scored against the polyline. Packages beyond the courier's remaining weight or size
+capacity are masked out together with the bounding box, before any
+distances are computed.
+
+Snapshots are immutable, so they can be shared by worker processes.
+
+open_package_snapshot is the process-wide snapshot request handlers share.
+It is replaced rather than modified: committed package changes are merged
+into a new snapshot on the next read, and status changes made through
+package_status.transition_package() are merged without re-reading the
+package. Changes committed by other processes are read from the Redis
+change feed (app.services.change_feed) and merged the same way. Readers
+keep whichever snapshot they got.
+"""
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+import logging
+import math
+import threading
+import time
+
+import numpy as np
+from sqlalchemy import and_, event
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.models.package import Package, PackageStatus, CourierRoute
+from app.services.change_feed import ChangeFeed, FeedReader, package_changes
+from app.services.courier_capacity import SIZE_RANK, UNLIMITED, CourierCapacity
+from app.services.route_corridor import RouteCorridor, corridor_of
+from app.services.spatial_index import ID_BATCH_SIZE, RoutePath, corridor_boxes
+from app.utils.geo import polyline_corridor_distances_batch, route_corridor_distances_batch
+
+# (route_id, start_lat, start_lng, end_lat, end_lng, max_deviation_km, max_weight_kg, max_size_rank, path, corridor);
+# the waypoint path may be left off for straight routes, and the precomputed corridor is optional
+RouteSpec = Tuple[int, float, float, float, float, float, float, int, Optional[RoutePath], Optional[RouteCorridor]]
+
+# (package_id, distance_from_route_km, estimated_detour_km)
+PackageMatch = Tuple[int, float, float]
+
+# (id, pickup_lat, pickup_lng, dropoff_lat, dropoff_lng, weight_kg, size_rank, price)
+SnapshotRow = Tuple[int, float, float, float, float, float, int, Optional[float]]
+
+logger = logging.getLogger(__name__)
+
+_DIRTY_KEY = "package_snapshot_dirty_ids"
+
+
+def route_spec(route: CourierRoute, capacity: CourierCapacity = UNLIMITED) -> RouteSpec:
+    """Describe a route and its courier's remaining capacity for snapshot matching."""
+    corridor = corridor_of(route)
+    return (
+        route.id,
+        route.start_lat, route.start_lng,
+        route.end_lat, route.end_lng,
+        route.max_deviation_km,
+        math.inf if capacity.max_weight_kg is None else capacity.max_weight_kg,
+        capacity.max_size_rank,
+        corridor.path,
+        corridor,
+    )
+
+
+class PackageSnapshot:
+    """Read-only arrays of open package ids, locations, weights, size ranks and prices, sorted by pickup latitude."""
+
+    def __init__(
+        self,
+        ids: Sequence[int],
+        pickup_lat: Sequence[float],
+        pickup_lng: Sequence[float],
+        dropoff_lat: Sequence[float],
+        dropoff_lng: Sequence[float],
+        weight_kg: Optional[Sequence[float]] = None,
+        size_rank: Optional[Sequence[int]] = None,
+        price: Optional[Sequence[Optional[float]]] = None
+    ):
+        pickup_lat = np.asarray(pickup_lat, dtype=np.float64)
+        order = np.argsort(pickup_lat, kind="stable")
+
+        self.ids = np.asarray(ids, dtype=np.int64)[order]
+        self.pickup_lat = pickup_lat[order]
+        self.pickup_lng = np.asarray(pickup_lng, dtype=np.float64)[order]
+        self.dropoff_lat = np.asarray(dropoff_lat, dtype=np.float64)[order]
+        self.dropoff_lng = np.asarray(dropoff_lng, dtype=np.float64)[order]
+        self.weight_kg = (
+            np.zeros(len(order)) if weight_kg is None else np.asarray(weight_kg, dtype=np.float64)[order]
+        )
+        self.size_rank = (
+            np.zeros(len(order), dtype=np.int8) if size_rank is None else np.asarray(size_rank, dtype=np.int8)[order]
+        )
+        # Packages without a price are NaN
+        self.price = (
+            np.full(len(order), np.nan) if price is None else np.asarray(price, dtype=np.float64)[order]
+        )
+
+        for array in self._columns():
+            array.flags.writeable = False
+
+    def _columns(self) -> Tuple[np.ndarray, ...]:
+        return (
+            self.ids, self.pickup_lat, self.pickup_lng, self.dropoff_lat, self.dropoff_lng,
+            self.weight_kg, self.size_rank, self.price
+        )
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @classmethod
+    def from_rows(cls, rows: Sequence[Tuple]) -> "PackageSnapshot":
+        """
+        Build a snapshot from (id, pickup_lat, pickup_lng, dropoff_lat, dropoff_lng,
+        weight_kg, size_rank[, price]) rows.
+        """
+        if not rows:
+            return cls([], [], [], [], [], [], [], [])
+        return cls(*zip(*rows))
+
+    def with_changes(self, rows: Sequence[SnapshotRow], removed_ids: Iterable[int] = ()) -> "PackageSnapshot":
+        """
+        A new snapshot with packages upserted from rows and removed_ids dropped.
+
+        The surviving columns are still sorted, so re-sorting is close to a
+        linear merge.
+        """
+        changed = np.fromiter(
+            (*removed_ids, *(row[0] for row in rows)), dtype=np.int64
+        )
+        keep = ~np.isin(self.ids, changed)
+        added = PackageSnapshot.from_rows(rows)
+        return PackageSnapshot(*(
+            np.concatenate((old[keep], new))
+            for old, new in zip(self._columns(), added._columns())
+        ))
+
+    @classmethod
+    def load(cls, db: Session) -> "PackageSnapshot":
+        """Load every active package open for bids."""
+        rows = db.query(
+            Package.id,
+            Package.pickup_lat,
+            Package.pickup_lng,
+            Package.dropoff_lat,
+            Package.dropoff_lng,
+            Package.weight_kg,
+            Package.size,
+            Package.price,
+        ).filter(
+            and_(
+                Package.status == PackageStatus.OPEN_FOR_BIDS,
+                Package.is_active == True
+            )
+        ).all()
+        return cls.from_rows([_row(*row) for row in rows])
+
+    def match_route(self, route: RouteSpec, fast: Optional[bool] = None) -> List[PackageMatch]:
+        """
+        Match one route against the snapshot.
+
+        Applies the same capacity filter, corridor test and rounding as the
+        matching engine.
+
+        Returns:
+            List of (package_id, distance_from_route_km, estimated_detour_km),
+            shortest detour first
+        """
+        route_id, start_lat, start_lng, end_lat, end_lng, max_deviation_km, max_weight_kg, max_size_rank = route[:8]
+        path = route[8] if len(route) > 8 else None
+        corridor = route[9] if len(route) > 9 else None
+        max_deviation_km = max_deviation_km or 0
+        if corridor is not None:
+            boxes = corridor.boxes
+        else:
+            boxes = corridor_boxes(start_lat, start_lng, end_lat, end_lng, max_deviation_km, path)
+
+        lo = np.searchsorted(self.pickup_lat, min(box[0] for box in boxes), side="left")
+        hi = np.searchsorted(self.pickup_lat, max(box[1] for box in boxes), side="right")
+        if lo >= hi:
+            return []
+
+        pickup_in_box = np.zeros(hi - lo, dtype=bool)
+        dropoff_in_box = np.zeros(hi - lo, dtype=bool)
+        for box in boxes:
+            pickup_in_box |= _in_box(self.pickup_lat[lo:hi], self.pickup_lng[lo:hi], box)
+            dropoff_in_box |= _in_box(self.dropoff_lat[lo:hi], self.dropoff_lng[lo:hi], box)
+        in_box = pickup_in_box & dropoff_in_box
+        if max_weight_kg < math.inf:
+            in_box &= self.weight_kg[lo:hi] <= max_weight_kg
+        if max_size_rank < len(SIZE_RANK) - 1:
+            in_box &= self.size_rank[lo:hi] <= max_size_rank
+
+        candidates = lo + np.flatnonzero(in_box)
+        if len(candidates) == 0:
+            return []
+
+        points = (
+            self.pickup_lat[candidates], self.pickup_lng[candidates],
+            self.dropoff_lat[candidates], self.dropoff_lng[candidates],
+        )
+        fast = settings.MATCHING_FAST_DISTANCE if fast is None else fast
+        if path is None:
+            pickup_distances, dropoff_distances, detours = route_corridor_distances_batch(
+                start_lat, start_lng, end_lat, end_lng,
+                *points,
+                fast=fast,
+                max_distance_km=max_deviation_km,
+                cached=True
+            )
+        else:
+            pickup_distances, dropoff_distances, detours = polyline_corridor_distances_batch(
+                *path, *points,
+                fast=fast,
+                max_distance_km=max_deviation_km,
+                segments=corridor.segments if corridor is not None else None,
+                cached=True
+            )
+
+        max_distances = np.maximum(pickup_distances, dropoff_distances)
+        within = np.flatnonzero(max_distances <= max_deviation_km)
+
+        matches = [
+            (
+                int(self.ids[candidates[i]]),
+                round(float(max_distances[i]), 2),
+                round(float(detours[i]), 2)
+            )
+            for i in within
+        ]
+        matches.sort(key=lambda m: (m[2], m[0]))
+        return matches
+
+    def match_routes(
+        self,
+        routes: Sequence[RouteSpec],
+        fast: Optional[bool] = None
+    ) -> List[Tuple[int, List[PackageMatch]]]:
+        """Match several routes; returns (route_id, matches) pairs in input order."""
+        return [(route[0], self.match_route(route, fast)) for route in routes]
+
+
+def _in_box(lat: np.ndarray, lng: np.ndarray, box: Tuple[float, float, float, float]) -> np.ndarray:
+    """Mask of points inside a (min_lat, max_lat, min_lng, max_lng) box."""
+    min_lat, max_lat, min_lng, max_lng = box
+    inside = (lat >= min_lat) & (lat <= max_lat)
+    # Corridors crossing the antimeridian only get the latitude predicates
+    if min_lng >= -180 and max_lng <= 180:
+        inside &= (lng >= min_lng) & (lng <= max_lng)
+    return inside
+
+
+def _row(package_id, pickup_lat, pickup_lng, dropoff_lat, dropoff_lng, weight_kg, size, price) -> SnapshotRow:
+    return (package_id, pickup_lat, pickup_lng, dropoff_lat, dropoff_lng, weight_kg, SIZE_RANK[size], price)
+
+
+def _open_package_rows_query(db: Session):
+    return db.query(
+        Package.id,
+        Package.pickup_lat,
+        Package.pickup_lng,
+        Package.dropoff_lat,
+        Package.dropoff_lng,
+        Package.weight_kg,
+        Package.size,
+        Package.price,
+    ).filter(
+        and_(
+            Package.status == PackageStatus.OPEN_FOR_BIDS,
+            Package.is_active == True
+        )
+    )
+
+
+def load_open_packages(db: Session, package_ids: Iterable[int]) -> Dict[int, Package]:
+    """Load the given packages that are still active and open for bids, by id."""
+    ids = sorted(package_ids)
+    packages = {}
+    for i in range(0, len(ids), ID_BATCH_SIZE):
+        for package in db.query(Package).filter(
+            and_(
+                Package.id.in_(ids[i:i + ID_BATCH_SIZE]),
+                Package.status == PackageStatus.OPEN_FOR_BIDS,
+                Package.is_active == True
+            )
+        ):
+            packages[package.id] = package
+    return packages
+
+
+class OpenPackageSnapshot:
+    """
+    Process-wide PackageSnapshot of open packages, kept current incrementally.
+
+    current() returns an immutable snapshot; pending changes are merged into
+    a new one first. Packages whose rows changed in a committed session are
+    re-read; status changes recorded with record() carry their new state
+    and need no query. With a change feed, packages changed by other
+    processes are re-read too. The snapshot is reloaded in full every
+    MATCHING_INDEX_MAX_AGE_SECONDS, or when the feed lost entries.
+    """
+
+    def __init__(self, changes: Optional[ChangeFeed] = None):
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._snapshot: Optional[PackageSnapshot] = None
+        self._loaded_at: Optional[float] = None
+        self._changes: Dict[int, Optional[SnapshotRow]] = {}
+        self._dirty_ids: Set[int] = set()
+        self._in_use = False
+        self._feed = FeedReader(changes) if changes is not None else None
+
+    def record(self, package: Package) -> None:
+        """Merge a committed package state (e.g. after a status transition) on the next read."""
+        is_open = package.status == PackageStatus.OPEN_FOR_BIDS and package.is_active
+        row = _row(
+            package.id,
+            package.pickup_lat, package.pickup_lng,
+            package.dropoff_lat, package.dropoff_lng,
+            package.weight_kg, package.size, package.price
+        ) if is_open else None
+        with self._lock:
+            # Until the first load there is nothing to merge into
+            if self._in_use:
+                self._dirty_ids.discard(package.id)
+                self._changes[package.id] = row
+
+    def mark_dirty(self, package_ids: Iterable[int]) -> None:
+        """Flag packages whose row changed; they are re-read on the next read."""
+        with self._lock:
+            if self._in_use:
+                self._dirty_ids.update(package_ids)
+
+    def clear(self) -> None:
+        """Drop the snapshot; the next read reloads it from the database."""
+        with self._lock:
+            self._snapshot = None
+            self._loaded_at = None
+            self._changes.clear()
+            self._dirty_ids.clear()
+            self._in_use = False
+        if self._feed is not None:
+            self._feed.reset()
+
+    @property
+    def synced_at(self) -> Optional[float]:
+        """time.monotonic() since which the snapshot has every change from any process, if known."""
+        return self._feed.synced_at if self._feed is not None else None
+
+    def is_stale(self) -> bool:
+        """Whether the snapshot needs a full reload."""
+        if self._loaded_at is None:
+            return True
+        return time.monotonic() - self._loaded_at > settings.MATCHING_INDEX_MAX_AGE_SECONDS
+
+    def current(self, db: Session) -> PackageSnapshot:
+        """The up-to-date snapshot; treat it as read-only."""
+        reload = self._feed is not None and not self._feed.catch_up(self.mark_dirty)
+        with self._lock:
+            if not reload and not self.is_stale() and not self._changes and not self._dirty_ids:
+                return self._snapshot
+
+        with self._refresh_lock:
+            if reload or self.is_stale():
+                self._reload(db)
+            else:
+                self._merge_pending(db)
+            return self._snapshot
+
+    def _reload(self, db: Session) -> None:
+        # Changes committed after this point stay pending and are merged later
+        mark = self._feed.begin_load() if self._feed is not None else None
+        with self._lock:
+            self._in_use = True
+            self._changes.clear()
+            self._dirty_ids.clear()
+
+        snapshot = PackageSnapshot.from_rows([_row(*row) for row in _open_package_rows_query(db)])
+
+        with self._lock:
+            self._snapshot = snapshot
+            self._loaded_at = time.monotonic()
+        if mark is not None:
+            self._feed.loaded(mark)
+        logger.info(f"Open package snapshot loaded with {len(snapshot)} packages")
+
+    def _merge_pending(self, db: Session) -> None:
+        with self._lock:
+            changes = self._changes
+            dirty_ids = sorted(self._dirty_ids)
+            self._changes = {}
+            self._dirty_ids = set()
+
+        if not changes and not dirty_ids:
+            return
+
+        changes.update((package_id, None) for package_id in dirty_ids)
+        for i in range(0, len(dirty_ids), ID_BATCH_SIZE):
+            for row in _open_package_rows_query(db).filter(Package.id.in_(dirty_ids[i:i + ID_BATCH_SIZE])):
+                changes[row[0]] = _row(*row)
+
+        rows = [row for row in changes.values() if row is not None]
+        removed = [package_id for package_id, row in changes.items() if row is None]
+        snapshot = self._snapshot.with_changes(rows, removed)
+
+        with self._lock:
+            self._snapshot = snapshot
+
+
+# Shared snapshot for this process
+open_package_snapshot = OpenPackageSnapshot(changes=package_changes)
+
+
+# Re-read packages changed by committed sessions on the next read
+@event.listens_for(Session, "after_flush")
+def _collect_changed_packages(session: Session, flush_context) -> None:
+    changed = session.info.setdefault(_DIRTY_KEY, set())
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, Package) and obj.id is not None:
+            changed.add(obj.id)
+
+
+@event.listens_for(Session, "after_commit")
+def _apply_changed_packages(session: Session) -> None:
+    changed = session.info.pop(_DIRTY_KEY, None)
+    if changed:
+        open_package_snapshot.mark_dirty(changed)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_changed_packages(session: Session) -> None:
+    session.info.pop(_DIRTY_KEY, None)
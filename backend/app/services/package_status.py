@@ -10,6 +10,7 @@ from typing import Tuple, List
 from sqlalchemy.orm import Session
 
 from app.models.package import Package, PackageStatus
+from app.services.package_snapshot import open_package_snapshot
 
 
 # Define allowed status transitions
@@ -213,6 +214,9 @@ def transition_package(
     db.commit()
     db.refresh(package)
 
+    # Matching reads open packages from the shared snapshot
+    open_package_snapshot.record(package)
+
     return package, ""
 
 
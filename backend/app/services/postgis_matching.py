@@ -0,0 +1,147 @@
+"""
+PostGIS-backed candidate selection for route matching.
+
+When the database is PostgreSQL with the PostGIS extension and the
+geography columns from migrations/add_postgis_geography.py, the corridor
+prefilter runs in the database as ST_DWithin against the route line on
+GiST-indexed geography columns, instead of in the in-process spatial index.
+
+packages.pickup_geog and packages.dropoff_geog are generated columns
+computed from the lat/lng columns, so they never go out of sync and the
+ORM does not need to know about them.
+
+The route line is densified before the cast to geography so that it
+follows the straight lat/lng line the in-process scorer uses rather than
+the great circle, and the search radius is padded like the in-process
+corridor. The database only selects candidates: CorridorScorer still
+computes distances and detours, so both backends rank identically.
+"""
+import logging
+from typing import Dict, List
+
+from shapely.geometry import LineString
+from sqlalchemy import and_, func, literal_column, text
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.models.package import Package, PackageStatus, CourierRoute
+from app.services.courier_capacity import UNLIMITED, CourierCapacity
+from app.services.route_corridor import corridor_of
+from app.services.spatial_index import CORRIDOR_PADDING
+
+logger = logging.getLogger(__name__)
+
+# Maximum length in degrees of the straight pieces the route line is cut into
+# before the cast to geography (~5.5 km; the great-circle sag is under a metre,
+# well inside the CORRIDOR_PADDING margin)
+SEGMENT_MAX_DEG = 0.05
+
+# Generated geography columns and their GiST indexes
+GEOGRAPHY_COLUMNS = {
+    "pickup_geog": ("pickup_lat", "pickup_lng"),
+    "dropoff_geog": ("dropoff_lat", "dropoff_lng"),
+}
+
+# Detection result per database URL
+_available: Dict[str, bool] = {}
+
+
+def install_geography_columns(conn) -> None:
+    """
+    Add the generated geography columns and GiST indexes to packages.
+
+    Requires PostgreSQL 12+ with PostGIS; safe to run more than once.
+    """
+    conn.execute(text("CREATE EXTENSION IF NOT EXISTS postgis"))
+    for column, (lat, lng) in GEOGRAPHY_COLUMNS.items():
+        conn.execute(text(f"""
+            ALTER TABLE packages
+            ADD COLUMN IF NOT EXISTS {column} geography(Point, 4326)
+            GENERATED ALWAYS AS (ST_SetSRID(ST_MakePoint({lng}, {lat}), 4326)::geography) STORED
+        """))
+        conn.execute(text(f"""
+            CREATE INDEX IF NOT EXISTS ix_packages_{column}
+            ON packages USING GIST ({column})
+        """))
+
+
+def postgis_available(db: Session) -> bool:
+    """
+    Whether PostGIS matching can be used on this session's database.
+
+    True when MATCHING_BACKEND allows it, the database is PostgreSQL with the
+    postgis extension and the packages geography columns exist. The check
+    runs once per database.
+    """
+    if settings.MATCHING_BACKEND == "python":
+        return False
+
+    bind = db.get_bind()
+    if bind.dialect.name != "postgresql":
+        return False
+
+    key = str(bind.engine.url)
+    if key not in _available:
+        try:
+            has_extension = db.execute(text(
+                "SELECT 1 FROM pg_extension WHERE extname = 'postgis'"
+            )).first() is not None
+            columns = {
+                row[0] for row in db.execute(text("""
+                    SELECT column_name
+                    FROM information_schema.columns
+                    WHERE table_name = 'packages' AND column_name IN ('pickup_geog', 'dropoff_geog')
+                """))
+            }
+            _available[key] = has_extension and columns == set(GEOGRAPHY_COLUMNS)
+        except Exception as e:
+            logger.warning(f"PostGIS detection failed, using in-process matching: {e}")
+            _available[key] = False
+        logger.info(f"PostGIS matching backend {'enabled' if _available[key] else 'unavailable'}")
+    return _available[key]
+
+
+def reset_detection() -> None:
+    """Forget detection results (after migrations, and in tests)."""
+    _available.clear()
+
+
+def route_line_wkt(route: CourierRoute) -> str:
+    """WKT of the route line (lng, lat order), through its waypoints if any."""
+    corridor = corridor_of(route)
+    lats, lngs = corridor.path_lat, corridor.path_lng
+    return LineString(list(zip(lngs, lats))).wkt
+
+
+def open_packages_within_route_query(
+    db: Session,
+    route: CourierRoute,
+    capacity: CourierCapacity = UNLIMITED
+):
+    """
+    Query open packages whose pickup and dropoff are within the route's
+    padded max deviation, using ST_DWithin on the geography columns.
+    """
+    corridor = func.geography(
+        func.ST_Segmentize(func.ST_GeomFromText(route_line_wkt(route), 4326), SEGMENT_MAX_DEG)
+    )
+    radius_m = max(route.max_deviation_km or 0, 0) * 1000 * CORRIDOR_PADDING
+
+    return db.query(Package).filter(
+        and_(
+            Package.status == PackageStatus.OPEN_FOR_BIDS,
+            Package.is_active == True,
+            func.ST_DWithin(literal_column("packages.pickup_geog"), corridor, radius_m),
+            func.ST_DWithin(literal_column("packages.dropoff_geog"), corridor, radius_m),
+            *capacity.package_conditions()
+        )
+    )
+
+
+def find_open_packages_within_route(
+    db: Session,
+    route: CourierRoute,
+    capacity: CourierCapacity = UNLIMITED
+) -> List[Package]:
+    """Load the candidate packages for a route with PostGIS, ordered by id."""
+    return open_packages_within_route_query(db, route, capacity).order_by(Package.id).all()
@@ -0,0 +1,193 @@
+"""
+Precomputed corridor geometry of courier routes.
+
+Matching a route needs its vertices, the bounding boxes of its deviation
+corridor and, for routes with waypoints, each segment's unit vector and
+length. These only change when the route does, so they are computed when a
+route is created or updated (routes/couriers.py) and stored as JSON in
+CourierRoute.corridor, together with:
+
+- the envelope: bounding box of the whole corridor
+- the route length along its vertices (geodesic)
+- an outline polygon of the corridor, as an encoded polyline ring, for
+  clients to draw; it is approximate, matching uses exact distances
+
+corridor_of() returns the stored corridor when it still describes the
+route's geometry and computes it otherwise (e.g. rows written before the
+column existed, or by bulk inserts); that fallback runs on every match of
+the route, so it computes only what matching uses and leaves the length
+and outline out.
+"""
+import math
+from typing import Any, Dict, NamedTuple, Optional, Tuple
+
+from shapely.geometry import LineString, Point
+from shapely import affinity
+
+from app.models.package import CourierRoute
+from app.services.spatial_index import (
+    CORRIDOR_PADDING,
+    KM_PER_DEG_LAT_MIN,
+    Box,
+    RoutePath,
+    corridor_boxes,
+    route_path,
+)
+from app.utils.geo import PolylineSegments, geodesic_distance_batch, polyline_segments
+from app.utils.polyline import encode_polyline
+
+# Bumped when the stored layout changes; older corridors are recomputed
+CORRIDOR_VERSION = 1
+
+# Arc segments per quarter circle in the outline polygon
+OUTLINE_QUAD_SEGMENTS = 4
+
+
+class RouteCorridor(NamedTuple):
+    """Ready-to-use geometry of a route and its deviation corridor."""
+    path_lat: Tuple[float, ...]  # Vertices from start to end
+    path_lng: Tuple[float, ...]
+    envelope: Box  # (min_lat, max_lat, min_lng, max_lng) of the whole corridor
+    boxes: Tuple[Box, ...]  # Boxes covering the corridor, for the prefilters
+    unit_lat: Tuple[float, ...]  # Per-segment unit vectors in lat/lng degrees
+    unit_lng: Tuple[float, ...]
+    segment_length_deg: Tuple[float, ...]
+    length_km: Optional[float]  # None when computed for matching only
+    outline: Optional[str]  # Encoded polyline ring around the corridor; None when computed for matching only
+
+    @property
+    def path(self) -> Optional[RoutePath]:
+        """Vertices of a route with waypoints, or None for a straight route."""
+        if len(self.path_lat) <= 2:
+            return None
+        return self.path_lat, self.path_lng
+
+    @property
+    def segments(self) -> PolylineSegments:
+        """Segment unit vectors and lengths for nearest_point_on_polyline_batch()."""
+        return self.unit_lat, self.unit_lng, self.segment_length_deg
+
+
+def _source(route: CourierRoute) -> list:
+    """Route fields the corridor is derived from."""
+    return [
+        route.start_lat, route.start_lng,
+        route.end_lat, route.end_lng,
+        route.max_deviation_km or 0,
+        route.waypoints or "",
+    ]
+
+
+def _outline(path_lat, path_lng, deviation_km: float) -> str:
+    """Corridor outline: the path buffered by deviation_km in a locally scaled plane."""
+    cos_lat = max(math.cos(math.radians(sum(path_lat) / len(path_lat))), 1e-6)
+    radius_deg = max(deviation_km, 0) * CORRIDOR_PADDING / KM_PER_DEG_LAT_MIN
+
+    points = [(lng * cos_lat, lat) for lat, lng in zip(path_lat, path_lng)]
+    geometry = Point(points[0]) if len(set(points)) == 1 else LineString(points)
+    polygon = affinity.scale(
+        geometry.buffer(radius_deg, quad_segs=OUTLINE_QUAD_SEGMENTS),
+        xfact=1 / cos_lat, yfact=1, origin=(0, 0)
+    )
+    return encode_polyline([(lat, lng) for lng, lat in polygon.exterior.coords])
+
+
+def build_corridor(
+    start_lat: float,
+    start_lng: float,
+    end_lat: float,
+    end_lng: float,
+    max_deviation_km: float,
+    waypoints: Optional[str] = None,
+    complete: bool = True
+) -> RouteCorridor:
+    """
+    Compute the corridor of a route from its endpoints, deviation and encoded waypoints.
+
+    With complete=False the route length and outline, which matching does
+    not use, are not computed and left as None.
+    """
+    path = route_path(start_lat, start_lng, end_lat, end_lng, waypoints)
+    path_lat, path_lng = path or ((start_lat, end_lat), (start_lng, end_lng))
+    max_deviation_km = max_deviation_km or 0
+
+    boxes = corridor_boxes(start_lat, start_lng, end_lat, end_lng, max_deviation_km, path)
+    envelope = (
+        min(box[0] for box in boxes),
+        max(box[1] for box in boxes),
+        min(box[2] for box in boxes),
+        max(box[3] for box in boxes),
+    )
+    unit_lat, unit_lng, length_deg = polyline_segments(path_lat, path_lng)
+    length_km = outline = None
+    if complete:
+        length_km = round(float(
+            geodesic_distance_batch(path_lat[:-1], path_lng[:-1], path_lat[1:], path_lng[1:]).sum()
+        ), 3)
+        outline = _outline(path_lat, path_lng, max_deviation_km)
+
+    return RouteCorridor(
+        path_lat=tuple(path_lat),
+        path_lng=tuple(path_lng),
+        envelope=envelope,
+        boxes=tuple(boxes),
+        unit_lat=tuple(unit_lat.tolist()),
+        unit_lng=tuple(unit_lng.tolist()),
+        segment_length_deg=tuple(length_deg.tolist()),
+        length_km=length_km,
+        outline=outline,
+    )
+
+
+def corridor_payload(route: CourierRoute, corridor: RouteCorridor) -> Dict[str, Any]:
+    """JSON-serializable form of a corridor, as stored in CourierRoute.corridor."""
+    return {
+        "version": CORRIDOR_VERSION,
+        "source": _source(route),
+        **corridor._asdict(),
+    }
+
+
+def corridor_from_payload(payload: Dict[str, Any]) -> RouteCorridor:
+    """Rebuild a corridor stored by corridor_payload()."""
+    return RouteCorridor(
+        path_lat=tuple(payload["path_lat"]),
+        path_lng=tuple(payload["path_lng"]),
+        envelope=tuple(payload["envelope"]),
+        boxes=tuple(tuple(box) for box in payload["boxes"]),
+        unit_lat=tuple(payload["unit_lat"]),
+        unit_lng=tuple(payload["unit_lng"]),
+        segment_length_deg=tuple(payload["segment_length_deg"]),
+        length_km=payload["length_km"],
+        outline=payload["outline"],
+    )
+
+
+def store_corridor(route: CourierRoute) -> RouteCorridor:
+    """Compute a route's corridor and set it on the route (persisted on commit)."""
+    corridor = build_corridor(
+        route.start_lat, route.start_lng,
+        route.end_lat, route.end_lng,
+        route.max_deviation_km,
+        route.waypoints
+    )
+    route.corridor = corridor_payload(route, corridor)
+    return corridor
+
+
+def corridor_of(route: CourierRoute) -> RouteCorridor:
+    """The route's stored corridor if it is current, else one computed for matching only."""
+    payload = route.corridor
+    if (
+        payload
+        and payload.get("version") == CORRIDOR_VERSION
+        and payload.get("source") == _source(route)
+    ):
+        return corridor_from_payload(payload)
+    return build_corridor(
+        route.start_lat, route.start_lng,
+        route.end_lat, route.end_lng,
+        route.max_deviation_km,
+        route.waypoints,
+        complete=False
+    )
@@ -1,27 +1,280 @@
-from typing import List, Tuple
-from shapely.geometry import LineString, Point
-from app.models.package import Package
+"""
+Pickup-and-delivery stop ordering for a courier's accepted packages.
+
+The courier drives from the route start to the route end and visits every
+pickup and dropoff in between. A package's pickup must come before its
+dropoff; packages already in transit only need their dropoff.
+
+The tour is built by cheapest insertion of pickup/dropoff pairs and then
+improved with 2-opt and Or-opt moves that keep every pickup ahead of its
+dropoff, until no move helps or the time budget runs out. The search works
+on one haversine distance matrix computed up front (cheaper to recompute
+than to look up), so it only does table lookups; the reported route length
+uses exact distances from the shared distance cache.
+"""
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app.config import settings
+from app.models.package import Package, PackageStatus
+from app.utils.geo import distance_cache, distance_matrix
+
+# Matrix rows 0 and 1 are the route start and end; stops follow
+START, END = 0, 1
+FIRST_STOP = 2
+
+# Or-opt moves chains of up to this many consecutive stops
+OR_OPT_MAX_SEGMENT = 3
+
+# Ignore "improvements" smaller than this (km), which are float noise
+IMPROVEMENT_EPSILON = 1e-9
+
+
+def build_stops(packages: List[Package]) -> List[dict]:
+    """
+    Pickup and dropoff stops for packages; in-transit packages only get a dropoff.
+
+    Each stop carries the public stop fields plus a private "pickup" index
+    (position in the returned list) on dropoffs whose pickup is also a stop.
+    """
+    stops = []
+    for package in packages:
+        pickup_index = None
+        if package.status != PackageStatus.IN_TRANSIT:
+            pickup_index = len(stops)
+            stops.append({
+                "package_id": package.id,
+                "stop_type": "pickup",
+                "address": package.pickup_address,
+                "lat": package.pickup_lat,
+                "lng": package.pickup_lng,
+                "contact_name": package.pickup_contact_name,
+                "contact_phone": package.pickup_contact_phone,
+            })
+
+        stops.append({
+            "package_id": package.id,
+            "stop_type": "dropoff",
+            "address": package.dropoff_address,
+            "lat": package.dropoff_lat,
+            "lng": package.dropoff_lng,
+            "contact_name": package.dropoff_contact_name,
+            "contact_phone": package.dropoff_contact_phone,
+            "pickup": pickup_index,
+        })
+    return stops
+
+
+def tour_length(tour: List[int], distances) -> float:
+    """Total length of a tour given as matrix node indices."""
+    return float(sum(distances[a][b] for a, b in zip(tour, tour[1:])))
+
+
+def insertion_tour(
+    distances: np.ndarray,
+    pairs: List[Tuple[Optional[int], int]]
+) -> List[int]:
+    """
+    Build a feasible tour by cheapest insertion.
+
+    Args:
+        distances: Node distance matrix (START, END, then stops)
+        pairs: (pickup node or None, dropoff node) per package
+
+    Returns:
+        Tour of node indices from START to END
+    """
+    tour = [START, END]
+
+    # Far-away packages first: they shape the tour, nearby ones slot in cheaply
+    def reach(pair):
+        pickup, dropoff = pair
+        return max(distances[START, dropoff], distances[START, pickup] if pickup is not None else 0.0)
+
+    for pickup, dropoff in sorted(pairs, key=reach, reverse=True):
+        before, after = np.asarray(tour[:-1]), np.asarray(tour[1:])
+        edge = distances[before, after]
+        dropoff_cost = distances[before, dropoff] + distances[dropoff, after] - edge
+
+        if pickup is None:
+            gap = int(np.argmin(dropoff_cost))
+            tour.insert(gap + 1, dropoff)
+            continue
+
+        pickup_cost = distances[before, pickup] + distances[pickup, after] - edge
+        # Pickup and dropoff back to back in the same gap
+        same_gap = distances[before, pickup] + distances[pickup, dropoff] + distances[dropoff, after] - edge
+        best_same = int(np.argmin(same_gap))
+
+        # Pickup in an earlier gap than the dropoff: cheapest pickup gap before each dropoff gap
+        best_separate, separate_cost = None, np.inf
+        if len(edge) > 1:
+            cheapest_pickup = np.minimum.accumulate(pickup_cost)[:-1]
+            totals = cheapest_pickup + dropoff_cost[1:]
+            dropoff_gap = int(np.argmin(totals)) + 1
+            best_separate, separate_cost = dropoff_gap, totals[dropoff_gap - 1]
+
+        if separate_cost < same_gap[best_same]:
+            pickup_gap = int(np.argmin(pickup_cost[:best_separate]))
+            tour.insert(best_separate + 1, dropoff)
+            tour.insert(pickup_gap + 1, pickup)
+        else:
+            tour[best_same + 1:best_same + 1] = [pickup, dropoff]
+
+    return tour
+
+
+class _LocalSearch:
+    """2-opt and Or-opt improvement of a tour under pickup-before-dropoff constraints."""
+
+    def __init__(self, tour: List[int], distances: np.ndarray, pairs: List[Tuple[Optional[int], int]], deadline: float):
+        self.tour = tour
+        self.d = distances.tolist()  # Nested lists: much faster scalar lookups than ndarray
+        self.deadline = deadline
+        self.pickup_of: Dict[int, int] = {}
+        self.dropoff_of: Dict[int, int] = {}
+        for pickup, dropoff in pairs:
+            if pickup is not None:
+                self.pickup_of[dropoff] = pickup
+                self.dropoff_of[pickup] = dropoff
+        self._index()
+
+    def _index(self) -> None:
+        self.pos = {node: i for i, node in enumerate(self.tour)}
+
+    def _expired(self) -> bool:
+        return time.monotonic() >= self.deadline
+
+    def run(self) -> List[int]:
+        improved = True
+        while improved and not self._expired():
+            improved = self._two_opt()
+            improved = self._or_opt() or improved
+        return self.tour
+
+    def _reversal_feasible(self, i: int, j: int) -> bool:
+        """Reversing tour[i..j] is only valid if no package has both stops inside it."""
+        for node in self.tour[i:j + 1]:
+            dropoff = self.dropoff_of.get(node)
+            if dropoff is not None and self.pos[dropoff] <= j:
+                return False
+        return True
+
+    def _two_opt(self) -> bool:
+        d, tour = self.d, self.tour
+        improved = False
+        n = len(tour)
+        for i in range(1, n - 2):
+            if self._expired():
+                break
+            a, b = tour[i - 1], tour[i]
+            for j in range(i + 1, n - 1):
+                c, e = tour[j], tour[j + 1]
+                delta = d[a][c] + d[b][e] - d[a][b] - d[c][e]
+                if delta < -IMPROVEMENT_EPSILON and self._reversal_feasible(i, j):
+                    tour[i:j + 1] = tour[i:j + 1][::-1]
+                    self._index()
+                    improved = True
+                    b = tour[i]
+        return improved
+
+    def _move_feasible(self, i: int, length: int, gap: int) -> bool:
+        """Whether tour[i:i+length] may move between tour[gap] and tour[gap+1]."""
+        segment = self.tour[i:i + length]
+        if gap >= i + length:
+            # Moving later: no pickup may pass its own dropoff
+            for node in segment:
+                dropoff = self.dropoff_of.get(node)
+                if dropoff is not None and i + length <= self.pos[dropoff] <= gap:
+                    return False
+        else:
+            # Moving earlier: no dropoff may pass its own pickup
+            for node in segment:
+                pickup = self.pickup_of.get(node)
+                if pickup is not None and gap < self.pos[pickup] < i:
+                    return False
+        return True
+
+    def _or_opt(self) -> bool:
+        d, tour = self.d, self.tour
+        improved = False
+        for length in range(1, OR_OPT_MAX_SEGMENT + 1):
+            i = 1
+            while i + length <= len(tour) - 1:
+                if self._expired():
+                    return improved
+                prev, first, last, nxt = tour[i - 1], tour[i], tour[i + length - 1], tour[i + length]
+                removal_gain = d[prev][first] + d[last][nxt] - d[prev][nxt]
+
+                best_gap, best_delta = None, -IMPROVEMENT_EPSILON
+                for gap in range(len(tour) - 1):
+                    if i - 1 <= gap <= i + length - 1:
+                        continue
+                    u, v = tour[gap], tour[gap + 1]
+                    delta = d[u][first] + d[last][v] - d[u][v] - removal_gain
+                    if delta < best_delta and self._move_feasible(i, length, gap):
+                        best_gap, best_delta = gap, delta
+
+                if best_gap is None:
+                    i += 1
+                    continue
+
+                segment = tour[i:i + length]
+                del tour[i:i + length]
+                insert_at = best_gap + 1 - (length if best_gap > i else 0)
+                tour[insert_at:insert_at] = segment
+                self._index()
+                improved = True
+        return improved
+
+
+def optimize_stop_sequence(
+    distances: np.ndarray,
+    pairs: List[Tuple[Optional[int], int]],
+    time_budget_ms: Optional[float] = None
+) -> List[int]:
+    """
+    Order stops to minimize total distance from START to END.
+
+    Args:
+        distances: Node distance matrix (START, END, then stops)
+        pairs: (pickup node or None, dropoff node) per package
+        time_budget_ms: Local search time limit (default: ROUTE_OPTIMIZER_TIME_BUDGET_MS)
+
+    Returns:
+        Tour of node indices from START to END with every pickup before its dropoff
+    """
+    if time_budget_ms is None:
+        time_budget_ms = settings.ROUTE_OPTIMIZER_TIME_BUDGET_MS
+    deadline = time.monotonic() + time_budget_ms / 1000
+
+    tour = insertion_tour(distances, pairs)
+    return _LocalSearch(tour, distances, pairs, deadline).run()
 
 
 def optimize_package_order(
     route_start: Tuple[float, float],  # (lat, lng)
     route_end: Tuple[float, float],    # (lat, lng)
-    packages: List[Package]
+    packages: List[Package],
+    time_budget_ms: Optional[float] = None
 ) -> List[dict]:
     """
     Optimize the order of package pickups and dropoffs along a route.
 
     Algorithm:
-    1. Create route line
-    2. For each package, calculate position along route (0-1) for pickup and dropoff
-    3. Create ordered list of stops (pickups and dropoffs)
-    4. Sort by position along route
-    5. Return optimized order
+    1. Build pickup and dropoff stops (dropoff only for in-transit packages)
+    2. Compute the distance matrix between route endpoints and stops
+    3. Insert each package's stops where they add the least distance
+    4. Improve with 2-opt and Or-opt moves until none helps or the time
+       budget is spent, keeping every pickup before its dropoff
 
     Args:
         route_start: Tuple of (latitude, longitude) for route start
         route_end: Tuple of (latitude, longitude) for route end
         packages: List of Package objects to optimize
+        time_budget_ms: Local search time limit (default: ROUTE_OPTIMIZER_TIME_BUDGET_MS)
 
     Returns:
         List of stops with:
@@ -35,51 +288,28 @@ def optimize_package_order(
     if not packages:
         return []
 
-    # Create route line (shapely expects lng, lat order)
-    route_line = LineString([
-        (route_start[1], route_start[0]),  # (lng, lat)
-        (route_end[1], route_end[0])
-    ])
-
-    stops = []
-
-    for package in packages:
-        pickup_point = Point(package.pickup_lng, package.pickup_lat)
-        dropoff_point = Point(package.dropoff_lng, package.dropoff_lat)
-
-        # Calculate position along route (0.0 = start, 1.0 = end)
-        # project() returns normalized distance along the line
-        pickup_position = route_line.project(pickup_point, normalized=True)
-        dropoff_position = route_line.project(dropoff_point, normalized=True)
-
-        stops.append({
-            "package_id": package.id,
-            "stop_type": "pickup",
-            "address": package.pickup_address,
-            "lat": package.pickup_lat,
-            "lng": package.pickup_lng,
-            "position": pickup_position,
-            "contact_name": package.pickup_contact_name,
-            "contact_phone": package.pickup_contact_phone,
-        })
+    stops = build_stops(packages)
+    points = np.asarray([route_start, route_end] + [(stop["lat"], stop["lng"]) for stop in stops])
+    distances = distance_matrix(points[:, 0], points[:, 1], fast=True)
+    pairs = [
+        (None if stop["pickup"] is None else stop["pickup"] + FIRST_STOP, index + FIRST_STOP)
+        for index, stop in enumerate(stops)
+        if stop["stop_type"] == "dropoff"
+    ]
 
-        stops.append({
-            "package_id": package.id,
-            "stop_type": "dropoff",
-            "address": package.dropoff_address,
-            "lat": package.dropoff_lat,
-            "lng": package.dropoff_lng,
-            "position": dropoff_position,
-            "contact_name": package.dropoff_contact_name,
-            "contact_phone": package.dropoff_contact_phone,
-        })
+    tour = optimize_stop_sequence(distances, pairs, time_budget_ms)
 
-    # Sort by position along route
-    stops.sort(key=lambda x: x["position"])
+    ordered = []
+    for sequence_number, node in enumerate(tour[1:-1], 1):
+        stop = dict(stops[node - FIRST_STOP])
+        stop.pop("pickup", None)
+        stop["sequence_number"] = sequence_number
+        ordered.append(stop)
+    return ordered
 
-    # Add sequence numbers and remove internal position value
-    for i, stop in enumerate(stops, 1):
-        stop["sequence_number"] = i
-        del stop["position"]
 
-    return stops
+def route_distance_km(route_start: Tuple[float, float], route_end: Tuple[float, float], stops: List[dict]) -> float:
+    """Geodesic length of driving from route_start through the stops to route_end."""
+    points = [route_start] + [(stop["lat"], stop["lng"]) for stop in stops] + [route_end]
+    coords = np.asarray(points, dtype=np.float64)
+    return float(np.sum(distance_cache.distances(coords[:-1, 0], coords[:-1, 1], coords[1:, 0], coords[1:, 1])))
@@ -0,0 +1,1066 @@
+"""
+In-process spatial index over open packages for route corridor matching.
+
+Packages that are open for bids are bucketed into a uniform lat/lng grid by
+their pickup point, and each entry remembers the cell of its dropoff point.
+A corridor query rasterizes the route segment, expanded by the route's
+deviation, into grid cells and returns only the packages whose pickup and
+dropoff both fall inside those cells. The exact distance checks then run on
+that candidate set instead of on every open package.
+
+The index is kept in sync incrementally: committed ORM changes to Package
+rows mark those package ids dirty, and the next query re-reads just those
+rows. Commits from other processes arrive the same way through the Redis
+change feed (app.services.change_feed), which every commit hook here
+publishes to. A full rebuild happens when the index is older than
+MATCHING_INDEX_MAX_AGE_SECONDS, which also bounds how long changes made
+outside ORM sessions, or while Redis is unreachable, go unseen.
+
+open_packages_in_corridor_query() is the database-side counterpart: it
+pushes the corridor bounding box into the SQL query as lat/lng range
+predicates, plus an IN (...) over the geohash cells covering the corridor
+(app.utils.geohash), and is used whenever the in-process index is not.
+
+Both also take the courier's remaining vehicle capacity
+(app.services.courier_capacity) and drop packages that are too heavy or too
+large before any distance is computed.
+
+RouteSpatialIndex is the reverse direction: active courier routes register
+their corridor cells on a coarser grid, so a single package can be matched
+against only the routes whose corridor covers both its pickup and dropoff.
+It is kept in sync from committed CourierRoute changes the same way.
+
+Routes with waypoints are polylines. Their corridor is built segment by
+segment, both as grid cells and as a handful of SQL bounding boxes, so a long
+winding route only covers the area along its roads rather than the box
+spanned by its start and end.
+"""
+import logging
+import math
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import and_, or_, event
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.models.package import Package, PackageStatus, PackageSize, CourierRoute
+from app.services.change_feed import ChangeFeed, FeedReader, package_changes, route_changes
+from app.services.courier_capacity import SIZE_RANK, UNLIMITED, CourierCapacity, couriers_able_to_carry
+from app.utils import geohash
+from app.utils.geohash import GEOHASH_PRECISIONS
+from app.utils.polyline import decode_polyline
+
+logger = logging.getLogger(__name__)
+
+Cell = Tuple[int, int]
+RouteGeometry = Tuple[float, float, float, float, float]
+Box = Tuple[float, float, float, float]
+
+# (lats, lngs) of every vertex of a route with waypoints, start and end included
+RoutePath = Tuple[Tuple[float, ...], Tuple[float, ...]]
+
+# Conservative kilometres per degree used to turn a deviation into degrees.
+# A degree of latitude is shortest at the equator, and a degree of longitude
+# is evaluated at the highest latitude the corridor reaches, so the grid
+# corridor always contains every point the exact geodesic check accepts.
+KM_PER_DEG_LAT_MIN = 110.574
+KM_PER_DEG_LNG_EQUATOR = 111.320
+CORRIDOR_PADDING = 1.05
+
+# Corridors larger than this fall back to the SQL prefilter (e.g. near the poles)
+MAX_CORRIDOR_CELLS = 250_000
+
+# Max ids per IN (...) clause when loading candidates (SQLite variable limit)
+ID_BATCH_SIZE = 500
+
+# Bounding boxes a polyline corridor is split into for the SQL prefilter
+MAX_CORRIDOR_BOXES = 8
+
+# Largest geohash cover used as an IN (...) list; two lists per query stay
+# below SQLite's default limit of 999 bound variables
+MAX_GEOHASH_CELLS = 400
+
+# Routes whose corridor covers more cells than this are kept in an
+# "unbounded" list and checked against every package instead
+MAX_ROUTE_CELLS = 20_000
+
+_PENDING_KEY = "package_index_dirty_ids"
+_PENDING_ROUTES_KEY = "route_index_dirty_ids"
+
+
+def corridor_margin_deg(lat_min: float, lat_max: float, deviation_km: float) -> Tuple[float, float]:
+    """
+    Convert a deviation in km into (lat, lng) margins in degrees.
+
+    Args:
+        lat_min: Southernmost latitude of the geometry being expanded
+        lat_max: Northernmost latitude of the geometry being expanded
+        deviation_km: Deviation distance in kilometers
+
+    Returns:
+        Tuple of (lat_margin_deg, lng_margin_deg)
+    """
+    padded_km = max(deviation_km, 0) * CORRIDOR_PADDING
+    dlat = padded_km / KM_PER_DEG_LAT_MIN
+    max_abs_lat = min(90.0, max(abs(lat_min), abs(lat_max)) + dlat)
+    cos_lat = math.cos(math.radians(max_abs_lat))
+    if cos_lat < 1e-6:
+        return dlat, 360.0
+    return dlat, min(360.0, padded_km / (KM_PER_DEG_LNG_EQUATOR * cos_lat))
+
+
+def route_path(
+    start_lat: float,
+    start_lng: float,
+    end_lat: float,
+    end_lng: float,
+    waypoints: Optional[str]
+) -> Optional[RoutePath]:
+    """
+    Vertices of a route that has waypoints.
+
+    Args:
+        waypoints: Encoded polyline of the intermediate vertices (start and end excluded)
+
+    Returns:
+        (lats, lngs) from start to end, or None for a straight start→end route
+    """
+    points = decode_polyline(waypoints) if waypoints else []
+    if not points:
+        return None
+    lats, lngs = zip((start_lat, start_lng), *points, (end_lat, end_lng))
+    return lats, lngs
+
+
+def path_of(route: CourierRoute) -> Optional[RoutePath]:
+    """Vertices of a CourierRoute with waypoints, or None for a straight route."""
+    return route_path(route.start_lat, route.start_lng, route.end_lat, route.end_lng, route.waypoints)
+
+
+def corridor_bounding_box(
+    start_lat: float,
+    start_lng: float,
+    end_lat: float,
+    end_lng: float,
+    deviation_km: float
+) -> Tuple[float, float, float, float]:
+    """
+    Bounding box of a route segment expanded by deviation_km.
+
+    Returns:
+        Tuple of (min_lat, max_lat, min_lng, max_lng) in degrees
+    """
+    dlat, dlng = corridor_margin_deg(min(start_lat, end_lat), max(start_lat, end_lat), deviation_km)
+    return (
+        min(start_lat, end_lat) - dlat,
+        max(start_lat, end_lat) + dlat,
+        min(start_lng, end_lng) - dlng,
+        max(start_lng, end_lng) + dlng,
+    )
+
+
+def corridor_boxes(
+    start_lat: float,
+    start_lng: float,
+    end_lat: float,
+    end_lng: float,
+    deviation_km: float,
+    path: Optional[RoutePath] = None,
+    max_boxes: int = MAX_CORRIDOR_BOXES
+) -> List[Box]:
+    """
+    Bounding boxes that together cover a route corridor.
+
+    A straight route gets its single corridor bounding box. A polyline is cut
+    into at most max_boxes runs of consecutive segments, and each run gets
+    the bounding box of its vertices expanded by deviation_km.
+
+    Returns:
+        List of (min_lat, max_lat, min_lng, max_lng) boxes in degrees
+    """
+    if path is None:
+        return [corridor_bounding_box(start_lat, start_lng, end_lat, end_lng, deviation_km)]
+
+    lats, lngs = path
+    segments = len(lats) - 1
+    per_box = max(1, math.ceil(segments / max_boxes))
+    boxes = []
+    for lo in range(0, segments, per_box):
+        run_lats = lats[lo:lo + per_box + 1]
+        run_lngs = lngs[lo:lo + per_box + 1]
+        dlat, dlng = corridor_margin_deg(min(run_lats), max(run_lats), deviation_km)
+        boxes.append((
+            min(run_lats) - dlat,
+            max(run_lats) + dlat,
+            min(run_lngs) - dlng,
+            max(run_lngs) + dlng,
+        ))
+    return boxes
+
+
+def _in_boxes(lat_column, lng_column, boxes: List[Box]):
+    """SQL predicate for a point lying in any of the boxes."""
+    clauses = []
+    for min_lat, max_lat, min_lng, max_lng in boxes:
+        conditions = [lat_column.between(min_lat, max_lat)]
+        # Corridors crossing the antimeridian only get the latitude predicates
+        if min_lng >= -180 and max_lng <= 180:
+            conditions.append(lng_column.between(min_lng, max_lng))
+        clauses.append(and_(*conditions))
+    return clauses[0] if len(clauses) == 1 else or_(*clauses)
+
+
+def open_packages_in_corridor_query(
+    db: Session,
+    route: CourierRoute,
+    capacity: CourierCapacity = UNLIMITED
+):
+    """
+    Query open packages whose pickup and dropoff lie in the route's corridor bounding boxes.
+
+    The range predicates are served by the composite (status, is_active, lat, lng)
+    indexes on packages, so only rows near the route are read and hydrated.
+    When the corridor is small enough, the pickup and dropoff geohash cells
+    must also be in the corridor's cell cover, an IN (...) lookup on the
+    (status, is_active, geohash) indexes. Packages the courier's capacity
+    does not allow are filtered out as well.
+    """
+    from app.services.route_corridor import corridor_of  # route_corridor imports this module
+
+    corridor = corridor_of(route)
+    path = corridor.path
+    boxes = list(corridor.boxes)
+
+    conditions = [
+        Package.status == PackageStatus.OPEN_FOR_BIDS,
+        Package.is_active == True,
+        _in_boxes(Package.pickup_lat, Package.pickup_lng, boxes),
+        _in_boxes(Package.dropoff_lat, Package.dropoff_lng, boxes),
+    ]
+    cover = corridor_geohashes(
+        route.start_lat, route.start_lng,
+        route.end_lat, route.end_lng,
+        route.max_deviation_km,
+        path
+    )
+    if cover is not None:
+        conditions.append(_cells_condition("pickup", Package, cover))
+        conditions.append(_cells_condition("dropoff", Package, cover))
+    conditions.extend(capacity.package_conditions())
+
+    return db.query(Package).filter(and_(*conditions))
+
+
+def segment_corridor_cells(
+    start_lat: float,
+    start_lng: float,
+    end_lat: float,
+    end_lng: float,
+    deviation_km: float,
+    cell_deg: float,
+    cell_lng_deg: Optional[float] = None
+) -> Optional[Set[Cell]]:
+    """
+    Rasterize a route segment expanded by deviation_km into grid cells.
+
+    The covered area is the segment swept by a (lat, lng) margin box, computed
+    column by column: for each column of cells, the part of the segment that
+    can reach it gives the range of rows to include.
+
+    Args:
+        cell_deg: Cell height (and width, unless cell_lng_deg is given) in degrees
+        cell_lng_deg: Cell width in degrees for non-square grids such as geohashes
+
+    Returns:
+        Set of (row, col) cells, or None if the corridor exceeds MAX_CORRIDOR_CELLS
+    """
+    cell_lng_deg = cell_lng_deg or cell_deg
+    dlat, dlng = corridor_margin_deg(
+        min(start_lat, end_lat), max(start_lat, end_lat), deviation_km
+    )
+
+    col_lo = math.floor((min(start_lng, end_lng) - dlng) / cell_lng_deg)
+    col_hi = math.floor((max(start_lng, end_lng) + dlng) / cell_lng_deg)
+
+    cells: Set[Cell] = set()
+    d_lng = end_lng - start_lng
+    d_lat = end_lat - start_lat
+
+    for col in range(col_lo, col_hi + 1):
+        # Longitude band whose points can lie within the margin of this column
+        band_lo = col * cell_lng_deg - dlng
+        band_hi = (col + 1) * cell_lng_deg + dlng
+
+        if d_lng == 0:
+            if not band_lo <= start_lng <= band_hi:
+                continue
+            t_lo, t_hi = 0.0, 1.0
+        else:
+            t_a = (band_lo - start_lng) / d_lng
+            t_b = (band_hi - start_lng) / d_lng
+            t_lo = max(0.0, min(t_a, t_b))
+            t_hi = min(1.0, max(t_a, t_b))
+            if t_lo > t_hi:
+                continue
+
+        lat_a = start_lat + t_lo * d_lat
+        lat_b = start_lat + t_hi * d_lat
+        row_lo = math.floor((min(lat_a, lat_b) - dlat) / cell_deg)
+        row_hi = math.floor((max(lat_a, lat_b) + dlat) / cell_deg)
+
+        if len(cells) + (row_hi - row_lo + 1) > MAX_CORRIDOR_CELLS:
+            return None
+
+        for row in range(row_lo, row_hi + 1):
+            cells.add((row, col))
+
+    return cells
+
+
+def path_corridor_cells(
+    start_lat: float,
+    start_lng: float,
+    end_lat: float,
+    end_lng: float,
+    deviation_km: float,
+    cell_deg: float,
+    path: Optional[RoutePath] = None,
+    cell_lng_deg: Optional[float] = None
+) -> Optional[Set[Cell]]:
+    """
+    Rasterize a route corridor into grid cells, one segment at a time.
+
+    Straight routes are a single segment. For polylines the union of the
+    segment corridors is only as wide as the deviation around each segment.
+
+    Returns:
+        Set of (row, col) cells, or None if the corridor exceeds MAX_CORRIDOR_CELLS
+    """
+    if path is None:
+        return segment_corridor_cells(start_lat, start_lng, end_lat, end_lng, deviation_km, cell_deg, cell_lng_deg)
+
+    lats, lngs = path
+    cells: Set[Cell] = set()
+    for i in range(len(lats) - 1):
+        segment_cells = segment_corridor_cells(
+            lats[i], lngs[i], lats[i + 1], lngs[i + 1], deviation_km, cell_deg, cell_lng_deg
+        )
+        if segment_cells is None:
+            return None
+        cells |= segment_cells
+        if len(cells) > MAX_CORRIDOR_CELLS:
+            return None
+    return cells
+
+
+def corridor_geohashes(
+    start_lat: float,
+    start_lng: float,
+    end_lat: float,
+    end_lng: float,
+    deviation_km: float,
+    path: Optional[RoutePath] = None
+) -> Optional[Tuple[int, List[str]]]:
+    """
+    Geohash cells covering a route corridor, at the finest usable precision.
+
+    The corridor is rasterized on the geohash grid of each stored precision,
+    coarsest first, and the finest cover of at most MAX_GEOHASH_CELLS cells
+    is kept. A degenerate segment (start == end) covers a circle of
+    deviation_km around a point.
+
+    Returns:
+        (precision, sorted geohashes), or None if even the coarsest cover is too large
+    """
+    cover = None
+    for precision in GEOHASH_PRECISIONS:
+        hashes = corridor_geohash_cover(
+            precision, start_lat, start_lng, end_lat, end_lng, deviation_km, path
+        )
+        if hashes is None:
+            break
+        cover = (precision, hashes)
+    return cover
+
+
+def corridor_geohash_cover(
+    precision: int,
+    start_lat: float,
+    start_lng: float,
+    end_lat: float,
+    end_lng: float,
+    deviation_km: float,
+    path: Optional[RoutePath] = None,
+    max_cells: int = MAX_GEOHASH_CELLS
+) -> Optional[List[str]]:
+    """
+    Geohash cells of one precision covering a route corridor.
+
+    Returns:
+        Sorted geohashes, or None if the cover has more than max_cells cells
+    """
+    lat_bits, lng_bits = geohash.grid_bits(precision)
+    cell_lat_deg, cell_lng_deg = geohash.cell_size(precision)
+    cells = path_corridor_cells(
+        start_lat, start_lng, end_lat, end_lng, deviation_km,
+        cell_lat_deg, path, cell_lng_deg
+    )
+    if cells is None or len(cells) > max_cells:
+        return None
+
+    # Grid rows/cols count from the equator and Greenwich, geohash ones from the south pole and antimeridian
+    row_offset, col_offset, cols = 1 << (lat_bits - 1), 1 << (lng_bits - 1), 1 << lng_bits
+    return sorted({
+        geohash.encode_cell(row + row_offset, (col + col_offset) % cols, precision)
+        for row, col in cells
+        if 0 <= row + row_offset < (1 << lat_bits)
+    })
+
+
+def _cells_condition(column_prefix: str, model, cover: Tuple[int, List[str]]):
+    """SQL predicate for a point whose stored geohash is in the cover."""
+    precision, hashes = cover
+    return getattr(model, f"{column_prefix}_geohash_{precision}").in_(hashes)
+
+
+def open_packages_near_point_query(db: Session, lat: float, lng: float, radius_km: float):
+    """
+    Query open packages whose pickup may lie within radius_km of a point.
+
+    The lookup is an IN (...) over the pickup geohash cells covering the
+    circle, served by the (status, is_active, pickup_geohash_N) indexes;
+    callers still run the exact distance check.
+    """
+    query = db.query(Package).filter(
+        and_(
+            Package.status == PackageStatus.OPEN_FOR_BIDS,
+            Package.is_active == True
+        )
+    )
+    cover = corridor_geohashes(lat, lng, lat, lng, radius_km)
+    if cover is None:
+        return query
+    return query.filter(_cells_condition("pickup", Package, cover))
+
+
+def routes_starting_near_point_query(db: Session, lat: float, lng: float, radius_km: float):
+    """
+    Query active, non-expired routes whose start may lie within radius_km of a point.
+
+    Served by the start_geohash_N indexes; callers still run the exact
+    distance check.
+    """
+    query = active_routes_query(db)
+    cover = corridor_geohashes(lat, lng, lat, lng, radius_km)
+    if cover is None:
+        return query
+    return query.filter(_cells_condition("start", CourierRoute, cover))
+
+
+class PackageSpatialIndex:
+    """
+    Grid index over the pickup/dropoff points of packages open for bids.
+
+    Each entry also keeps the package weight and size rank, so corridor
+    queries can apply a courier's capacity while scanning the cells.
+
+    With a change feed, ensure_fresh() also re-reads the packages other
+    processes changed.
+    """
+
+    def __init__(self, cell_deg: Optional[float] = None, changes: Optional[ChangeFeed] = None):
+        self.cell_deg = cell_deg or settings.MATCHING_INDEX_CELL_DEG
+        self._lock = threading.RLock()
+        self._entries: Dict[int, Tuple[Cell, Cell, float, int]] = {}
+        self._pickup_cells: Dict[Cell, Set[int]] = {}
+        self._dirty_ids: Set[int] = set()
+        self._loaded_at: Optional[float] = None
+        self._in_use = False
+        self._feed = FeedReader(changes) if changes is not None else None
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def cell_for(self, lat: float, lng: float) -> Cell:
+        """Return the (row, col) grid cell containing a point."""
+        return (math.floor(lat / self.cell_deg), math.floor(lng / self.cell_deg))
+
+    # Maintenance
+    def upsert(
+        self,
+        package_id: int,
+        pickup_lat: float,
+        pickup_lng: float,
+        dropoff_lat: float,
+        dropoff_lng: float,
+        weight_kg: float = 0.0,
+        size: PackageSize = PackageSize.SMALL
+    ) -> None:
+        """Add a package to the index, or move it if its location changed."""
+        pickup_cell = self.cell_for(pickup_lat, pickup_lng)
+        dropoff_cell = self.cell_for(dropoff_lat, dropoff_lng)
+
+        with self._lock:
+            self._discard(package_id)
+            self._entries[package_id] = (pickup_cell, dropoff_cell, weight_kg or 0.0, SIZE_RANK[size])
+            self._pickup_cells.setdefault(pickup_cell, set()).add(package_id)
+
+    def remove(self, package_id: int) -> None:
+        """Remove a package from the index (no-op if not indexed)."""
+        with self._lock:
+            self._discard(package_id)
+
+    def _discard(self, package_id: int) -> None:
+        entry = self._entries.pop(package_id, None)
+        if entry is None:
+            return
+        bucket = self._pickup_cells.get(entry[0])
+        if bucket is not None:
+            bucket.discard(package_id)
+            if not bucket:
+                del self._pickup_cells[entry[0]]
+
+    def clear(self) -> None:
+        """Drop all entries; the next ensure_fresh() rebuilds from the database."""
+        with self._lock:
+            self._entries.clear()
+            self._pickup_cells.clear()
+            self._dirty_ids.clear()
+            self._loaded_at = None
+            self._in_use = False
+        if self._feed is not None:
+            self._feed.reset()
+
+    def mark_dirty(self, package_ids: Iterable[int]) -> None:
+        """Flag packages whose row changed; they are re-read on the next query."""
+        with self._lock:
+            # Until the first rebuild there is nothing to refresh
+            if self._in_use:
+                self._dirty_ids.update(package_ids)
+
+    def is_stale(self) -> bool:
+        """Whether the index needs a full rebuild."""
+        if self._loaded_at is None:
+            return True
+        return time.monotonic() - self._loaded_at > settings.MATCHING_INDEX_MAX_AGE_SECONDS
+
+    def rebuild(self, db: Session) -> None:
+        """Reload every open package from the database."""
+        # Changes committed after this point stay dirty and are re-read later
+        mark = self._feed.begin_load() if self._feed is not None else None
+        with self._lock:
+            self._in_use = True
+            self._dirty_ids.clear()
+
+        rows = _open_package_location_query(db).all()
+
+        with self._lock:
+            self._entries.clear()
+            self._pickup_cells.clear()
+            for row in rows:
+                self.upsert(*row)
+            self._loaded_at = time.monotonic()
+        if mark is not None:
+            self._feed.loaded(mark)
+
+        logger.info(f"Package spatial index rebuilt with {len(rows)} open packages")
+
+    def refresh_dirty(self, db: Session) -> None:
+        """Re-read only the packages that changed since the last query."""
+        with self._lock:
+            dirty_ids = sorted(self._dirty_ids)
+            self._dirty_ids.clear()
+
+        if not dirty_ids:
+            return
+
+        found = {}
+        for i in range(0, len(dirty_ids), ID_BATCH_SIZE):
+            batch = dirty_ids[i:i + ID_BATCH_SIZE]
+            for row in _open_package_location_query(db).filter(Package.id.in_(batch)):
+                found[row[0]] = row
+
+        with self._lock:
+            for package_id in dirty_ids:
+                row = found.get(package_id)
+                if row is None:
+                    self._discard(package_id)
+                else:
+                    self.upsert(*row)
+
+    @property
+    def synced_at(self) -> Optional[float]:
+        """time.monotonic() since which the index has every change from any process, if known."""
+        return self._feed.synced_at if self._feed is not None else None
+
+    def ensure_fresh(self, db: Session) -> None:
+        """Bring the index up to date before a query."""
+        if self.is_stale() or (self._feed is not None and not self._feed.catch_up(self.mark_dirty)):
+            self.rebuild(db)
+        else:
+            self.refresh_dirty(db)
+
+    # Queries
+    def query_corridor(
+        self,
+        start_lat: float,
+        start_lng: float,
+        end_lat: float,
+        end_lng: float,
+        deviation_km: float,
+        capacity: CourierCapacity = UNLIMITED,
+        path: Optional[RoutePath] = None
+    ) -> Optional[Set[int]]:
+        """
+        Find packages whose pickup and dropoff may lie within a route corridor.
+
+        The result is a superset of the packages within deviation_km of the
+        segment (or of the polyline given by path) that the courier's
+        capacity allows; callers still run the exact distance check.
+
+        Returns:
+            Set of candidate package ids, or None if the corridor is too large
+            to rasterize and the caller should use the SQL prefilter instead
+        """
+        cells = path_corridor_cells(
+            start_lat, start_lng, end_lat, end_lng, deviation_km, self.cell_deg, path
+        )
+        if cells is None:
+            return None
+
+        max_weight = math.inf if capacity.max_weight_kg is None else capacity.max_weight_kg
+        max_size_rank = capacity.max_size_rank
+
+        candidates: Set[int] = set()
+        with self._lock:
+            for cell in cells:
+                bucket = self._pickup_cells.get(cell)
+                if not bucket:
+                    continue
+                for package_id in bucket:
+                    _, dropoff_cell, weight_kg, size_rank = self._entries[package_id]
+                    if weight_kg <= max_weight and size_rank <= max_size_rank and dropoff_cell in cells:
+                        candidates.add(package_id)
+
+        return candidates
+
+
+def _open_package_location_query(db: Session):
+    return db.query(
+        Package.id,
+        Package.pickup_lat,
+        Package.pickup_lng,
+        Package.dropoff_lat,
+        Package.dropoff_lng,
+        Package.weight_kg,
+        Package.size,
+    ).filter(
+        and_(
+            Package.status == PackageStatus.OPEN_FOR_BIDS,
+            Package.is_active == True
+        )
+    )
+
+
+# Shared index for this process
+package_index = PackageSpatialIndex(changes=package_changes)
+
+
+def find_open_packages_near_route(
+    db: Session,
+    route: CourierRoute,
+    capacity: CourierCapacity = UNLIMITED
+) -> List[Package]:
+    """
+    Load the open packages that may match a courier route.
+
+    Uses the spatial index to skip packages outside the route corridor or
+    beyond the courier's capacity, and falls back to the SQL bounding-box
+    prefilter when the index is disabled.
+    """
+    open_packages = open_packages_in_corridor_query(db, route, capacity)
+
+    if not settings.MATCHING_INDEX_ENABLED:
+        return open_packages.order_by(Package.id).all()
+
+    package_index.ensure_fresh(db)
+    candidate_ids = package_index.query_corridor(
+        route.start_lat, route.start_lng,
+        route.end_lat, route.end_lng,
+        route.max_deviation_km,
+        capacity,
+        path_of(route)
+    )
+
+    if candidate_ids is None:
+        return open_packages.order_by(Package.id).all()
+
+    ids = sorted(candidate_ids)
+    packages = []
+    for i in range(0, len(ids), ID_BATCH_SIZE):
+        packages.extend(
+            open_packages.filter(Package.id.in_(ids[i:i + ID_BATCH_SIZE]))
+            .order_by(Package.id)
+            .all()
+        )
+    return packages
+
+
+class RouteSpatialIndex:
+    """
+    Grid index over the corridors of active courier routes.
+
+    Besides its corridor cells, each entry keeps the route geometry, trip
+    date, courier and waypoint path, so candidate routes for a package can be
+    scored and expired routes skipped without touching the database.
+
+    With a change feed, ensure_fresh() also re-reads the routes other
+    processes changed.
+    """
+
+    def __init__(self, cell_deg: Optional[float] = None, changes: Optional[ChangeFeed] = None):
+        self.cell_deg = cell_deg or settings.MATCHING_ROUTE_INDEX_CELL_DEG
+        self._lock = threading.RLock()
+        self._entries: Dict[
+            int, Tuple[Optional[Set[Cell]], RouteGeometry, Optional[float], Optional[int], Optional[RoutePath]]
+        ] = {}
+        self._cell_routes: Dict[Cell, Set[int]] = {}
+        self._unbounded: Set[int] = set()
+        self._dirty_ids: Set[int] = set()
+        self._loaded_at: Optional[float] = None
+        self._feed = FeedReader(changes) if changes is not None else None
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def cell_for(self, lat: float, lng: float) -> Cell:
+        """Return the (row, col) grid cell containing a point."""
+        return (math.floor(lat / self.cell_deg), math.floor(lng / self.cell_deg))
+
+    # Maintenance
+    def upsert(
+        self,
+        route_id: int,
+        start_lat: float,
+        start_lng: float,
+        end_lat: float,
+        end_lng: float,
+        max_deviation_km: float,
+        trip_date: Optional[datetime] = None,
+        courier_id: Optional[int] = None,
+        waypoints: Optional[str] = None
+    ) -> None:
+        """Add a route corridor to the index, or replace it if the route changed."""
+        max_deviation_km = max_deviation_km or 0
+        path = route_path(start_lat, start_lng, end_lat, end_lng, waypoints)
+        cells = path_corridor_cells(
+            start_lat, start_lng, end_lat, end_lng, max_deviation_km, self.cell_deg, path
+        )
+        if cells is not None and len(cells) > MAX_ROUTE_CELLS:
+            cells = None
+        geometry = (start_lat, start_lng, end_lat, end_lng, float(max_deviation_km))
+
+        with self._lock:
+            self._discard(route_id)
+            self._entries[route_id] = (cells, geometry, _trip_timestamp(trip_date), courier_id, path)
+            if cells is None:
+                self._unbounded.add(route_id)
+                return
+            for cell in cells:
+                self._cell_routes.setdefault(cell, set()).add(route_id)
+
+    def remove(self, route_id: int) -> None:
+        """Remove a route from the index (no-op if not indexed)."""
+        with self._lock:
+            self._discard(route_id)
+
+    def _discard(self, route_id: int) -> None:
+        entry = self._entries.pop(route_id, None)
+        if entry is None:
+            return
+        cells = entry[0]
+        if cells is None:
+            self._unbounded.discard(route_id)
+            return
+        for cell in cells:
+            bucket = self._cell_routes.get(cell)
+            if bucket is not None:
+                bucket.discard(route_id)
+                if not bucket:
+                    del self._cell_routes[cell]
+
+    def sync_route(self, route: CourierRoute) -> None:
+        """Apply a route's committed state right away instead of on the next query."""
+        if route.is_active:
+            self.upsert(
+                route.id,
+                route.start_lat, route.start_lng,
+                route.end_lat, route.end_lng,
+                route.max_deviation_km,
+                route.trip_date,
+                route.courier_id,
+                route.waypoints
+            )
+        else:
+            self.remove(route.id)
+
+    def clear(self) -> None:
+        """Drop all entries; the next ensure_fresh() rebuilds from the database."""
+        with self._lock:
+            self._entries.clear()
+            self._cell_routes.clear()
+            self._unbounded.clear()
+            self._dirty_ids.clear()
+            self._loaded_at = None
+        if self._feed is not None:
+            self._feed.reset()
+
+    def mark_dirty(self, route_ids: Iterable[int]) -> None:
+        """Flag routes whose row changed; they are re-read on the next query."""
+        with self._lock:
+            self._dirty_ids.update(route_ids)
+
+    def is_loaded(self) -> bool:
+        """Whether the index has been built from the database at least once."""
+        return self._loaded_at is not None
+
+    def is_stale(self) -> bool:
+        """Whether the index needs a full rebuild."""
+        if self._loaded_at is None:
+            return True
+        return time.monotonic() - self._loaded_at > settings.MATCHING_INDEX_MAX_AGE_SECONDS
+
+    def rebuild(self, db: Session) -> None:
+        """Reload every active route from the database."""
+        mark = self._feed.begin_load() if self._feed is not None else None
+        with self._lock:
+            self._dirty_ids.clear()
+
+        rows = _active_route_geometry_query(db).all()
+
+        with self._lock:
+            self._entries.clear()
+            self._cell_routes.clear()
+            self._unbounded.clear()
+            for row in rows:
+                self.upsert(*row)
+            self._loaded_at = time.monotonic()
+        if mark is not None:
+            self._feed.loaded(mark)
+
+        logger.info(f"Route spatial index rebuilt with {len(rows)} active routes")
+
+    def refresh_dirty(self, db: Session) -> None:
+        """Re-read only the routes that changed since the last query."""
+        with self._lock:
+            dirty_ids = sorted(self._dirty_ids)
+            self._dirty_ids.clear()
+
+        if not dirty_ids:
+            return
+
+        found = {}
+        for i in range(0, len(dirty_ids), ID_BATCH_SIZE):
+            batch = dirty_ids[i:i + ID_BATCH_SIZE]
+            for row in _active_route_geometry_query(db).filter(CourierRoute.id.in_(batch)):
+                found[row[0]] = row
+
+        with self._lock:
+            for route_id in dirty_ids:
+                row = found.get(route_id)
+                if row is None:
+                    self._discard(route_id)
+                else:
+                    self.upsert(*row)
+
+    @property
+    def synced_at(self) -> Optional[float]:
+        """time.monotonic() since which the index has every change from any process, if known."""
+        return self._feed.synced_at if self._feed is not None else None
+
+    def ensure_fresh(self, db: Session) -> None:
+        """Bring the index up to date before a query."""
+        if self.is_stale() or (self._feed is not None and not self._feed.catch_up(self.mark_dirty)):
+            self.rebuild(db)
+        else:
+            self.refresh_dirty(db)
+
+    # Queries
+    def query_package(
+        self,
+        pickup_lat: float,
+        pickup_lng: float,
+        dropoff_lat: float,
+        dropoff_lng: float
+    ) -> Set[int]:
+        """
+        Find non-expired routes whose corridor may contain both a pickup and a dropoff point.
+
+        The result is a superset of the matching routes; callers still run
+        the exact distance check.
+        """
+        pickup_cell = self.cell_for(pickup_lat, pickup_lng)
+        dropoff_cell = self.cell_for(dropoff_lat, dropoff_lng)
+        now = time.time()
+
+        with self._lock:
+            pickup_routes = self._cell_routes.get(pickup_cell, set())
+            dropoff_routes = self._cell_routes.get(dropoff_cell, set())
+            if len(dropoff_routes) < len(pickup_routes):
+                pickup_routes, dropoff_routes = dropoff_routes, pickup_routes
+            candidates = {r for r in pickup_routes if r in dropoff_routes}
+            candidates.update(self._unbounded)
+            return {
+                route_id for route_id in candidates
+                if self._entries[route_id][2] is None or self._entries[route_id][2] >= now
+            }
+
+    def geometries(self, route_ids: Iterable[int]) -> Dict[int, RouteGeometry]:
+        """Return (start_lat, start_lng, end_lat, end_lng, max_deviation_km) for indexed routes."""
+        with self._lock:
+            return {
+                route_id: self._entries[route_id][1]
+                for route_id in route_ids
+                if route_id in self._entries
+            }
+
+    def paths(self, route_ids: Iterable[int]) -> Dict[int, RoutePath]:
+        """Return the waypoint path of the indexed routes that have one."""
+        with self._lock:
+            return {
+                route_id: self._entries[route_id][4]
+                for route_id in route_ids
+                if route_id in self._entries and self._entries[route_id][4] is not None
+            }
+
+    def couriers(self, route_ids: Iterable[int]) -> Dict[int, Optional[int]]:
+        """Return the courier id of each indexed route."""
+        with self._lock:
+            return {
+                route_id: self._entries[route_id][3]
+                for route_id in route_ids
+                if route_id in self._entries
+            }
+
+    def routes_for_couriers(self, courier_ids: Iterable[int]) -> Set[int]:
+        """Return the indexed routes of the given couriers."""
+        courier_ids = set(courier_ids)
+        with self._lock:
+            return {
+                route_id for route_id, entry in self._entries.items()
+                if entry[3] in courier_ids
+            }
+
+
+def _trip_timestamp(trip_date: Optional[datetime]) -> Optional[float]:
+    if trip_date is None:
+        return None
+    if trip_date.tzinfo is None:
+        trip_date = trip_date.replace(tzinfo=timezone.utc)
+    return trip_date.timestamp()
+
+
+def _active_route_geometry_query(db: Session):
+    return db.query(
+        CourierRoute.id,
+        CourierRoute.start_lat,
+        CourierRoute.start_lng,
+        CourierRoute.end_lat,
+        CourierRoute.end_lng,
+        CourierRoute.max_deviation_km,
+        CourierRoute.trip_date,
+        CourierRoute.courier_id,
+        CourierRoute.waypoints,
+    ).filter(CourierRoute.is_active == True)
+
+
+def active_routes_query(db: Session):
+    """Query active courier routes whose trip date has not passed."""
+    now = datetime.now(timezone.utc)
+    return db.query(CourierRoute).filter(
+        and_(
+            CourierRoute.is_active == True,
+            or_(
+                CourierRoute.trip_date.is_(None),
+                CourierRoute.trip_date >= now
+            )
+        )
+    )
+
+
+def load_active_routes(db: Session, route_ids: Iterable[int]) -> List[CourierRoute]:
+    """Load the given routes that are still active and not expired, ordered by id."""
+    ids = sorted(route_ids)
+    routes = []
+    for i in range(0, len(ids), ID_BATCH_SIZE):
+        routes.extend(
+            active_routes_query(db)
+            .filter(CourierRoute.id.in_(ids[i:i + ID_BATCH_SIZE]))
+            .order_by(CourierRoute.id)
+            .all()
+        )
+    return routes
+
+
+# Shared route index for this process
+route_index = RouteSpatialIndex(changes=route_changes)
+
+
+def find_route_candidates_for_package(db: Session, package: Package) -> Optional[Dict[int, RouteGeometry]]:
+    """
+    Find the routes that may match a package, with their geometry.
+
+    Routes whose courier has no room for the package are dropped before
+    their geometry is returned.
+
+    Returns:
+        Dict of route id -> geometry from the route index, or None when the
+        index is disabled and the caller should score every active route
+    """
+    if not settings.MATCHING_INDEX_ENABLED:
+        return None
+
+    route_index.ensure_fresh(db)
+    candidate_ids = route_index.query_package(
+        package.pickup_lat, package.pickup_lng,
+        package.dropoff_lat, package.dropoff_lng
+    )
+    route_couriers = route_index.couriers(candidate_ids)
+    able = couriers_able_to_carry(db, route_couriers.values(), package.weight_kg, package.size)
+    return route_index.geometries(
+        route_id for route_id, courier_id in route_couriers.items() if courier_id in able
+    )
+
+
+# Keep the indexes in sync with committed package and route changes, and tell
+# other processes through the change feed
+@event.listens_for(Session, "after_flush")
+def _collect_changed_packages(session: Session, flush_context) -> None:
+    changed = session.info.setdefault(_PENDING_KEY, set())
+    changed_routes = session.info.setdefault(_PENDING_ROUTES_KEY, set())
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, Package) and obj.id is not None:
+            changed.add(obj.id)
+        elif isinstance(obj, CourierRoute) and obj.id is not None:
+            changed_routes.add(obj.id)
+
+
+@event.listens_for(Session, "after_commit")
+def _apply_changed_packages(session: Session) -> None:
+    changed = session.info.pop(_PENDING_KEY, None)
+    if changed:
+        package_index.mark_dirty(changed)
+        package_changes.publish(changed)
+    changed_routes = session.info.pop(_PENDING_ROUTES_KEY, None)
+    if changed_routes:
+        route_index.mark_dirty(changed_routes)
+        route_changes.publish(changed_routes)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_changed_packages(session: Session) -> None:
+    session.info.pop(_PENDING_KEY, None)
+    session.info.pop(_PENDING_ROUTES_KEY, None)
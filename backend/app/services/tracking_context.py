@@ -0,0 +1,148 @@
+"""
+Cache of active tracking-session context for the location update hot path.
+
+A location update needs the session's courier (authorization), whether it
+is active, its package's dropoff (ETA) and its sharing preference. These do
+not change while the session runs, so they are cached when the session
+starts, in two layers:
+
+- in process: a small LRU with a short TTL (TRACKING_CONTEXT_LOCAL_TTL_SECONDS)
+- in Redis under tracking:context:{session_id}, shared by workers, for
+  TRACKING_CONTEXT_TTL_SECONDS
+
+Ending a session drops the local entry and replaces the Redis entry with a
+short-lived tombstone, so other workers stop using it once their own local
+entry expires. A miss is not an error: TrackingService loads the session
+and package from the database and caches them in process only, so a load
+that races with the session ending cannot put a stale entry in Redis.
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import NamedTuple, Optional, Tuple
+
+from app.config import settings
+from app.models.package import Package
+from app.models.tracking import TrackingSession
+from app.services.redis_client import RedisClient
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = "tracking:context:"
+
+
+class SessionContext(NamedTuple):
+    """What a location update needs to know about its active session."""
+    session_id: int
+    courier_id: int
+    package_id: int
+    dropoff_lat: Optional[float]
+    dropoff_lng: Optional[float]
+    share_live_location: bool
+    update_interval_seconds: int
+
+    @classmethod
+    def of(cls, session: TrackingSession, package: Optional[Package]) -> "SessionContext":
+        return cls(
+            session_id=session.id,
+            courier_id=session.courier_id,
+            package_id=session.package_id,
+            dropoff_lat=package.dropoff_lat if package else None,
+            dropoff_lng=package.dropoff_lng if package else None,
+            share_live_location=bool(session.share_live_location),
+            update_interval_seconds=session.update_interval_seconds or 30,
+        )
+
+
+class TrackingContextCache:
+    """In-process LRU in front of Redis for SessionContext, with hit/miss counters."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local: "OrderedDict[int, Tuple[float, SessionContext]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(session_id: int) -> str:
+        return f"{KEY_PREFIX}{session_id}"
+
+    def _get_local(self, session_id: int) -> Optional[SessionContext]:
+        with self._lock:
+            entry = self._local.get(session_id)
+            if entry is None:
+                return None
+            expires_at, context = entry
+            if time.monotonic() >= expires_at:
+                del self._local[session_id]
+                return None
+            self._local.move_to_end(session_id)
+            return context
+
+    def _put_local(self, context: SessionContext) -> None:
+        with self._lock:
+            self._local[context.session_id] = (
+                time.monotonic() + settings.TRACKING_CONTEXT_LOCAL_TTL_SECONDS,
+                context
+            )
+            self._local.move_to_end(context.session_id)
+            while len(self._local) > settings.TRACKING_CONTEXT_LOCAL_MAX_ENTRIES:
+                self._local.popitem(last=False)
+
+    def _count(self, hit: bool) -> None:
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    async def get(self, session_id: int, redis: Optional[RedisClient] = None) -> Optional[SessionContext]:
+        """Context of an active session, or None if it is not cached."""
+        if not settings.TRACKING_CONTEXT_CACHE_ENABLED:
+            return None
+
+        context = self._get_local(session_id)
+        if context is None and redis is not None:
+            try:
+                cached = await redis.get_json(self.key(session_id))
+                if isinstance(cached, dict) and not cached.get("ended"):
+                    context = SessionContext(**cached)
+                    self._put_local(context)
+            except Exception as e:
+                logger.warning(f"Tracking context read failed for session {session_id}: {e}")
+
+        self._count(context is not None)
+        return context
+
+    async def put(self, context: SessionContext, redis: Optional[RedisClient] = None) -> None:
+        """Cache the context of an active session (in Redis too when redis is given)."""
+        if not settings.TRACKING_CONTEXT_CACHE_ENABLED or context.session_id is None:
+            return
+
+        self._put_local(context)
+        if redis is not None:
+            try:
+                await redis.set_json(self.key(context.session_id), context._asdict(), settings.TRACKING_CONTEXT_TTL_SECONDS)
+            except Exception as e:
+                logger.warning(f"Tracking context write failed for session {context.session_id}: {e}")
+
+    async def evict(self, session_id: int, redis: Optional[RedisClient] = None) -> None:
+        """Forget a session that is no longer active."""
+        with self._lock:
+            self._local.pop(session_id, None)
+        if redis is not None and settings.TRACKING_CONTEXT_CACHE_ENABLED:
+            try:
+                # A short-lived tombstone replaces the entry; readers treat it as a miss
+                await redis.set_json(self.key(session_id), {"ended": True}, settings.TRACKING_CONTEXT_LOCAL_TTL_SECONDS)
+            except Exception as e:
+                logger.warning(f"Tracking context eviction failed for session {session_id}: {e}")
+
+    def clear(self) -> None:
+        """Drop the in-process entries (Redis entries expire on their own)."""
+        with self._lock:
+            self._local.clear()
+
+
+# Shared cache for this process
+tracking_context = TrackingContextCache()
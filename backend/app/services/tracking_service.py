@@ -3,9 +3,11 @@ Real-time tracking service for courier location and package tracking.
 Handles location updates, ETA calculations, and event broadcasting.
 """
 import json
-from datetime import datetime, timedelta
-from typing import Optional, List, Dict, Any
+from datetime import datetime, timedelta, timezone
+from typing import Optional, List, Dict, Any, NamedTuple, Tuple
+from sqlalchemy import insert, or_, update
 from sqlalchemy.orm import Session
+from sqlalchemy.orm.attributes import set_committed_value
 
 from app.models.tracking import (
     TrackingSession,
@@ -15,7 +17,10 @@ from app.models.tracking import (
     TrackingEventType
 )
 from app.models.package import Package, PackageStatus
+from app.services.location_buffer import location_buffer
 from app.services.redis_client import RedisClient
+from app.services.tracking_context import SessionContext, tracking_context
+from app.services.trajectory import track_history
 from app.utils.geo import haversine_distance
 from app.config import settings
 
@@ -27,6 +32,12 @@ AVERAGE_DRIVING_SPEED = 8.3  # ~30 km/h (urban)
 DEFAULT_SPEED = AVERAGE_DRIVING_SPEED
 
 
+class LocationRecord(NamedTuple):
+    """Outcome of recording location fixes."""
+    location: LocationUpdate  # The latest fix
+    session: TrackingSession  # Session with its new position and ETA; may be a detached view
+
+
 class TrackingService:
     """Service for managing real-time package tracking."""
 
@@ -53,6 +64,7 @@ class TrackingService:
             # End existing session
             existing.is_active = False
             existing.ended_at = datetime.utcnow()
+            await tracking_context.evict(existing.id, self.redis)
 
         # Create new session
         session = TrackingSession(
@@ -69,6 +81,10 @@ class TrackingService:
         self.db.commit()
         self.db.refresh(session)
 
+        # Usually already loaded by the caller, so served from the identity map
+        package = self.db.get(Package, package_id)
+        await tracking_context.put(SessionContext.of(session, package), self.redis)
+
         # Create initial tracking event
         await self.create_tracking_event(
             session.id,
@@ -101,6 +117,7 @@ class TrackingService:
         session.is_active = False
         session.ended_at = datetime.utcnow()
         self.db.commit()
+        await tracking_context.evict(session_id, self.redis)
 
         # Create delivery completed event
         await self.create_tracking_event(
@@ -128,58 +145,177 @@ class TrackingService:
         heading: Optional[float] = None,
         speed_mps: Optional[float] = None,
         battery_level: Optional[float] = None,
-        source: str = "gps"
+        source: str = "gps",
+        courier_id: Optional[int] = None
     ) -> LocationUpdate:
-        """Record a new location update for a tracking session."""
-        session = self.db.query(TrackingSession).filter(
-            TrackingSession.id == session_id,
-            TrackingSession.is_active == True
-        ).first()
-
-        if not session:
-            raise ValueError(f"Active tracking session {session_id} not found")
-
-        # Create location update record
-        location_update = LocationUpdate(
-            session_id=session_id,
-            latitude=latitude,
-            longitude=longitude,
-            accuracy_meters=accuracy_meters,
-            altitude_meters=altitude_meters,
-            heading=heading,
-            speed_mps=speed_mps,
-            battery_level=battery_level,
-            source=source,
-            timestamp=datetime.utcnow()
-        )
-        self.db.add(location_update)
-
-        # Update session with latest location
-        session.last_latitude = latitude
-        session.last_longitude = longitude
-        session.last_location_at = datetime.utcnow()
+        """
+        Record a new location update for a tracking session.
+
+        With LOCATION_WRITE_BEHIND the update is cached and broadcast right
+        away and stored by the write-behind buffer; the returned record then
+        has no id yet. With courier_id, sessions of other couriers are
+        treated as not found.
+        """
+        fix = {
+            "latitude": latitude,
+            "longitude": longitude,
+            "accuracy_meters": accuracy_meters,
+            "altitude_meters": altitude_meters,
+            "heading": heading,
+            "speed_mps": speed_mps,
+            "battery_level": battery_level,
+            "source": source,
+        }
+        record = await self.record_locations(session_id, [fix], courier_id=courier_id)
+        return record.location
 
-        # Calculate new ETA
-        package = self.db.query(Package).filter(Package.id == session.package_id).first()
-        if package and package.dropoff_lat and package.dropoff_lng:
-            eta = await self._calculate_eta(
-                latitude, longitude,
-                package.dropoff_lat, package.dropoff_lng,
-                speed_mps or DEFAULT_SPEED
+    async def update_locations(
+        self,
+        session_id: int,
+        fixes: List[Dict[str, Any]],
+        courier_id: Optional[int] = None
+    ) -> LocationUpdate:
+        """
+        Record a batch of location fixes for a tracking session.
+
+        All fixes are inserted in one statement and committed together; the
+        session, its ETA, the cache and subscribers only see the latest fix,
+        which is broadcast once with the number of fixes it stands for.
+
+        Args:
+            session_id: Active tracking session
+            fixes: Dicts with latitude and longitude and optionally the other
+                LocationUpdate fields; timestamps are device times, missing or
+                future ones are taken as now
+            courier_id: If given, sessions of other couriers are treated as not found
+
+        Returns:
+            The latest fix
+        """
+        record = await self.record_locations(session_id, fixes, courier_id=courier_id)
+        return record.location
+
+    async def record_locations(
+        self,
+        session_id: int,
+        fixes: List[Dict[str, Any]],
+        courier_id: Optional[int] = None
+    ) -> LocationRecord:
+        """
+        Record one or more location fixes and return the latest with the session's new state.
+
+        The session's courier, package dropoff and sharing preference come
+        from the tracking context cache, so with a warm cache the update
+        runs without SELECTs: the ETA is computed from the cached dropoff and
+        the session is updated (or, with LOCATION_WRITE_BEHIND, buffered)
+        by id. The returned session is then a detached view holding the new
+        position and ETA rather than a loaded row.
+
+        All fixes are stored, but the session, cache and subscribers only move
+        to the latest one if it is newer than the session's last_location_at,
+        so a batch buffered offline and uploaded after newer live fixes does
+        not send the courier back. With LOCATION_WRITE_BEHIND the stored
+        position is the buffered one, or, with nothing buffered in this
+        process, read by id.
+
+        Raises:
+            ValueError: If there is no active session session_id (of courier_id)
+        """
+        if not fixes:
+            raise ValueError("No location fixes to record")
+
+        context, session = await self._session_context(session_id, courier_id)
+
+        now = datetime.utcnow()
+        rows = [
+            {
+                "session_id": session_id,
+                "latitude": fix["latitude"],
+                "longitude": fix["longitude"],
+                "accuracy_meters": fix.get("accuracy_meters"),
+                "altitude_meters": fix.get("altitude_meters"),
+                "heading": fix.get("heading"),
+                "speed_mps": fix.get("speed_mps"),
+                "battery_level": fix.get("battery_level"),
+                "source": fix.get("source") or "gps",
+                "timestamp": _fix_timestamp(fix.get("timestamp"), now),
+            }
+            for fix in fixes
+        ]
+        # Buffered fixes can arrive out of order; the last one is the current position
+        rows.sort(key=lambda row: row["timestamp"])
+        latest = LocationUpdate(**rows[-1])
+        state = await self._location_state(context, latest)
+
+        if settings.LOCATION_WRITE_BEHIND:
+            buffered_at = location_buffer.latest_at(session_id)
+            if session is None and buffered_at is None:
+                session = self.db.get(TrackingSession, session_id)
+            current = _is_newer(latest.timestamp, buffered_at) and (
+                session is None or _is_newer(latest.timestamp, session.last_location_at)
             )
-            if eta:
-                session.estimated_arrival = eta['arrival_time']
-                session.distance_remaining_meters = eta['distance_meters']
+            location_buffer.add(rows, session_id, state)
+            if session is not None and current:
+                # Show the new position on the loaded session without making it dirty
+                for field, value in state.items():
+                    set_committed_value(session, field, value)
+        else:
+            if session is not None:
+                current = _is_newer(latest.timestamp, session.last_location_at)
+                if current:
+                    for field, value in state.items():
+                        setattr(session, field, value)
+            else:
+                result = self.db.execute(
+                    update(TrackingSession)
+                    .where(
+                        TrackingSession.id == session_id,
+                        TrackingSession.is_active == True,
+                        or_(
+                            TrackingSession.last_location_at.is_(None),
+                            TrackingSession.last_location_at < latest.timestamp
+                        )
+                    )
+                    .values(**state)
+                )
+                current = result.rowcount > 0
+                if not current and self._active_session(session_id) is None:
+                    # Ended by another worker while still cached here
+                    self.db.rollback()
+                    await tracking_context.evict(session_id, self.redis)
+                    raise ValueError(f"Active tracking session {session_id} not found")
+
+            if len(rows) == 1:
+                latest.id = self.db.execute(
+                    insert(LocationUpdate).values(**rows[0]).returning(LocationUpdate.id)
+                ).scalar_one()
+            else:
+                self.db.execute(insert(LocationUpdate), rows)
+            self.db.commit()
 
-        self.db.commit()
-        self.db.refresh(location_update)
+        if not current:
+            # Fixes older than the session's position (e.g. uploaded after coming
+            # back online) are history only; the session and subscribers keep the newer one
+            if session is None:
+                session = self.db.get(TrackingSession, session_id)
+            return LocationRecord(latest, session)
+
+        if session is None:
+            session = TrackingSession(
+                id=context.session_id,
+                package_id=context.package_id,
+                courier_id=context.courier_id,
+                is_active=True,
+                share_live_location=context.share_live_location,
+                update_interval_seconds=context.update_interval_seconds,
+                **state
+            )
 
-        # Cache and broadcast location
-        if self.redis and session.share_live_location:
-            await self._cache_location(session, latitude, longitude, heading, speed_mps)
-            await self._broadcast_location(session, location_update)
+        if self.redis and context.share_live_location:
+            await self._cache_location(session, latest.latitude, latest.longitude, latest.heading, latest.speed_mps)
+            await self._broadcast_location(session, latest, fix_count=len(rows) if len(rows) > 1 else None)
 
-        return location_update
+        return LocationRecord(latest, session)
 
     async def get_active_session(self, package_id: int) -> Optional[TrackingSession]:
         """Get the active tracking session for a package."""
@@ -200,7 +336,12 @@ class TrackingService:
         limit: int = 100,
         since: Optional[datetime] = None
     ) -> List[LocationUpdate]:
-        """Get location history for a tracking session."""
+        """
+        Get location history for a tracking session, newest first.
+
+        Ended sessions may have been compacted (see trajectory.py): their
+        history then comes from the stored track, as records without id.
+        """
         query = self.db.query(LocationUpdate).filter(
             LocationUpdate.session_id == session_id
         )
@@ -208,7 +349,19 @@ class TrackingService:
         if since:
             query = query.filter(LocationUpdate.timestamp >= since)
 
-        return query.order_by(LocationUpdate.timestamp.desc()).limit(limit).all()
+        history = query.order_by(LocationUpdate.timestamp.desc()).limit(limit).all()
+
+        # Usually already loaded by the caller, so served from the identity map
+        session = self.db.get(TrackingSession, session_id)
+        compacted = track_history(session) if session is not None else []
+        if since:
+            compacted = [location for location in compacted if location.timestamp >= since]
+        if not compacted:
+            return history
+
+        history.extend(compacted)
+        history.sort(key=lambda location: location.timestamp, reverse=True)
+        return history[:limit]
 
     async def get_current_location(self, package_id: int) -> Optional[Dict[str, Any]]:
         """Get current location from cache or database."""
@@ -346,6 +499,79 @@ class TrackingService:
             "arrival_time": arrival_time
         }
 
+    def _active_session(self, session_id: int) -> Optional[TrackingSession]:
+        """The session if it is still active, loaded from the database."""
+        return self.db.query(TrackingSession).filter(
+            TrackingSession.id == session_id,
+            TrackingSession.is_active == True
+        ).first()
+
+    def _active_session_for_update(self, session_id: int, courier_id: Optional[int]) -> TrackingSession:
+        """The active session a location update is for, or ValueError."""
+        query = self.db.query(TrackingSession).filter(
+            TrackingSession.id == session_id,
+            TrackingSession.is_active == True
+        )
+        if courier_id is not None:
+            query = query.filter(TrackingSession.courier_id == courier_id)
+
+        session = query.first()
+        if not session:
+            raise ValueError(f"Active tracking session {session_id} not found")
+        return session
+
+    async def _session_context(
+        self,
+        session_id: int,
+        courier_id: Optional[int]
+    ) -> Tuple[SessionContext, Optional[TrackingSession]]:
+        """
+        Cached context of the active session a location update is for, or ValueError.
+
+        On a cache miss the session and its package are loaded and cached (in
+        process only, see tracking_context); the loaded session is returned
+        along with the context, otherwise None. A cached context of another
+        courier may be stale (e.g. cached by another worker before the
+        session was handed over), so it is evicted everywhere and the
+        session checked against the database instead of refusing outright.
+        """
+        context = await tracking_context.get(session_id, self.redis)
+        if context is not None:
+            if courier_id is None or context.courier_id == courier_id:
+                return context, None
+            await tracking_context.evict(session_id, self.redis)
+
+        session = self._active_session_for_update(session_id, courier_id)
+        package = self.db.query(Package).filter(Package.id == session.package_id).first()
+        context = SessionContext.of(session, package)
+        await tracking_context.put(context)
+        return context, session
+
+    async def _location_state(
+        self,
+        context: SessionContext,
+        location_update: LocationUpdate
+    ) -> Dict[str, Any]:
+        """Session columns to update for a new latest fix: position, and ETA if the dropoff is known."""
+        state = {
+            "last_latitude": location_update.latitude,
+            "last_longitude": location_update.longitude,
+            "last_location_at": location_update.timestamp,
+        }
+
+        # Calculate new ETA
+        if context.dropoff_lat and context.dropoff_lng:
+            eta = await self._calculate_eta(
+                location_update.latitude, location_update.longitude,
+                context.dropoff_lat, context.dropoff_lng,
+                location_update.speed_mps or DEFAULT_SPEED
+            )
+            if eta:
+                state["estimated_arrival"] = eta['arrival_time']
+                state["distance_remaining_meters"] = eta['distance_meters']
+
+        return state
+
     async def _cache_location(
         self,
         session: TrackingSession,
@@ -379,26 +605,42 @@ class TrackingService:
     async def _broadcast_location(
         self,
         session: TrackingSession,
-        location_update: LocationUpdate
+        location_update: LocationUpdate,
+        fix_count: Optional[int] = None
     ) -> None:
-        """Broadcast location update to subscribers."""
+        """Broadcast location update to subscribers (fix_count: size of a coalesced batch)."""
         if not self.redis:
             return
 
-        await self.redis.publish_location_update(
-            session.package_id,
-            {
-                "type": "location_update",
-                "session_id": session.id,
-                "latitude": location_update.latitude,
-                "longitude": location_update.longitude,
-                "heading": location_update.heading,
-                "speed_mps": location_update.speed_mps,
-                "timestamp": location_update.timestamp.isoformat(),
-                "estimated_arrival": session.estimated_arrival.isoformat() if session.estimated_arrival else None,
-                "distance_remaining_meters": session.distance_remaining_meters
-            }
-        )
+        message = {
+            "type": "location_update",
+            "session_id": session.id,
+            "latitude": location_update.latitude,
+            "longitude": location_update.longitude,
+            "heading": location_update.heading,
+            "speed_mps": location_update.speed_mps,
+            "timestamp": location_update.timestamp.isoformat(),
+            "estimated_arrival": session.estimated_arrival.isoformat() if session.estimated_arrival else None,
+            "distance_remaining_meters": session.distance_remaining_meters
+        }
+        if fix_count is not None:
+            message["fix_count"] = fix_count
+
+        await self.redis.publish_location_update(session.package_id, message)
+
+
+def _is_newer(timestamp: datetime, stored: Optional[datetime]) -> bool:
+    """Whether a fix time is newer than a stored position's (or there is none)."""
+    return stored is None or timestamp > stored
+
+
+def _fix_timestamp(timestamp: Optional[datetime], now: datetime) -> datetime:
+    """Naive UTC time of a fix; missing or future device times are taken as now."""
+    if timestamp is None:
+        return now
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+    return min(timestamp, now)
 
 
 # Dependency for FastAPI
@@ -0,0 +1,235 @@
+"""
+Compaction of the location history of ended tracking sessions.
+
+An active delivery adds a location_updates row every few seconds, most of
+them on straight stretches that say nothing a line between their
+neighbours does not. Once a session has ended (and stayed ended for
+TRACK_COMPACTION_DELAY_MINUTES, so late buffered fixes are in), its rows
+are simplified with Douglas-Peucker and stored on the session as a JSON
+track, and the rows are deleted:
+
+- polyline: the kept positions as an encoded polyline (utils/polyline.py)
+- times: seconds of each kept fix since the previous one (the first since start)
+- raw_count: how many fixes the track stands for
+
+Distances are synchronized (the deviation of a fix from where the courier
+would be at that time moving steadily between the kept neighbours), so
+stops and speed changes are kept, not just turns. Accuracy, heading, speed,
+battery and source are not kept; get_location_history serves the track
+points without them. Rows that arrive after a session was compacted are
+merged into its track by the next run.
+"""
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence
+
+import numpy as np
+from sqlalchemy import exists
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.models.tracking import LocationUpdate, TrackingSession
+from app.services.location_buffer import location_buffer
+from app.utils.geo import EARTH_RADIUS_KM
+from app.utils.polyline import decode_polyline, encode_polyline
+
+logger = logging.getLogger(__name__)
+
+# Bumped when the stored layout changes; tracks of other versions are ignored
+TRACK_VERSION = 1
+
+# Source reported for fixes served from a compacted track
+TRACK_SOURCE = "track"
+
+
+class TrackPoint(NamedTuple):
+    """A fix kept in a compacted track."""
+    latitude: float
+    longitude: float
+    timestamp: datetime
+
+
+def simplify_track(
+    lat: Sequence[float],
+    lng: Sequence[float],
+    seconds: Sequence[float],
+    tolerance_m: float
+) -> np.ndarray:
+    """
+    Douglas-Peucker simplification of a timed track.
+
+    A fix is dropped when it is within tolerance_m of the position
+    interpolated for its time between the kept fixes around it.
+
+    Args:
+        lat, lng: Positions in degrees, in time order
+        seconds: Time of each fix (any origin)
+        tolerance_m: Largest allowed deviation of a dropped fix
+
+    Returns:
+        Indices of the kept fixes, ascending; always includes the first and last
+    """
+    n = len(lat)
+    if n <= 2:
+        return np.arange(n)
+
+    lat = np.asarray(lat, dtype=float)
+    seconds = np.asarray(seconds, dtype=float)
+    # Local equirectangular projection in meters; tracks span a city, not a continent
+    radius_m = EARTH_RADIUS_KM * 1000
+    y = np.radians(lat) * radius_m
+    x = np.radians(np.asarray(lng, dtype=float)) * radius_m * np.cos(np.radians(lat.mean()))
+
+    keep = np.zeros(n, dtype=bool)
+    keep[[0, -1]] = True
+    stack = [(0, n - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+
+        duration = seconds[end] - seconds[start]
+        inner = slice(start + 1, end)
+        ratio = (seconds[inner] - seconds[start]) / duration if duration > 0 else 0.0
+        deviation = np.hypot(
+            x[inner] - (x[start] + ratio * (x[end] - x[start])),
+            y[inner] - (y[start] + ratio * (y[end] - y[start]))
+        )
+
+        i = int(np.argmax(deviation))
+        if deviation[i] > tolerance_m:
+            split = start + 1 + i
+            keep[split] = True
+            stack.append((start, split))
+            stack.append((split, end))
+
+    return np.flatnonzero(keep)
+
+
+def track_payload(points: Sequence[TrackPoint], raw_count: int, tolerance_m: float) -> Dict[str, Any]:
+    """JSON value of TrackingSession.track for time-ordered points."""
+    start = points[0].timestamp
+    offsets = [round((point.timestamp - start).total_seconds()) for point in points]
+    return {
+        "version": TRACK_VERSION,
+        "start": start.isoformat(),
+        "polyline": encode_polyline([(point.latitude, point.longitude) for point in points]),
+        "times": [offsets[0]] + [b - a for a, b in zip(offsets, offsets[1:])],
+        "raw_count": raw_count,
+        "tolerance_m": tolerance_m,
+    }
+
+
+def track_points(payload: Optional[Dict[str, Any]]) -> List[TrackPoint]:
+    """Points of a stored track, oldest first (none for a missing or unknown track)."""
+    if not payload or payload.get("version") != TRACK_VERSION:
+        return []
+
+    timestamp = datetime.fromisoformat(payload["start"])
+    points = []
+    for (lat, lng), delta in zip(decode_polyline(payload["polyline"]), payload["times"]):
+        timestamp += timedelta(seconds=delta)
+        points.append(TrackPoint(lat, lng, timestamp))
+    return points
+
+
+def track_history(session: TrackingSession) -> List[LocationUpdate]:
+    """
+    Fixes of a compacted track as LocationUpdate records (not attached, no id).
+    """
+    return [
+        LocationUpdate(
+            session_id=session.id,
+            latitude=point.latitude,
+            longitude=point.longitude,
+            timestamp=point.timestamp,
+            source=TRACK_SOURCE,
+        )
+        for point in track_points(session.track)
+    ]
+
+
+def compact_session(db: Session, session: TrackingSession, tolerance_m: Optional[float] = None) -> int:
+    """
+    Fold a session's location rows into its track and delete them.
+
+    The caller commits.
+
+    Returns:
+        Number of location rows removed
+    """
+    if tolerance_m is None:
+        tolerance_m = settings.TRACK_COMPACTION_TOLERANCE_METERS
+
+    rows = db.query(
+        LocationUpdate.id, LocationUpdate.latitude, LocationUpdate.longitude, LocationUpdate.timestamp
+    ).filter(
+        LocationUpdate.session_id == session.id
+    ).all()
+    if not rows:
+        return 0
+
+    previous = track_points(session.track)
+    points = sorted(
+        previous + [TrackPoint(row.latitude, row.longitude, row.timestamp) for row in rows],
+        key=lambda point: point.timestamp
+    )
+    start = points[0].timestamp
+    keep = simplify_track(
+        [point.latitude for point in points],
+        [point.longitude for point in points],
+        [(point.timestamp - start).total_seconds() for point in points],
+        tolerance_m
+    )
+
+    raw_count = session.track["raw_count"] if previous else 0
+    session.track = track_payload([points[i] for i in keep], raw_count + len(rows), tolerance_m)
+
+    # Only the rows read above; anything written meanwhile waits for the next run
+    return db.query(LocationUpdate).filter(
+        LocationUpdate.session_id == session.id,
+        LocationUpdate.id <= max(row.id for row in rows)
+    ).delete(synchronize_session=False)
+
+
+def compact_ended_sessions(
+    db: Session,
+    delay_minutes: Optional[int] = None,
+    batch_size: Optional[int] = None
+) -> Dict[str, int]:
+    """
+    Compact ended sessions that still have location rows.
+
+    Buffered fixes of this process are flushed first; sessions ended less
+    than delay_minutes ago are left for a later run, so fixes still buffered
+    by other processes are in before their session is compacted. Each
+    session is committed on its own.
+
+    Returns:
+        Sessions compacted and location rows removed
+    """
+    if delay_minutes is None:
+        delay_minutes = settings.TRACK_COMPACTION_DELAY_MINUTES
+    if batch_size is None:
+        batch_size = settings.TRACK_COMPACTION_BATCH_SIZE
+
+    location_buffer.flush()
+
+    cutoff = datetime.utcnow() - timedelta(minutes=delay_minutes)
+    sessions = db.query(TrackingSession).filter(
+        TrackingSession.is_active == False,
+        TrackingSession.ended_at <= cutoff,
+        exists().where(LocationUpdate.session_id == TrackingSession.id)
+    ).order_by(TrackingSession.ended_at).limit(batch_size).all()
+
+    compacted = removed = 0
+    for session in sessions:
+        try:
+            removed += compact_session(db, session)
+            db.commit()
+            compacted += 1
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Failed to compact location history of tracking session {session.id}: {e}")
+
+    return {"sessions_compacted": compacted, "locations_removed": removed}
@@ -14,6 +14,7 @@ from app.models.rating import Rating
 from app.models.payment import Transaction, TransactionStatus
 from app.models.analytics import DailyMetrics, CourierPerformance, HourlyActivity
 from app.models.tracking import LocationUpdate, TrackingSession
+from app.services.trajectory import compact_ended_sessions
 
 
 @shared_task(name="app.tasks.analytics.aggregate_daily_metrics")
@@ -326,6 +327,21 @@ def cleanup_old_locations(retention_days: int = 30):
         db.close()
 
 
+@shared_task(name="app.tasks.analytics.compact_location_history")
+def compact_location_history():
+    """
+    Compact the location history of ended tracking sessions into tracks.
+    Runs in batches of TRACK_COMPACTION_BATCH_SIZE sessions.
+    """
+    db = SessionLocal()
+    try:
+        result = compact_ended_sessions(db)
+        return {"status": "completed", **result}
+
+    finally:
+        db.close()
+
+
 @shared_task(name="app.tasks.analytics.update_courier_performance")
 def update_courier_performance(courier_id: int):
     """
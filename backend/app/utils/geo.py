@@ -1,7 +1,25 @@
 """Geometric utility functions for matching algorithm"""
-from typing import Tuple
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
 from geopy.distance import geodesic
 import math
+import threading
+import time
+import numpy as np
+
+from app.config import settings
+
+
+# Mean Earth radius (IUGG) used by the spherical batch kernels
+EARTH_RADIUS_KM = 6371.0088
+
+# Maximum relative error of the spherical haversine distance against the WGS-84
+# geodesic that haversine_distance() returns. The worst case (~0.56%) is a
+# north-south distance at the equator, where the ellipsoid is flattest.
+HAVERSINE_MAX_RELATIVE_ERROR = 0.006
+
+# Point-segment pairs projected at once by nearest_point_on_polyline_batch()
+POLYLINE_PAIRS_PER_BLOCK = 262_144
 
 
 def haversine_distance(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
@@ -201,3 +219,625 @@ def is_package_along_route(
 
     # Both points must be within deviation distance
     return pickup_distance <= max_deviation_km and dropoff_distance <= max_deviation_km
+
+
+# Batch (vectorized) API
+#
+# These functions take NumPy arrays (or scalars, broadcast against the arrays)
+# of coordinates in degrees and return NumPy arrays of distances in kilometers.
+# With fast=False distances are WGS-84 geodesics, identical to
+# haversine_distance(). With fast=True they use the spherical haversine formula
+# in one vectorized pass, which is orders of magnitude faster and within
+# HAVERSINE_MAX_RELATIVE_ERROR (0.6%) of the geodesic.
+
+
+def haversine_distance_batch(lat1, lng1, lat2, lng2) -> np.ndarray:
+    """
+    Spherical great-circle distance between arrays of points.
+
+    Args:
+        lat1, lng1: Latitudes/longitudes of the first points
+        lat2, lng2: Latitudes/longitudes of the second points
+
+    Returns:
+        Array of distances in kilometers
+    """
+    lat1 = np.radians(np.asarray(lat1, dtype=np.float64))
+    lat2 = np.radians(np.asarray(lat2, dtype=np.float64))
+    dlat = lat2 - lat1
+    dlng = np.radians(np.asarray(lng2, dtype=np.float64) - np.asarray(lng1, dtype=np.float64))
+
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlng / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def geodesic_distance_batch(lat1, lng1, lat2, lng2) -> np.ndarray:
+    """
+    WGS-84 geodesic distance between arrays of points.
+
+    Exact but evaluated point by point; prefer distance_batch(fast=True)
+    when HAVERSINE_MAX_RELATIVE_ERROR is acceptable.
+
+    Returns:
+        Array of distances in kilometers
+    """
+    lat1, lng1, lat2, lng2 = np.broadcast_arrays(
+        np.asarray(lat1, dtype=np.float64), np.asarray(lng1, dtype=np.float64),
+        np.asarray(lat2, dtype=np.float64), np.asarray(lng2, dtype=np.float64)
+    )
+    result = np.fromiter(
+        (
+            geodesic((a, b), (c, d)).kilometers
+            for a, b, c, d in zip(lat1.ravel(), lng1.ravel(), lat2.ravel(), lng2.ravel())
+        ),
+        dtype=np.float64,
+        count=lat1.size
+    )
+    return result.reshape(lat1.shape)
+
+
+def distance_batch(lat1, lng1, lat2, lng2, fast: bool = False) -> np.ndarray:
+    """
+    Distance between arrays of points.
+
+    Args:
+        lat1, lng1: Latitudes/longitudes of the first points
+        lat2, lng2: Latitudes/longitudes of the second points
+        fast: Use the vectorized haversine kernel instead of geodesics
+
+    Returns:
+        Array of distances in kilometers
+    """
+    if fast:
+        return haversine_distance_batch(lat1, lng1, lat2, lng2)
+    return geodesic_distance_batch(lat1, lng1, lat2, lng2)
+
+
+def point_to_line_distance_batch(
+    point_lat,
+    point_lng,
+    line_start_lat: float,
+    line_start_lng: float,
+    line_end_lat: float,
+    line_end_lng: float
+) -> np.ndarray:
+    """
+    Distance from many points to one line segment using spherical cross-track distance.
+
+    Vectorized counterpart of point_to_line_distance(). Points whose closest
+    position lies before the start or past the end of the segment get the
+    distance to that endpoint. All distances are spherical (fast mode).
+
+    Returns:
+        Array of distances in kilometers
+    """
+    point_lat = np.asarray(point_lat, dtype=np.float64)
+    point_lng = np.asarray(point_lng, dtype=np.float64)
+
+    d_start_point = haversine_distance_batch(line_start_lat, line_start_lng, point_lat, point_lng)
+    d_end_point = haversine_distance_batch(line_end_lat, line_end_lng, point_lat, point_lng)
+    d_start_end = float(haversine_distance_batch(line_start_lat, line_start_lng, line_end_lat, line_end_lng))
+
+    # If the route is essentially a point, return distance to that point
+    if d_start_end < 0.1:  # Less than 100 meters
+        return d_start_point
+
+    start_lat = math.radians(line_start_lat)
+    start_lng = math.radians(line_start_lng)
+    end_lat = math.radians(line_end_lat)
+    end_lng = math.radians(line_end_lng)
+    p_lat = np.radians(point_lat)
+    p_lng = np.radians(point_lng)
+
+    bearing_start_end = math.atan2(
+        math.sin(end_lng - start_lng) * math.cos(end_lat),
+        math.cos(start_lat) * math.sin(end_lat)
+        - math.sin(start_lat) * math.cos(end_lat) * math.cos(end_lng - start_lng)
+    )
+    bearing_start_point = np.arctan2(
+        np.sin(p_lng - start_lng) * np.cos(p_lat),
+        math.cos(start_lat) * np.sin(p_lat)
+        - math.sin(start_lat) * np.cos(p_lat) * np.cos(p_lng - start_lng)
+    )
+
+    angular_start_point = d_start_point / EARTH_RADIUS_KM
+    angle = bearing_start_point - bearing_start_end
+
+    cross_track = np.arcsin(np.clip(np.sin(angular_start_point) * np.sin(angle), -1.0, 1.0))
+    along_track = np.arccos(
+        np.clip(np.cos(angular_start_point) / np.cos(cross_track), -1.0, 1.0)
+    ) * EARTH_RADIUS_KM
+    # Points behind the start (bearing more than 90 degrees off the route)
+    along_track = np.where(np.cos(angle) < 0, -along_track, along_track)
+
+    return np.where(
+        along_track < 0,
+        d_start_point,
+        np.where(along_track > d_start_end, d_end_point, np.abs(cross_track) * EARTH_RADIUS_KM)
+    )
+
+
+def calculate_detour_distance_batch(
+    route_start_lat: float,
+    route_start_lng: float,
+    route_end_lat: float,
+    route_end_lng: float,
+    pickup_lat,
+    pickup_lng,
+    dropoff_lat,
+    dropoff_lng,
+    fast: bool = False
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Vectorized counterpart of calculate_detour_distance().
+
+    Returns:
+        Tuple of (detour_distance_km, total_distance_with_package_km) arrays
+    """
+    direct_distance = distance_batch(
+        route_start_lat, route_start_lng, route_end_lat, route_end_lng, fast
+    )
+    start_to_pickup = distance_batch(route_start_lat, route_start_lng, pickup_lat, pickup_lng, fast)
+    pickup_to_dropoff = distance_batch(pickup_lat, pickup_lng, dropoff_lat, dropoff_lng, fast)
+    dropoff_to_end = distance_batch(dropoff_lat, dropoff_lng, route_end_lat, route_end_lng, fast)
+
+    total_distance_with_package = start_to_pickup + pickup_to_dropoff + dropoff_to_end
+    return total_distance_with_package - direct_distance, total_distance_with_package
+
+
+def nearest_point_on_segment_batch(
+    point_lat,
+    point_lng,
+    line_start_lat,
+    line_start_lng,
+    line_end_lat,
+    line_end_lng
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Project points onto segments in planar lat/lng coordinates.
+
+    Matches shapely's nearest_points() for a two-point LineString. The segment
+    endpoints may be scalars (one route, many points) or arrays that broadcast
+    against the points (many routes, one point).
+
+    Returns:
+        Tuple of (nearest_lat, nearest_lng) arrays
+    """
+    point_lat = np.asarray(point_lat, dtype=np.float64)
+    point_lng = np.asarray(point_lng, dtype=np.float64)
+    line_start_lat = np.asarray(line_start_lat, dtype=np.float64)
+    line_start_lng = np.asarray(line_start_lng, dtype=np.float64)
+
+    dx = np.asarray(line_end_lng, dtype=np.float64) - line_start_lng
+    dy = np.asarray(line_end_lat, dtype=np.float64) - line_start_lat
+    length_sq = dx * dx + dy * dy
+
+    # Degenerate (zero-length) segments project every point onto the start
+    degenerate = length_sq == 0
+    t = ((point_lng - line_start_lng) * dx + (point_lat - line_start_lat) * dy) / np.where(degenerate, 1.0, length_sq)
+    t = np.where(degenerate, 0.0, np.clip(t, 0.0, 1.0))
+
+    return line_start_lat + t * dy, line_start_lng + t * dx
+
+
+def route_corridor_distances_batch(
+    route_start_lat,
+    route_start_lng,
+    route_end_lat,
+    route_end_lng,
+    pickup_lat,
+    pickup_lng,
+    dropoff_lat,
+    dropoff_lng,
+    fast: bool = False,
+    max_distance_km=None,
+    cached: bool = False
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Compute route matching metrics for many packages in one pass.
+
+    All coordinate arguments broadcast against each other, so this scores
+    many packages against one route or one package against many routes
+    (with max_distance_km given per route).
+
+    For each package this returns the distance from its pickup and dropoff to
+    the nearest point on the route line, and the estimated detour
+    (pickup→route + dropoff→route + pickup→dropoff).
+
+    When max_distance_km is given and fast=False, packages whose pickup or
+    dropoff is farther than max_distance_km even after allowing for
+    HAVERSINE_MAX_RELATIVE_ERROR are screened out with the haversine kernel
+    and reported as infinity; only the rest get exact geodesic distances.
+
+    With cached=True the exact pickup→dropoff leg, which recurs for every
+    route a package is scored against, comes from distance_cache; its
+    coordinates are quantized to DISTANCE_CACHE_PRECISION decimals.
+
+    Returns:
+        Tuple of (pickup_distance_km, dropoff_distance_km, detour_km) arrays
+    """
+    (
+        route_start_lat, route_start_lng, route_end_lat, route_end_lng,
+        pickup_lat, pickup_lng, dropoff_lat, dropoff_lng,
+    ) = np.broadcast_arrays(*(
+        np.asarray(value, dtype=np.float64) for value in (
+            route_start_lat, route_start_lng, route_end_lat, route_end_lng,
+            pickup_lat, pickup_lng, dropoff_lat, dropoff_lng,
+        )
+    ))
+
+    segment = (route_start_lat, route_start_lng, route_end_lat, route_end_lng)
+    pickup_near_lat, pickup_near_lng = nearest_point_on_segment_batch(pickup_lat, pickup_lng, *segment)
+    dropoff_near_lat, dropoff_near_lng = nearest_point_on_segment_batch(dropoff_lat, dropoff_lng, *segment)
+
+    return _corridor_distances(
+        pickup_lat, pickup_lng, pickup_near_lat, pickup_near_lng,
+        dropoff_lat, dropoff_lng, dropoff_near_lat, dropoff_near_lng,
+        fast, max_distance_km, cached
+    )
+
+
+# (unit_lat, unit_lng, length) of each polyline segment in planar lat/lng degrees
+PolylineSegments = Tuple[np.ndarray, np.ndarray, np.ndarray]
+
+
+def polyline_segments(path_lat, path_lng) -> PolylineSegments:
+    """
+    Unit direction vectors and lengths of a polyline's segments.
+
+    These only depend on the route, so they can be computed once and passed
+    to nearest_point_on_polyline_batch(). Zero-length segments get a zero
+    vector, which projects every point onto their start.
+
+    Returns:
+        Tuple of (unit_lat, unit_lng, length_deg) arrays, one entry per segment
+    """
+    path_lat = np.asarray(path_lat, dtype=np.float64).ravel()
+    path_lng = np.asarray(path_lng, dtype=np.float64).ravel()
+    dy = np.diff(path_lat)
+    dx = np.diff(path_lng)
+    length = np.hypot(dx, dy)
+    scale = np.where(length == 0, 0.0, 1.0 / np.where(length == 0, 1.0, length))
+    return dy * scale, dx * scale, length
+
+
+def nearest_point_on_polyline_batch(
+    point_lat,
+    point_lng,
+    path_lat,
+    path_lng,
+    segments: Optional[PolylineSegments] = None
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Project points onto a polyline in planar lat/lng coordinates.
+
+    Every point is projected onto each segment of the path (a dot product
+    with the segment's unit vector, clamped to its length), and the
+    projection closest to the point (equirectangular distance) is kept.
+    Points are processed in blocks so that memory stays bounded on long paths.
+
+    Args:
+        point_lat, point_lng: Point latitudes/longitudes
+        path_lat, path_lng: Polyline vertices in order (at least one)
+        segments: polyline_segments() of the path, if already computed
+
+    Returns:
+        Tuple of (nearest_lat, nearest_lng) arrays shaped like the points
+    """
+    point_lat, point_lng = np.broadcast_arrays(
+        np.asarray(point_lat, dtype=np.float64), np.asarray(point_lng, dtype=np.float64)
+    )
+    shape = point_lat.shape
+    point_lat = point_lat.ravel()
+    point_lng = point_lng.ravel()
+    path_lat = np.asarray(path_lat, dtype=np.float64).ravel()
+    path_lng = np.asarray(path_lng, dtype=np.float64).ravel()
+
+    if len(path_lat) < 2:
+        return np.full(shape, path_lat[0]), np.full(shape, path_lng[0])
+
+    unit_lat, unit_lng, length = segments if segments is not None else polyline_segments(path_lat, path_lng)
+    start_lat, start_lng = path_lat[None, :-1], path_lng[None, :-1]
+    unit_lat, unit_lng, length = (np.asarray(a, dtype=np.float64)[None, :] for a in (unit_lat, unit_lng, length))
+    near_lat = np.empty(len(point_lat))
+    near_lng = np.empty(len(point_lat))
+
+    block = max(1, POLYLINE_PAIRS_PER_BLOCK // (len(path_lat) - 1))
+    for lo in range(0, len(point_lat), block):
+        lat = point_lat[lo:lo + block, None]
+        lng = point_lng[lo:lo + block, None]
+        t = np.clip((lat - start_lat) * unit_lat + (lng - start_lng) * unit_lng, 0.0, length)
+        seg_lat = start_lat + t * unit_lat
+        seg_lng = start_lng + t * unit_lng
+        dx = (seg_lng - lng) * np.cos(np.radians(lat))
+        dy = seg_lat - lat
+        best = np.argmin(dx * dx + dy * dy, axis=1)
+        rows = np.arange(len(best))
+        near_lat[lo:lo + block] = seg_lat[rows, best]
+        near_lng[lo:lo + block] = seg_lng[rows, best]
+
+    return near_lat.reshape(shape), near_lng.reshape(shape)
+
+
+def polyline_corridor_distances_batch(
+    path_lat,
+    path_lng,
+    pickup_lat,
+    pickup_lng,
+    dropoff_lat,
+    dropoff_lng,
+    fast: bool = False,
+    max_distance_km: Optional[float] = None,
+    segments: Optional[PolylineSegments] = None,
+    cached: bool = False
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Polyline counterpart of route_corridor_distances_batch() for one route.
+
+    Distances are measured to the nearest point on any segment of the path,
+    so a route with waypoints is matched along the roads it actually takes
+    instead of the straight start→end line. A two-vertex path gives the same
+    results as route_corridor_distances_batch().
+
+    Returns:
+        Tuple of (pickup_distance_km, dropoff_distance_km, detour_km) arrays
+    """
+    pickup_lat, pickup_lng, dropoff_lat, dropoff_lng = np.broadcast_arrays(*(
+        np.asarray(value, dtype=np.float64) for value in (pickup_lat, pickup_lng, dropoff_lat, dropoff_lng)
+    ))
+
+    if segments is None:
+        segments = polyline_segments(path_lat, path_lng)
+    pickup_near_lat, pickup_near_lng = nearest_point_on_polyline_batch(
+        pickup_lat, pickup_lng, path_lat, path_lng, segments
+    )
+    dropoff_near_lat, dropoff_near_lng = nearest_point_on_polyline_batch(
+        dropoff_lat, dropoff_lng, path_lat, path_lng, segments
+    )
+
+    return _corridor_distances(
+        pickup_lat, pickup_lng, pickup_near_lat, pickup_near_lng,
+        dropoff_lat, dropoff_lng, dropoff_near_lat, dropoff_near_lng,
+        fast, max_distance_km, cached
+    )
+
+
+def _corridor_distances(
+    pickup_lat: np.ndarray,
+    pickup_lng: np.ndarray,
+    pickup_near_lat: np.ndarray,
+    pickup_near_lng: np.ndarray,
+    dropoff_lat: np.ndarray,
+    dropoff_lng: np.ndarray,
+    dropoff_near_lat: np.ndarray,
+    dropoff_near_lng: np.ndarray,
+    fast: bool,
+    max_distance_km,
+    cached: bool = False
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Distances from pickups/dropoffs to their nearest route points, and the detour."""
+    pickup_distance = haversine_distance_batch(pickup_lat, pickup_lng, pickup_near_lat, pickup_near_lng)
+    dropoff_distance = haversine_distance_batch(dropoff_lat, dropoff_lng, dropoff_near_lat, dropoff_near_lng)
+
+    if fast:
+        delivery_distance = haversine_distance_batch(pickup_lat, pickup_lng, dropoff_lat, dropoff_lng)
+        return pickup_distance, dropoff_distance, pickup_distance + dropoff_distance + delivery_distance
+
+    if max_distance_km is None:
+        refine = np.ones(pickup_lat.shape, dtype=bool)
+    else:
+        screen_km = np.asarray(max_distance_km, dtype=np.float64) * (1 + HAVERSINE_MAX_RELATIVE_ERROR) / (1 - HAVERSINE_MAX_RELATIVE_ERROR)
+        refine = np.maximum(pickup_distance, dropoff_distance) <= screen_km
+
+    pickup_exact = np.full(pickup_lat.shape, np.inf)
+    dropoff_exact = np.full(pickup_lat.shape, np.inf)
+    detour = np.full(pickup_lat.shape, np.inf)
+
+    if refine.any():
+        pickup_exact[refine] = geodesic_distance_batch(
+            pickup_lat[refine], pickup_lng[refine], pickup_near_lat[refine], pickup_near_lng[refine]
+        )
+        dropoff_exact[refine] = geodesic_distance_batch(
+            dropoff_lat[refine], dropoff_lng[refine], dropoff_near_lat[refine], dropoff_near_lng[refine]
+        )
+        # A package's pickup→dropoff leg is the same for every route it is scored against
+        delivery = distance_cache.distances if cached else geodesic_distance_batch
+        detour[refine] = pickup_exact[refine] + dropoff_exact[refine] + delivery(
+            pickup_lat[refine], pickup_lng[refine], dropoff_lat[refine], dropoff_lng[refine]
+        )
+
+    return pickup_exact, dropoff_exact, detour
+
+
+# Distance cache
+#
+# Exact (geodesic) distances cost ~80 µs each, and the same pairs come up over
+# and over: a package's pickup→dropoff leg is scored against every route near
+# it, and an optimized route's legs between the same stops. DistanceCache keeps exact distances between coordinates
+# quantized to DISTANCE_CACHE_PRECISION decimals (6 ≈ 11 cm) in a bounded LRU
+# with a TTL. Distances are computed from the quantized coordinates, so a
+# pair's value does not depend on which caller computed it first.
+#
+# Callers opt in (cached_distance(), cached=True on the corridor kernels); the
+# plain helpers such as calculate_detour_distance() stay exact. Pairs that
+# rarely repeat, such as a moving courier's distance to the dropoff, should
+# not opt in: they would only evict the recurring ones.
+#
+# Spherical (fast) distances are cheaper to recompute than to look up, so
+# fast=True requests bypass the cache.
+
+QuantizedPoint = Tuple[int, int]
+
+
+class DistanceCache:
+    """Bounded LRU/TTL cache of geodesic distances keyed by quantized coordinate pairs."""
+
+    def __init__(
+        self,
+        max_entries: Optional[int] = None,
+        ttl_seconds: Optional[float] = None,
+        precision: Optional[int] = None
+    ):
+        self.max_entries = settings.DISTANCE_CACHE_MAX_ENTRIES if max_entries is None else max_entries
+        self.ttl_seconds = settings.DISTANCE_CACHE_TTL_SECONDS if ttl_seconds is None else ttl_seconds
+        self.precision = settings.DISTANCE_CACHE_PRECISION if precision is None else precision
+        self.scale = 10 ** self.precision
+        self._entries: "OrderedDict[Tuple[QuantizedPoint, QuantizedPoint], Tuple[float, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def quantize(self, lat, lng) -> Tuple[np.ndarray, np.ndarray]:
+        """Integer grid coordinates of points."""
+        return (
+            np.rint(np.asarray(lat, dtype=np.float64) * self.scale).astype(np.int64),
+            np.rint(np.asarray(lng, dtype=np.float64) * self.scale).astype(np.int64),
+        )
+
+    def _lookup(self, keys: List[Tuple[QuantizedPoint, QuantizedPoint]]) -> List[Optional[float]]:
+        now = time.monotonic()
+        values: List[Optional[float]] = []
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry is not None and entry[1] < now:
+                    del self._entries[key]
+                    self.expirations += 1
+                    entry = None
+                if entry is None:
+                    values.append(None)
+                else:
+                    self._entries.move_to_end(key)
+                    values.append(entry[0])
+            found = sum(value is not None for value in values)
+            self.hits += found
+            self.misses += len(values) - found
+        return values
+
+    def _store(self, keys: List[Tuple[QuantizedPoint, QuantizedPoint]], distances: np.ndarray) -> None:
+        if self.max_entries <= 0:
+            return
+        expires_at = time.monotonic() + self.ttl_seconds
+        with self._lock:
+            for key, distance in zip(keys, distances.tolist()):
+                self._entries[key] = (distance, expires_at)
+                self._entries.move_to_end(key)
+            overflow = len(self._entries) - self.max_entries
+            for _ in range(max(0, overflow)):
+                self._entries.popitem(last=False)
+            self.evictions += max(0, overflow)
+
+    def _get_or_compute(self, a: np.ndarray, b: np.ndarray) -> np.ndarray:
+        """Distances between quantized point arrays a and b, each of shape (n, 2)."""
+        keys = [
+            (p, q) if p <= q else (q, p)
+            for p, q in zip(map(tuple, a.tolist()), map(tuple, b.tolist()))
+        ]
+        values = self._lookup(keys)
+        result = np.array([np.nan if v is None else v for v in values], dtype=np.float64)
+
+        missing = np.flatnonzero(np.isnan(result))
+        if len(missing):
+            # Duplicate pairs within one batch are only computed once
+            unique_keys = list(dict.fromkeys(keys[i] for i in missing))
+            ends = np.asarray(unique_keys, dtype=np.float64).reshape(-1, 4) / self.scale
+            computed = geodesic_distance_batch(ends[:, 0], ends[:, 1], ends[:, 2], ends[:, 3])
+            self._store(unique_keys, computed)
+            by_key = dict(zip(unique_keys, computed.tolist()))
+            result[missing] = [by_key[keys[i]] for i in missing]
+        return result
+
+    def distance(self, lat1: float, lng1: float, lat2: float, lng2: float) -> float:
+        """Cached geodesic distance between two points in kilometers."""
+        return float(self.distances(lat1, lng1, lat2, lng2))
+
+    def distances(self, lat1, lng1, lat2, lng2) -> np.ndarray:
+        """
+        Cached geodesic distances between arrays of points (broadcast like distance_batch).
+
+        Returns:
+            Array of distances in kilometers
+        """
+        lat1, lng1, lat2, lng2 = np.broadcast_arrays(
+            *(np.asarray(value, dtype=np.float64) for value in (lat1, lng1, lat2, lng2))
+        )
+        a = np.stack(self.quantize(lat1.ravel(), lng1.ravel()), axis=1)
+        b = np.stack(self.quantize(lat2.ravel(), lng2.ravel()), axis=1)
+        return self._get_or_compute(a, b).reshape(lat1.shape)
+
+    def matrix(self, lat, lng) -> np.ndarray:
+        """
+        Cached N×N geodesic distance matrix between points.
+
+        Each unordered pair is looked up (or computed) once.
+
+        Returns:
+            Symmetric (N, N) array of distances in kilometers
+        """
+        points = np.stack(self.quantize(np.ravel(lat), np.ravel(lng)), axis=1)
+        n = len(points)
+        result = np.zeros((n, n), dtype=np.float64)
+        if n < 2:
+            return result
+        rows, cols = np.triu_indices(n, k=1)
+        upper = self._get_or_compute(points[rows], points[cols])
+        result[rows, cols] = upper
+        result[cols, rows] = upper
+        return result
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters and occupancy for sizing the cache."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "ttl_seconds": self.ttl_seconds,
+                "precision": self.precision,
+            }
+
+    def reset_stats(self) -> None:
+        with self._lock:
+            self.hits = self.misses = self.evictions = self.expirations = 0
+
+
+# Shared cache for this process
+distance_cache = DistanceCache()
+
+
+def cached_distance(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
+    """Geodesic distance in kilometers, served from the shared distance cache."""
+    return distance_cache.distance(lat1, lng1, lat2, lng2)
+
+
+def distance_matrix(lat, lng, fast: bool = False) -> np.ndarray:
+    """
+    N×N distance matrix between points.
+
+    Args:
+        lat, lng: Point latitudes/longitudes
+        fast: Spherical haversine distances, computed directly; otherwise
+              geodesic distances through the shared distance cache
+
+    Returns:
+        Symmetric (N, N) array of distances in kilometers
+    """
+    if fast:
+        lat = np.asarray(lat, dtype=np.float64).ravel()
+        lng = np.asarray(lng, dtype=np.float64).ravel()
+        return haversine_distance_batch(lat[:, None], lng[:, None], lat[None, :], lng[None, :])
+    return distance_cache.matrix(lat, lng)
@@ -0,0 +1,80 @@
+"""
+Geohash cell ids for indexed proximity lookups.
+
+A geohash of precision p splits the globe into a regular lat/lng grid of
+2^floor(5p/2) rows by 2^ceil(5p/2) columns and names each cell with p
+base-32 characters. Packages and routes store the cell ids of their points
+at GEOHASH_PRECISIONS in plain indexed string columns, so "points in these
+cells" is an `IN (...)` lookup on any database.
+
+Cells are addressed by (row, col) here, counted from the south pole and the
+antimeridian, so that corridor rasterization can work on the grid directly.
+"""
+import math
+from typing import Dict, Tuple
+
+BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+# Stored precisions: ~39 x 20 km, ~4.9 x 4.9 km and ~1.2 x 0.6 km cells
+GEOHASH_PRECISIONS = (4, 5, 6)
+
+
+def grid_bits(precision: int) -> Tuple[int, int]:
+    """Number of (latitude, longitude) bits in a geohash of this precision."""
+    bits = 5 * precision
+    return bits // 2, (bits + 1) // 2
+
+
+def cell_size(precision: int) -> Tuple[float, float]:
+    """Height and width in degrees of a cell at this precision."""
+    lat_bits, lng_bits = grid_bits(precision)
+    return 180.0 / (1 << lat_bits), 360.0 / (1 << lng_bits)
+
+
+def cell_for(lat: float, lng: float, precision: int) -> Tuple[int, int]:
+    """(row, col) of the cell containing a point."""
+    lat_bits, lng_bits = grid_bits(precision)
+    dlat, dlng = cell_size(precision)
+    row = min(max(math.floor((lat + 90.0) / dlat), 0), (1 << lat_bits) - 1)
+    col = math.floor((lng + 180.0) / dlng) % (1 << lng_bits)
+    return row, col
+
+
+def encode_cell(row: int, col: int, precision: int) -> str:
+    """Geohash string of a (row, col) cell."""
+    lat_bits, lng_bits = grid_bits(precision)
+    value = 0
+    # Bits alternate starting with longitude, most significant first
+    for i in range(5 * precision):
+        if i % 2 == 0:
+            lng_bits -= 1
+            bit = (col >> lng_bits) & 1
+        else:
+            lat_bits -= 1
+            bit = (row >> lat_bits) & 1
+        value = (value << 1) | bit
+    return "".join(
+        BASE32[(value >> shift) & 0x1f]
+        for shift in range(5 * (precision - 1), -1, -5)
+    )
+
+
+def encode(lat: float, lng: float, precision: int) -> str:
+    """Geohash of a point."""
+    return encode_cell(*cell_for(lat, lng, precision), precision)
+
+
+def cell_columns(prefix: str, lat: float, lng: float) -> Dict[str, str]:
+    """
+    Values of the stored cell columns for a point.
+
+    Args:
+        prefix: Column prefix, e.g. "pickup" for pickup_geohash_4..6
+
+    Returns:
+        Dict of column name -> geohash at each of GEOHASH_PRECISIONS
+    """
+    return {
+        f"{prefix}_geohash_{precision}": encode(lat, lng, precision)
+        for precision in GEOHASH_PRECISIONS
+    }
@@ -0,0 +1,77 @@
+"""
+Encoded polyline format for storing point sequences compactly.
+
+Uses the Google Maps encoded polyline algorithm: each coordinate is rounded
+to `precision` decimals, delta-encoded against the previous point and
+written as base64-like ASCII chunks. At the default precision of 5 (~1.1 m)
+a typical vertex takes 6-10 characters instead of two 8-byte floats, and
+the strings can be handed to map clients as-is.
+"""
+from typing import List, Sequence, Tuple
+
+DEFAULT_PRECISION = 5
+
+
+def _encode_value(value: int) -> str:
+    value = ~(value << 1) if value < 0 else value << 1
+    chunks = []
+    while value >= 0x20:
+        chunks.append(chr((0x20 | (value & 0x1f)) + 63))
+        value >>= 5
+    chunks.append(chr(value + 63))
+    return "".join(chunks)
+
+
+def encode_polyline(points: Sequence[Tuple[float, float]], precision: int = DEFAULT_PRECISION) -> str:
+    """
+    Encode (lat, lng) points as a polyline string.
+
+    Args:
+        points: Sequence of (lat, lng) tuples in degrees
+        precision: Decimal places kept for each coordinate
+
+    Returns:
+        Encoded polyline (empty string for no points)
+    """
+    factor = 10 ** precision
+    result = []
+    prev_lat = prev_lng = 0
+    for lat, lng in points:
+        lat_i = int(round(lat * factor))
+        lng_i = int(round(lng * factor))
+        result.append(_encode_value(lat_i - prev_lat))
+        result.append(_encode_value(lng_i - prev_lng))
+        prev_lat, prev_lng = lat_i, lng_i
+    return "".join(result)
+
+
+def decode_polyline(encoded: str, precision: int = DEFAULT_PRECISION) -> List[Tuple[float, float]]:
+    """
+    Decode a polyline string into (lat, lng) points.
+
+    Raises:
+        ValueError: If the string is not a valid encoded polyline
+    """
+    factor = 10 ** precision
+    values = []
+    value = shift = 0
+    for char in encoded:
+        byte = ord(char) - 63
+        if not 0 <= byte < 64:
+            raise ValueError(f"Invalid character in encoded polyline: {char!r}")
+        value |= (byte & 0x1f) << shift
+        shift += 5
+        if byte < 0x20:
+            values.append(~(value >> 1) if value & 1 else value >> 1)
+            value = shift = 0
+
+    if shift or len(values) % 2:
+        raise ValueError("Truncated encoded polyline")
+
+    points = []
+    lat = lng = 0
+    for i in range(0, len(values), 2):
+        lat += values[i]
+        lng += values[i + 1]
+        points.append((lat / factor, lng / factor))
+    return points
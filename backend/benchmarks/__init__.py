@@ -0,0 +1,9 @@
+"""
+Matching performance benchmarks.
+
+Generates synthetic, metro-clustered package and route datasets, times the
+geo kernels, the matching engine, the periodic matching job and the matching
+API endpoints against them, and compares the results with stored baselines.
+
+Usage: python -m benchmarks.run --help
+"""
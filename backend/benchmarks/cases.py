@@ -0,0 +1,204 @@
+"""
+Benchmark cases for the geo kernels, matching engine, matching job and API.
+
+Every case takes the benchmark session and a seeded Random, samples its
+inputs from the generated dataset, and returns a summary from
+harness.measure (latency percentiles plus throughput).
+"""
+import random
+from typing import Any, Callable, Dict, List
+
+import numpy as np
+from fastapi.testclient import TestClient
+from sqlalchemy.orm import Session
+
+from app.database import get_db
+from app.models.package import Package, PackageStatus, CourierRoute
+from app.models.user import User
+from app.services.batch_assignment import run_batch_assignment_job
+from app.services.matching_engine import matching_engine
+from app.services.matching_job import run_matching_job
+from app.services.package_snapshot import PackageSnapshot, route_spec
+from app.services.spatial_index import package_index, route_index
+from app.utils.auth import create_access_token
+from app.utils.geo import haversine_distance, is_package_along_route, route_corridor_distances_batch
+from benchmarks.harness import measure
+
+# Cap on packages fed to a single vectorized corridor call
+KERNEL_BATCH = 100_000
+
+
+def _sample_routes(db: Session, rng: random.Random, n: int) -> List[CourierRoute]:
+    ids = [route_id for (route_id,) in db.query(CourierRoute.id).filter(CourierRoute.is_active == True)]
+    chosen = rng.sample(ids, min(n, len(ids)))
+    return db.query(CourierRoute).filter(CourierRoute.id.in_(chosen)).order_by(CourierRoute.id).all()
+
+
+def _sample_packages(db: Session, rng: random.Random, n: int) -> List[Package]:
+    ids = [package_id for (package_id,) in db.query(Package.id).filter(
+        Package.status == PackageStatus.OPEN_FOR_BIDS,
+        Package.is_active == True
+    )]
+    chosen = rng.sample(ids, min(n, len(ids)))
+    return db.query(Package).filter(Package.id.in_(chosen)).order_by(Package.id).all()
+
+
+def _route_args(route: CourierRoute):
+    return route.start_lat, route.start_lng, route.end_lat, route.end_lng
+
+
+def bench_haversine(db: Session, rng: random.Random, samples: int) -> Dict[str, Any]:
+    """Scalar haversine_distance between random package pickups and dropoffs."""
+    def run(package: Package) -> int:
+        haversine_distance(package.pickup_lat, package.pickup_lng, package.dropoff_lat, package.dropoff_lng)
+        return 1
+
+    return measure(run, _sample_packages(db, rng, samples))
+
+
+def bench_is_package_along_route(db: Session, rng: random.Random, samples: int) -> Dict[str, Any]:
+    """Scalar corridor check for random (route, package) pairs."""
+    routes = _sample_routes(db, rng, samples)
+    packages = _sample_packages(db, rng, samples)
+    pairs = list(zip(routes, rng.sample(packages, len(packages))))
+
+    def run(pair) -> int:
+        route, package = pair
+        is_package_along_route(
+            *_route_args(route),
+            package.pickup_lat, package.pickup_lng, package.dropoff_lat, package.dropoff_lng,
+            route.max_deviation_km
+        )
+        return 1
+
+    return measure(run, pairs)
+
+
+def bench_corridor_batch(db: Session, rng: random.Random, samples: int) -> Dict[str, Any]:
+    """Vectorized corridor distances for one route against up to KERNEL_BATCH packages."""
+    snapshot = PackageSnapshot.load(db)
+    take = np.sort(np.asarray(rng.sample(range(len(snapshot)), min(KERNEL_BATCH, len(snapshot))), dtype=np.int64))
+    columns = [snapshot.pickup_lat[take], snapshot.pickup_lng[take], snapshot.dropoff_lat[take], snapshot.dropoff_lng[take]]
+
+    def run(route: CourierRoute) -> int:
+        route_corridor_distances_batch(*_route_args(route), *columns, max_distance_km=route.max_deviation_km)
+        return len(take)
+
+    return measure(run, _sample_routes(db, rng, samples))
+
+
+def bench_snapshot_load(db: Session, rng: random.Random, samples: int) -> Dict[str, Any]:
+    """Loading the columnar snapshot of open packages used by the matching job."""
+    return measure(lambda _: len(PackageSnapshot.load(db)), range(max(1, samples // 20)), warmup=0)
+
+
+def bench_snapshot_match_route(db: Session, rng: random.Random, samples: int) -> Dict[str, Any]:
+    """Matching one route against the in-memory package snapshot."""
+    snapshot = PackageSnapshot.load(db)
+    routes = [route_spec(r) for r in _sample_routes(db, rng, samples)]
+    return measure(lambda spec: len(snapshot.match_route(spec)), routes)
+
+
+def bench_index_rebuild(db: Session, rng: random.Random, samples: int) -> Dict[str, Any]:
+    """Full rebuild of the package and route spatial indexes."""
+    def run(_) -> int:
+        package_index.rebuild(db)
+        route_index.rebuild(db)
+        return len(package_index) + len(route_index)
+
+    return measure(run, range(max(1, samples // 20)), warmup=0)
+
+
+def bench_match_route(db: Session, rng: random.Random, samples: int) -> Dict[str, Any]:
+    """MatchingEngine.match_route for random routes (index prefilter + scoring + ranking)."""
+    return measure(lambda route: len(matching_engine.match_route(db, route)), _sample_routes(db, rng, samples))
+
+
+def bench_match_package(db: Session, rng: random.Random, samples: int) -> Dict[str, Any]:
+    """MatchingEngine.match_package (reverse matching) for random packages."""
+    return measure(
+        lambda package: len(matching_engine.match_package(db, package, limit=50)),
+        _sample_packages(db, rng, samples)
+    )
+
+
+def bench_matching_job(db: Session, rng: random.Random, samples: int) -> Dict[str, Any]:
+    """Dry run of the periodic matching job over every active route."""
+    return measure(
+        lambda _: run_matching_job(dry_run=True, db=db)['routes_processed'],
+        range(max(1, samples // 50)),
+        warmup=0
+    )
+
+
+def bench_batch_assignment(db: Session, rng: random.Random, samples: int) -> Dict[str, Any]:
+    """Global one-to-one assignment of open packages to every active route."""
+    return measure(
+        lambda _: run_batch_assignment_job(db=db)['candidate_pairs'],
+        range(max(1, samples // 50)),
+        warmup=0
+    )
+
+
+def _client(db: Session) -> TestClient:
+    from main import app
+
+    def override_get_db():
+        yield db
+
+    app.dependency_overrides[get_db] = override_get_db
+    return TestClient(app)
+
+
+def _token(db: Session, user_id: int) -> str:
+    email = db.query(User.email).filter(User.id == user_id).scalar()
+    return create_access_token(data={"sub": email})
+
+
+def bench_api_packages_along_route(db: Session, rng: random.Random, samples: int) -> Dict[str, Any]:
+    """GET /api/matching/packages-along-route/{id} as the route's courier."""
+    requests = [
+        (f"/api/matching/packages-along-route/{route.id}", _token(db, route.courier_id))
+        for route in _sample_routes(db, rng, samples)
+    ]
+    return _measure_requests(db, requests)
+
+
+def bench_api_routes_for_package(db: Session, rng: random.Random, samples: int) -> Dict[str, Any]:
+    """GET /api/matching/routes-for-package/{id} as the package's sender."""
+    requests = [
+        (f"/api/matching/routes-for-package/{package.id}", _token(db, package.sender_id))
+        for package in _sample_packages(db, rng, samples)
+    ]
+    return _measure_requests(db, requests)
+
+
+def _measure_requests(db: Session, requests) -> Dict[str, Any]:
+    client = _client(db)
+
+    def run(request) -> int:
+        path, token = request
+        response = client.get(path, headers={"Authorization": f"Bearer {token}"})
+        response.raise_for_status()
+        return len(response.json())
+
+    try:
+        return measure(run, requests)
+    finally:
+        client.app.dependency_overrides.pop(get_db, None)
+
+
+CASES: Dict[str, Callable[[Session, random.Random, int], Dict[str, Any]]] = {
+    "geo.haversine_distance": bench_haversine,
+    "geo.is_package_along_route": bench_is_package_along_route,
+    "geo.route_corridor_distances_batch": bench_corridor_batch,
+    "index.rebuild": bench_index_rebuild,
+    "snapshot.load": bench_snapshot_load,
+    "snapshot.match_route": bench_snapshot_match_route,
+    "engine.match_route": bench_match_route,
+    "engine.match_package": bench_match_package,
+    "job.run_matching_job": bench_matching_job,
+    "job.batch_assignment": bench_batch_assignment,
+    "api.packages_along_route": bench_api_packages_along_route,
+    "api.routes_for_package": bench_api_routes_for_package,
+}
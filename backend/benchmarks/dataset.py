@@ -0,0 +1,240 @@
+"""
+Synthetic city-scale datasets for the matching benchmarks.
+
+Packages and routes are clustered around real metro areas, weighted by
+population: most packages travel within one metro, the rest between nearby
+metros, and routes mix short urban trips with intercity runs. Rows are
+written with bulk Core inserts, so ORM session hooks (route index, match
+cache) do not fire while loading.
+"""
+import math
+import random
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Tuple
+
+from sqlalchemy import func, insert
+from sqlalchemy.orm import Session
+
+from app.models.package import Package, PackageStatus, PackageSize, CourierRoute
+from app.models.user import User, UserRole
+from app.utils.geohash import cell_columns
+
+# (name, lat, lng, relative population weight)
+METRO_AREAS: List[Tuple[str, float, float, float]] = [
+    ("New York", 40.7128, -74.0060, 19.5),
+    ("Los Angeles", 34.0522, -118.2437, 13.0),
+    ("Chicago", 41.8781, -87.6298, 9.4),
+    ("Dallas", 32.7767, -96.7970, 7.6),
+    ("Houston", 29.7604, -95.3698, 7.1),
+    ("Washington", 38.9072, -77.0369, 6.3),
+    ("Philadelphia", 39.9526, -75.1652, 6.2),
+    ("Miami", 25.7617, -80.1918, 6.1),
+    ("Atlanta", 33.7490, -84.3880, 6.1),
+    ("Boston", 42.3601, -71.0589, 4.9),
+    ("Phoenix", 33.4484, -112.0740, 4.9),
+    ("San Francisco", 37.7749, -122.4194, 4.7),
+    ("Seattle", 47.6062, -122.3321, 4.0),
+    ("San Diego", 32.7157, -117.1611, 3.3),
+    ("Denver", 39.7392, -104.9903, 3.0),
+    ("La Paz", -16.4897, -68.1193, 2.0),
+    ("Santa Cruz", -17.7833, -63.1821, 1.8),
+    ("Cochabamba", -17.3895, -66.1568, 1.3),
+]
+
+# Intercity legs only connect metros closer than this
+MAX_INTERCITY_KM = 800
+
+# Standard deviation of pickup/dropoff scatter around a metro centre, in degrees (~15 km)
+METRO_SPREAD_DEG = 0.15
+
+# Share of packages delivered to another metro
+INTERCITY_PACKAGE_SHARE = 0.2
+
+# Share of routes that run between metros
+INTERCITY_ROUTE_SHARE = 0.4
+
+INSERT_CHUNK = 10_000
+
+TRACKING_ALPHABET = "0123456789abcdefghijklmnopqrstuvwxyz"
+
+# Benchmark users share this password hash; nobody logs in with a password
+PASSWORD_HASH = "benchmark-not-a-real-hash"
+
+
+def _distance_km(a: Tuple[float, float], b: Tuple[float, float]) -> float:
+    """Equirectangular distance, good enough for picking neighbouring metros."""
+    x = math.radians(b[1] - a[1]) * math.cos(math.radians((a[0] + b[0]) / 2))
+    y = math.radians(b[0] - a[0])
+    return 6371 * math.hypot(x, y)
+
+
+def _neighbours() -> Dict[int, List[int]]:
+    """Metros reachable from each metro by an intercity leg."""
+    return {
+        i: [
+            j for j, (_, lat2, lng2, _) in enumerate(METRO_AREAS)
+            if j != i and _distance_km((lat, lng), (lat2, lng2)) <= MAX_INTERCITY_KM
+        ]
+        for i, (_, lat, lng, _) in enumerate(METRO_AREAS)
+    }
+
+
+def benchmark_tracking_id(n: int) -> str:
+    """Deterministic, unique tracking ID (xxxx-xxxx-xxxx-xxxx) for row n."""
+    chars = []
+    for _ in range(16):
+        n, digit = divmod(n, 36)
+        chars.append(TRACKING_ALPHABET[digit])
+    chars.reverse()
+    return "-".join("".join(chars[i:i + 4]) for i in range(0, 16, 4))
+
+
+class DatasetGenerator:
+    """Seeded generator of clustered package and route rows."""
+
+    def __init__(self, seed: int = 42):
+        self.rng = random.Random(seed)
+        self.weights = [metro[3] for metro in METRO_AREAS]
+        self.neighbours = _neighbours()
+
+    def metro(self) -> int:
+        return self.rng.choices(range(len(METRO_AREAS)), weights=self.weights)[0]
+
+    def destination(self, origin: int, intercity_share: float) -> int:
+        neighbours = self.neighbours[origin]
+        if neighbours and self.rng.random() < intercity_share:
+            return self.rng.choice(neighbours)
+        return origin
+
+    def point(self, metro: int) -> Tuple[float, float]:
+        _, lat, lng, _ = METRO_AREAS[metro]
+        return (
+            round(self.rng.gauss(lat, METRO_SPREAD_DEG), 6),
+            round(self.rng.gauss(lng, METRO_SPREAD_DEG / math.cos(math.radians(lat))), 6),
+        )
+
+    def package(self, n: int, sender_id: int) -> Dict:
+        origin = self.metro()
+        pickup = self.point(origin)
+        dropoff = self.point(self.destination(origin, INTERCITY_PACKAGE_SHARE))
+        size = self.rng.choices(list(PackageSize), weights=[6, 3, 1, 0.2])[0]
+        return {
+            "tracking_id": benchmark_tracking_id(n),
+            "sender_id": sender_id,
+            "description": f"Benchmark package {n}",
+            "size": size,
+            "weight_kg": round(self.rng.uniform(0.2, 25.0), 1),
+            "pickup_address": f"{METRO_AREAS[origin][0]} pickup {n}",
+            "pickup_lat": pickup[0],
+            "pickup_lng": pickup[1],
+            "dropoff_address": f"Dropoff {n}",
+            "dropoff_lat": dropoff[0],
+            "dropoff_lng": dropoff[1],
+            # Core inserts skip the ORM events that normally fill the cell columns
+            **cell_columns("pickup", *pickup),
+            **cell_columns("dropoff", *dropoff),
+            "status": PackageStatus.OPEN_FOR_BIDS,
+            "price": round(self.rng.uniform(5, 150), 2),
+            "is_active": True,
+            "requires_proof": True,
+            "bid_count": 0,
+            "deadline_extensions": 0,
+            "deadline_warning_sent": False,
+        }
+
+    def route(self, n: int, courier_id: int, now: datetime) -> Dict:
+        origin = self.metro()
+        start = self.point(origin)
+        end = self.point(self.destination(origin, INTERCITY_ROUTE_SHARE))
+        trip_date = None
+        if self.rng.random() < 0.5:
+            trip_date = now + timedelta(days=self.rng.randint(1, 30))
+        return {
+            "courier_id": courier_id,
+            "start_address": f"{METRO_AREAS[origin][0]} start {n}",
+            "start_lat": start[0],
+            "start_lng": start[1],
+            "end_address": f"End {n}",
+            "end_lat": end[0],
+            "end_lng": end[1],
+            **cell_columns("start", *start),
+            **cell_columns("end", *end),
+            "max_deviation_km": self.rng.choice([2, 5, 5, 10, 10, 20]),
+            "trip_date": trip_date,
+            "is_active": True,
+        }
+
+
+def _insert_chunked(db: Session, model, rows) -> None:
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= INSERT_CHUNK:
+            db.execute(insert(model), chunk)
+            chunk = []
+    if chunk:
+        db.execute(insert(model), chunk)
+
+
+def _insert_users(db: Session, prefix: str, role: UserRole, count: int) -> List[int]:
+    _insert_chunked(db, User, (
+        {
+            "email": f"{prefix}{i}@benchmark.test",
+            "hashed_password": PASSWORD_HASH,
+            "full_name": f"Benchmark {prefix.title()} {i}",
+            "role": role,
+            "is_active": True,
+            "is_verified": True,
+            "preferred_language": "en",
+        }
+        for i in range(count)
+    ))
+    return [
+        user_id for (user_id,) in db.query(User.id).filter(
+            User.email.like(f"{prefix}%@benchmark.test")
+        ).order_by(User.id)
+    ]
+
+
+def generate_dataset(db: Session, packages: int, routes: int, seed: int = 42) -> Dict[str, int]:
+    """
+    Insert a clustered dataset of open packages and active courier routes.
+
+    One courier is created per route; senders each own about 20 packages.
+
+    Returns:
+        Counts of inserted senders, couriers, packages and routes
+    """
+    generator = DatasetGenerator(seed)
+    now = datetime.now(timezone.utc)
+
+    sender_ids = _insert_users(db, "sender", UserRole.SENDER, max(1, packages // 20))
+    courier_ids = _insert_users(db, "courier", UserRole.COURIER, max(1, routes))
+
+    _insert_chunked(db, Package, (
+        generator.package(n, sender_ids[n % len(sender_ids)]) for n in range(packages)
+    ))
+    _insert_chunked(db, CourierRoute, (
+        generator.route(n, courier_ids[n % len(courier_ids)], now) for n in range(routes)
+    ))
+    db.commit()
+
+    return {
+        "senders": len(sender_ids),
+        "couriers": len(courier_ids),
+        "packages": packages,
+        "routes": routes,
+    }
+
+
+def dataset_size(db: Session) -> Dict[str, int]:
+    """Counts of open packages and active routes already in the database."""
+    return {
+        "packages": db.query(func.count(Package.id)).filter(
+            Package.status == PackageStatus.OPEN_FOR_BIDS,
+            Package.is_active == True
+        ).scalar(),
+        "routes": db.query(func.count(CourierRoute.id)).filter(
+            CourierRoute.is_active == True
+        ).scalar(),
+    }
@@ -0,0 +1,151 @@
+"""
+Timing, latency percentiles and baseline comparison for the benchmarks.
+"""
+import json
+import os
+import platform
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+import numpy as np
+
+BASELINE_DIR = os.path.join(os.path.dirname(__file__), "baselines")
+
+# A case regresses when its p95 latency grows by more than this fraction
+DEFAULT_TOLERANCE = 0.25
+
+
+def summarize(durations: List[float], items: int = 0) -> Dict[str, Any]:
+    """
+    Latency percentiles and throughput for a list of per-call durations.
+
+    Args:
+        durations: Wall-clock seconds per call
+        items: Total items (packages, routes, ...) processed across all calls
+
+    Returns:
+        Dict with samples, p50_ms, p95_ms, p99_ms, mean_ms, ops_per_s and,
+        when items is given, items_per_s
+    """
+    if not durations:
+        return {"samples": 0}
+    samples = np.asarray(durations) * 1000
+    total = float(np.sum(durations))
+    p50, p95, p99 = np.percentile(samples, [50, 95, 99])
+    summary = {
+        "samples": len(durations),
+        "p50_ms": round(float(p50), 3),
+        "p95_ms": round(float(p95), 3),
+        "p99_ms": round(float(p99), 3),
+        "mean_ms": round(float(np.mean(samples)), 3),
+        "ops_per_s": round(len(durations) / total, 1) if total else None,
+    }
+    if items:
+        summary["items_per_s"] = round(items / total, 1) if total else None
+    return summary
+
+
+def measure(
+    fn: Callable[[Any], Optional[int]],
+    inputs: Iterable[Any],
+    warmup: int = 1
+) -> Dict[str, Any]:
+    """
+    Time fn once per input.
+
+    fn may return the number of items it processed (e.g. matches found or
+    packages scanned); those are summed into items_per_s.
+    """
+    inputs = list(inputs)
+    for value in inputs[:warmup]:
+        fn(value)
+
+    durations = []
+    items = 0
+    for value in inputs:
+        start = time.perf_counter()
+        processed = fn(value)
+        durations.append(time.perf_counter() - start)
+        items += processed or 0
+    return summarize(durations, items)
+
+
+def environment() -> Dict[str, str]:
+    """Host details stored alongside results; latencies only compare on similar hosts."""
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "processor": platform.processor() or platform.machine(),
+        "numpy": np.__version__,
+    }
+
+
+def baseline_path(name: str) -> str:
+    return os.path.join(BASELINE_DIR, f"{name}.json")
+
+
+def save_baseline(name: str, report: Dict[str, Any]) -> str:
+    """Write a report as the named baseline; returns its path."""
+    os.makedirs(BASELINE_DIR, exist_ok=True)
+    path = baseline_path(name)
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+        f.write("\n")
+    return path
+
+
+def load_baseline(name: str) -> Optional[Dict[str, Any]]:
+    """Load the named baseline, or None if it has not been recorded."""
+    path = baseline_path(name)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def compare(
+    report: Dict[str, Any],
+    baseline: Dict[str, Any],
+    tolerance: float = DEFAULT_TOLERANCE
+) -> List[Dict[str, Any]]:
+    """
+    Compare each case's p95 latency against the baseline.
+
+    Returns:
+        One entry per case present in both, with baseline/current p95,
+        the relative change and whether it exceeds the tolerance
+    """
+    rows = []
+    for case, current in report["results"].items():
+        previous = baseline.get("results", {}).get(case)
+        if not previous or not previous.get("p95_ms") or "p95_ms" not in current:
+            continue
+        change = current["p95_ms"] / previous["p95_ms"] - 1
+        rows.append({
+            "case": case,
+            "baseline_p95_ms": previous["p95_ms"],
+            "p95_ms": current["p95_ms"],
+            "change": round(change, 3),
+            "regressed": change > tolerance,
+        })
+    return rows
+
+
+def format_report(report: Dict[str, Any], comparison: Optional[List[Dict[str, Any]]] = None) -> str:
+    """Plain-text table of a report and, optionally, its baseline comparison."""
+    changes = {row["case"]: row for row in comparison or []}
+    lines = [
+        f"{'case':<34} {'samples':>7} {'p50 ms':>10} {'p95 ms':>10} {'p99 ms':>10} "
+        f"{'ops/s':>10} {'items/s':>12} {'vs base':>9}"
+    ]
+    for case, stats in report["results"].items():
+        change = changes.get(case)
+        flag = ""
+        if change:
+            flag = f"{change['change']:+.0%}" + (" !" if change["regressed"] else "")
+        lines.append(
+            f"{case:<34} {stats.get('samples', 0):>7} {stats.get('p50_ms', 0):>10.3f} "
+            f"{stats.get('p95_ms', 0):>10.3f} {stats.get('p99_ms', 0):>10.3f} "
+            f"{stats.get('ops_per_s') or 0:>10.1f} {stats.get('items_per_s') or 0:>12.1f} {flag:>9}"
+        )
+    return "\n".join(lines)
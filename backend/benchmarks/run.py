@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+Run the matching benchmarks and compare them with a stored baseline.
+
+Usage:
+    # 10k packages / 1k routes in a generated SQLite database
+    python -m benchmarks.run
+
+    # City-scale profiles
+    python -m benchmarks.run --profile medium    # 100k packages / 10k routes
+    python -m benchmarks.run --profile large     # 1M packages / 100k routes
+
+    # Custom size against Postgres
+    python -m benchmarks.run --packages 250000 --routes 20000 \\
+        --database-url postgresql://localhost/chaski_bench
+
+    # Only some cases, and record the results as the new baseline
+    python -m benchmarks.run --cases engine.,api. --save-baseline
+
+    # Exit non-zero when a case's p95 regresses by more than 25%
+    python -m benchmarks.run --fail-on-regression
+
+Datasets are generated once per database and reused on later runs. Baselines
+live in benchmarks/baselines/<name>.json (default name: the profile).
+"""
+
+import argparse
+import json
+import logging
+import os
+import random
+import sys
+from datetime import datetime, timezone
+
+PROFILES = {
+    "small": (10_000, 1_000),
+    "medium": (100_000, 10_000),
+    "large": (1_000_000, 100_000),
+}
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), "data")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark package-route matching")
+    parser.add_argument("--profile", choices=PROFILES, default="small", help="Dataset size preset")
+    parser.add_argument("--packages", type=int, help="Open packages to generate (overrides profile)")
+    parser.add_argument("--routes", type=int, help="Active routes to generate (overrides profile)")
+    parser.add_argument("--seed", type=int, default=42, help="Dataset and sampling seed")
+    parser.add_argument("--database-url", help="Benchmark database (default: SQLite file under benchmarks/data)")
+    parser.add_argument("--regenerate", action="store_true", help="Drop and regenerate the dataset")
+    parser.add_argument("--samples", type=int, default=200, help="Calls per case (whole-dataset cases run fewer)")
+    parser.add_argument("--cases", help="Comma-separated case names or prefixes, e.g. geo.,engine.match_route")
+    parser.add_argument("--fast-distance", action="store_true", help="Benchmark with MATCHING_FAST_DISTANCE")
+    parser.add_argument("--baseline", help="Baseline name (default: profile, or packages-routes for custom sizes)")
+    parser.add_argument("--save-baseline", action="store_true", help="Store these results as the baseline")
+    parser.add_argument("--tolerance", type=float, help="Allowed relative p95 growth before flagging a regression")
+    parser.add_argument("--fail-on-regression", action="store_true", help="Exit 1 if any case regressed")
+    parser.add_argument("--json", dest="json_path", help="Also write the report to this file")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    packages = args.packages or PROFILES[args.profile][0]
+    routes = args.routes or PROFILES[args.profile][1]
+    custom_size = args.packages or args.routes
+    baseline_name = args.baseline or (f"{packages}-{routes}" if custom_size else args.profile)
+
+    database_url = args.database_url
+    if not database_url:
+        os.makedirs(DATA_DIR, exist_ok=True)
+        database_url = f"sqlite:///{os.path.join(DATA_DIR, f'bench-{packages}-{routes}-{args.seed}.db')}"
+
+    # Settings are read at import time, so configure them before importing the app
+    os.environ["DATABASE_URL"] = database_url
+    os.environ["MATCH_CACHE_ENABLED"] = "false"  # Time matching, not Redis hits
+    os.environ["MATCHING_FAST_DISTANCE"] = "true" if args.fast_distance else "false"
+
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+
+    from app.models.base import Base
+    from main import app  # noqa: F401  registers every model
+    from benchmarks import harness
+    from benchmarks.cases import CASES
+    from benchmarks.dataset import dataset_size, generate_dataset
+
+    # Per-match job logging would dominate the timings
+    logging.getLogger("app").setLevel(logging.WARNING)
+
+    engine = create_engine(database_url)
+    if args.regenerate:
+        Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(autocommit=False, autoflush=False, bind=engine)()
+
+    try:
+        size = dataset_size(db)
+        if size["packages"] == 0 and size["routes"] == 0:
+            print(f"Generating {packages} packages and {routes} routes in {database_url} ...")
+            generate_dataset(db, packages, routes, args.seed)
+            size = dataset_size(db)
+        elif size != {"packages": packages, "routes": routes}:
+            print(
+                f"Database already holds {size['packages']} packages and {size['routes']} routes; "
+                f"use --regenerate or another --database-url", file=sys.stderr
+            )
+            return 2
+
+        selected = {
+            name: case for name, case in CASES.items()
+            if not args.cases or any(name.startswith(prefix) for prefix in args.cases.split(","))
+        }
+
+        report = {
+            "recorded_at": datetime.now(timezone.utc).isoformat(),
+            "dataset": {**size, "seed": args.seed, "database": engine.dialect.name},
+            "settings": {"fast_distance": args.fast_distance, "samples": args.samples},
+            "environment": harness.environment(),
+            "results": {},
+        }
+        for name, case in selected.items():
+            print(f"Running {name} ...", file=sys.stderr)
+            report["results"][name] = case(db, random.Random(args.seed), args.samples)
+            db.rollback()
+    finally:
+        db.close()
+
+    tolerance = harness.DEFAULT_TOLERANCE if args.tolerance is None else args.tolerance
+    baseline = harness.load_baseline(baseline_name)
+    comparison = harness.compare(report, baseline, tolerance) if baseline else None
+
+    print(harness.format_report(report, comparison))
+    if baseline is None:
+        print(f"\nNo baseline '{baseline_name}' recorded yet (use --save-baseline).")
+    elif baseline.get("dataset", {}).get("database") != report["dataset"]["database"]:
+        print(f"\nWarning: baseline '{baseline_name}' was recorded on {baseline['dataset'].get('database')}.")
+
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.save_baseline:
+        if baseline:
+            # Keep baseline entries for cases that were not run this time
+            report["results"] = {**baseline.get("results", {}), **report["results"]}
+        print(f"\nSaved baseline to {harness.save_baseline(baseline_name, report)}")
+
+    regressed = [row["case"] for row in comparison or [] if row["regressed"]]
+    if regressed:
+        print(f"\nRegressed beyond {tolerance:.0%} (p95): {', '.join(regressed)}")
+        if args.fail_on_regression:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
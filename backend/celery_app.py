@@ -11,6 +11,10 @@ from celery import Celery
 
 from app.config import settings
 
+# Register the commit hooks that invalidate cached route matches, so package
+# changes made by workers are seen by the API processes
+import app.services.match_cache  # noqa: F401
+
 # Create Celery application
 celery_app = Celery(
     "chaski",
@@ -64,6 +68,10 @@ celery_app.conf.update(
             "task": "app.tasks.analytics.cleanup_old_locations",
             "schedule": 86400.0,  # Daily
         },
+        "compact-location-history": {
+            "task": "app.tasks.analytics.compact_location_history",
+            "schedule": 900.0,  # Every 15 minutes
+        },
         "send-matched-package-reminders": {
             "task": "app.tasks.notifications.send_matched_package_reminders",
             "schedule": 3600.0,  # Every hour
@@ -9,6 +9,7 @@ from app.config import settings
 from app.database import engine
 from app.models import base
 from app.routes import auth, packages, couriers, matching, admin, notifications, ratings, ws, messages, delivery_proof, payments, payouts, tracking, analytics, bids, notes, logs
+from app.services.location_buffer import location_buffer
 from app.utils.logging_config import setup_logging
 from app.middleware.logging_middleware import (
     RequestLoggingMiddleware,
@@ -147,6 +148,11 @@ app.include_router(notes.router, prefix="/api/packages", tags=["Package Notes"])
 app.include_router(logs.router, prefix="/api/logs", tags=["Logging"])
 app.include_router(ws.router, prefix="/api", tags=["WebSocket"])
 
+@app.on_event("shutdown")
+def flush_location_buffer():
+    """Write buffered location updates before the process exits."""
+    location_buffer.close()
+
 @app.get("/")
 async def root():
     return {"message": "Welcome to Chaski API"}
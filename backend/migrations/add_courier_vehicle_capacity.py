@@ -0,0 +1,63 @@
+"""
+Migration script to add vehicle capacity fields to users table
+
+Couriers can limit the total weight and the largest package size their
+vehicle carries. Both columns are nullable; NULL means no limit.
+Usage: python migrations/add_courier_vehicle_capacity.py
+"""
+
+from sqlalchemy import create_engine, text
+from app.config import settings
+
+def upgrade():
+    """Add vehicle capacity fields to users table"""
+    engine = create_engine(settings.DATABASE_URL)
+
+    with engine.connect() as conn:
+        # Check if columns already exist
+        result = conn.execute(text("""
+            SELECT column_name
+            FROM information_schema.columns
+            WHERE table_name='users' AND column_name='vehicle_max_weight_kg'
+        """))
+
+        if result.fetchone():
+            print("Vehicle capacity columns already exist in users table")
+            return
+
+        # Total load the courier's vehicle carries
+        conn.execute(text("""
+            ALTER TABLE users
+            ADD COLUMN vehicle_max_weight_kg DOUBLE PRECISION
+        """))
+
+        # Largest package size class, reusing the packages.size enum type
+        conn.execute(text("""
+            ALTER TABLE users
+            ADD COLUMN vehicle_max_size packagesize
+        """))
+
+        conn.commit()
+        print("Successfully added vehicle capacity columns to users table")
+
+def downgrade():
+    """Remove vehicle capacity fields from users table"""
+    engine = create_engine(settings.DATABASE_URL)
+
+    with engine.connect() as conn:
+        conn.execute(text("""
+            ALTER TABLE users
+            DROP COLUMN IF EXISTS vehicle_max_weight_kg,
+            DROP COLUMN IF EXISTS vehicle_max_size
+        """))
+
+        conn.commit()
+        print("Successfully removed vehicle capacity columns from users table")
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) > 1 and sys.argv[1] == "downgrade":
+        downgrade()
+    else:
+        upgrade()
@@ -0,0 +1,97 @@
+"""
+Migration script to add geohash cell columns to packages and courier_routes
+
+Packages store the geohash of their pickup and dropoff, routes of their
+start and end, at precisions 4-6. The columns are indexed so proximity and
+corridor lookups can use `IN (...)` over cell ids on any database. Existing
+rows are backfilled from their coordinates.
+Usage: python migrations/add_geohash_cells.py
+"""
+
+from sqlalchemy import create_engine, text
+from app.config import settings
+from app.utils.geohash import GEOHASH_PRECISIONS, cell_columns
+
+TABLE_POINTS = {
+    "packages": ("pickup", "dropoff"),
+    "courier_routes": ("start", "end"),
+}
+
+
+def _index_sql(table, column):
+    if table == "packages":
+        # Composite with the open-package filter, like the location indexes
+        return f"CREATE INDEX IF NOT EXISTS ix_packages_status_{column} ON packages (status, is_active, {column})"
+    return f"CREATE INDEX IF NOT EXISTS ix_courier_routes_{column} ON courier_routes ({column})"
+
+
+def _backfill(conn, table, points):
+    coordinate_columns = ", ".join(f"{point}_lat, {point}_lng" for point in points)
+    rows = conn.execute(text(f"SELECT id, {coordinate_columns} FROM {table}")).fetchall()
+
+    for row in rows:
+        values = {}
+        for i, point in enumerate(points):
+            lat, lng = row[1 + 2 * i], row[2 + 2 * i]
+            if lat is not None and lng is not None:
+                values.update(cell_columns(point, lat, lng))
+        if not values:
+            continue
+        assignments = ", ".join(f"{column} = :{column}" for column in values)
+        conn.execute(text(f"UPDATE {table} SET {assignments} WHERE id = :id"), {**values, "id": row[0]})
+
+    print(f"Backfilled geohash cells for {len(rows)} rows in {table}")
+
+
+def upgrade():
+    """Add, index and backfill geohash cell columns"""
+    engine = create_engine(settings.DATABASE_URL)
+
+    with engine.connect() as conn:
+        for table, points in TABLE_POINTS.items():
+            for point in points:
+                for precision in GEOHASH_PRECISIONS:
+                    column = f"{point}_geohash_{precision}"
+
+                    # Check if column already exists
+                    result = conn.execute(text(f"""
+                        SELECT column_name
+                        FROM information_schema.columns
+                        WHERE table_name='{table}' AND column_name='{column}'
+                    """))
+
+                    if result.fetchone():
+                        print(f"{column} column already exists in {table} table")
+                    else:
+                        conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} VARCHAR({precision})"))
+                        print(f"Added {column} column to {table} table")
+
+                    conn.execute(text(_index_sql(table, column)))
+
+            _backfill(conn, table, points)
+
+        conn.commit()
+        print("Successfully added geohash cell columns")
+
+
+def downgrade():
+    """Remove geohash cell columns (their indexes are dropped with them)"""
+    engine = create_engine(settings.DATABASE_URL)
+
+    with engine.connect() as conn:
+        for table, points in TABLE_POINTS.items():
+            for point in points:
+                for precision in GEOHASH_PRECISIONS:
+                    conn.execute(text(f"ALTER TABLE {table} DROP COLUMN IF EXISTS {point}_geohash_{precision}"))
+
+        conn.commit()
+        print("Successfully removed geohash cell columns")
+
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) > 1 and sys.argv[1] == "downgrade":
+        downgrade()
+    else:
+        upgrade()
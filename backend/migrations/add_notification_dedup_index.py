@@ -0,0 +1,43 @@
+"""
+Migration script to add a composite de-duplication index to notifications table
+
+The index backs the matching job's lookup of recent PACKAGE_MATCH_FOUND
+notifications per (courier, package).
+
+Usage: python migrations/add_notification_dedup_index.py
+"""
+
+from sqlalchemy import create_engine, text
+from app.config import settings
+
+INDEX_NAME = "ix_notifications_user_package_type_created"
+INDEX_COLUMNS = "user_id, package_id, type, created_at"
+
+
+def upgrade():
+    """Create composite de-duplication index on notifications table"""
+    engine = create_engine(settings.DATABASE_URL)
+
+    with engine.connect() as conn:
+        conn.execute(text(f"CREATE INDEX IF NOT EXISTS {INDEX_NAME} ON notifications ({INDEX_COLUMNS})"))
+        conn.commit()
+        print(f"Ensured index '{INDEX_NAME}' on notifications ({INDEX_COLUMNS})")
+
+
+def downgrade():
+    """Drop composite de-duplication index from notifications table"""
+    engine = create_engine(settings.DATABASE_URL)
+
+    with engine.connect() as conn:
+        conn.execute(text(f"DROP INDEX IF EXISTS {INDEX_NAME}"))
+        conn.commit()
+        print(f"Successfully removed index '{INDEX_NAME}'")
+
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) > 1 and sys.argv[1] == "downgrade":
+        downgrade()
+    else:
+        upgrade()
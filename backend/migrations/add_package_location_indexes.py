@@ -0,0 +1,49 @@
+"""
+Migration script to add composite location indexes to packages table
+
+These indexes back the route corridor bounding-box prefilter used by the
+matching engine (status + is_active equality, then a lat/lng range scan).
+
+Usage: python migrations/add_package_location_indexes.py
+"""
+
+from sqlalchemy import create_engine, text
+from app.config import settings
+
+INDEXES = {
+    "ix_packages_status_pickup_location": "status, is_active, pickup_lat, pickup_lng",
+    "ix_packages_status_dropoff_location": "status, is_active, dropoff_lat, dropoff_lng",
+}
+
+
+def upgrade():
+    """Create composite location indexes on packages table"""
+    engine = create_engine(settings.DATABASE_URL)
+
+    with engine.connect() as conn:
+        for name, columns in INDEXES.items():
+            conn.execute(text(f"CREATE INDEX IF NOT EXISTS {name} ON packages ({columns})"))
+            print(f"Ensured index '{name}' on packages ({columns})")
+
+        conn.commit()
+
+
+def downgrade():
+    """Drop composite location indexes from packages table"""
+    engine = create_engine(settings.DATABASE_URL)
+
+    with engine.connect() as conn:
+        for name in INDEXES:
+            conn.execute(text(f"DROP INDEX IF EXISTS {name}"))
+
+        conn.commit()
+        print("Successfully removed package location indexes")
+
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) > 1 and sys.argv[1] == "downgrade":
+        downgrade()
+    else:
+        upgrade()
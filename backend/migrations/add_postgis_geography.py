@@ -0,0 +1,56 @@
+"""
+Migration script to add PostGIS geography columns to packages table
+
+Adds pickup_geog and dropoff_geog, generated from the lat/lng columns, with
+GiST indexes. With these in place the matching engine selects route
+candidates with ST_DWithin in the database; without them it keeps using
+the in-process spatial index. Requires PostgreSQL 12+ with PostGIS.
+Usage: python migrations/add_postgis_geography.py
+"""
+
+from sqlalchemy import create_engine, text
+from app.config import settings
+from app.services.postgis_matching import GEOGRAPHY_COLUMNS, install_geography_columns
+
+def upgrade():
+    """Add geography columns and GiST indexes to packages table"""
+    engine = create_engine(settings.DATABASE_URL)
+
+    with engine.connect() as conn:
+        # Check that PostGIS can be installed on this server
+        result = conn.execute(text("""
+            SELECT 1
+            FROM pg_available_extensions
+            WHERE name='postgis'
+        """))
+
+        if not result.fetchone():
+            print("PostGIS is not available on this server; matching stays in-process")
+            return
+
+        install_geography_columns(conn)
+
+        conn.commit()
+        print("Successfully added geography columns to packages table")
+
+def downgrade():
+    """Remove geography columns from packages table"""
+    engine = create_engine(settings.DATABASE_URL)
+
+    with engine.connect() as conn:
+        for column in GEOGRAPHY_COLUMNS:
+            conn.execute(text(f"""
+                ALTER TABLE packages
+                DROP COLUMN IF EXISTS {column}
+            """))
+
+        conn.commit()
+        print("Successfully removed geography columns from packages table")
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) > 1 and sys.argv[1] == "downgrade":
+        downgrade()
+    else:
+        upgrade()
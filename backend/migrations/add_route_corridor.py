@@ -0,0 +1,65 @@
+"""
+Migration script to add the corridor column to courier_routes table
+
+Routes store their precomputed corridor geometry (vertices, corridor boxes,
+segment unit vectors and lengths, outline) as JSON, so matching does not
+rebuild it on every call. Existing routes are backfilled; NULL rows are
+still matched, their corridor is just computed on use.
+Usage: python migrations/add_route_corridor.py
+"""
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import Session
+from app.config import settings
+from app.models.package import CourierRoute
+from app.services.route_corridor import store_corridor
+
+def upgrade():
+    """Add and backfill corridor column on courier_routes table"""
+    engine = create_engine(settings.DATABASE_URL)
+
+    with engine.connect() as conn:
+        # Check if column already exists
+        result = conn.execute(text("""
+            SELECT column_name
+            FROM information_schema.columns
+            WHERE table_name='courier_routes' AND column_name='corridor'
+        """))
+
+        if result.fetchone():
+            print("Corridor column already exists in courier_routes table")
+        else:
+            conn.execute(text("""
+                ALTER TABLE courier_routes
+                ADD COLUMN corridor JSON
+            """))
+            conn.commit()
+            print("Successfully added corridor column to courier_routes table")
+
+    with Session(engine) as session:
+        routes = session.query(CourierRoute).all()
+        for route in routes:
+            store_corridor(route)
+        session.commit()
+        print(f"Backfilled corridors for {len(routes)} routes")
+
+def downgrade():
+    """Remove corridor column from courier_routes table"""
+    engine = create_engine(settings.DATABASE_URL)
+
+    with engine.connect() as conn:
+        conn.execute(text("""
+            ALTER TABLE courier_routes
+            DROP COLUMN IF EXISTS corridor
+        """))
+
+        conn.commit()
+        print("Successfully removed corridor column from courier_routes table")
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) > 1 and sys.argv[1] == "downgrade":
+        downgrade()
+    else:
+        upgrade()
@@ -0,0 +1,56 @@
+"""
+Migration script to add the waypoints column to courier_routes table
+
+Routes can follow a polyline instead of a straight start→end line. The
+intermediate vertices are stored as an encoded polyline; NULL keeps the
+route a straight line.
+Usage: python migrations/add_route_waypoints.py
+"""
+
+from sqlalchemy import create_engine, text
+from app.config import settings
+
+def upgrade():
+    """Add waypoints column to courier_routes table"""
+    engine = create_engine(settings.DATABASE_URL)
+
+    with engine.connect() as conn:
+        # Check if column already exists
+        result = conn.execute(text("""
+            SELECT column_name
+            FROM information_schema.columns
+            WHERE table_name='courier_routes' AND column_name='waypoints'
+        """))
+
+        if result.fetchone():
+            print("Waypoints column already exists in courier_routes table")
+            return
+
+        conn.execute(text("""
+            ALTER TABLE courier_routes
+            ADD COLUMN waypoints TEXT
+        """))
+
+        conn.commit()
+        print("Successfully added waypoints column to courier_routes table")
+
+def downgrade():
+    """Remove waypoints column from courier_routes table"""
+    engine = create_engine(settings.DATABASE_URL)
+
+    with engine.connect() as conn:
+        conn.execute(text("""
+            ALTER TABLE courier_routes
+            DROP COLUMN IF EXISTS waypoints
+        """))
+
+        conn.commit()
+        print("Successfully removed waypoints column from courier_routes table")
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) > 1 and sys.argv[1] == "downgrade":
+        downgrade()
+    else:
+        upgrade()
@@ -0,0 +1,57 @@
+"""
+Migration script to add the track column to tracking_sessions table
+
+Ended sessions get their location history compacted into a simplified
+track (encoded polyline and fix times, JSON) and their location_updates
+rows deleted by the compact_location_history task. Existing ended
+sessions are compacted by its next runs.
+Usage: python migrations/add_tracking_session_track.py
+"""
+
+from sqlalchemy import create_engine, text
+from app.config import settings
+
+def upgrade():
+    """Add track column to tracking_sessions table"""
+    engine = create_engine(settings.DATABASE_URL)
+
+    with engine.connect() as conn:
+        # Check if column already exists
+        result = conn.execute(text("""
+            SELECT column_name
+            FROM information_schema.columns
+            WHERE table_name='tracking_sessions' AND column_name='track'
+        """))
+
+        if result.fetchone():
+            print("Track column already exists in tracking_sessions table")
+            return
+
+        conn.execute(text("""
+            ALTER TABLE tracking_sessions
+            ADD COLUMN track JSON
+        """))
+
+        conn.commit()
+        print("Successfully added track column to tracking_sessions table")
+
+def downgrade():
+    """Remove track column from tracking_sessions table"""
+    engine = create_engine(settings.DATABASE_URL)
+
+    with engine.connect() as conn:
+        conn.execute(text("""
+            ALTER TABLE tracking_sessions
+            DROP COLUMN IF EXISTS track
+        """))
+
+        conn.commit()
+        print("Successfully removed track column from tracking_sessions table")
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) > 1 and sys.argv[1] == "downgrade":
+        downgrade()
+    else:
+        upgrade()
@@ -12,6 +12,9 @@ Usage:
     # Set custom notification threshold (default: 24 hours)
     python run_matching_job.py --hours 12
 
+    # Shard routes across 8 worker processes
+    python run_matching_job.py --workers 8
+
     # Run with verbose output
     python run_matching_job.py -v
 
@@ -63,6 +66,12 @@ def main():
         default=24,
         help="Don't re-notify about same package within this many hours (default: 24)"
     )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Worker processes to shard routes across (default: MATCHING_JOB_WORKERS)"
+    )
     parser.add_argument(
         "-v", "--verbose",
         action="store_true",
@@ -86,7 +95,8 @@ def main():
     try:
         results = run_matching_job(
             notify_hours_threshold=args.hours,
-            dry_run=args.dry_run
+            dry_run=args.dry_run,
+            workers=args.workers
         )
 
         if args.json:
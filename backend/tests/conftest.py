@@ -1,4 +1,6 @@
+import itertools
 import os
+from datetime import datetime
 
 import pytest
 from fastapi.testclient import TestClient
@@ -15,6 +17,14 @@ os.environ.setdefault("ENVIRONMENT", "test")
 
 from app.models.base import Base
 from app.database import get_db
+from app.models.package import CourierRoute, Package, PackageSize, PackageStatus
+from app.models.tracking import TrackingSession
+from app.models.user import User, UserRole
+from app.services.change_feed import package_changes, route_changes
+from app.services.package_snapshot import open_package_snapshot
+from app.services.spatial_index import package_index, route_index
+from app.services.tracking_context import tracking_context
+from app.utils.polyline import encode_polyline
 from main import app
 
 engine = create_engine(
@@ -40,6 +50,156 @@ def db_session():
         Base.metadata.drop_all(bind=engine)
 
 
+class ModelFactory:
+    """Creates committed users, packages, routes and tracking sessions with test defaults."""
+
+    SF, SJ = (37.7749, -122.4194), (37.3382, -121.8863)
+    PALO_ALTO, MOUNTAIN_VIEW = (37.4419, -122.1430), (37.3861, -122.0839)
+
+    def __init__(self, db):
+        self.db = db
+        self._numbers = itertools.count(1)
+
+    def using(self, db):
+        """The same factory writing to another session."""
+        return ModelFactory(db)
+
+    def _commit(self, instance):
+        self.db.add(instance)
+        self.db.commit()
+        return instance
+
+    def user(self, role=UserRole.COURIER, **overrides):
+        role = UserRole(role)
+        number = next(self._numbers)
+        data = dict(
+            email=f"{role.value}{number}@factory.test",
+            hashed_password="hashed",
+            full_name=f"Test {role.value.title()} {number}",
+            role=role,
+            is_active=True,
+            is_verified=True
+        )
+        data.update(overrides)
+        return self._commit(User(**data))
+
+    def package(self, sender, pickup=PALO_ALTO, dropoff=MOUNTAIN_VIEW, **overrides):
+        """An open package of sender's from pickup to dropoff ((lat, lng) pairs)."""
+        data = dict(
+            tracking_id=generate_tracking_id(),
+            sender_id=sender.id,
+            description="Test package",
+            size=PackageSize.SMALL,
+            weight_kg=1.0,
+            pickup_address="Pickup",
+            pickup_lat=pickup[0],
+            pickup_lng=pickup[1],
+            dropoff_address="Dropoff",
+            dropoff_lat=dropoff[0],
+            dropoff_lng=dropoff[1],
+            status=PackageStatus.OPEN_FOR_BIDS,
+            is_active=True
+        )
+        data.update(overrides)
+        return self._commit(Package(**data))
+
+    def route(self, courier, start=SF, end=SJ, waypoints=None, **overrides):
+        """An active route of courier's; waypoints are (lat, lng) pairs."""
+        data = dict(
+            courier_id=courier.id,
+            start_address="Start",
+            start_lat=start[0],
+            start_lng=start[1],
+            end_address="End",
+            end_lat=end[0],
+            end_lng=end[1],
+            waypoints=encode_polyline(waypoints) if waypoints else None,
+            max_deviation_km=10,
+            is_active=True
+        )
+        data.update(overrides)
+        return self._commit(CourierRoute(**data))
+
+    def tracking_session(self, package, **overrides):
+        """An active tracking session of the package's courier."""
+        data = dict(
+            package_id=package.id,
+            courier_id=package.courier_id,
+            is_active=True,
+            started_at=datetime.utcnow()
+        )
+        data.update(overrides)
+        return self._commit(TrackingSession(**data))
+
+
+@pytest.fixture
+def factory(db_session):
+    """ModelFactory on the test database session"""
+    return ModelFactory(db_session)
+
+
+@pytest.fixture
+def sender(factory):
+    """A verified sender"""
+    return factory.user(UserRole.SENDER)
+
+
+@pytest.fixture
+def courier(factory):
+    """A verified courier"""
+    return factory.user(UserRole.COURIER)
+
+
+@pytest.fixture(autouse=True)
+def clear_tracking_context():
+    """Forget cached tracking-session context; session ids are reused across tests"""
+    tracking_context.clear()
+    yield
+    tracking_context.clear()
+
+
+class FakeStreams:
+    """In-memory stand-in for the Redis stream commands the change feed uses."""
+
+    def __init__(self):
+        self.streams = {}
+        self._numbers = itertools.count(1)
+
+    @staticmethod
+    def _number(entry_id):
+        return int(entry_id.split("-")[0])
+
+    def xadd(self, name, fields, maxlen=None, approximate=True):
+        entry_id = f"{next(self._numbers)}-0"
+        entries = self.streams.setdefault(name, [])
+        entries.append((entry_id, dict(fields)))
+        if maxlen is not None:
+            del entries[:-maxlen]
+        return entry_id
+
+    def xrange(self, name, min="-", max="+", count=None):
+        start = 0 if min == "-" else self._number(min)
+        entries = [entry for entry in self.streams.get(name, []) if self._number(entry[0]) >= start]
+        return entries[:count]
+
+    def xrevrange(self, name, max="+", min="-", count=None):
+        return list(reversed(self.streams.get(name, [])))[:count]
+
+
+@pytest.fixture
+def change_feed(monkeypatch):
+    """Change feeds on an in-memory Redis, with the shared indexes and snapshot reloaded around the test"""
+    streams = FakeStreams()
+    for feed in (package_changes, route_changes):
+        monkeypatch.setattr(feed, "_sync_client", streams)
+        monkeypatch.setattr(feed, "_unavailable_until", 0.0)
+    for shared in (package_index, route_index, open_package_snapshot):
+        shared.clear()
+    yield streams
+    for shared in (package_index, route_index, open_package_snapshot):
+        shared.clear()
+
+
 @pytest.fixture(scope="function")
 def client(db_session):
     """Create a test client with dependency override"""
@@ -0,0 +1,216 @@
+"""Tests for the global batch assignment of packages to routes."""
+import itertools
+import random
+
+import pytest
+from fastapi import status
+
+from app.models.user import User, UserRole
+from app.models.package import Package, PackageStatus, PackageSize, CourierRoute
+from app.utils.auth import get_password_hash
+from app.utils.tracking_id import generate_tracking_id
+from app.services.batch_assignment import run_batch_assignment_job, solve_assignment
+
+
+def best_by_brute_force(edges):
+    """(assigned pairs, total detour) of the best assignment: most pairs, then least detour."""
+    routes = sorted({r for r, _, _ in edges})
+    options = {r: [(p, c) for rr, p, c in edges if rr == r] + [(None, 0.0)] for r in routes}
+    best = None
+    for choice in itertools.product(*(options[r] for r in routes)):
+        packages = [p for p, _ in choice if p is not None]
+        if len(packages) != len(set(packages)):
+            continue
+        key = (-len(packages), round(sum(c for _, c in choice), 2))
+        best = key if best is None or key < best else best
+    return best
+
+
+class TestSolveAssignment:
+    """Tests for the sparse auction solver."""
+
+    def test_matches_brute_force(self):
+        """Small random instances get the most pairs with the least total detour."""
+        for seed in range(60):
+            rng = random.Random(seed)
+            edges = [
+                (r, 100 + p, round(rng.uniform(0, 20), 2))
+                for r in range(rng.randint(1, 5))
+                for p in range(rng.randint(1, 5))
+                if rng.random() < 0.5
+            ]
+            if not edges:
+                continue
+            detours = {(r, p): c for r, p, c in edges}
+
+            pairs = solve_assignment(*zip(*edges))
+
+            assert len({p for _, p in pairs}) == len(pairs) == len({r for r, _ in pairs})
+            key = (-len(pairs), round(sum(detours[pair] for pair in pairs), 2))
+            assert key == best_by_brute_force(edges)
+
+    def test_prefers_more_pairs_over_shorter_detours(self):
+        """A route gives up its best package when that lets another route get one."""
+        pairs = solve_assignment([1, 1, 2], [10, 11, 10], [0.5, 9.0, 3.0])
+
+        assert pairs == [(1, 11), (2, 10)]
+
+    def test_empty(self):
+        """No candidates means no assignment."""
+        assert solve_assignment([], [], []) == []
+
+    def test_large_sparse_instance(self):
+        """Thousands of routes and packages with a few candidates each are solved consistently."""
+        rng = random.Random(1)
+        edges = {}
+        for r in range(2000):
+            for _ in range(8):
+                edges[(r, (r + rng.randint(-40, 40)) % 1500)] = round(rng.uniform(0, 15), 2)
+
+        pairs = solve_assignment(
+            [r for r, _ in edges], [p for _, p in edges], list(edges.values())
+        )
+
+        assert len({p for _, p in pairs}) == len(pairs)
+        assert all(pair in edges for pair in pairs)
+        assert len(pairs) >= 1400
+
+
+class TestBatchAssignmentJob:
+    """Tests for the batch assignment job and admin endpoint."""
+
+    @pytest.fixture
+    def contested(self, db_session):
+        """Two routes that both match the package nearest to their start."""
+        sender = User(
+            email="assign_sender@test.com",
+            hashed_password=get_password_hash("password123"),
+            full_name="Assign Sender",
+            role=UserRole.SENDER,
+            is_active=True,
+            is_verified=True
+        )
+        db_session.add(sender)
+        couriers = [
+            User(
+                email=f"assign_courier{i}@test.com",
+                hashed_password=get_password_hash("password123"),
+                full_name=f"Assign Courier {i}",
+                role=UserRole.COURIER,
+                is_active=True,
+                is_verified=True
+            )
+            for i in range(2)
+        ]
+        db_session.add_all(couriers)
+        db_session.commit()
+
+        routes = [
+            CourierRoute(
+                courier_id=courier.id,
+                start_address="San Francisco, CA",
+                start_lat=37.7749,
+                start_lng=-122.4194,
+                end_address="San Jose, CA",
+                end_lat=37.3382,
+                end_lng=-121.8863,
+                max_deviation_km=10,
+                is_active=True
+            )
+            for courier in couriers
+        ]
+        db_session.add_all(routes)
+
+        packages = [
+            Package(
+                tracking_id=generate_tracking_id(),
+                sender_id=sender.id,
+                description=f"Assign package {i}",
+                size=PackageSize.SMALL,
+                weight_kg=1.0,
+                pickup_address="Palo Alto, CA",
+                pickup_lat=37.4419 + 0.01 * i,
+                pickup_lng=-122.1430,
+                dropoff_address="Mountain View, CA",
+                dropoff_lat=37.3861,
+                dropoff_lng=-122.0839,
+                status=PackageStatus.OPEN_FOR_BIDS,
+                is_active=True
+            )
+            for i in range(3)
+        ]
+        db_session.add_all(packages)
+        db_session.commit()
+        return routes, packages
+
+    def test_assigns_each_package_once(self, db_session, contested):
+        """Every route gets a different package and nothing is written."""
+        routes, packages = contested
+
+        results = run_batch_assignment_job(db=db_session)
+
+        assert results['routes_considered'] == 2
+        assert results['candidate_pairs'] == 6
+        assert results['assignments_made'] == 2
+        assert sorted(a['route_id'] for a in results['assignments']) == sorted(r.id for r in routes)
+        assert len({a['package_id'] for a in results['assignments']}) == 2
+        assert results['total_detour_km'] == pytest.approx(
+            sum(a['detour_km'] for a in results['assignments']), abs=0.01
+        )
+        assert db_session.query(Package).filter(Package.courier_id.isnot(None)).count() == 0
+
+    def test_own_packages_are_not_assigned(self, db_session, contested):
+        """A courier's route is never paired with a package that courier sent."""
+        routes, packages = contested
+        own = Package(
+            tracking_id=generate_tracking_id(),
+            sender_id=routes[0].courier_id,
+            description="Courier's own package",
+            size=PackageSize.SMALL,
+            weight_kg=1.0,
+            pickup_address="San Francisco, CA",
+            pickup_lat=37.7749,
+            pickup_lng=-122.4194,
+            dropoff_address="San Jose, CA",
+            dropoff_lat=37.3382,
+            dropoff_lng=-121.8863,
+            status=PackageStatus.OPEN_FOR_BIDS,
+            is_active=True
+        )
+        db_session.add(own)
+        db_session.commit()
+
+        results = run_batch_assignment_job(db=db_session)
+
+        # The other courier's route may still take it
+        assert results['candidate_pairs'] == 3 + 4
+        assert results['assignments_made'] == 2
+        assert all(
+            a['package_id'] != own.id for a in results['assignments'] if a['route_id'] == routes[0].id
+        )
+
+    def test_candidate_limit(self, db_session, contested):
+        """Only the shortest-detour candidates of each route are considered."""
+        results = run_batch_assignment_job(max_candidates_per_route=1, db=db_session)
+
+        assert results['candidate_pairs'] == 2
+        assert results['assignments_made'] == 1
+
+    def test_admin_endpoint(self, client, authenticated_admin, authenticated_courier, contested):
+        """Admins get suggestions; other users are rejected."""
+        response = client.post(
+            "/api/admin/jobs/run-assignment",
+            json={},
+            headers={"Authorization": f"Bearer {authenticated_admin}"}
+        )
+        assert response.status_code == status.HTTP_200_OK
+        data = response.json()
+        assert data['assignments_made'] == 2
+        assert all(a['tracking_id'] for a in data['assignments'])
+
+        response = client.post(
+            "/api/admin/jobs/run-assignment",
+            json={},
+            headers={"Authorization": f"Bearer {authenticated_courier}"}
+        )
+        assert response.status_code == status.HTTP_403_FORBIDDEN
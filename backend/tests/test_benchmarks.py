@@ -0,0 +1,90 @@
+"""Tests for the matching benchmark harness and dataset generator."""
+import random
+from datetime import datetime, timezone
+
+import pytest
+
+from app.models.package import Package
+from app.utils.geo import haversine_distance
+from app.utils.tracking_id import is_valid_tracking_id
+from benchmarks.cases import bench_match_package, bench_match_route
+from benchmarks.dataset import METRO_AREAS, DatasetGenerator, benchmark_tracking_id, dataset_size, generate_dataset
+from benchmarks.harness import compare, summarize
+
+
+class TestHarness:
+    """Tests for latency summaries and baseline comparison."""
+
+    def test_summarize_percentiles(self):
+        """Percentiles and throughput are computed from per-call durations."""
+        summary = summarize([0.001] * 98 + [0.1, 0.2], items=500)
+
+        assert summary["samples"] == 100
+        assert summary["p50_ms"] == pytest.approx(1.0)
+        assert summary["p99_ms"] > summary["p95_ms"] >= summary["p50_ms"]
+        assert summary["ops_per_s"] == pytest.approx(100 / 0.398, rel=1e-3)
+        assert summary["items_per_s"] == pytest.approx(500 / 0.398, rel=1e-3)
+
+    def test_compare_flags_regressions(self):
+        """Only cases whose p95 grew beyond the tolerance are flagged."""
+        baseline = {"results": {"fast": {"p95_ms": 10.0}, "slow": {"p95_ms": 10.0}}}
+        report = {"results": {
+            "fast": {"p95_ms": 11.0},
+            "slow": {"p95_ms": 15.0},
+            "new": {"p95_ms": 1.0},
+        }}
+
+        rows = {row["case"]: row for row in compare(report, baseline, tolerance=0.25)}
+
+        assert set(rows) == {"fast", "slow"}
+        assert rows["fast"]["regressed"] is False
+        assert rows["slow"]["regressed"] is True
+        assert rows["slow"]["change"] == 0.5
+
+
+class TestDataset:
+    """Tests for the synthetic dataset generator."""
+
+    def test_tracking_ids_valid_and_unique(self):
+        """Generated tracking IDs use the production format."""
+        ids = [benchmark_tracking_id(n) for n in (0, 1, 35, 36, 10 ** 6)]
+
+        assert all(is_valid_tracking_id(tracking_id) for tracking_id in ids)
+        assert len(set(ids)) == len(ids)
+
+    def test_generates_clustered_rows(self, db_session):
+        """Pickups cluster around metro areas and counts match the request."""
+        stats = generate_dataset(db_session, packages=300, routes=40, seed=7)
+
+        assert stats["packages"] == 300 and stats["routes"] == 40
+        assert dataset_size(db_session) == {"packages": 300, "routes": 40}
+
+        for package in db_session.query(Package).all():
+            nearest = min(
+                haversine_distance(package.pickup_lat, package.pickup_lng, lat, lng)
+                for _, lat, lng, _ in METRO_AREAS
+            )
+            assert nearest < 150
+
+    def test_seed_is_deterministic(self):
+        """The same seed produces the same rows."""
+        now = datetime(2026, 1, 1, tzinfo=timezone.utc)
+        first, second = DatasetGenerator(seed=3), DatasetGenerator(seed=3)
+
+        assert [first.route(n, 1, now) for n in range(10)] == [second.route(n, 1, now) for n in range(10)]
+        assert [first.package(n, 1) for n in range(10)] == [second.package(n, 1) for n in range(10)]
+
+
+class TestCases:
+    """Smoke tests that benchmark cases run against a generated dataset."""
+
+    def test_engine_cases(self, db_session):
+        """Engine cases report latency and the matches they found."""
+        generate_dataset(db_session, packages=500, routes=50, seed=11)
+
+        forward = bench_match_route(db_session, random.Random(1), 10)
+        reverse = bench_match_package(db_session, random.Random(1), 10)
+
+        assert forward["samples"] == 10 and reverse["samples"] == 10
+        assert forward["p50_ms"] > 0
+        assert forward.get("items_per_s", 0) > 0
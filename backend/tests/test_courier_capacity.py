@@ -0,0 +1,148 @@
+"""Tests for courier vehicle capacity in package-route matching."""
+import pytest
+from fastapi import status
+
+from app.config import settings
+from app.models.package import PackageStatus, PackageSize
+from app.services.courier_capacity import CourierCapacity, courier_capacities, courier_capacity
+from app.services.matching_engine import MatchingEngine, BoundingBoxPrefilter, FullScanPrefilter
+from app.services.package_snapshot import PackageSnapshot, route_spec
+from app.services.spatial_index import PackageSpatialIndex, package_index, route_index
+
+
+@pytest.fixture(autouse=True)
+def fresh_indexes():
+    package_index.clear()
+    route_index.clear()
+    yield
+    package_index.clear()
+    route_index.clear()
+
+
+class TestCourierCapacities:
+    """Tests for remaining capacity lookups."""
+
+    def test_unset_limits_are_unlimited(self, db_session, factory):
+        """Couriers without vehicle limits can carry anything."""
+        courier = factory.user()
+
+        capacity = courier_capacity(db_session, courier.id)
+
+        assert capacity.unlimited
+        assert capacity.can_carry(500.0, PackageSize.EXTRA_LARGE)
+
+    def test_committed_packages_reduce_weight(self, db_session, factory, sender):
+        """Packages pending pickup or in transit use up the weight limit; others do not."""
+        courier = factory.user(vehicle_max_weight_kg=20.0, vehicle_max_size=PackageSize.MEDIUM)
+        factory.package(sender, weight_kg=5.0, courier_id=courier.id, status=PackageStatus.PENDING_PICKUP)
+        factory.package(sender, weight_kg=4.0, courier_id=courier.id, status=PackageStatus.IN_TRANSIT)
+        factory.package(sender, weight_kg=8.0, courier_id=courier.id, status=PackageStatus.DELIVERED)
+        other = factory.user(vehicle_max_weight_kg=20.0)
+
+        capacities = courier_capacities(db_session, [courier.id, other.id])
+
+        assert capacities[courier.id] == CourierCapacity(11.0, PackageSize.MEDIUM)
+        assert capacities[other.id].max_weight_kg == 20.0
+        assert capacities[courier.id].can_carry(11.0, PackageSize.MEDIUM)
+        assert not capacities[courier.id].can_carry(11.5, PackageSize.SMALL)
+        assert not capacities[courier.id].can_carry(1.0, PackageSize.LARGE)
+
+
+    def test_lookups_are_batched(self, db_session, factory, sender, monkeypatch):
+        """Couriers are looked up ID_BATCH_SIZE at a time with the same results."""
+        couriers = [factory.user(vehicle_max_weight_kg=10.0 + i) for i in range(5)]
+        for courier in couriers:
+            factory.package(sender, weight_kg=2.0, courier_id=courier.id, status=PackageStatus.IN_TRANSIT)
+        monkeypatch.setattr("app.services.spatial_index.ID_BATCH_SIZE", 2)
+
+        capacities = courier_capacities(db_session, [courier.id for courier in couriers])
+
+        assert [capacities[courier.id].max_weight_kg for courier in couriers] == [8.0, 9.0, 10.0, 11.0, 12.0]
+
+
+class TestCapacityFiltering:
+    """Tests that matching drops packages beyond the courier's capacity."""
+
+    def test_index_filters_by_capacity(self):
+        """Corridor queries skip packages too heavy or too large for the courier."""
+        index = PackageSpatialIndex(cell_deg=0.05)
+        index.upsert(1, 37.4419, -122.1430, 37.3861, -122.0839, 2.0, PackageSize.SMALL)
+        index.upsert(2, 37.4419, -122.1430, 37.3861, -122.0839, 30.0, PackageSize.SMALL)
+        index.upsert(3, 37.4419, -122.1430, 37.3861, -122.0839, 2.0, PackageSize.LARGE)
+        corridor = (37.7749, -122.4194, 37.3382, -121.8863, 10)
+
+        assert index.query_corridor(*corridor) == {1, 2, 3}
+        assert index.query_corridor(*corridor, CourierCapacity(10.0, PackageSize.MEDIUM)) == {1}
+
+    @pytest.mark.parametrize("prefilter", [None, BoundingBoxPrefilter(), FullScanPrefilter()])
+    def test_match_route_respects_capacity(self, db_session, factory, sender, prefilter):
+        """Every prefilter leaves out packages the courier has no room for."""
+        courier = factory.user(vehicle_max_weight_kg=10.0, vehicle_max_size=PackageSize.MEDIUM)
+        route = factory.route(courier)
+        factory.package(sender, weight_kg=6.0, courier_id=courier.id, status=PackageStatus.PENDING_PICKUP)
+        fits = factory.package(sender, weight_kg=3.0, size=PackageSize.MEDIUM)
+        factory.package(sender, weight_kg=5.0)  # Over the remaining 4 kg
+        factory.package(sender, weight_kg=1.0, size=PackageSize.LARGE)
+
+        matches = MatchingEngine(prefilter=prefilter).match_route(db_session, route)
+
+        assert [m['package'].id for m in matches] == [fits.id]
+
+    def test_snapshot_respects_capacity(self, db_session, factory, sender):
+        """The matching job's snapshot applies the same capacity filter."""
+        courier = factory.user(vehicle_max_weight_kg=3.0, vehicle_max_size=PackageSize.SMALL)
+        route = factory.route(courier)
+        fits = factory.package(sender, weight_kg=2.0)
+        factory.package(sender, weight_kg=4.0)
+        factory.package(sender, weight_kg=1.0, size=PackageSize.MEDIUM)
+
+        snapshot = PackageSnapshot.load(db_session)
+        matches = snapshot.match_route(route_spec(route, courier_capacity(db_session, courier.id)))
+
+        assert [m[0] for m in matches] == [fits.id]
+        assert len(snapshot.match_route(route_spec(route))) == 3
+
+    @pytest.mark.parametrize("index_enabled", [True, False])
+    def test_match_package_skips_full_couriers(self, db_session, factory, sender, monkeypatch, index_enabled):
+        """Reverse matching only returns routes whose courier can carry the package."""
+        monkeypatch.setattr(settings, "MATCHING_INDEX_ENABLED", index_enabled)
+        roomy = factory.route(factory.user(vehicle_max_weight_kg=100.0))
+        full = factory.user(vehicle_max_weight_kg=10.0)
+        factory.route(full)
+        factory.package(sender, weight_kg=9.0, courier_id=full.id, status=PackageStatus.IN_TRANSIT)
+        package = factory.package(sender, weight_kg=5.0)
+
+        matches = MatchingEngine().match_package(db_session, package)
+
+        assert [m['route'].id for m in matches] == [roomy.id]
+
+
+class TestVehicleCapacityProfile:
+    """Tests for setting vehicle limits on the courier profile."""
+
+    def test_update_and_clear_limits(self, client, authenticated_courier):
+        """Limits can be set through PUT /api/auth/me and removed with null."""
+        headers = {"Authorization": f"Bearer {authenticated_courier}"}
+
+        response = client.put(
+            "/api/auth/me",
+            json={"vehicle_max_weight_kg": 25.5, "vehicle_max_size": "medium"},
+            headers=headers
+        )
+        assert response.status_code == status.HTTP_200_OK
+        assert response.json()["vehicle_max_weight_kg"] == 25.5
+        assert response.json()["vehicle_max_size"] == "medium"
+
+        response = client.put("/api/auth/me", json={"full_name": "Renamed"}, headers=headers)
+        assert response.json()["vehicle_max_size"] == "medium"
+
+        response = client.put("/api/auth/me", json={"vehicle_max_size": None}, headers=headers)
+        assert response.json()["vehicle_max_size"] is None
+        assert response.json()["vehicle_max_weight_kg"] == 25.5
+
+    def test_rejects_invalid_limits(self, client, authenticated_courier):
+        """Non-positive weights and unknown size classes are rejected."""
+        headers = {"Authorization": f"Bearer {authenticated_courier}"}
+
+        assert client.put("/api/auth/me", json={"vehicle_max_weight_kg": 0}, headers=headers).status_code == 422
+        assert client.put("/api/auth/me", json={"vehicle_max_size": "huge"}, headers=headers).status_code == 422
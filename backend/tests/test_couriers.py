@@ -150,6 +150,98 @@ class TestCreateRoute:
         assert get_response2.json()["is_active"] is True
 
 
+class TestRouteWaypoints:
+    """Tests for routes with intermediate waypoints"""
+
+    def test_create_route_with_waypoints(self, client, authenticated_courier, test_route_data, db_session):
+        """Waypoints are stored as an encoded polyline and returned in order"""
+        waypoints = [{"lat": 41.3083, "lng": -72.9279}, {"lat": 41.8240, "lng": -71.4128}]
+        response = client.post(
+            "/api/couriers/routes",
+            json={**test_route_data, "waypoints": waypoints},
+            headers={"Authorization": f"Bearer {authenticated_courier}"}
+        )
+
+        assert response.status_code == status.HTTP_201_CREATED
+        data = response.json()
+        assert data["waypoints"] == waypoints
+
+        route = db_session.query(CourierRoute).filter(CourierRoute.id == data["id"]).first()
+        assert isinstance(route.waypoints, str)
+
+    def test_create_route_without_waypoints(self, client, authenticated_courier, test_route_data, db_session):
+        """Routes without waypoints stay straight lines"""
+        response = client.post(
+            "/api/couriers/routes",
+            json=test_route_data,
+            headers={"Authorization": f"Bearer {authenticated_courier}"}
+        )
+
+        assert response.status_code == status.HTTP_201_CREATED
+        assert response.json()["waypoints"] == []
+        route = db_session.query(CourierRoute).filter(CourierRoute.id == response.json()["id"]).first()
+        assert route.waypoints is None
+
+    def test_create_route_invalid_waypoint(self, client, authenticated_courier, test_route_data):
+        """Waypoint coordinates are range-checked"""
+        response = client.post(
+            "/api/couriers/routes",
+            json={**test_route_data, "waypoints": [{"lat": 91, "lng": -72.9}]},
+            headers={"Authorization": f"Bearer {authenticated_courier}"}
+        )
+
+        assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+    def test_update_clears_waypoints(self, client, authenticated_courier, test_route_data):
+        """An empty waypoints list turns the route back into a straight line"""
+        created = client.post(
+            "/api/couriers/routes",
+            json={**test_route_data, "waypoints": [{"lat": 41.3083, "lng": -72.9279}]},
+            headers={"Authorization": f"Bearer {authenticated_courier}"}
+        ).json()
+
+        response = client.put(
+            f"/api/couriers/routes/{created['id']}",
+            json={"waypoints": []},
+            headers={"Authorization": f"Bearer {authenticated_courier}"}
+        )
+
+        assert response.status_code == status.HTTP_200_OK
+        assert response.json()["waypoints"] == []
+
+    def test_create_route_stores_corridor(self, client, authenticated_courier, test_route_data, db_session):
+        """The route's corridor geometry is computed and stored on create"""
+        waypoints = [{"lat": 41.3083, "lng": -72.9279}]
+        response = client.post(
+            "/api/couriers/routes",
+            json={**test_route_data, "waypoints": waypoints},
+            headers={"Authorization": f"Bearer {authenticated_courier}"}
+        )
+
+        route = db_session.query(CourierRoute).filter(CourierRoute.id == response.json()["id"]).first()
+        assert route.corridor["path_lat"] == [test_route_data["start_lat"], 41.3083, test_route_data["end_lat"]]
+        assert len(route.corridor["unit_lat"]) == 2
+
+    def test_update_route_refreshes_corridor(self, client, authenticated_courier, test_route_data, db_session):
+        """Changing the route's geometry recomputes its stored corridor"""
+        created = client.post(
+            "/api/couriers/routes",
+            json={**test_route_data, "waypoints": [{"lat": 41.3083, "lng": -72.9279}]},
+            headers={"Authorization": f"Bearer {authenticated_courier}"}
+        ).json()
+
+        client.put(
+            f"/api/couriers/routes/{created['id']}",
+            json={"waypoints": [], "max_deviation_km": 20},
+            headers={"Authorization": f"Bearer {authenticated_courier}"}
+        )
+
+        db_session.expire_all()
+        route = db_session.query(CourierRoute).filter(CourierRoute.id == created["id"]).first()
+        assert len(route.corridor["path_lat"]) == 2
+        assert route.corridor["source"][4] == 20
+
+
 class TestCoordinateValidation:
     """Tests for coordinate validation"""
 
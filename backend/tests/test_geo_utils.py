@@ -2,12 +2,28 @@
 
 import pytest
 import math
+import numpy as np
+from shapely.geometry import LineString, Point
+from shapely.ops import nearest_points
 
 from app.utils.geo import (
     haversine_distance,
     point_to_line_distance,
     calculate_detour_distance,
-    is_package_along_route
+    is_package_along_route,
+    HAVERSINE_MAX_RELATIVE_ERROR,
+    haversine_distance_batch,
+    geodesic_distance_batch,
+    distance_batch,
+    point_to_line_distance_batch,
+    calculate_detour_distance_batch,
+    nearest_point_on_segment_batch,
+    nearest_point_on_polyline_batch,
+    route_corridor_distances_batch,
+    polyline_corridor_distances_batch,
+    DistanceCache,
+    distance_cache,
+    distance_matrix,
 )
 
 
@@ -348,3 +364,314 @@ class TestIsPackageAlongRoute:
         )
 
         assert result is False
+
+
+class TestBatchDistances:
+    """Tests for the vectorized distance kernels"""
+
+    @pytest.fixture
+    def random_pairs(self):
+        rng = np.random.default_rng(7)
+        lat1 = rng.uniform(-80, 80, 300)
+        lng1 = rng.uniform(-180, 180, 300)
+        # Mix of short (city-scale) and long distances
+        lat2 = np.where(np.arange(300) % 2 == 0, lat1 + rng.uniform(-0.3, 0.3, 300), rng.uniform(-80, 80, 300))
+        lng2 = np.where(np.arange(300) % 2 == 0, lng1 + rng.uniform(-0.3, 0.3, 300), rng.uniform(-180, 180, 300))
+        return lat1, lng1, lat2, lng2
+
+    def test_geodesic_batch_matches_scalar(self, random_pairs):
+        """Exact batch mode returns the same values as haversine_distance()"""
+        lat1, lng1, lat2, lng2 = random_pairs
+        batch = geodesic_distance_batch(lat1, lng1, lat2, lng2)
+        expected = [haversine_distance(*args) for args in zip(lat1, lng1, lat2, lng2)]
+        assert batch == pytest.approx(expected)
+
+    def test_fast_mode_within_error_bound(self, random_pairs):
+        """Fast mode stays within the documented error bound of the geodesic"""
+        lat1, lng1, lat2, lng2 = random_pairs
+        fast = distance_batch(lat1, lng1, lat2, lng2, fast=True)
+        exact = distance_batch(lat1, lng1, lat2, lng2, fast=False)
+        relative_error = np.abs(fast - exact) / exact
+        assert relative_error.max() <= HAVERSINE_MAX_RELATIVE_ERROR
+
+    def test_scalar_broadcast(self):
+        """A single origin broadcasts against an array of destinations"""
+        distances = haversine_distance_batch(40.7128, -74.0060, [40.7128, 34.0522], [-74.0060, -118.2437])
+        assert distances.shape == (2,)
+        assert distances[0] == pytest.approx(0, abs=1e-9)
+        assert distances[1] == pytest.approx(3940, rel=0.05)
+
+    def test_empty_input(self):
+        """Empty arrays produce empty results"""
+        assert geodesic_distance_batch([], [], [], []).shape == (0,)
+        assert haversine_distance_batch([], [], [], []).shape == (0,)
+
+
+class TestBatchRouteGeometry:
+    """Tests for batched point-to-route and detour computation"""
+
+    route = (37.7749, -122.4194, 37.3382, -121.8863)  # San Francisco -> San Jose
+
+    def test_point_to_line_batch_close_to_scalar(self):
+        """Cross-track batch agrees with point_to_line_distance() for points beside the route"""
+        lats = np.array([37.6, 37.5, 37.4419])
+        lngs = np.array([-122.3, -122.1, -122.1430])
+        batch = point_to_line_distance_batch(lats, lngs, *self.route)
+        expected = [point_to_line_distance(lat, lng, *self.route) for lat, lng in zip(lats, lngs)]
+        assert batch == pytest.approx(expected, rel=0.01, abs=0.05)
+
+    def test_point_behind_start_uses_start_distance(self):
+        """Points before the start of the segment are measured to the start"""
+        lat, lng = 37.9, -122.6  # North-west of San Francisco
+        batch = point_to_line_distance_batch([lat], [lng], *self.route)
+        assert batch[0] == pytest.approx(
+            haversine_distance(self.route[0], self.route[1], lat, lng), rel=0.01
+        )
+
+    def test_detour_batch_matches_scalar(self):
+        """Exact detour batch matches calculate_detour_distance()"""
+        detour, total = calculate_detour_distance_batch(
+            *self.route, [37.4419], [-122.1430], [37.3861], [-122.0839]
+        )
+        expected_detour, expected_total = calculate_detour_distance(
+            *self.route, 37.4419, -122.1430, 37.3861, -122.0839
+        )
+        assert detour[0] == pytest.approx(expected_detour)
+        assert total[0] == pytest.approx(expected_total)
+
+    def test_nearest_point_matches_shapely(self):
+        """Planar projection matches shapely nearest_points"""
+        line = LineString([(self.route[1], self.route[0]), (self.route[3], self.route[2])])
+        lats = np.array([37.4419, 38.5816, 37.0])
+        lngs = np.array([-122.1430, -121.4944, -121.5])
+        near_lat, near_lng = nearest_point_on_segment_batch(lats, lngs, *self.route)
+        for i in range(len(lats)):
+            nearest = nearest_points(line, Point(lngs[i], lats[i]))[0]
+            assert near_lat[i] == pytest.approx(nearest.y)
+            assert near_lng[i] == pytest.approx(nearest.x)
+
+    def test_corridor_distances_screen_far_packages(self):
+        """Packages clearly outside max_distance_km are reported as infinity"""
+        pickup_d, dropoff_d, detour = route_corridor_distances_batch(
+            *self.route,
+            [37.4419, 38.5816], [-122.1430, -121.4944],
+            [37.3861, 38.5449], [-122.0839, -121.7405],
+            max_distance_km=10
+        )
+        assert np.isfinite(pickup_d[0]) and np.isfinite(detour[0])
+        assert np.isinf(pickup_d[1]) and np.isinf(detour[1])
+
+    def test_corridor_fast_mode_close_to_exact(self):
+        """Fast corridor distances are within the error bound of exact ones"""
+        args = (*self.route, [37.4419], [-122.1430], [37.3861], [-122.0839])
+        exact = route_corridor_distances_batch(*args)
+        fast = route_corridor_distances_batch(*args, fast=True)
+        for e, f in zip(exact, fast):
+            assert f[0] == pytest.approx(e[0], rel=HAVERSINE_MAX_RELATIVE_ERROR)
+
+    def test_corridor_distances_many_routes_one_package(self):
+        """One package scored against many routes matches per-route results"""
+        routes = [self.route, (37.8044, -122.2712, 37.3382, -121.8863), (37.0, -122.0, 37.0, -122.0)]
+        starts_lat, starts_lng, ends_lat, ends_lng = (list(c) for c in zip(*routes))
+        pickup_d, dropoff_d, detour = route_corridor_distances_batch(
+            starts_lat, starts_lng, ends_lat, ends_lng,
+            37.4419, -122.1430, 37.3861, -122.0839,
+            max_distance_km=[10, 50, 100]
+        )
+        for i, route in enumerate(routes):
+            expected = route_corridor_distances_batch(
+                *route, [37.4419], [-122.1430], [37.3861], [-122.0839]
+            )
+            assert pickup_d[i] == pytest.approx(expected[0][0])
+            assert dropoff_d[i] == pytest.approx(expected[1][0])
+            assert detour[i] == pytest.approx(expected[2][0])
+
+
+class TestPolylineCorridor:
+    """Tests for distances to routes with waypoints"""
+
+    # South, then east: an L-shaped route whose straight line cuts the corner
+    path = ((37.0, 37.5, 37.5), (-122.0, -122.0, -121.5))
+
+    def test_two_vertex_path_matches_segment(self):
+        """A path without waypoints gives the same results as the segment kernel"""
+        route = (37.7749, -122.4194, 37.3382, -121.8863)
+        args = ([37.4419, 38.5816], [-122.1430, -121.4944], [37.3861, 38.5449], [-122.0839, -121.7405])
+        expected = route_corridor_distances_batch(*route, *args, max_distance_km=10)
+        result = polyline_corridor_distances_batch(
+            (route[0], route[2]), (route[1], route[3]), *args, max_distance_km=10
+        )
+        for e, r in zip(expected, result):
+            assert r == pytest.approx(e)
+
+    def test_nearest_point_matches_shapely(self):
+        """Projection onto a polyline matches shapely for points clearly nearest one leg"""
+        line = LineString(list(zip(self.path[1], self.path[0])))
+        lats = np.array([37.2, 37.6, 37.48, 36.9])
+        lngs = np.array([-122.05, -121.7, -121.9, -122.0])
+        near_lat, near_lng = nearest_point_on_polyline_batch(lats, lngs, *self.path)
+        for i in range(len(lats)):
+            nearest = nearest_points(line, Point(lngs[i], lats[i]))[0]
+            assert near_lat[i] == pytest.approx(nearest.y)
+            assert near_lng[i] == pytest.approx(nearest.x)
+
+    def test_corner_package_only_near_polyline(self):
+        """A package at the corner is on the polyline but far from the straight line"""
+        package = ([37.49], [-121.99], [37.49], [-121.8])
+        straight = route_corridor_distances_batch(37.0, -122.0, 37.5, -121.5, *package)
+        polyline = polyline_corridor_distances_batch(*self.path, *package)
+        assert straight[0][0] > 30
+        assert polyline[0][0] < 2 and polyline[1][0] < 2
+
+    def test_distance_is_min_over_segments(self):
+        """Exact distances equal the best of the per-segment distances"""
+        lats, lngs = [37.3, 37.55, 37.45], [-121.95, -121.6, -121.52]
+        segments = [
+            route_corridor_distances_batch(37.0, -122.0, 37.5, -122.0, lats, lngs, lats, lngs),
+            route_corridor_distances_batch(37.5, -122.0, 37.5, -121.5, lats, lngs, lats, lngs),
+        ]
+        pickup_d, _, _ = polyline_corridor_distances_batch(*self.path, lats, lngs, lats, lngs)
+        assert pickup_d == pytest.approx(np.minimum(segments[0][0], segments[1][0]))
+
+    def test_screening_far_packages(self):
+        """Packages clearly beyond max_distance_km are reported as infinity"""
+        pickup_d, _, detour = polyline_corridor_distances_batch(
+            *self.path, [37.49, 38.5], [-121.99, -121.0], [37.49, 38.5], [-121.8, -121.1],
+            max_distance_km=5
+        )
+        assert np.isfinite(detour[0])
+        assert np.isinf(pickup_d[1]) and np.isinf(detour[1])
+
+
+class TestDistanceCache:
+    """Tests for the geodesic distance cache"""
+
+    SF = (37.7749, -122.4194)
+    SJ = (37.3382, -121.8863)
+    PA = (37.4419, -122.1430)
+
+    def test_cached_distance_matches_geodesic(self):
+        """Cached distances equal haversine_distance() and repeat lookups hit"""
+        cache = DistanceCache(max_entries=100, ttl_seconds=60)
+        first = cache.distance(*self.SF, *self.SJ)
+        second = cache.distance(*self.SJ, *self.SF)
+
+        assert first == pytest.approx(haversine_distance(*self.SF, *self.SJ))
+        assert second == first
+        stats = cache.stats()
+        assert stats["misses"] == 1
+        assert stats["hits"] == 1
+        assert stats["hit_rate"] == 0.5
+
+    def test_quantized_keys_share_entries(self):
+        """Points closer than the key precision share one entry"""
+        cache = DistanceCache(max_entries=100, ttl_seconds=60, precision=4)
+        cache.distance(*self.SF, *self.SJ)
+        cache.distance(self.SF[0] + 1e-6, self.SF[1], *self.SJ)
+
+        assert len(cache) == 1
+        assert cache.stats()["hits"] == 1
+
+    def test_lru_eviction(self):
+        """The least recently used entry is evicted when full"""
+        cache = DistanceCache(max_entries=2, ttl_seconds=60)
+        cache.distance(*self.SF, *self.SJ)
+        cache.distance(*self.SF, *self.PA)
+        cache.distance(*self.SF, *self.SJ)  # Refresh SF-SJ
+        cache.distance(*self.PA, *self.SJ)  # Evicts SF-PA
+
+        assert len(cache) == 2
+        assert cache.stats()["evictions"] == 1
+        cache.distance(*self.SF, *self.SJ)
+        assert cache.stats()["hits"] == 2
+
+    def test_expired_entries_recomputed(self):
+        """Entries past their TTL count as misses"""
+        cache = DistanceCache(max_entries=100, ttl_seconds=-1)
+        cache.distance(*self.SF, *self.SJ)
+        cache.distance(*self.SF, *self.SJ)
+
+        stats = cache.stats()
+        assert stats["hits"] == 0
+        assert stats["misses"] == 2
+        assert stats["expirations"] == 1
+
+    def test_matrix(self):
+        """N×N matrices are symmetric, exact and reuse cached pairs"""
+        cache = DistanceCache(max_entries=100, ttl_seconds=60)
+        points = [self.SF, self.SJ, self.PA]
+        lat, lng = [p[0] for p in points], [p[1] for p in points]
+
+        matrix = cache.matrix(lat, lng)
+
+        assert matrix.shape == (3, 3)
+        assert np.allclose(matrix, matrix.T)
+        assert np.all(np.diag(matrix) == 0)
+        assert matrix[0, 1] == pytest.approx(haversine_distance(*self.SF, *self.SJ))
+        assert cache.stats()["misses"] == 3
+
+        cache.matrix(lat, lng)
+        assert cache.stats()["hits"] == 3
+
+    def test_batch_distances_dedupe_misses(self):
+        """A batch with repeated pairs computes each pair once"""
+        cache = DistanceCache(max_entries=100, ttl_seconds=60)
+        result = cache.distances([self.SF[0]] * 3, [self.SF[1]] * 3, [self.SJ[0]] * 3, [self.SJ[1]] * 3)
+
+        assert len(cache) == 1
+        assert np.allclose(result, haversine_distance(*self.SF, *self.SJ))
+
+    def test_fast_matrix_bypasses_cache(self):
+        """Spherical matrices are computed directly"""
+        lat, lng = [self.SF[0], self.SJ[0]], [self.SF[1], self.SJ[1]]
+        before = distance_cache.stats()["misses"] + distance_cache.stats()["hits"]
+
+        matrix = distance_matrix(lat, lng, fast=True)
+
+        assert matrix[0, 1] == pytest.approx(haversine_distance(*self.SF, *self.SJ), rel=HAVERSINE_MAX_RELATIVE_ERROR)
+        assert distance_cache.stats()["misses"] + distance_cache.stats()["hits"] == before
+
+    def test_scalar_helpers_bypass_cache(self):
+        """point_to_line_distance() and calculate_detour_distance() stay exact and uncached"""
+        before = distance_cache.stats()["misses"] + distance_cache.stats()["hits"]
+        offset = (self.SF[0] + 1e-7, self.SF[1])
+
+        point_to_line_distance(*self.PA, *self.SF, *self.SJ)
+        detour, _ = calculate_detour_distance(*self.SF, *self.SJ, *self.PA, *offset)
+
+        assert distance_cache.stats()["misses"] + distance_cache.stats()["hits"] == before
+        expected = (
+            haversine_distance(*self.SF, *self.PA) + haversine_distance(*self.PA, *offset)
+            + haversine_distance(*offset, *self.SJ) - haversine_distance(*self.SF, *self.SJ)
+        )
+        assert detour == expected
+
+    def test_corridor_cache_is_opt_in(self):
+        """Corridor kernels only use the cache for the delivery leg when asked to"""
+        args = (*self.SF, *self.SJ, *self.PA, self.PA[0] - 0.01, self.PA[1])
+        before = distance_cache.stats()["misses"] + distance_cache.stats()["hits"]
+
+        exact = route_corridor_distances_batch(*args)
+        assert distance_cache.stats()["misses"] + distance_cache.stats()["hits"] == before
+
+        cached = route_corridor_distances_batch(*args, cached=True)
+        assert distance_cache.stats()["misses"] + distance_cache.stats()["hits"] == before + 1
+        assert np.allclose(cached[2], exact[2])
+
+    def test_admin_stats_endpoint(self, client, authenticated_admin, authenticated_sender):
+        """Admins can read the shared cache's counters; others cannot"""
+        distance_cache.distance(*self.SF, *self.SJ)
+
+        response = client.get(
+            "/api/admin/matching/distance-cache-stats",
+            headers={"Authorization": f"Bearer {authenticated_admin}"}
+        )
+        assert response.status_code == 200
+        assert response.json()["size"] >= 1
+        assert response.json()["max_entries"] == distance_cache.max_entries
+
+        response = client.get(
+            "/api/admin/matching/distance-cache-stats",
+            headers={"Authorization": f"Bearer {authenticated_sender}"}
+        )
+        assert response.status_code == 403
@@ -0,0 +1,57 @@
+"""Tests for app/utils/geohash.py - Geohash cell ids"""
+
+import pytest
+
+from app.utils.geohash import (
+    GEOHASH_PRECISIONS,
+    cell_columns,
+    cell_for,
+    cell_size,
+    encode,
+    encode_cell,
+)
+
+
+class TestGeohash:
+    """Tests for geohash encoding"""
+
+    @pytest.mark.parametrize("lat,lng,expected", [
+        (57.64911, 10.40744, "u4pruy"),
+        (-25.38262, -49.26561, "6gkzwg"),
+        (37.7749, -122.4194, "9q8yyk"),
+    ])
+    def test_reference_encodings(self, lat, lng, expected):
+        """Encodings match the reference geohash values"""
+        assert encode(lat, lng, 6) == expected
+
+    def test_prefixes_nest(self):
+        """A coarser geohash is a prefix of the finer one"""
+        assert encode(40.7128, -74.0060, 6).startswith(encode(40.7128, -74.0060, 4))
+
+    def test_cell_size(self):
+        """Odd precisions have square cells, even ones are twice as wide"""
+        assert cell_size(5) == (180 / 2 ** 12, 360 / 2 ** 13)
+        height, width = cell_size(6)
+        assert width == pytest.approx(2 * height)
+
+    def test_cell_bounds(self):
+        """Points just inside a cell's corners encode to that cell"""
+        row, col = cell_for(40.7128, -74.0060, 5)
+        height, width = cell_size(5)
+        south, west = row * height - 90, col * width - 180
+        expected = encode_cell(row, col, 5)
+
+        assert encode(south + 1e-9, west + 1e-9, 5) == expected
+        assert encode(south + height - 1e-9, west + width - 1e-9, 5) == expected
+        assert encode(south - 1e-9, west, 5) != expected
+
+    def test_poles_and_antimeridian(self):
+        """Out-of-range coordinates clamp at the poles and wrap at the antimeridian"""
+        assert encode(90.0, 0.0, 4) == encode(89.99, 0.0, 4)
+        assert encode(0.0, 180.0, 4) == encode(0.0, -180.0, 4)
+
+    def test_cell_columns(self):
+        """Column values cover every stored precision"""
+        columns = cell_columns("pickup", 37.7749, -122.4194)
+        assert set(columns) == {f"pickup_geohash_{p}" for p in GEOHASH_PRECISIONS}
+        assert columns["pickup_geohash_6"] == "9q8yyk"
@@ -0,0 +1,307 @@
+"""Tests for incremental package-route matching and the route index."""
+from datetime import datetime, timedelta, timezone
+from unittest.mock import patch, AsyncMock
+
+import pytest
+from fastapi import status
+
+from app.models.user import User, UserRole
+from app.models.notification import Notification, NotificationType
+from app.utils.polyline import encode_polyline
+from app.services.matching_engine import matching_engine
+from app.services.matching_job import has_recent_match_notification
+from app.services.spatial_index import RouteSpatialIndex, route_index
+
+
+MANHATTAN, BROOKLYN = (40.7831, -73.9712), (40.6782, -73.9442)
+LOWER_MANHATTAN, SOHO = (40.7128, -74.0060), (40.7204, -74.0014)
+
+
+@pytest.fixture
+def courier_route(db_session, factory, authenticated_courier):
+    """Active Manhattan -> Brooklyn route for the authenticated courier."""
+    courier = db_session.query(User).filter(User.email == "courier@example.com").first()
+    return factory.route(courier, MANHATTAN, BROOKLYN)
+
+
+class TestRouteSpatialIndex:
+    """Tests for route corridor indexing."""
+
+    def test_query_returns_covering_route(self):
+        """A route is returned for packages inside its corridor only."""
+        index = RouteSpatialIndex(cell_deg=0.25)
+        index.upsert(1, 37.7749, -122.4194, 37.3382, -121.8863, 10)  # SF -> San Jose
+        index.upsert(2, 40.7831, -73.9712, 40.6782, -73.9442, 10)  # Manhattan -> Brooklyn
+
+        assert index.query_package(37.4419, -122.1430, 37.3861, -122.0839) == {1}
+        assert index.query_package(40.7128, -74.0060, 40.7204, -74.0014) == {2}
+
+    def test_dropoff_outside_corridor_excluded(self):
+        """A route is only a candidate if it also covers the dropoff."""
+        index = RouteSpatialIndex(cell_deg=0.25)
+        index.upsert(1, 37.7749, -122.4194, 37.3382, -121.8863, 10)
+
+        assert index.query_package(37.4419, -122.1430, 40.7204, -74.0014) == set()
+
+    def test_upsert_and_remove(self):
+        """Re-inserting a route replaces its corridor; removing drops it."""
+        index = RouteSpatialIndex(cell_deg=0.25)
+        index.upsert(1, 37.7749, -122.4194, 37.3382, -121.8863, 10)
+        index.upsert(1, 40.7831, -73.9712, 40.6782, -73.9442, 10)
+
+        assert len(index) == 1
+        assert index.query_package(37.4419, -122.1430, 37.3861, -122.0839) == set()
+
+        index.remove(1)
+        assert len(index) == 0
+        assert index.query_package(40.7128, -74.0060, 40.7204, -74.0014) == set()
+
+    def test_expired_route_excluded(self):
+        """Routes whose trip date has passed are skipped without a database read."""
+        index = RouteSpatialIndex(cell_deg=0.25)
+        index.upsert(1, 40.7831, -73.9712, 40.6782, -73.9442, 10, datetime(2020, 1, 1))
+        index.upsert(2, 40.7831, -73.9712, 40.6782, -73.9442, 10, datetime.now(timezone.utc) + timedelta(days=1))
+
+        assert index.query_package(40.7128, -74.0060, 40.7204, -74.0014) == {2}
+
+    def test_route_with_waypoints(self):
+        """A polyline route covers packages along its waypoints, not along the straight line."""
+        index = RouteSpatialIndex(cell_deg=0.25)
+        # SF -> Sacramento -> San Jose
+        index.upsert(1, 37.7749, -122.4194, 37.3382, -121.8863, 10, waypoints=encode_polyline([(38.5816, -121.4944)]))
+
+        assert index.query_package(38.5816, -121.4944, 38.5449, -121.7405) == {1}
+        assert 1 in index.paths([1])
+        assert index.paths([1])[1][0] == (37.7749, 38.5816, 37.3382)
+
+    def test_huge_corridor_always_candidate(self):
+        """Routes too large to rasterize are checked against every package."""
+        index = RouteSpatialIndex(cell_deg=0.01)
+        index.upsert(1, 89.9, -180, 89.9, 179, 50)
+
+        assert index.query_package(0.0, 0.0, 1.0, 1.0) == {1}
+
+
+class TestMatchPackage:
+    """Tests for matching one package against active routes."""
+
+    def test_finds_route(self, db_session, factory, courier_route, authenticated_sender):
+        """A package inside the corridor matches the route."""
+        sender = db_session.query(User).filter(User.email == "test@example.com").first()
+        package = factory.package(sender, LOWER_MANHATTAN, SOHO)
+
+        matches = matching_engine.match_package(db_session, package)
+
+        assert [m['route'].id for m in matches] == [courier_route.id]
+        assert matches[0]['distance_from_route_km'] <= courier_route.max_deviation_km
+
+    def test_agrees_with_route_matching(self, db_session, factory, courier_route, authenticated_sender):
+        """Reverse matching reports the same metrics as match_route."""
+        sender = db_session.query(User).filter(User.email == "test@example.com").first()
+        package = factory.package(sender, LOWER_MANHATTAN, SOHO)
+
+        forward = matching_engine.match_route(db_session, courier_route)[0]
+        reverse = matching_engine.match_package(db_session, package)[0]
+
+        assert forward['distance_from_route_km'] == reverse['distance_from_route_km']
+        assert forward['estimated_detour_km'] == reverse['estimated_detour_km']
+
+    def test_inactive_and_expired_routes_excluded(self, db_session, factory, courier_route, authenticated_sender):
+        """Deactivated routes and routes past their trip date do not match."""
+        sender = db_session.query(User).filter(User.email == "test@example.com").first()
+        package = factory.package(sender, LOWER_MANHATTAN, SOHO)
+
+        courier_route.trip_date = datetime.now(timezone.utc) - timedelta(days=1)
+        db_session.commit()
+        assert matching_engine.match_package(db_session, package) == []
+
+        courier_route.trip_date = None
+        courier_route.is_active = False
+        db_session.commit()
+        assert matching_engine.match_package(db_session, package) == []
+
+    def test_far_package_not_matched(self, db_session, factory, courier_route, authenticated_sender):
+        """Packages outside every corridor have no matches."""
+        sender = db_session.query(User).filter(User.email == "test@example.com").first()
+        package = factory.package(sender, (42.3601, -71.0589), (42.3736, -71.1097))
+
+        assert matching_engine.match_package(db_session, package) == []
+
+
+class TestIncrementalNotifications:
+    """Tests that matches are notified as packages and routes are created."""
+
+    def test_create_package_notifies_matching_courier(
+        self, client, db_session, courier_route, authenticated_sender, test_package_data
+    ):
+        """Creating a package notifies couriers whose route fits it immediately."""
+        response = client.post(
+            "/api/packages",
+            json=test_package_data,
+            headers={"Authorization": f"Bearer {authenticated_sender}"}
+        )
+        assert response.status_code == status.HTTP_201_CREATED
+        package_id = response.json()["id"]
+
+        notification = db_session.query(Notification).filter(
+            Notification.user_id == courier_route.courier_id,
+            Notification.package_id == package_id,
+            Notification.type == NotificationType.PACKAGE_MATCH_FOUND
+        ).first()
+        assert notification is not None
+
+    def test_create_package_without_matching_route(
+        self, client, db_session, courier_route, authenticated_sender, test_package_data
+    ):
+        """Packages outside every route corridor do not notify anyone."""
+        test_package_data.update({
+            "pickup_lat": 42.3601, "pickup_lng": -71.0589,
+            "dropoff_lat": 42.3736, "dropoff_lng": -71.1097
+        })
+        response = client.post(
+            "/api/packages",
+            json=test_package_data,
+            headers={"Authorization": f"Bearer {authenticated_sender}"}
+        )
+        assert response.status_code == status.HTTP_201_CREATED
+
+        assert db_session.query(Notification).filter(
+            Notification.type == NotificationType.PACKAGE_MATCH_FOUND
+        ).count() == 0
+
+    def test_create_route_records_package_matches(
+        self, client, db_session, factory, authenticated_courier, authenticated_sender
+    ):
+        """A new route records per-package matches so the periodic job skips them."""
+        sender = db_session.query(User).filter(User.email == "test@example.com").first()
+        courier = db_session.query(User).filter(User.email == "courier@example.com").first()
+        package = factory.package(sender, LOWER_MANHATTAN, SOHO)
+
+        with patch('app.routes.couriers.send_route_match_found_email', new_callable=AsyncMock):
+            response = client.post(
+                "/api/couriers/routes",
+                json={
+                    "start_address": "Manhattan, NY",
+                    "start_lat": 40.7831,
+                    "start_lng": -73.9712,
+                    "end_address": "Brooklyn, NY",
+                    "end_lat": 40.6782,
+                    "end_lng": -73.9442,
+                    "max_deviation_km": 10
+                },
+                headers={"Authorization": f"Bearer {authenticated_courier}"}
+            )
+        assert response.status_code == status.HTTP_201_CREATED
+
+        assert has_recent_match_notification(db_session, courier.id, package.id)
+        assert db_session.query(Notification).filter(
+            Notification.user_id == courier.id,
+            Notification.type == NotificationType.ROUTE_MATCH_FOUND
+        ).count() == 1
+
+    def test_own_package_not_notified(self, client, db_session, factory):
+        """Users with both roles are not notified about their own packages."""
+        from app.utils.auth import create_access_token
+
+        user = factory.user(UserRole.BOTH)
+        factory.route(user, MANHATTAN, BROOKLYN)
+        package = factory.package(user, LOWER_MANHATTAN, SOHO)
+
+        assert [m['route'].courier_id for m in matching_engine.match_package(db_session, package)] == [user.id]
+
+        token = create_access_token(data={"sub": user.email})
+        response = client.post(
+            "/api/packages",
+            json={
+                "description": "Own package",
+                "size": "small",
+                "weight_kg": 1.0,
+                "pickup_address": "Lower Manhattan",
+                "pickup_lat": 40.7128,
+                "pickup_lng": -74.0060,
+                "dropoff_address": "SoHo",
+                "dropoff_lat": 40.7204,
+                "dropoff_lng": -74.0014
+            },
+            headers={"Authorization": f"Bearer {token}"}
+        )
+        assert response.status_code == status.HTTP_201_CREATED
+
+        assert db_session.query(Notification).filter(
+            Notification.type == NotificationType.PACKAGE_MATCH_FOUND
+        ).count() == 0
+
+
+class TestRouteIndexSync:
+    """Tests that courier route endpoints keep the route index in sync."""
+
+    route_data = {
+        "start_address": "Manhattan, NY",
+        "start_lat": 40.7831,
+        "start_lng": -73.9712,
+        "end_address": "Brooklyn, NY",
+        "end_lat": 40.6782,
+        "end_lng": -73.9442,
+        "max_deviation_km": 10
+    }
+
+    def create_route(self, client, token):
+        with patch('app.routes.couriers.send_route_match_found_email', new_callable=AsyncMock):
+            response = client.post(
+                "/api/couriers/routes",
+                json=self.route_data,
+                headers={"Authorization": f"Bearer {token}"}
+            )
+        assert response.status_code == status.HTTP_201_CREATED
+        return response.json()["id"]
+
+    def test_create_and_delete(self, client, authenticated_courier):
+        """Created routes are indexed immediately; deleted routes are removed."""
+        route_id = self.create_route(client, authenticated_courier)
+        assert route_id in route_index.query_package(40.7128, -74.0060, 40.7204, -74.0014)
+
+        response = client.delete(
+            f"/api/couriers/routes/{route_id}",
+            headers={"Authorization": f"Bearer {authenticated_courier}"}
+        )
+        assert response.status_code == status.HTTP_200_OK
+        assert route_id not in route_index.query_package(40.7128, -74.0060, 40.7204, -74.0014)
+
+    def test_update_moves_corridor(self, client, authenticated_courier):
+        """Editing a route's end point re-indexes its corridor."""
+        route_id = self.create_route(client, authenticated_courier)
+
+        response = client.put(
+            f"/api/couriers/routes/{route_id}",
+            json={"end_address": "Newark, NJ", "end_lat": 40.7357, "end_lng": -74.1724},
+            headers={"Authorization": f"Bearer {authenticated_courier}"}
+        )
+        assert response.status_code == status.HTTP_200_OK
+
+        assert route_index.geometries([route_id])[route_id][2:4] == (40.7357, -74.1724)
+        assert route_id in route_index.query_package(40.7178, -74.0431, 40.7282, -74.0776)
+
+    def test_update_waypoints_reindexes(self, client, authenticated_courier):
+        """Adding waypoints re-indexes the route along its new path."""
+        route_id = self.create_route(client, authenticated_courier)
+        # Trenton -> Princeton
+        assert route_id not in route_index.query_package(40.2171, -74.7429, 40.3573, -74.6672)
+
+        response = client.put(
+            f"/api/couriers/routes/{route_id}",
+            json={"waypoints": [{"lat": 40.2171, "lng": -74.7429}]},
+            headers={"Authorization": f"Bearer {authenticated_courier}"}
+        )
+        assert response.status_code == status.HTTP_200_OK
+        assert response.json()["waypoints"] == [{"lat": 40.2171, "lng": -74.7429}]
+
+        assert route_id in route_index.query_package(40.2171, -74.7429, 40.3573, -74.6672)
+
+    def test_new_route_replaces_previous(self, client, authenticated_courier):
+        """Creating a route deactivates and un-indexes the courier's previous route."""
+        first_id = self.create_route(client, authenticated_courier)
+        second_id = self.create_route(client, authenticated_courier)
+
+        candidates = route_index.query_package(40.7128, -74.0060, 40.7204, -74.0014)
+        assert second_id in candidates
+        assert first_id not in candidates
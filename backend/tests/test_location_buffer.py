@@ -0,0 +1,318 @@
+"""Tests for the write-behind buffer of location updates."""
+import time
+from datetime import datetime, timedelta
+from unittest.mock import AsyncMock, patch
+
+import pytest
+from sqlalchemy.orm import sessionmaker
+
+from app.config import settings
+from app.models.package import PackageStatus
+from app.models.tracking import LocationUpdate
+from app.models.user import User
+from app.services.location_buffer import LocationBufferFull, LocationWriteBuffer
+from app.services.redis_client import get_redis
+from app.utils.auth import create_access_token
+from main import app
+
+
+@pytest.fixture
+def tracking_session(factory, sender, courier):
+    """An active tracking session for a package in transit."""
+    package = factory.package(
+        sender, (37.7749, -122.4194), (37.7849, -122.4094),
+        courier_id=courier.id, status=PackageStatus.IN_TRANSIT
+    )
+    return factory.tracking_session(package)
+
+
+def make_buffer(db_session, **kwargs):
+    kwargs.setdefault("interval_ms", 60_000)
+    return LocationWriteBuffer(session_factory=sessionmaker(bind=db_session.get_bind()), **kwargs)
+
+
+def location_row(session_id, latitude=37.7750):
+    return {
+        "session_id": session_id,
+        "latitude": latitude,
+        "longitude": -122.4195,
+        "source": "gps",
+        "timestamp": datetime.utcnow(),
+    }
+
+
+def session_state(latitude=37.7750):
+    return {
+        "last_latitude": latitude,
+        "last_longitude": -122.4195,
+        "last_location_at": datetime.utcnow(),
+        "estimated_arrival": None,
+        "distance_remaining_meters": 1200.0,
+    }
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+class TestLocationWriteBuffer:
+    """Tests for buffering and bulk flushing."""
+
+    def test_flush_writes_rows_and_session(self, db_session, tracking_session):
+        """A flush inserts the rows and moves the session to its latest position."""
+        buffer = make_buffer(db_session)
+        buffer.add([location_row(tracking_session.id, 37.7750), location_row(tracking_session.id, 37.7760)],
+                   tracking_session.id, session_state(37.7760))
+
+        assert db_session.query(LocationUpdate).count() == 0
+        assert buffer.flush() == 2
+        buffer.close()
+
+        db_session.expire_all()
+        assert db_session.query(LocationUpdate).filter_by(session_id=tracking_session.id).count() == 2
+        assert tracking_session.last_latitude == 37.7760
+        assert tracking_session.distance_remaining_meters == 1200.0
+        assert len(buffer) == 0
+
+    def test_background_flush_on_row_threshold(self, db_session, tracking_session):
+        """The background thread flushes once enough rows are waiting."""
+        buffer = make_buffer(db_session, flush_rows=3)
+        for i in range(3):
+            buffer.add([location_row(tracking_session.id)], tracking_session.id, session_state())
+
+        assert wait_for(lambda: len(buffer) == 0)
+        buffer.close()
+        assert db_session.query(LocationUpdate).count() == 3
+
+    def test_background_flush_on_interval(self, db_session, tracking_session):
+        """Rows below the threshold are flushed after the interval."""
+        buffer = make_buffer(db_session, interval_ms=50)
+        buffer.add([location_row(tracking_session.id)], tracking_session.id, session_state())
+
+        assert wait_for(lambda: len(buffer) == 0)
+        buffer.close()
+        assert db_session.query(LocationUpdate).count() == 1
+
+    def test_older_batch_keeps_newer_position(self, db_session, tracking_session):
+        """A late batch of older fixes is written but does not replace the newer buffered position."""
+        buffer = make_buffer(db_session)
+        newer = session_state(latitude=37.7800)
+        older = {**session_state(latitude=37.7760), "last_location_at": newer["last_location_at"] - timedelta(minutes=5)}
+        buffer.add([location_row(tracking_session.id, 37.7800)], tracking_session.id, newer)
+        buffer.add([location_row(tracking_session.id, 37.7760)], tracking_session.id, older)
+
+        assert buffer.flush() == 2
+        buffer.close()
+
+        db_session.expire_all()
+        assert tracking_session.last_latitude == 37.7800
+
+    def test_flush_keeps_newer_stored_position(self, db_session, tracking_session):
+        """A buffered position older than the one another process stored is not written over it."""
+        buffer = make_buffer(db_session)
+        state = session_state(latitude=37.7760)
+        tracking_session.last_latitude = 37.7800
+        tracking_session.last_location_at = state["last_location_at"] + timedelta(minutes=1)
+        db_session.commit()
+
+        buffer.add([location_row(tracking_session.id, 37.7760)], tracking_session.id, state)
+        assert buffer.flush() == 1
+        buffer.close()
+
+        db_session.expire_all()
+        assert tracking_session.last_latitude == 37.7800
+
+    def test_close_flushes_remaining_rows(self, db_session, tracking_session):
+        """Closing the buffer writes what is still buffered."""
+        buffer = make_buffer(db_session)
+        buffer.add([location_row(tracking_session.id)], tracking_session.id, session_state())
+
+        buffer.close()
+        assert db_session.query(LocationUpdate).count() == 1
+
+    def test_ended_session_keeps_its_position(self, db_session, tracking_session):
+        """Fixes flushed after their session ended are stored but do not move the session."""
+        buffer = make_buffer(db_session)
+        buffer.add([location_row(tracking_session.id)], tracking_session.id, session_state())
+        tracking_session.is_active = False
+        db_session.commit()
+
+        assert buffer.flush() == 1
+        buffer.close()
+
+        db_session.expire_all()
+        assert db_session.query(LocationUpdate).filter_by(session_id=tracking_session.id).count() == 1
+        assert tracking_session.last_latitude is None
+        assert tracking_session.distance_remaining_meters is None
+
+    def test_failed_flush_keeps_rows(self, db_session, tracking_session):
+        """Rows of a failed flush stay buffered and are written by the next one."""
+        buffer = make_buffer(db_session)
+        buffer.add([location_row(tracking_session.id, 37.7750)], tracking_session.id, session_state(37.7750))
+
+        with patch.object(buffer, "_write", side_effect=RuntimeError("database down")):
+            with pytest.raises(RuntimeError):
+                buffer.flush()
+        buffer.add([location_row(tracking_session.id, 37.7760)], tracking_session.id, session_state(37.7760))
+
+        assert len(buffer) == 2
+        assert buffer.flush() == 2
+        buffer.close()
+        db_session.expire_all()
+        latitudes = [row.latitude for row in db_session.query(LocationUpdate).order_by(LocationUpdate.id)]
+        assert latitudes == [37.7750, 37.7760]
+        assert tracking_session.last_latitude == 37.7760
+
+    def test_bad_row_is_dropped(self, db_session, factory, tracking_session):
+        """A row the database rejects is dropped with its session; other sessions are written."""
+        other = factory.tracking_session(tracking_session.package)
+        buffer = make_buffer(db_session)
+        bad = location_row(tracking_session.id)
+        bad["latitude"] = None
+        buffer.add([location_row(tracking_session.id), bad], tracking_session.id, session_state())
+        buffer.add([location_row(other.id, 37.7760)], other.id, session_state(37.7760))
+
+        assert buffer.flush() == 1
+        buffer.close()
+
+        assert len(buffer) == 0
+        assert buffer.stats() == {"buffered": 0, "written": 1, "dropped": 2}
+        db_session.expire_all()
+        assert [row.session_id for row in db_session.query(LocationUpdate)] == [other.id]
+        assert other.last_latitude == 37.7760
+        assert tracking_session.last_latitude is None
+
+    def test_database_failure_during_retry_keeps_rows(self, db_session, tracking_session):
+        """When the database fails while retrying per session, the unwritten rows stay buffered."""
+        buffer = make_buffer(db_session)
+        bad = location_row(tracking_session.id)
+        bad["latitude"] = None
+        buffer.add([bad], tracking_session.id, session_state())
+        write = buffer._write
+        calls = []
+
+        def failing_retry(rows, sessions):
+            calls.append(len(rows))
+            if len(calls) > 1:
+                raise RuntimeError("database down")
+            write(rows, sessions)
+
+        with patch.object(buffer, "_write", side_effect=failing_retry):
+            with pytest.raises(RuntimeError):
+                buffer.flush()
+
+        assert len(buffer) == 1
+        assert buffer.stats()["dropped"] == 0
+
+    def test_full_buffer_rejects_and_wakes_flush(self, db_session, tracking_session):
+        """A writer that would exceed the bound is rejected and the flush thread makes room."""
+        buffer = make_buffer(db_session, max_rows=2)
+        buffer.add([location_row(tracking_session.id)] * 2, tracking_session.id, session_state())
+
+        with pytest.raises(LocationBufferFull):
+            buffer.add([location_row(tracking_session.id)], tracking_session.id, session_state())
+
+        assert wait_for(lambda: db_session.query(LocationUpdate).count() == 2)
+        buffer.add([location_row(tracking_session.id)], tracking_session.id, session_state())
+        buffer.close()
+        assert db_session.query(LocationUpdate).count() == 3
+
+    def test_full_buffer_does_not_flush_inline(self, db_session, tracking_session):
+        """The rejected writer never runs the flush itself, even when the database is down."""
+        buffer = make_buffer(db_session, max_rows=2)
+        buffer.add([location_row(tracking_session.id)] * 2, tracking_session.id, session_state())
+
+        with patch.object(buffer, "flush", side_effect=AssertionError("flushed inline")):
+            with pytest.raises(LocationBufferFull):
+                buffer.add([location_row(tracking_session.id)], tracking_session.id, session_state())
+
+        assert len(buffer) == 2
+        buffer.close()
+
+
+class TestWriteBehindTracking:
+    """Tests for location updates through the write-behind buffer."""
+
+    def test_location_update_is_buffered(self, client, db_session, tracking_session):
+        """The endpoint answers with the new position before the row is written."""
+        buffer = make_buffer(db_session)
+        courier = db_session.get(User, tracking_session.courier_id)
+        headers = {"Authorization": f"Bearer {create_access_token({'sub': courier.email})}"}
+        app.dependency_overrides[get_redis] = lambda: None
+
+        with patch.object(settings, "LOCATION_WRITE_BEHIND", True), \
+                patch("app.services.tracking_service.location_buffer", buffer):
+            response = client.post(
+                f"/api/tracking/sessions/{tracking_session.id}/location",
+                headers=headers,
+                json={"latitude": 37.7750, "longitude": -122.4195, "speed_mps": 5.0}
+            )
+
+            assert response.status_code == 200
+            assert response.json()["distance_remaining_meters"] > 0
+            assert db_session.query(LocationUpdate).count() == 0
+            assert len(buffer) == 1
+
+            buffer.close()
+
+        db_session.expire_all()
+        assert db_session.query(LocationUpdate).filter_by(session_id=tracking_session.id).count() == 1
+        assert tracking_session.last_latitude == 37.7750
+        assert tracking_session.estimated_arrival is not None
+
+    def test_older_batch_is_not_broadcast(self, client, db_session, tracking_session):
+        """A late offline batch is buffered but neither moves the session nor reaches subscribers."""
+        buffer = make_buffer(db_session)
+        courier = db_session.get(User, tracking_session.courier_id)
+        headers = {"Authorization": f"Bearer {create_access_token({'sub': courier.email})}"}
+        redis = AsyncMock()
+        redis.get_json.return_value = None
+        app.dependency_overrides[get_redis] = lambda: redis
+        recorded = datetime.utcnow() - timedelta(minutes=10)
+
+        with patch.object(settings, "LOCATION_WRITE_BEHIND", True), \
+                patch("app.services.tracking_service.location_buffer", buffer):
+            client.post(
+                f"/api/tracking/sessions/{tracking_session.id}/location",
+                headers=headers,
+                json={"latitude": 37.7800, "longitude": -122.4195}
+            )
+            redis.publish_location_update.reset_mock()
+            response = client.post(
+                f"/api/tracking/sessions/{tracking_session.id}/locations",
+                headers=headers,
+                json={"fixes": [{"latitude": 37.7750, "longitude": -122.4195, "timestamp": recorded.isoformat()}]}
+            )
+
+            assert response.status_code == 200
+            redis.publish_location_update.assert_not_called()
+            buffer.close()
+
+        db_session.expire_all()
+        assert db_session.query(LocationUpdate).count() == 2
+        assert tracking_session.last_latitude == 37.7800
+
+    def test_full_buffer_is_service_unavailable(self, client, db_session, tracking_session):
+        """Fixes refused by a full buffer are answered with 503 and Retry-After."""
+        buffer = make_buffer(db_session, max_rows=0)
+        courier = db_session.get(User, tracking_session.courier_id)
+        headers = {"Authorization": f"Bearer {create_access_token({'sub': courier.email})}"}
+        app.dependency_overrides[get_redis] = lambda: None
+
+        with patch.object(settings, "LOCATION_WRITE_BEHIND", True), \
+                patch("app.services.tracking_service.location_buffer", buffer):
+            response = client.post(
+                f"/api/tracking/sessions/{tracking_session.id}/location",
+                headers=headers,
+                json={"latitude": 37.7750, "longitude": -122.4195}
+            )
+            buffer.close()
+
+        assert response.status_code == 503
+        assert response.headers["Retry-After"] == "1"
+        assert db_session.query(LocationUpdate).count() == 0
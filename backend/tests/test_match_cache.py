@@ -0,0 +1,246 @@
+"""Tests for the per-route match result cache."""
+import pytest
+from sqlalchemy import update
+
+from app.models.user import UserRole
+from app.models.package import Package, PackageStatus, CourierRoute
+from app.services.change_feed import package_changes
+from app.services.redis_client import RedisClient
+from app.services.match_cache import match_cache
+from app.services.spatial_index import route_index
+from app.utils.auth import create_access_token
+
+
+class FakeRedis:
+    """Dict-backed stand-in for the Redis commands the match cache uses."""
+
+    def __init__(self):
+        self.data = {}
+        self.gets = 0
+
+    # Async client
+    async def mget(self, *keys):
+        self.gets += 1
+        return [self.data.get(key) for key in keys]
+
+    async def setex(self, key, ttl, value):
+        self.data[key] = value
+        return True
+
+    # Sync client
+    def pipeline(self, transaction=False):
+        return FakePipeline(self)
+
+
+class FakePipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = []
+
+    def incr(self, key):
+        self.commands.append(lambda: self.redis.data.__setitem__(key, str(int(self.redis.data.get(key, 0)) + 1)))
+
+    def delete(self, *keys):
+        self.commands.append(lambda: [self.redis.data.pop(key, None) for key in keys])
+
+    def execute(self):
+        for command in self.commands:
+            command()
+
+
+@pytest.fixture
+def fake_redis(monkeypatch, change_feed):
+    redis = FakeRedis()
+    client = RedisClient()
+    client._client = redis
+
+    async def get_instance():
+        return client
+
+    monkeypatch.setattr(RedisClient, "get_instance", get_instance)
+    monkeypatch.setattr(match_cache, "_sync_client", redis)
+    monkeypatch.setattr(match_cache, "_unavailable_until", 0.0)
+    match_cache.reset_stats()
+    yield redis
+    match_cache.reset_stats()
+
+
+SF, SJ = (37.7749, -122.4194), (37.3382, -121.8863)
+PALO_ALTO, MOUNTAIN_VIEW = (37.4419, -122.1430), (37.3861, -122.0839)
+MANHATTAN, BROOKLYN = (40.7831, -73.9712), (40.6782, -73.9442)
+
+
+class TestMatchCache:
+    """Tests for caching, invalidation and metrics."""
+
+    def get_matches(self, client, courier, route):
+        response = client.get(
+            f"/api/matching/packages-along-route/{route.id}",
+            headers={"Authorization": f"Bearer {create_access_token(data={'sub': courier.email})}"}
+        )
+        assert response.status_code == 200
+        return [p["package_id"] for p in response.json()]
+
+    def test_repeat_view_is_a_hit(self, client, db_session, factory, fake_redis, courier, sender):
+        """The second view is served from the cache."""
+        route = factory.route(courier, SF, SJ)
+        package = factory.package(sender, PALO_ALTO, MOUNTAIN_VIEW)
+
+        assert self.get_matches(client, courier, route) == [package.id]
+        assert self.get_matches(client, courier, route) == [package.id]
+
+        stats = match_cache.stats()
+        assert stats["misses"] == 1
+        assert stats["hits"] == 1
+        assert stats["hit_rate"] == 0.5
+
+    def test_package_status_change_invalidates_route(self, client, db_session, factory, fake_redis, courier, sender):
+        """A package in the corridor changing status drops the route's entry."""
+        route = factory.route(courier, SF, SJ)
+        package = factory.package(sender, PALO_ALTO, MOUNTAIN_VIEW)
+        route_index.rebuild(db_session)
+
+        assert self.get_matches(client, courier, route) == [package.id]
+
+        package.status = PackageStatus.BID_SELECTED
+        db_session.commit()
+
+        assert self.get_matches(client, courier, route) == []
+        assert match_cache.stats()["hits"] == 0
+
+    def test_new_package_invalidates_route(self, client, db_session, factory, fake_redis, courier, sender):
+        """A package created inside the corridor shows up on the next view."""
+        route = factory.route(courier, SF, SJ)
+        route_index.rebuild(db_session)
+        assert self.get_matches(client, courier, route) == []
+
+        package = factory.package(sender, PALO_ALTO, MOUNTAIN_VIEW)
+
+        assert self.get_matches(client, courier, route) == [package.id]
+
+    def test_unrelated_package_keeps_entry(self, client, db_session, factory, fake_redis, courier, sender):
+        """Packages outside a route's corridor do not invalidate it."""
+        route = factory.route(courier, SF, SJ)
+        other_courier = factory.user(UserRole.COURIER)
+        factory.route(other_courier, MANHATTAN, BROOKLYN)
+        route_index.rebuild(db_session)
+
+        self.get_matches(client, courier, route)
+        factory.package(sender, (40.7128, -74.0060), (40.7204, -74.0014))
+        self.get_matches(client, courier, route)
+
+        assert match_cache.stats()["hits"] == 1
+
+    def test_route_edit_invalidates_route(self, client, db_session, factory, fake_redis, courier, sender):
+        """Editing the route drops its entry."""
+        route = factory.route(courier, SF, SJ)
+        package = factory.package(sender, PALO_ALTO, MOUNTAIN_VIEW)
+        route_index.rebuild(db_session)
+        assert self.get_matches(client, courier, route) == [package.id]
+
+        route.max_deviation_km = 1
+        db_session.commit()
+
+        assert self.get_matches(client, courier, route) == []
+
+    def test_invalidation_without_route_index(self, client, db_session, factory, fake_redis, courier, sender):
+        """Processes that never loaded the route index invalidate only the affected routes."""
+        route_index.clear()
+        route = factory.route(courier, SF, SJ)
+        assert self.get_matches(client, courier, route) == []
+
+        factory.package(sender, MANHATTAN, BROOKLYN)
+        assert self.get_matches(client, courier, route) == []
+        assert match_cache.stats()["hits"] == 1
+
+        package = factory.package(sender, PALO_ALTO, MOUNTAIN_VIEW)
+        assert self.get_matches(client, courier, route) == [package.id]
+        assert match_cache.stats()["hits"] == 1
+
+    def test_courier_capacity_change_invalidates_route(self, client, db_session, factory, fake_redis, courier, sender):
+        """A change of the courier's vehicle capacity drops their routes' entries."""
+        route = factory.route(courier, SF, SJ)
+        factory.package(sender, PALO_ALTO, MOUNTAIN_VIEW)
+        self.get_matches(client, courier, route)
+
+        courier.vehicle_max_weight_kg = 0.5
+        db_session.commit()
+
+        assert self.get_matches(client, courier, route) == []
+        assert match_cache.stats()["hits"] == 0
+
+    def test_other_process_change_is_cached_fresh(self, client, db_session, factory, fake_redis, courier, sender):
+        """After another process reopens a package, the recomputed matches include it before they are cached."""
+        route = factory.route(courier, SF, SJ)
+        package = factory.package(sender, PALO_ALTO, MOUNTAIN_VIEW, status=PackageStatus.BID_SELECTED)
+        assert self.get_matches(client, courier, route) == []
+
+        # The other process's commit hooks: no session hook runs in this one
+        db_session.execute(
+            update(Package).where(Package.id == package.id).values(status=PackageStatus.OPEN_FOR_BIDS)
+        )
+        db_session.commit()
+        package_changes.publish([package.id])
+        match_cache.invalidate_packages([(*PALO_ALTO, *MOUNTAIN_VIEW)])
+
+        assert self.get_matches(client, courier, route) == [package.id]
+        assert self.get_matches(client, courier, route) == [package.id]
+        assert match_cache.stats()["hits"] == 1
+
+    def test_unsynced_matches_are_not_cached(self, client, db_session, factory, fake_redis, courier, sender, monkeypatch):
+        """Matches from a snapshot that could not check the change feed are served but not cached."""
+        route = factory.route(courier, SF, SJ)
+        package = factory.package(sender, PALO_ALTO, MOUNTAIN_VIEW)
+        monkeypatch.setattr(package_changes, "_unavailable_until", float("inf"))
+
+        assert self.get_matches(client, courier, route) == [package.id]
+        assert self.get_matches(client, courier, route) == [package.id]
+
+        assert match_cache.stats()["hits"] == 0
+        assert match_cache.key(route.id) not in fake_redis.data
+
+    def test_feed_published_before_invalidation(self, db_session, factory, fake_redis, change_feed, sender, monkeypatch):
+        """A commit's package ids are in the change feed by the time its counters are bumped."""
+        published = []
+        bump = match_cache._bump
+
+        def recording_bump(keys, delete=()):
+            published.append([entry[1]["ids"] for entry in change_feed.streams.get(package_changes.stream, [])])
+            return bump(keys, delete)
+        monkeypatch.setattr(match_cache, "_bump", recording_bump)
+
+        package = factory.package(sender, PALO_ALTO, MOUNTAIN_VIEW)
+
+        assert published and all(str(package.id) in ids for ids in published)
+
+    @pytest.mark.asyncio
+    async def test_stale_write_is_ignored(self, fake_redis):
+        """An entry computed before an invalidation is never served."""
+        route = CourierRoute(id=1, courier_id=1, start_lat=SF[0], start_lng=SF[1], end_lat=SJ[0], end_lng=SJ[1],
+                             max_deviation_km=10)
+        matches, version = await match_cache.get(route)
+        assert matches is None
+
+        match_cache.invalidate_packages([(*PALO_ALTO, *MOUNTAIN_VIEW)])
+        await match_cache.set(route.id, version, [{"package_id": 1}])
+
+        matches, _ = await match_cache.get(route)
+        assert matches is None
+
+    @pytest.mark.asyncio
+    async def test_redis_errors_fall_through(self, monkeypatch):
+        """Redis failures count as misses instead of failing the request."""
+        async def get_instance():
+            raise ConnectionError("Redis down")
+
+        monkeypatch.setattr(RedisClient, "get_instance", get_instance)
+        monkeypatch.setattr(match_cache, "_unavailable_until", 0.0)
+        match_cache.reset_stats()
+
+        route = CourierRoute(id=1, courier_id=1, start_lat=SF[0], start_lng=SF[1], end_lat=SJ[0], end_lng=SJ[1],
+                             max_deviation_km=10)
+        matches, version = await match_cache.get(route)
+
+        assert matches is None and version is None
+        assert match_cache.stats()["errors"] == 1
+        monkeypatch.setattr(match_cache, "_unavailable_until", 0.0)
@@ -1,4 +1,6 @@
 """Tests for matching algorithm endpoints"""
+import json
+
 import pytest
 from fastapi.testclient import TestClient
 from sqlalchemy.orm import Session
@@ -433,6 +435,322 @@ class TestMatchingAlgorithm:
         assert inactive_package.id not in package_ids
 
 
+class TestPackagesAlongRoutePages:
+    """Tests for top-K pages, cursors and NDJSON streaming of packages along a route"""
+
+    @pytest.fixture
+    def courier_token(self, db_session):
+        courier = User(
+            email="pages_courier@test.com",
+            hashed_password=get_password_hash("testpass123"),
+            full_name="Pages Courier",
+            role=UserRole.COURIER,
+            is_active=True,
+            is_verified=True
+        )
+        db_session.add(courier)
+        db_session.commit()
+        return create_access_token(data={"sub": courier.email})
+
+    @pytest.fixture
+    def route(self, db_session, courier_token):
+        courier = db_session.query(User).filter(User.email == "pages_courier@test.com").one()
+        route = CourierRoute(
+            courier_id=courier.id,
+            start_address="San Francisco, CA",
+            start_lat=37.7749,
+            start_lng=-122.4194,
+            end_address="San Jose, CA",
+            end_lat=37.3382,
+            end_lng=-121.8863,
+            max_deviation_km=10,
+            is_active=True
+        )
+        db_session.add(route)
+        db_session.commit()
+        return route
+
+    @pytest.fixture
+    def packages(self, db_session):
+        sender = User(
+            email="pages_sender@test.com",
+            hashed_password=get_password_hash("testpass123"),
+            full_name="Pages Sender",
+            role=UserRole.SENDER,
+            is_active=True,
+            is_verified=True
+        )
+        db_session.add(sender)
+        db_session.commit()
+
+        packages = []
+        for i in range(7):
+            # Pickups spread along the route, dropoffs at growing distances from it
+            t = i / 7
+            lat = 37.7749 + t * (37.3382 - 37.7749)
+            lng = -122.4194 + t * (-121.8863 + 122.4194)
+            packages.append(Package(
+                tracking_id=generate_tracking_id(),
+                sender_id=sender.id,
+                description=f"Page package {i}",
+                size=PackageSize.SMALL,
+                weight_kg=1.0,
+                pickup_address="Pickup",
+                pickup_lat=lat,
+                pickup_lng=lng,
+                dropoff_address="Dropoff",
+                dropoff_lat=lat - 0.01 * (i % 3),
+                dropoff_lng=lng + 0.01 * (i % 4),
+                status=PackageStatus.OPEN_FOR_BIDS,
+                price=10.0,
+                is_active=True
+            ))
+        db_session.add_all(packages)
+        db_session.commit()
+        return packages
+
+    def get(self, client, token, route, **params):
+        return client.get(
+            f"/api/matching/packages-along-route/{route.id}",
+            params=params,
+            headers={"Authorization": f"Bearer {token}"}
+        )
+
+    def test_pages_cover_full_ranking(self, client, courier_token, route, packages):
+        """Following cursors returns the full ranking, page by page"""
+        full = self.get(client, courier_token, route).json()
+        assert len(full) == len(packages)
+
+        pages, cursor = [], None
+        while True:
+            params = {"limit": 3}
+            if cursor:
+                params["cursor"] = cursor
+            response = self.get(client, courier_token, route, **params)
+            assert response.status_code == 200
+            assert len(response.json()) <= 3
+            pages.extend(response.json())
+            cursor = response.headers.get("X-Next-Cursor")
+            if not cursor:
+                break
+
+        assert [p["package_id"] for p in pages] == [p["package_id"] for p in full]
+
+    def test_top_k(self, client, courier_token, route, packages):
+        """limit returns the best matches by detour"""
+        full = self.get(client, courier_token, route).json()
+        top = self.get(client, courier_token, route, limit=2)
+
+        assert top.json() == full[:2]
+        assert "X-Next-Cursor" in top.headers
+
+    def test_last_page_has_no_cursor(self, client, courier_token, route, packages):
+        response = self.get(client, courier_token, route, limit=len(packages))
+        assert len(response.json()) == len(packages)
+        assert "X-Next-Cursor" not in response.headers
+
+    def test_cached_results_are_paged(self, client, courier_token, route, packages, monkeypatch):
+        """Pages are cut from cached results when available"""
+        from app.services.match_cache import match_cache
+
+        full = self.get(client, courier_token, route).json()
+
+        async def cached_get(route_id):
+            return full, "1"
+        monkeypatch.setattr(match_cache, "get", cached_get)
+
+        first = self.get(client, courier_token, route, limit=4)
+        second = self.get(client, courier_token, route, limit=4, cursor=first.headers["X-Next-Cursor"])
+
+        assert first.json() + second.json() == full
+        assert "X-Next-Cursor" not in second.headers
+
+    def test_ndjson_stream(self, client, courier_token, route, packages):
+        """format=ndjson streams one match per line"""
+        full = self.get(client, courier_token, route).json()
+        response = self.get(client, courier_token, route, format="ndjson", limit=5)
+
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("application/x-ndjson")
+        assert "X-Next-Cursor" in response.headers
+        lines = response.text.splitlines()
+        assert [json.loads(line) for line in lines] == full[:5]
+
+    def test_invalid_cursor(self, client, courier_token, route):
+        response = self.get(client, courier_token, route, cursor="not-a-cursor")
+        assert response.status_code == 400
+
+    def test_package_closed_after_snapshot_load(self, client, db_session, courier_token, route, packages):
+        """A package closed elsewhere is replaced by the next match and the cursor is kept"""
+        from sqlalchemy import update
+
+        full = self.get(client, courier_token, route).json()
+        # Closed without ORM events, as by another process; the loaded snapshot still has it
+        db_session.execute(
+            update(Package)
+            .where(Package.id == full[1]["package_id"])
+            .values(status=PackageStatus.CANCELED)
+        )
+        db_session.commit()
+
+        response = self.get(client, courier_token, route, limit=3)
+
+        assert [p["package_id"] for p in response.json()] == [full[i]["package_id"] for i in (0, 2, 3)]
+        assert "X-Next-Cursor" in response.headers
+
+
+class TestRoutesForPackage:
+    """Tests for reverse matching: routes that can carry a package"""
+
+    @pytest.fixture
+    def sender_user(self, db_session):
+        user = User(
+            email="reverse_sender@test.com",
+            hashed_password=get_password_hash("testpass123"),
+            full_name="Reverse Sender",
+            role=UserRole.SENDER,
+            is_active=True,
+            is_verified=True
+        )
+        db_session.add(user)
+        db_session.commit()
+        return user
+
+    @pytest.fixture
+    def package(self, db_session, sender_user):
+        """Package from Palo Alto to Mountain View"""
+        package = Package(
+            tracking_id=generate_tracking_id(),
+            sender_id=sender_user.id,
+            description="Reverse match package",
+            size=PackageSize.SMALL,
+            weight_kg=2.5,
+            pickup_address="Palo Alto, CA",
+            pickup_lat=37.4419,
+            pickup_lng=-122.1430,
+            dropoff_address="Mountain View, CA",
+            dropoff_lat=37.3861,
+            dropoff_lng=-122.0839,
+            status=PackageStatus.OPEN_FOR_BIDS,
+            price=25.0,
+            is_active=True
+        )
+        db_session.add(package)
+        db_session.commit()
+        return package
+
+    def make_route(self, db_session, email, start, end, max_deviation_km=10, **overrides):
+        courier = User(
+            email=email,
+            hashed_password=get_password_hash("testpass123"),
+            full_name=f"Courier {email}",
+            role=UserRole.COURIER,
+            is_active=True,
+            is_verified=True
+        )
+        db_session.add(courier)
+        db_session.commit()
+
+        route = CourierRoute(
+            courier_id=courier.id,
+            start_address="Start",
+            start_lat=start[0],
+            start_lng=start[1],
+            end_address="End",
+            end_lat=end[0],
+            end_lng=end[1],
+            max_deviation_km=max_deviation_km,
+            is_active=True,
+            **overrides
+        )
+        db_session.add(route)
+        db_session.commit()
+        return route
+
+    def test_routes_ranked_by_detour(self, client, db_session, sender_user, package):
+        """Matching routes are returned shortest detour first, far routes excluded"""
+        sf_sj = self.make_route(db_session, "sfsj@test.com", (37.7749, -122.4194), (37.3382, -121.8863))
+        oak_sj = self.make_route(db_session, "oaksj@test.com", (37.8044, -122.2712), (37.3382, -121.8863), 20)
+        self.make_route(db_session, "sac@test.com", (38.5816, -121.4944), (38.5449, -121.7405))
+
+        response = client.get(
+            f"/api/matching/routes-for-package/{package.id}",
+            headers={"Authorization": f"Bearer {create_access_token(data={'sub': sender_user.email})}"}
+        )
+
+        assert response.status_code == 200
+        data = response.json()
+        assert [r["route_id"] for r in data] == [sf_sj.id, oak_sj.id]
+        assert data[0]["estimated_detour_km"] <= data[1]["estimated_detour_km"]
+        assert data[0]["courier_name"] == "Courier sfsj@test.com"
+
+    def test_limit(self, client, db_session, sender_user, package):
+        """The limit parameter caps the number of routes"""
+        self.make_route(db_session, "one@test.com", (37.7749, -122.4194), (37.3382, -121.8863))
+        self.make_route(db_session, "two@test.com", (37.7749, -122.4194), (37.3382, -121.8863))
+
+        response = client.get(
+            f"/api/matching/routes-for-package/{package.id}?limit=1",
+            headers={"Authorization": f"Bearer {create_access_token(data={'sub': sender_user.email})}"}
+        )
+
+        assert response.status_code == 200
+        assert len(response.json()) == 1
+
+    def test_expired_route_excluded(self, client, db_session, sender_user, package):
+        """Routes whose trip date has passed are not returned"""
+        self.make_route(
+            db_session, "expired@test.com", (37.7749, -122.4194), (37.3382, -121.8863),
+            trip_date=datetime(2020, 1, 1)
+        )
+
+        response = client.get(
+            f"/api/matching/routes-for-package/{package.id}",
+            headers={"Authorization": f"Bearer {create_access_token(data={'sub': sender_user.email})}"}
+        )
+
+        assert response.status_code == 200
+        assert response.json() == []
+
+    def test_other_sender_forbidden(self, client, db_session, package):
+        """Only the package's sender (or an admin) can see matching routes"""
+        other = User(
+            email="other_sender@test.com",
+            hashed_password=get_password_hash("testpass123"),
+            full_name="Other Sender",
+            role=UserRole.SENDER,
+            is_active=True,
+            is_verified=True
+        )
+        db_session.add(other)
+        db_session.commit()
+
+        response = client.get(
+            f"/api/matching/routes-for-package/{package.id}",
+            headers={"Authorization": f"Bearer {create_access_token(data={'sub': other.email})}"}
+        )
+
+        assert response.status_code == 403
+
+    def test_admin_allowed(self, client, package, authenticated_admin):
+        """Admins can run reverse matching for any package"""
+        response = client.get(
+            f"/api/matching/routes-for-package/{package.id}",
+            headers={"Authorization": f"Bearer {authenticated_admin}"}
+        )
+
+        assert response.status_code == 200
+
+    def test_package_not_found(self, client, sender_user):
+        """Unknown packages return 404"""
+        response = client.get(
+            "/api/matching/routes-for-package/99999",
+            headers={"Authorization": f"Bearer {create_access_token(data={'sub': sender_user.email})}"}
+        )
+
+        assert response.status_code == 404
+
+
 class TestGeoUtils:
     """Tests for geometric utility functions"""
 
@@ -0,0 +1,193 @@
+"""
+Shared test suite for the matching backends.
+
+Every backend must return exactly the ranked matches of a full scan scored
+in-process. The in-process backends run on the SQLite test database; the
+PostGIS backend runs when POSTGIS_TEST_DATABASE_URL points at a PostgreSQL
+database with PostGIS available (its tables are created and dropped here).
+"""
+import os
+import random
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import sessionmaker
+
+from app.config import settings
+from app.models.base import Base
+from app.models.user import UserRole
+from app.models.package import Package, PackageStatus, PackageSize
+from app.utils.tracking_id import generate_tracking_id
+from app.services.courier_capacity import CourierCapacity
+from app.services.matching_engine import (
+    MatchingEngine,
+    FullScanPrefilter,
+    BoundingBoxPrefilter,
+    PostGISPrefilter,
+    SpatialIndexPrefilter,
+)
+from app.services.postgis_matching import (
+    install_geography_columns,
+    open_packages_within_route_query,
+    postgis_available,
+    reset_detection,
+    route_line_wkt,
+)
+
+POSTGIS_TEST_DATABASE_URL = os.environ.get("POSTGIS_TEST_DATABASE_URL")
+
+
+@pytest.fixture
+def postgis_session():
+    if not POSTGIS_TEST_DATABASE_URL:
+        pytest.skip("POSTGIS_TEST_DATABASE_URL not set")
+
+    engine = create_engine(POSTGIS_TEST_DATABASE_URL)
+    Base.metadata.create_all(bind=engine)
+    with engine.connect() as conn:
+        install_geography_columns(conn)
+        conn.commit()
+    reset_detection()
+
+    db = sessionmaker(autocommit=False, autoflush=False, bind=engine)()
+    try:
+        yield db
+    finally:
+        db.close()
+        Base.metadata.drop_all(bind=engine)
+        reset_detection()
+        engine.dispose()
+
+
+@pytest.fixture(params=["spatial_index", "bounding_box", "postgis_fallback", "postgis"])
+def backend(request):
+    """(session, engine) for each backend under test."""
+    if request.param == "postgis":
+        db = request.getfixturevalue("postgis_session")
+        assert postgis_available(db)
+        return db, MatchingEngine(prefilter=PostGISPrefilter())
+
+    db = request.getfixturevalue("db_session")
+    prefilter = {
+        "spatial_index": SpatialIndexPrefilter(),
+        "bounding_box": BoundingBoxPrefilter(),
+        "postgis_fallback": PostGISPrefilter(),
+    }[request.param]
+    return db, MatchingEngine(prefilter=prefilter)
+
+
+def seed_packages(db, sender, count=300, seed=11):
+    """Random packages around the Bay Area, half of them scattered along the route."""
+    rng = random.Random(seed)
+    sizes = list(PackageSize)
+
+    def point(i):
+        if i % 2:
+            return rng.uniform(37.2, 38.0), rng.uniform(-122.6, -121.7)
+        t = rng.random()
+        return (
+            37.7749 + t * (37.3382 - 37.7749) + rng.gauss(0, 0.04),
+            -122.4194 + t * (-121.8863 + 122.4194) + rng.gauss(0, 0.04),
+        )
+
+    for i in range(count):
+        pickup, dropoff = point(i), point(i)
+        db.add(Package(
+            tracking_id=generate_tracking_id(),
+            sender_id=sender.id,
+            description=f"Backend package {i}",
+            size=rng.choice(sizes),
+            weight_kg=round(rng.uniform(0.5, 30.0), 1),
+            pickup_address="Pickup",
+            pickup_lat=pickup[0],
+            pickup_lng=pickup[1],
+            dropoff_address="Dropoff",
+            dropoff_lat=dropoff[0],
+            dropoff_lng=dropoff[1],
+            status=PackageStatus.OPEN_FOR_BIDS if i % 10 else PackageStatus.NEW,
+            is_active=i % 17 != 0
+        ))
+    db.commit()
+
+
+def ranked(matches):
+    return [
+        (m['package'].description, m['distance_from_route_km'], m['estimated_detour_km'])
+        for m in matches
+    ]
+
+
+class TestBackendsAgree:
+    """Each backend returns the full-scan ranking."""
+
+    @pytest.fixture
+    def data(self, backend, factory):
+        db, engine = backend
+        factory = factory.using(db)
+        sender = factory.user(UserRole.SENDER)
+        courier = factory.user(UserRole.COURIER)
+        seed_packages(db, sender)
+        return factory, engine, courier
+
+    def assert_same_ranking(self, db, engine, route, capacity=None):
+        expected = MatchingEngine(prefilter=FullScanPrefilter()).match_route(db, route, capacity)
+        assert expected
+        assert ranked(engine.match_route(db, route, capacity)) == ranked(expected)
+
+    def test_straight_route(self, data):
+        factory, engine, courier = data
+        self.assert_same_ranking(factory.db, engine, factory.route(courier))
+
+    def test_narrow_corridor(self, data):
+        factory, engine, courier = data
+        self.assert_same_ranking(factory.db, engine, factory.route(courier, max_deviation_km=3))
+
+    def test_waypoint_route(self, data):
+        factory, engine, courier = data
+        route = factory.route(courier, waypoints=[(37.8044, -122.2712), (37.5485, -121.9886)])
+        self.assert_same_ranking(factory.db, engine, route)
+
+    def test_capacity(self, data):
+        factory, engine, courier = data
+        capacity = CourierCapacity(max_weight_kg=10.0, max_size=PackageSize.MEDIUM)
+        self.assert_same_ranking(factory.db, engine, factory.route(courier), capacity)
+
+    def test_count_matches(self, data):
+        factory, engine, courier = data
+        route = factory.route(courier)
+        expected = MatchingEngine(prefilter=FullScanPrefilter()).count_matches(factory.db, route)
+        assert engine.count_matches(factory.db, route) == expected
+
+
+class TestPostGISPrefilter:
+    """Tests for PostGIS detection and query building."""
+
+    def test_not_available_on_sqlite(self, db_session):
+        assert postgis_available(db_session) is False
+
+    def test_disabled_by_setting(self, postgis_session, monkeypatch):
+        monkeypatch.setattr(settings, "MATCHING_BACKEND", "python")
+        assert postgis_available(postgis_session) is False
+
+    def test_route_line_follows_waypoints(self, factory, courier):
+        straight = factory.route(courier)
+        winding = factory.route(courier, waypoints=[(37.8044, -122.2712)])
+
+        assert route_line_wkt(straight) == "LINESTRING (-122.4194 37.7749, -121.8863 37.3382)"
+        assert route_line_wkt(winding) == (
+            "LINESTRING (-122.4194 37.7749, -122.2712 37.8044, -121.8863 37.3382)"
+        )
+
+    def test_query_uses_geography_columns(self, db_session, factory, courier):
+        route = factory.route(courier)
+
+        sql = str(open_packages_within_route_query(db_session, route).statement.compile(
+            dialect=postgresql.dialect(),
+            compile_kwargs={"literal_binds": True}
+        ))
+
+        assert "ST_DWithin(packages.pickup_geog" in sql
+        assert "ST_DWithin(packages.dropoff_geog" in sql
+        assert "ST_Segmentize" in sql
+        assert "10500.0" in sql
@@ -0,0 +1,255 @@
+"""Tests for the shared matching engine."""
+import random
+
+import pytest
+
+from app.config import settings
+from app.models.package import Package, PackageStatus
+from app.utils.polyline import encode_polyline
+from app.services import matching_engine as matching_engine_module
+from app.services.package_snapshot import PackageSnapshot, open_package_snapshot, route_spec
+from app.services.package_status import transition_package
+from app.services.spatial_index import package_index
+from app.services.matching_engine import (
+    MatchingEngine,
+    FullScanPrefilter,
+    BoundingBoxPrefilter,
+    SpatialIndexPrefilter,
+    CorridorScorer,
+    DetourRanker,
+    matching_engine,
+)
+
+
+@pytest.fixture
+def route(factory, courier):
+    """San Francisco -> San Jose route."""
+    return factory.route(courier)
+
+
+@pytest.fixture
+def random_packages(factory, sender):
+    """Open packages scattered around the Bay Area."""
+    rng = random.Random(3)
+    return [
+        factory.package(
+            sender,
+            (rng.uniform(37.0, 38.2), rng.uniform(-122.8, -121.5)),
+            (rng.uniform(37.0, 38.2), rng.uniform(-122.8, -121.5)),
+            description=f"Random package {i}"
+        )
+        for i in range(150)
+    ]
+
+
+class TestMatchingEngine:
+    """Tests for the prefilter, scoring and ranking stages."""
+
+    def test_index_prefilter_matches_full_scan(self, db_session, route, random_packages):
+        """The spatial index prefilter does not change match results."""
+        full_scan = MatchingEngine(prefilter=FullScanPrefilter()).match_route(db_session, route)
+        indexed = MatchingEngine(prefilter=SpatialIndexPrefilter()).match_route(db_session, route)
+
+        assert full_scan
+        assert [(m['package'].id, m['estimated_detour_km']) for m in indexed] == \
+            [(m['package'].id, m['estimated_detour_km']) for m in full_scan]
+
+    def test_bounding_box_prefilter_matches_full_scan(self, db_session, route, random_packages):
+        """The SQL bounding-box prefilter does not change match results."""
+        full_scan = MatchingEngine(prefilter=FullScanPrefilter()).match_route(db_session, route)
+        bbox = MatchingEngine(prefilter=BoundingBoxPrefilter()).match_route(db_session, route)
+
+        assert [m['package'].id for m in bbox] == [m['package'].id for m in full_scan]
+
+    def test_bounding_box_prefilter_skips_far_packages(self, db_session, factory, route, random_packages, sender):
+        """Packages outside the corridor bounding box are not loaded."""
+        far = factory.package(sender, (38.5816, -121.4944), (38.5449, -121.7405), description="Sacramento package")
+
+        candidates = BoundingBoxPrefilter().candidates(db_session, route)
+
+        assert far.id not in {p.id for p in candidates}
+        assert len(candidates) < len(FullScanPrefilter().candidates(db_session, route))
+
+    def test_matches_are_ranked_by_detour(self, db_session, route, random_packages):
+        """Matches come back shortest detour first."""
+        matches = matching_engine.match_route(db_session, route)
+        detours = [m['estimated_detour_km'] for m in matches]
+        assert detours == sorted(detours)
+
+    def test_matches_within_deviation(self, db_session, route, random_packages):
+        """Every match is within the route's max deviation."""
+        for match in matching_engine.match_route(db_session, route):
+            assert match['distance_from_route_km'] <= route.max_deviation_km
+
+    def test_count_matches(self, db_session, route, random_packages):
+        """count_matches agrees with match_route."""
+        assert matching_engine.count_matches(db_session, route) == \
+            len(matching_engine.match_route(db_session, route))
+
+    def test_fast_scorer_close_to_exact(self, db_session, route, random_packages):
+        """The fast scorer finds essentially the same matches as the exact one."""
+        exact = MatchingEngine(scorer=CorridorScorer(fast=False)).match_route(db_session, route)
+        fast = MatchingEngine(scorer=CorridorScorer(fast=True)).match_route(db_session, route)
+
+        exact_ids = {m['package'].id for m in exact}
+        fast_ids = {m['package'].id for m in fast}
+        # Only packages right at the deviation boundary may differ
+        assert len(exact_ids ^ fast_ids) <= 2
+
+    def test_custom_ranker(self, db_session, route, random_packages):
+        """Stages can be swapped out."""
+        class FarthestFirstRanker(DetourRanker):
+            def rank(self, matches):
+                return sorted(matches, key=lambda m: -m['estimated_detour_km'])
+
+        matches = MatchingEngine(ranker=FarthestFirstRanker()).match_route(db_session, route)
+        detours = [m['estimated_detour_km'] for m in matches]
+        assert detours == sorted(detours, reverse=True)
+
+    def test_top_pages_follow_ranking(self, db_session, route, random_packages):
+        """Top-K pages after a cursor concatenate to the full ranking."""
+        route.max_deviation_km = 40
+        db_session.commit()
+        full = matching_engine.match_route(db_session, route)
+        assert len(full) > 6
+
+        pages, after = [], None
+        while True:
+            page = matching_engine.match_route_top(db_session, route, limit=4, after=after)
+            if not page:
+                break
+            pages.extend(page)
+            after = (page[-1]['estimated_detour_km'], page[-1]['package'].id)
+
+        assert [m['package'].id for m in pages] == [m['package'].id for m in full]
+
+    def test_no_packages(self, db_session, route):
+        """A route with no open packages has no matches."""
+        assert matching_engine.match_route(db_session, route) == []
+        assert matching_engine.count_matches(db_session, route) == 0
+
+    def test_route_geometry_limit_keeps_top_detours(self):
+        """Scoring with a limit returns the same shortest detours as scoring everything."""
+        rng = random.Random(7)
+        geometries = {}
+        for route_id in range(400):
+            lat, lng = rng.uniform(37.0, 38.2), rng.uniform(-122.8, -121.5)
+            geometries[route_id] = (
+                lat, lng, lat + rng.uniform(-0.5, 0.5), lng + rng.uniform(-0.5, 0.5), rng.choice([5, 10, 20])
+            )
+        package = Package(pickup_lat=37.44, pickup_lng=-122.14, dropoff_lat=37.38, dropoff_lng=-122.08)
+        scorer = CorridorScorer(fast=False)
+
+        def top(scores):
+            return sorted(scores.items(), key=lambda item: (item[1][1], item[0]))[:10]
+
+        assert top(scorer.score_route_geometry(package, geometries, limit=10)) == \
+            top(scorer.score_route_geometry(package, geometries))
+
+
+class TestBackendChoice:
+    """Tests for which layer serves the shared engine's route matching."""
+
+    @pytest.fixture(autouse=True)
+    def unloaded(self):
+        package_index.clear()
+        open_package_snapshot.clear()
+        yield
+        package_index.clear()
+        open_package_snapshot.clear()
+
+    def ids(self, matches):
+        return [m['package'].id for m in matches]
+
+    def test_snapshot_by_default(self, db_session, route, random_packages, monkeypatch):
+        """Without PostGIS, the default settings match on the snapshot and run no prefilter."""
+        def no_prefilter(*args):
+            raise AssertionError("prefilter used")
+        monkeypatch.setattr(matching_engine.prefilter, "candidates", no_prefilter)
+
+        assert matching_engine.backend(db_session) == "snapshot"
+        expected = self.ids(MatchingEngine(prefilter=FullScanPrefilter()).match_route(db_session, route))
+        assert expected
+        assert self.ids(matching_engine.match_route(db_session, route)) == expected
+        assert package_index.is_stale()
+
+    @pytest.mark.parametrize("index_enabled, backend", [(True, "spatial_index"), (False, "bounding_box")])
+    def test_prefilters_without_snapshot(self, db_session, route, random_packages, monkeypatch, index_enabled, backend):
+        """With the snapshot off, the spatial index serves matching, or the SQL corridor query without it."""
+        monkeypatch.setattr(settings, "MATCHING_SNAPSHOT_ENABLED", False)
+        monkeypatch.setattr(settings, "MATCHING_INDEX_ENABLED", index_enabled)
+
+        assert matching_engine.backend(db_session) == backend
+        expected = self.ids(MatchingEngine(prefilter=FullScanPrefilter()).match_route(db_session, route))
+        assert self.ids(matching_engine.match_route(db_session, route)) == expected
+        assert open_package_snapshot.is_stale()
+        assert package_index.is_stale() != index_enabled
+
+    def test_postgis_skips_snapshot(self, db_session, route, monkeypatch):
+        """On PostGIS, matching runs in the database even with the snapshot enabled."""
+        queried = []
+        monkeypatch.setattr(matching_engine_module, "postgis_available", lambda db: True)
+        monkeypatch.setattr(
+            matching_engine_module, "find_open_packages_within_route",
+            lambda db, route, capacity: queried.append(route.id) or []
+        )
+
+        assert matching_engine.backend(db_session) == "postgis"
+        assert matching_engine.match_route(db_session, route) == []
+        assert queried == [route.id]
+        assert open_package_snapshot.is_stale()
+
+    def test_unused_layers_track_nothing(self, db_session, factory, sender):
+        """Commits do not pile up in a snapshot or index no query has loaded."""
+        package = factory.package(sender)
+        _, error = transition_package(db_session, package, PackageStatus.CANCELED, actor_id=sender.id)
+        assert not error
+
+        assert not package_index._dirty_ids
+        assert not open_package_snapshot._dirty_ids
+        assert not open_package_snapshot._changes
+
+
+class TestWaypointRoutes:
+    """Tests for matching routes that follow a polyline."""
+
+    @pytest.fixture
+    def winding_route(self, db_session, route):
+        """SF -> Oakland -> Walnut Creek -> San Jose instead of straight down the peninsula."""
+        route.waypoints = encode_polyline([(37.8044, -122.2712), (37.9101, -122.0652)])
+        db_session.commit()
+        return route
+
+    def test_prefilters_match_full_scan(self, db_session, winding_route, random_packages):
+        """Index, bounding-box and snapshot matching agree with a full scan on a polyline."""
+        full_scan = MatchingEngine(prefilter=FullScanPrefilter()).match_route(db_session, winding_route)
+        expected = [(m['package'].id, m['estimated_detour_km']) for m in full_scan]
+
+        for prefilter in (SpatialIndexPrefilter(), BoundingBoxPrefilter()):
+            matches = MatchingEngine(prefilter=prefilter).match_route(db_session, winding_route)
+            assert [(m['package'].id, m['estimated_detour_km']) for m in matches] == expected
+
+        snapshot = PackageSnapshot.load(db_session)
+        assert full_scan
+        assert [(m[0], m[2]) for m in snapshot.match_route(route_spec(winding_route))] == expected
+
+    def test_follows_waypoints(self, db_session, factory, sender, winding_route):
+        """Packages along the waypoints match; packages on the straight line no longer do."""
+        walnut_creek = factory.package(sender, (37.9061, -122.0650), (37.8900, -122.0400))
+        palo_alto = factory.package(sender, (37.4419, -122.1430), (37.3861, -122.0839))
+
+        matched = {m['package'].id for m in matching_engine.match_route(db_session, winding_route)}
+
+        assert walnut_creek.id in matched
+        assert palo_alto.id not in matched
+
+    def test_match_package_uses_waypoints(self, db_session, factory, sender, winding_route):
+        """Reverse matching scores the package against the route's polyline."""
+        walnut_creek = factory.package(sender, (37.9061, -122.0650), (37.8900, -122.0400))
+        palo_alto = factory.package(sender, (37.4419, -122.1430), (37.3861, -122.0839))
+
+        matches = matching_engine.match_package(db_session, walnut_creek)
+        assert [m['route'].id for m in matches] == [winding_route.id]
+        assert matches[0]['estimated_detour_km'] == \
+            matching_engine.match_route(db_session, winding_route)[0]['estimated_detour_km']
+        assert matching_engine.match_package(db_session, palo_alto) == []
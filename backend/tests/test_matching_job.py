@@ -11,6 +11,7 @@ from app.services.matching_job import (
     haversine_distance,
     find_matching_packages_for_route,
     has_recent_match_notification,
+    recent_match_notification_pairs,
     create_match_notification,
     run_matching_job
 )
@@ -319,6 +320,55 @@ class TestHasRecentMatchNotification:
         )
         assert result is False
 
+    def test_bulk_lookup_returns_recent_pairs(self, db_session, notification_setup):
+        """The set-based lookup returns recent pairs and skips old ones."""
+        from sqlalchemy import text
+
+        setup = notification_setup
+        courier_id, package_id = setup["courier"].id, setup["package"].id
+
+        assert recent_match_notification_pairs(db_session, [courier_id]) == set()
+
+        notification = Notification(
+            user_id=courier_id,
+            type=NotificationType.PACKAGE_MATCH_FOUND,
+            message="Test match notification",
+            package_id=package_id,
+            read=False
+        )
+        db_session.add(notification)
+        db_session.commit()
+
+        assert recent_match_notification_pairs(db_session, [courier_id]) == {(courier_id, package_id)}
+        assert recent_match_notification_pairs(db_session, [setup["sender"].id]) == set()
+
+        db_session.execute(
+            text(f"UPDATE notifications SET created_at = datetime('now', '-25 hours') WHERE id = {notification.id}")
+        )
+        db_session.commit()
+
+        assert recent_match_notification_pairs(db_session, [courier_id], hours=24) == set()
+
+
+    def test_bulk_lookup_is_batched(self, db_session, notification_setup, monkeypatch):
+        """Couriers are looked up ID_BATCH_SIZE at a time with the same pairs."""
+        setup = notification_setup
+        users = [setup["courier"].id, setup["sender"].id]
+        for user_id in users:
+            db_session.add(Notification(
+                user_id=user_id,
+                type=NotificationType.PACKAGE_MATCH_FOUND,
+                message="Test match notification",
+                package_id=setup["package"].id,
+                read=False
+            ))
+        db_session.commit()
+        monkeypatch.setattr("app.services.matching_job.ID_BATCH_SIZE", 1)
+
+        assert recent_match_notification_pairs(db_session, users + [users[0]]) == {
+            (user_id, setup["package"].id) for user_id in users
+        }
+
 
 class TestCreateMatchNotification:
     """Tests for creating match notifications."""
@@ -463,22 +513,137 @@ class TestRunMatchingJob:
 
     def test_dry_run_does_not_create_notifications(self, db_session, matching_job_setup):
         """Dry run should not create notifications."""
-        from app.database import SessionLocal
+        results = run_matching_job(dry_run=True, db=db_session)
 
-        # Note: run_matching_job creates its own session, so we can't easily test this
-        # without mocking. This is more of an integration test.
-        pass  # Skip for unit tests
+        assert results['notifications_created'] == 1
+        assert db_session.query(Notification).count() == 0
 
     def test_job_returns_results_summary(self, db_session, matching_job_setup):
         """Job should return a summary of results."""
-        # This would require the job to use the test database
-        # For now, we test the result structure
-        expected_keys = [
-            'started_at', 'routes_processed', 'total_matches_found',
+        setup = matching_job_setup
+
+        results = run_matching_job(db=db_session)
+
+        for key in [
+            'started_at', 'completed_at', 'routes_processed', 'total_matches_found',
             'notifications_created', 'notifications_skipped', 'route_details'
+        ]:
+            assert key in results
+        assert results['routes_processed'] == 1
+        assert results['total_matches_found'] == 1
+
+        detail = results['route_details'][0]
+        assert detail['courier_name'] == "Job Courier"
+        assert detail['matched_packages'][0]['package_id'] == setup["package"].id
+        assert detail['matched_packages'][0]['tracking_id'] == setup["package"].tracking_id
+
+    def test_job_inserts_notifications(self, db_session, matching_job_setup):
+        """Notifications are bulk-inserted and not repeated on the next run."""
+        setup = matching_job_setup
+
+        first = run_matching_job(db=db_session)
+        second = run_matching_job(db=db_session)
+
+        notifications = db_session.query(Notification).filter(
+            Notification.user_id == setup["courier"].id,
+            Notification.type == NotificationType.PACKAGE_MATCH_FOUND
+        ).all()
+        assert len(notifications) == 1
+        assert notifications[0].package_id == setup["package"].id
+        assert notifications[0].read is False
+        assert "$30.00" in notifications[0].message
+        assert first['notifications_created'] == 1
+        assert second['notifications_created'] == 0
+        assert second['notifications_skipped'] == 1
+
+    def test_courier_with_several_routes_notified_once(self, db_session, matching_job_setup):
+        """A package matching two of a courier's routes yields one notification."""
+        setup = matching_job_setup
+        db_session.add(CourierRoute(
+            courier_id=setup["courier"].id,
+            start_address="Second start",
+            start_lat=40.7128,
+            start_lng=-74.0060,
+            end_address="Second end",
+            end_lat=40.7831,
+            end_lng=-73.9712,
+            max_deviation_km=8.0,
+            is_active=True
+        ))
+        db_session.commit()
+
+        results = run_matching_job(db=db_session)
+
+        assert results['total_matches_found'] == 2
+        assert results['notifications_created'] == 1
+        assert results['notifications_skipped'] == 1
+        assert db_session.query(Notification).filter(
+            Notification.type == NotificationType.PACKAGE_MATCH_FOUND
+        ).count() == 1
+
+    def test_own_package_not_notified(self, db_session, matching_job_setup):
+        """A courier's own open package on their route is neither matched nor notified."""
+        setup = matching_job_setup
+        own = Package(
+            tracking_id=generate_tracking_id(),
+            sender_id=setup["courier"].id,
+            description="Courier's own package",
+            size="small",
+            weight_kg=1.0,
+            status=PackageStatus.OPEN_FOR_BIDS,
+            pickup_address="Own pickup",
+            pickup_lat=40.7410,
+            pickup_lng=-73.9900,
+            dropoff_address="Own dropoff",
+            dropoff_lat=40.7610,
+            dropoff_lng=-73.9800,
+            price=20.00,
+            is_active=True
+        )
+        db_session.add(own)
+        db_session.commit()
+
+        results = run_matching_job(db=db_session)
+
+        matched = [p['package_id'] for p in results['route_details'][0]['matched_packages']]
+        assert matched == [setup["package"].id]
+        assert results['notifications_created'] == 1
+        assert db_session.query(Notification).filter(Notification.package_id == own.id).count() == 0
+
+    def test_matches_agree_with_route_matching(self, db_session, matching_job_setup):
+        """The snapshot-based job finds the same matches as the matching engine."""
+        setup = matching_job_setup
+
+        results = run_matching_job(dry_run=True, db=db_session)
+        expected = find_matching_packages_for_route(db_session, setup["route"])
+
+        matched = results['route_details'][0]['matched_packages']
+        assert [(p['package_id'], p['distance_km'], p['detour_km']) for p in matched] == [
+            (m['package'].id, m['distance_from_route_km'], m['estimated_detour_km']) for m in expected
         ]
-        # The actual job test would go here
-        pass
+
+    def test_sharded_run_matches_serial_run(self, db_session, matching_job_setup):
+        """Sharding routes across worker processes does not change the results."""
+        setup = matching_job_setup
+        for i in range(5):
+            db_session.add(CourierRoute(
+                courier_id=setup["courier"].id,
+                start_address=f"Start {i}",
+                start_lat=40.7128 + i * 0.01,
+                start_lng=-74.0060,
+                end_address=f"End {i}",
+                end_lat=40.7831,
+                end_lng=-73.9712 + i * 0.01,
+                max_deviation_km=5,
+                is_active=True
+            ))
+        db_session.commit()
+
+        serial = run_matching_job(dry_run=True, workers=1, db=db_session)
+        sharded = run_matching_job(dry_run=True, workers=2, db=db_session)
+
+        assert sharded['route_details'] == serial['route_details']
+        assert sharded['total_matches_found'] == 6
 
 
 class TestAdminMatchingJobEndpoint:
@@ -0,0 +1,309 @@
+"""Tests for the columnar package snapshots used by matching."""
+import math
+import random
+
+import pytest
+from sqlalchemy import update
+
+from app.models.user import User, UserRole
+from app.models.package import Package, PackageStatus, PackageSize, CourierRoute
+from app.utils.auth import get_password_hash
+from app.utils.tracking_id import generate_tracking_id
+from app.services.change_feed import package_changes
+from app.services.matching_engine import MatchingEngine, FullScanPrefilter
+from app.services.package_snapshot import OpenPackageSnapshot, PackageSnapshot, route_spec
+from app.services.package_status import transition_package
+
+
+class TestPackageSnapshot:
+    """Tests for snapshot construction and route matching."""
+
+    @pytest.fixture
+    def sender(self, db_session):
+        user = User(
+            email="snapshot_sender@test.com",
+            hashed_password=get_password_hash("password123"),
+            full_name="Snapshot Sender",
+            role=UserRole.SENDER,
+            is_active=True,
+            is_verified=True
+        )
+        db_session.add(user)
+        db_session.commit()
+        return user
+
+    @pytest.fixture
+    def packages(self, db_session, sender):
+        rng = random.Random(11)
+        for i in range(200):
+            db_session.add(Package(
+                tracking_id=generate_tracking_id(),
+                sender_id=sender.id,
+                description=f"Snapshot package {i}",
+                size=PackageSize.SMALL,
+                weight_kg=1.0,
+                pickup_address="Pickup",
+                pickup_lat=rng.uniform(37.0, 38.2),
+                pickup_lng=rng.uniform(-122.8, -121.5),
+                dropoff_address="Dropoff",
+                dropoff_lat=rng.uniform(37.0, 38.2),
+                dropoff_lng=rng.uniform(-122.8, -121.5),
+                status=PackageStatus.OPEN_FOR_BIDS if i % 10 else PackageStatus.BID_SELECTED,
+                is_active=True
+            ))
+        db_session.commit()
+
+    def test_load_only_open_packages(self, db_session, packages):
+        """Only active packages open for bids are loaded."""
+        snapshot = PackageSnapshot.load(db_session)
+        assert len(snapshot) == 180
+
+    def test_snapshot_is_read_only(self, db_session, packages):
+        """Snapshot arrays cannot be modified by shard workers."""
+        snapshot = PackageSnapshot.load(db_session)
+        with pytest.raises(ValueError):
+            snapshot.pickup_lat[0] = 0.0
+
+    def test_empty_snapshot(self):
+        """An empty snapshot has no matches."""
+        snapshot = PackageSnapshot.from_rows([])
+        assert snapshot.match_route((1, 37.7749, -122.4194, 37.3382, -121.8863, 10, math.inf, 3)) == []
+
+    def test_matches_agree_with_engine(self, db_session, sender, packages):
+        """Snapshot matching gives the same matches, metrics and order as the engine."""
+        courier = User(
+            email="snapshot_courier@test.com",
+            hashed_password=get_password_hash("password123"),
+            full_name="Snapshot Courier",
+            role=UserRole.COURIER,
+            is_active=True,
+            is_verified=True
+        )
+        db_session.add(courier)
+        db_session.commit()
+        route = CourierRoute(
+            courier_id=courier.id,
+            start_address="San Francisco, CA",
+            start_lat=37.7749,
+            start_lng=-122.4194,
+            end_address="San Jose, CA",
+            end_lat=37.3382,
+            end_lng=-121.8863,
+            max_deviation_km=15,
+            is_active=True
+        )
+        db_session.add(route)
+        db_session.commit()
+
+        snapshot = PackageSnapshot.load(db_session)
+        matches = snapshot.match_route(route_spec(route))
+        expected = MatchingEngine(prefilter=FullScanPrefilter()).match_route(db_session, route)
+
+        assert matches
+        assert matches == [
+            (m['package'].id, m['distance_from_route_km'], m['estimated_detour_km']) for m in expected
+        ]
+
+
+class TestSnapshotChanges:
+    """Tests for merging changes into a snapshot."""
+
+    rows = [
+        (1, 37.5, -122.0, 37.4, -122.1, 1.0, 0, 10.0),
+        (2, 37.1, -122.0, 37.2, -122.1, 2.0, 1, None),
+        (3, 37.9, -122.0, 37.8, -122.1, 3.0, 2, 30.0),
+    ]
+
+    def test_upsert_and_remove(self):
+        """Changed packages are replaced, removed ones dropped, order kept."""
+        snapshot = PackageSnapshot.from_rows(self.rows)
+        changed = snapshot.with_changes(
+            [(2, 37.7, -122.0, 37.2, -122.1, 2.0, 1, 20.0), (4, 37.3, -122.0, 37.2, -122.1, 4.0, 0, 40.0)],
+            removed_ids=[3]
+        )
+
+        assert list(changed.ids) == [4, 1, 2]
+        assert list(changed.pickup_lat) == sorted(changed.pickup_lat)
+        assert list(changed.price) == [40.0, 10.0, 20.0]
+        assert not changed.ids.flags.writeable
+
+    def test_original_unchanged(self):
+        """Readers holding the old snapshot keep seeing it."""
+        snapshot = PackageSnapshot.from_rows(self.rows)
+        snapshot.with_changes([], removed_ids=[1, 2, 3])
+        assert len(snapshot) == 3
+
+    def test_missing_price_is_nan(self):
+        snapshot = PackageSnapshot.from_rows(self.rows)
+        assert math.isnan(snapshot.price[list(snapshot.ids).index(2)])
+
+
+class TestOpenPackageSnapshot:
+    """Tests for the shared snapshot kept current from package changes."""
+
+    @pytest.fixture
+    def store(self):
+        return OpenPackageSnapshot()
+
+    @pytest.fixture
+    def sender(self, db_session):
+        user = User(
+            email="shared_snapshot_sender@test.com",
+            hashed_password=get_password_hash("password123"),
+            full_name="Shared Snapshot Sender",
+            role=UserRole.SENDER,
+            is_active=True,
+            is_verified=True
+        )
+        db_session.add(user)
+        db_session.commit()
+        return user
+
+    def make_package(self, db_session, sender, **overrides):
+        data = dict(
+            tracking_id=generate_tracking_id(),
+            sender_id=sender.id,
+            description="Shared snapshot package",
+            size=PackageSize.SMALL,
+            weight_kg=1.0,
+            pickup_address="Palo Alto, CA",
+            pickup_lat=37.4419,
+            pickup_lng=-122.1430,
+            dropoff_address="Mountain View, CA",
+            dropoff_lat=37.3861,
+            dropoff_lng=-122.0839,
+            status=PackageStatus.OPEN_FOR_BIDS,
+            price=12.5,
+            is_active=True
+        )
+        data.update(overrides)
+        package = Package(**data)
+        db_session.add(package)
+        db_session.commit()
+        return package
+
+    def test_reused_until_changed(self, db_session, sender, store):
+        """Reads share one snapshot until a package changes."""
+        self.make_package(db_session, sender)
+        first = store.current(db_session)
+
+        assert store.current(db_session) is first
+        assert list(first.price) == [12.5]
+
+    def test_committed_changes_merged(self, db_session, sender, store):
+        """New, moved and deactivated packages are merged on the next read."""
+        package = self.make_package(db_session, sender)
+        store.current(db_session)
+
+        other = self.make_package(db_session, sender, pickup_lat=37.5)
+        package.is_active = False
+        db_session.commit()
+        # The session hooks feed the shared store; replay them on this one
+        store.mark_dirty([package.id, other.id])
+
+        snapshot = store.current(db_session)
+        assert list(snapshot.ids) == [other.id]
+        assert list(snapshot.pickup_lat) == [37.5]
+
+    def reopen_elsewhere(self, db_session, package):
+        """Reopen a package the way another process would: no commit hook runs here."""
+        db_session.execute(
+            update(Package).where(Package.id == package.id).values(status=PackageStatus.OPEN_FOR_BIDS)
+        )
+        db_session.commit()
+
+    def test_other_process_changes_merged(self, db_session, sender, change_feed):
+        """Packages changed by another process are merged once the change feed has them."""
+        store = OpenPackageSnapshot(changes=package_changes)
+        package = self.make_package(db_session, sender, status=PackageStatus.BID_SELECTED)
+        first = store.current(db_session)
+        assert len(first) == 0
+
+        self.reopen_elsewhere(db_session, package)
+        assert store.current(db_session) is first
+        package_changes.publish([package.id])
+
+        assert list(store.current(db_session).ids) == [package.id]
+
+    def test_trimmed_feed_reloads(self, db_session, sender, change_feed):
+        """When entries since the last read were trimmed, the snapshot is reloaded."""
+        store = OpenPackageSnapshot(changes=package_changes)
+        package = self.make_package(db_session, sender, status=PackageStatus.BID_SELECTED)
+        store.current(db_session)
+
+        self.reopen_elsewhere(db_session, package)
+        change_feed.streams[package_changes.stream].clear()
+        package_changes.publish([package.id + 1])
+
+        assert list(store.current(db_session).ids) == [package.id]
+
+    def test_shared_snapshot_follows_feed(self, db_session, sender, change_feed):
+        """The snapshot the matching engine uses by default reads the change feed."""
+        from app.services.package_snapshot import open_package_snapshot
+
+        package = self.make_package(db_session, sender, status=PackageStatus.BID_SELECTED)
+        open_package_snapshot.current(db_session)
+
+        self.reopen_elsewhere(db_session, package)
+        package_changes.publish([package.id])
+
+        assert package.id in open_package_snapshot.current(db_session).ids
+
+    def test_transition_recorded_without_query(self, db_session, sender, monkeypatch):
+        """Status transitions are merged from the package itself."""
+        from app.services import package_snapshot
+
+        package_snapshot.open_package_snapshot.clear()
+        package = self.make_package(db_session, sender)
+        assert package.id in package_snapshot.open_package_snapshot.current(db_session).ids
+
+        transition_package(db_session, package, PackageStatus.BID_SELECTED, actor_id=sender.id)
+
+        def no_query(db):
+            raise AssertionError("snapshot re-read a recorded package")
+        monkeypatch.setattr(package_snapshot, "_open_package_rows_query", no_query)
+
+        assert package.id not in package_snapshot.open_package_snapshot.current(db_session).ids
+
+    def test_engine_matches_agree(self, db_session, sender):
+        """The shared engine gives the same matches with and without the snapshot."""
+        from app.services.matching_engine import matching_engine
+
+        courier = User(
+            email="shared_snapshot_courier@test.com",
+            hashed_password=get_password_hash("password123"),
+            full_name="Shared Snapshot Courier",
+            role=UserRole.COURIER,
+            is_active=True,
+            is_verified=True
+        )
+        db_session.add(courier)
+        db_session.commit()
+        route = CourierRoute(
+            courier_id=courier.id,
+            start_address="San Francisco, CA",
+            start_lat=37.7749,
+            start_lng=-122.4194,
+            end_address="San Jose, CA",
+            end_lat=37.3382,
+            end_lng=-121.8863,
+            max_deviation_km=15,
+            is_active=True
+        )
+        db_session.add(route)
+        db_session.commit()
+
+        rng = random.Random(5)
+        for _ in range(60):
+            self.make_package(
+                db_session, sender,
+                pickup_lat=rng.uniform(37.2, 37.9), pickup_lng=rng.uniform(-122.5, -121.8),
+                dropoff_lat=rng.uniform(37.2, 37.9), dropoff_lng=rng.uniform(-122.5, -121.8)
+            )
+        expected = MatchingEngine(prefilter=FullScanPrefilter()).match_route(db_session, route)
+        matches = matching_engine.match_route(db_session, route)
+
+        assert expected
+        assert [(m['package'].id, m['estimated_detour_km']) for m in matches] == \
+            [(m['package'].id, m['estimated_detour_km']) for m in expected]
+        assert matching_engine.count_matches(db_session, route) == len(expected)
@@ -0,0 +1,38 @@
+"""Tests for app/utils/polyline.py - Encoded polyline format"""
+
+import pytest
+
+from app.utils.polyline import encode_polyline, decode_polyline
+
+
+class TestPolyline:
+    """Tests for polyline encoding and decoding"""
+
+    points = [(38.5, -120.2), (40.7, -120.95), (43.252, -126.453)]
+
+    def test_encode_reference_example(self):
+        """Encoding matches the reference example of the format"""
+        assert encode_polyline(self.points) == "_p~iF~ps|U_ulLnnqC_mqNvxq`@"
+
+    def test_round_trip(self):
+        """Decoded points equal the input rounded to the precision"""
+        points = [(37.774929, -122.419416), (37.338208, -121.886329), (-33.8688, 151.2093)]
+        decoded = decode_polyline(encode_polyline(points))
+        assert decoded == pytest.approx([(round(a, 5), round(b, 5)) for a, b in points])
+
+    def test_precision(self):
+        """A higher precision keeps more decimals"""
+        points = [(37.774929, -122.419416)]
+        assert decode_polyline(encode_polyline(points, precision=6), precision=6) == pytest.approx(points)
+
+    def test_empty(self):
+        """No points encode to an empty string"""
+        assert encode_polyline([]) == ""
+        assert decode_polyline("") == []
+
+    def test_invalid_input(self):
+        """Truncated or malformed strings are rejected"""
+        with pytest.raises(ValueError):
+            decode_polyline("_p~iF~ps|U_")
+        with pytest.raises(ValueError):
+            decode_polyline("_p~iF ~ps|U")
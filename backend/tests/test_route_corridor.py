@@ -0,0 +1,128 @@
+"""Tests for the precomputed route corridor geometry."""
+import numpy as np
+import pytest
+
+from app.models.package import CourierRoute
+from app.services.route_corridor import (
+    CORRIDOR_VERSION,
+    build_corridor,
+    corridor_from_payload,
+    corridor_of,
+    corridor_payload,
+    store_corridor,
+)
+from app.services.spatial_index import corridor_boxes, path_of
+from app.utils.geo import geodesic_distance_batch, polyline_corridor_distances_batch
+from app.utils.polyline import decode_polyline
+
+
+NEW_YORK, BOSTON = (40.7128, -74.0060), (42.3601, -71.0589)
+WAYPOINTS = [(41.3083, -72.9279), (41.8240, -71.4128)]
+
+
+@pytest.fixture
+def route(factory, courier):
+    """New York -> New Haven -> Providence -> Boston."""
+    return factory.route(courier, NEW_YORK, BOSTON, waypoints=WAYPOINTS)
+
+
+class TestBuildCorridor:
+    """Tests for computing a route's corridor."""
+
+    def test_straight_route(self, factory, courier):
+        """A straight route has its endpoints as path and one corridor box."""
+        route = factory.route(courier, NEW_YORK, BOSTON)
+        corridor = store_corridor(route)
+
+        assert corridor.path is None
+        assert corridor.path_lat == (40.7128, 42.3601)
+        assert list(corridor.boxes) == corridor_boxes(40.7128, -74.0060, 42.3601, -71.0589, 10)
+        assert corridor.envelope == corridor.boxes[0]
+        assert corridor.length_km == pytest.approx(
+            float(geodesic_distance_batch(40.7128, -74.0060, 42.3601, -71.0589)), abs=0.01
+        )
+
+    def test_route_with_waypoints(self, route):
+        """A route with waypoints keeps its vertices, boxes and per-segment vectors."""
+        corridor = corridor_of(route)
+
+        assert corridor.path == path_of(route)
+        assert list(corridor.boxes) == corridor_boxes(
+            route.start_lat, route.start_lng, route.end_lat, route.end_lng, 10, path_of(route)
+        )
+        assert len(corridor.unit_lat) == len(corridor.segment_length_deg) == 3
+        norms = np.hypot(corridor.unit_lat, corridor.unit_lng)
+        assert np.allclose(norms, 1.0)
+
+    def test_envelope_contains_boxes(self, route):
+        """The envelope covers every corridor box."""
+        corridor = corridor_of(route)
+        min_lat, max_lat, min_lng, max_lng = corridor.envelope
+        for box in corridor.boxes:
+            assert min_lat <= box[0] and box[1] <= max_lat
+            assert min_lng <= box[2] and box[3] <= max_lng
+
+    def test_outline_surrounds_route(self, route):
+        """The outline ring extends about max deviation beyond the route's vertices."""
+        corridor = store_corridor(route)
+        ring = decode_polyline(corridor.outline)
+
+        assert ring[0] == ring[-1]
+        lats = [lat for lat, _ in ring]
+        assert min(lats) < 40.7128 - 0.08
+        assert max(lats) > 42.3601 + 0.08
+
+    def test_segments_give_same_distances(self, route):
+        """Scoring with the stored segment vectors matches scoring without them."""
+        corridor = corridor_of(route)
+        rng = np.random.default_rng(7)
+        points = (
+            rng.uniform(40.5, 42.5, 50), rng.uniform(-74.2, -70.9, 50),
+            rng.uniform(40.5, 42.5, 50), rng.uniform(-74.2, -70.9, 50),
+        )
+
+        expected = polyline_corridor_distances_batch(*corridor.path, *points)
+        actual = polyline_corridor_distances_batch(*corridor.path, *points, segments=corridor.segments)
+        for a, b in zip(actual, expected):
+            assert np.allclose(a, b)
+
+
+class TestStoredCorridor:
+    """Tests for persisting corridors on routes."""
+
+    def test_payload_round_trip(self, route):
+        """A corridor survives serialization unchanged."""
+        corridor = build_corridor(
+            route.start_lat, route.start_lng, route.end_lat, route.end_lng, 10, route.waypoints
+        )
+
+        assert corridor_from_payload(corridor_payload(route, corridor)) == corridor
+
+    def test_store_and_reload(self, db_session, route):
+        """The stored corridor is read back from the database as is."""
+        corridor = store_corridor(route)
+        db_session.commit()
+        db_session.expire_all()
+
+        reloaded = db_session.query(CourierRoute).get(route.id)
+        assert reloaded.corridor["version"] == CORRIDOR_VERSION
+        assert corridor_of(reloaded) == corridor
+
+    def test_stale_corridor_is_recomputed(self, route):
+        """Changing the route's geometry without storing again is not served stale data."""
+        store_corridor(route)
+        route.max_deviation_km = 20
+
+        corridor = corridor_of(route)
+        assert corridor.boxes == tuple(corridor_boxes(
+            route.start_lat, route.start_lng, route.end_lat, route.end_lng, 20, path_of(route)
+        ))
+
+    def test_route_without_corridor(self, route):
+        """Routes written without a corridor get the matching geometry computed on use."""
+        assert route.corridor is None
+
+        corridor = corridor_of(route)
+        assert corridor.path == path_of(route)
+        assert corridor.boxes == store_corridor(route).boxes
+        assert corridor.length_km is None and corridor.outline is None
@@ -0,0 +1,184 @@
+"""Tests for the pickup-and-delivery route optimizer."""
+import itertools
+import random
+import time
+from types import SimpleNamespace
+
+import pytest
+from fastapi import status
+
+from app.models.user import User
+from app.models.package import Package, PackageStatus, PackageSize, CourierRoute
+from app.services.route_optimizer import (
+    optimize_package_order,
+    optimize_stop_sequence,
+    route_distance_km,
+    tour_length,
+)
+from app.utils.geo import distance_matrix
+from app.utils.tracking_id import generate_tracking_id
+
+START = (40.60, -74.10)
+END = (40.90, -73.80)
+
+
+def fake_package(package_id, rng, package_status=PackageStatus.PENDING_PICKUP):
+    return SimpleNamespace(
+        id=package_id,
+        status=package_status,
+        pickup_address=f"Pickup {package_id}",
+        pickup_lat=40.6 + rng.random() * 0.3,
+        pickup_lng=-74.1 + rng.random() * 0.3,
+        pickup_contact_name=None,
+        pickup_contact_phone=None,
+        dropoff_address=f"Dropoff {package_id}",
+        dropoff_lat=40.6 + rng.random() * 0.3,
+        dropoff_lng=-74.1 + rng.random() * 0.3,
+        dropoff_contact_name=None,
+        dropoff_contact_phone=None,
+    )
+
+
+def assert_pickups_first(stops, packages):
+    picked_up = {p.id for p in packages if p.status == PackageStatus.IN_TRANSIT}
+    for stop in stops:
+        if stop["stop_type"] == "pickup":
+            picked_up.add(stop["package_id"])
+        else:
+            assert stop["package_id"] in picked_up
+
+
+class TestOptimizePackageOrder:
+    """Tests for stop ordering."""
+
+    def test_pickup_before_dropoff(self):
+        """Every dropoff comes after its pickup, even when it lies closer to the start."""
+        rng = random.Random(3)
+        packages = [fake_package(i, rng) for i in range(30)]
+        # Dropoff right at the route start, pickup near the end
+        packages[0].dropoff_lat, packages[0].dropoff_lng = START
+        packages[0].pickup_lat, packages[0].pickup_lng = 40.88, -73.82
+
+        stops = optimize_package_order(START, END, packages)
+
+        assert len(stops) == 60
+        assert [s["sequence_number"] for s in stops] == list(range(1, 61))
+        assert_pickups_first(stops, packages)
+
+    def test_in_transit_packages_only_dropoff(self):
+        """Packages already picked up contribute only their dropoff."""
+        rng = random.Random(5)
+        packages = [
+            fake_package(1, rng, PackageStatus.IN_TRANSIT),
+            fake_package(2, rng, PackageStatus.PENDING_PICKUP),
+        ]
+
+        stops = optimize_package_order(START, END, packages)
+
+        assert [(s["package_id"], s["stop_type"]) for s in stops if s["package_id"] == 1] == [(1, "dropoff")]
+        assert len(stops) == 3
+        assert "pickup" not in stops[0]
+
+    def test_matches_brute_force_on_small_instances(self):
+        """Small instances are solved optimally."""
+        for seed in range(5):
+            rng = random.Random(seed)
+            packages = [fake_package(i, rng) for i in range(3)]
+            points = [START, END]
+            pairs = []
+            for p in packages:
+                pairs.append((len(points), len(points) + 1))
+                points += [(p.pickup_lat, p.pickup_lng), (p.dropoff_lat, p.dropoff_lng)]
+            distances = distance_matrix([p[0] for p in points], [p[1] for p in points], fast=True)
+
+            best = min(
+                tour_length([0, *order, 1], distances)
+                for order in itertools.permutations(range(2, len(points)))
+                if all(order.index(pickup) < order.index(dropoff) for pickup, dropoff in pairs)
+            )
+            tour = optimize_stop_sequence(distances, pairs, time_budget_ms=1000)
+
+            assert tour_length(tour, distances) == pytest.approx(best)
+
+    def test_beats_naive_order(self):
+        """The optimized tour is much shorter than visiting packages one by one."""
+        rng = random.Random(7)
+        packages = [fake_package(i, rng) for i in range(40)]
+        naive = []
+        for p in packages:
+            naive += [{"lat": p.pickup_lat, "lng": p.pickup_lng}, {"lat": p.dropoff_lat, "lng": p.dropoff_lng}]
+
+        stops = optimize_package_order(START, END, packages)
+
+        assert route_distance_km(START, END, stops) < 0.5 * route_distance_km(START, END, naive)
+
+    def test_hundred_plus_stops_within_budget(self):
+        """120 packages (240 stops) are ordered well under a second."""
+        rng = random.Random(11)
+        packages = [fake_package(i, rng) for i in range(120)]
+
+        started = time.perf_counter()
+        stops = optimize_package_order(START, END, packages, time_budget_ms=300)
+        elapsed = time.perf_counter() - started
+
+        assert len(stops) == 240
+        assert elapsed < 1.0
+        assert_pickups_first(stops, packages)
+
+
+class TestOptimizedRouteEndpoint:
+    """Tests for GET /api/matching/optimized-route/{route_id}."""
+
+    def test_returns_ordered_stops(self, client, db_session, authenticated_courier, authenticated_sender):
+        """Accepted packages come back in a feasible order with the tour length."""
+        courier = db_session.query(User).filter(User.email == "courier@example.com").first()
+        sender = db_session.query(User).filter(User.email == "test@example.com").first()
+        route = CourierRoute(
+            courier_id=courier.id,
+            start_address="Start",
+            start_lat=START[0],
+            start_lng=START[1],
+            end_address="End",
+            end_lat=END[0],
+            end_lng=END[1],
+            max_deviation_km=10,
+            is_active=True
+        )
+        db_session.add(route)
+
+        rng = random.Random(13)
+        packages = []
+        for i in range(6):
+            fake = fake_package(i, rng, PackageStatus.IN_TRANSIT if i == 0 else PackageStatus.PENDING_PICKUP)
+            package = Package(
+                tracking_id=generate_tracking_id(),
+                sender_id=sender.id,
+                courier_id=courier.id,
+                description=f"Optimizer package {i}",
+                size=PackageSize.SMALL,
+                weight_kg=1.0,
+                pickup_address=fake.pickup_address,
+                pickup_lat=fake.pickup_lat,
+                pickup_lng=fake.pickup_lng,
+                dropoff_address=fake.dropoff_address,
+                dropoff_lat=fake.dropoff_lat,
+                dropoff_lng=fake.dropoff_lng,
+                status=fake.status,
+                is_active=True
+            )
+            packages.append(package)
+        db_session.add_all(packages)
+        db_session.commit()
+
+        response = client.get(
+            f"/api/matching/optimized-route/{route.id}",
+            headers={"Authorization": f"Bearer {authenticated_courier}"}
+        )
+
+        assert response.status_code == status.HTTP_200_OK
+        data = response.json()
+        assert data["total_stops"] == 11
+        assert data["total_distance_km"] == pytest.approx(
+            route_distance_km(START, END, data["stops"]), abs=0.01
+        )
+        assert_pickups_first(data["stops"], packages)
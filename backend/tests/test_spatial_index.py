@@ -0,0 +1,387 @@
+"""Tests for the package spatial index used by route matching."""
+import random
+
+import pytest
+from shapely.geometry import LineString, Point
+from shapely.ops import nearest_points
+
+from sqlalchemy import update
+
+from app.config import settings
+from app.models.package import CourierRoute, Package, PackageStatus
+from app.services.change_feed import package_changes, route_changes
+from app.utils.geo import haversine_distance
+from app.utils.geohash import encode
+from app.services.spatial_index import (
+    MAX_GEOHASH_CELLS,
+    PackageSpatialIndex,
+    corridor_boxes,
+    corridor_geohashes,
+    open_packages_in_corridor_query,
+    open_packages_near_point_query,
+    routes_starting_near_point_query,
+    path_corridor_cells,
+    segment_corridor_cells,
+    find_open_packages_near_route,
+    package_index,
+    route_index,
+)
+
+
+def exact_route_distance(route, lat, lng):
+    """Distance used by the matching code: geodesic to nearest point on the route line."""
+    line = LineString([(route[1], route[0]), (route[3], route[2])])
+    nearest = nearest_points(line, Point(lng, lat))[0]
+    return haversine_distance(lat, lng, nearest.y, nearest.x)
+
+
+class TestSegmentCorridorCells:
+    """Tests for corridor rasterization."""
+
+    def test_endpoints_are_covered(self):
+        """Both route endpoints fall inside the corridor."""
+        cells = segment_corridor_cells(37.7749, -122.4194, 37.3382, -121.8863, 5, 0.05)
+        index = PackageSpatialIndex(cell_deg=0.05)
+        assert index.cell_for(37.7749, -122.4194) in cells
+        assert index.cell_for(37.3382, -121.8863) in cells
+
+    def test_vertical_segment(self):
+        """A north-south route produces a single band of columns."""
+        cells = segment_corridor_cells(40.0, -74.0, 41.0, -74.0, 1, 0.05)
+        cols = {c for _, c in cells}
+        assert len(cols) <= 3
+
+    def test_huge_corridor_returns_none(self):
+        """Corridors near the poles are too large to rasterize."""
+        assert segment_corridor_cells(89.9, -180, 89.9, 179, 50, 0.01) is None
+
+    def test_corridor_contains_all_exact_matches(self):
+        """Every point the exact check accepts is inside the corridor cells."""
+        rng = random.Random(42)
+        index = PackageSpatialIndex(cell_deg=0.05)
+        route = (40.7128, -74.0060, 40.9000, -73.5000)
+        deviation = 5
+
+        cells = segment_corridor_cells(*route, deviation, index.cell_deg)
+
+        for _ in range(2000):
+            lat = rng.uniform(40.5, 41.1)
+            lng = rng.uniform(-74.3, -73.2)
+            if exact_route_distance(route, lat, lng) <= deviation:
+                assert index.cell_for(lat, lng) in cells
+
+
+class TestPathCorridor:
+    """Tests for corridors of routes with waypoints."""
+
+    # South, then east: an L-shaped route whose straight line cuts the corner
+    path = ((37.0, 37.5, 37.5), (-122.0, -122.0, -121.5))
+
+    def test_cells_follow_segments(self):
+        """Polyline cells cover the corner but not the far side of the bounding box."""
+        index = PackageSpatialIndex(cell_deg=0.05)
+        cells = path_corridor_cells(37.0, -122.0, 37.5, -121.5, 2, index.cell_deg, self.path)
+
+        assert index.cell_for(37.49, -121.99) in cells
+        assert index.cell_for(37.05, -121.55) not in cells
+        assert cells == segment_corridor_cells(37.0, -122.0, 37.5, -122.0, 2, 0.05) | \
+            segment_corridor_cells(37.5, -122.0, 37.5, -121.5, 2, 0.05)
+
+    def test_straight_route_unchanged(self):
+        """Without a path the corridor is the single start-end segment."""
+        assert path_corridor_cells(37.0, -122.0, 37.5, -121.5, 2, 0.05) == \
+            segment_corridor_cells(37.0, -122.0, 37.5, -121.5, 2, 0.05)
+
+    def test_boxes_split_long_paths(self):
+        """A long polyline is covered by a bounded number of per-run boxes."""
+        lats = tuple(37.0 + 0.01 * i for i in range(201))
+        lngs = tuple(-122.0 + 0.01 * (i % 2) for i in range(201))
+        boxes = corridor_boxes(lats[0], lngs[0], lats[-1], lngs[-1], 2, (lats, lngs), max_boxes=8)
+
+        assert len(boxes) == 8
+        for lat, lng in zip(lats, lngs):
+            assert any(b[0] <= lat <= b[1] and b[2] <= lng <= b[3] for b in boxes)
+
+    def test_boxes_skip_corner(self):
+        """Per-segment boxes leave out the corner the straight corridor box would include."""
+        boxes = corridor_boxes(37.0, -122.0, 37.5, -121.5, 2, self.path)
+        assert not any(b[0] <= 37.05 <= b[1] and b[2] <= -121.55 <= b[3] for b in boxes)
+
+    def test_index_query_with_path(self):
+        """The package index returns packages along the polyline only."""
+        index = PackageSpatialIndex(cell_deg=0.05)
+        index.upsert(1, 37.49, -121.99, 37.49, -121.8)  # Along the corner
+        index.upsert(2, 37.25, -121.75, 37.3, -121.7)  # On the straight line
+
+        assert index.query_corridor(37.0, -122.0, 37.5, -121.5, 2, path=self.path) == {1}
+        assert index.query_corridor(37.0, -122.0, 37.5, -121.5, 2) == {2}
+
+
+class TestCorridorGeohashes:
+    """Tests for the geohash cell cover of a corridor."""
+
+    def test_cover_contains_all_exact_matches(self):
+        """Every point the exact check accepts has its geohash in the cover."""
+        rng = random.Random(7)
+        route = (40.7128, -74.0060, 40.9000, -73.5000)
+        deviation = 5
+
+        precision, hashes = corridor_geohashes(*route, deviation)
+        hashes = set(hashes)
+        assert len(hashes) <= MAX_GEOHASH_CELLS
+
+        for _ in range(2000):
+            lat = rng.uniform(40.5, 41.1)
+            lng = rng.uniform(-74.3, -73.2)
+            if exact_route_distance(route, lat, lng) <= deviation:
+                assert encode(lat, lng, precision) in hashes
+
+    def test_point_cover(self):
+        """A degenerate route covers a circle around the point."""
+        precision, hashes = corridor_geohashes(37.7749, -122.4194, 37.7749, -122.4194, 2)
+        assert precision == 6
+        assert encode(37.7749, -122.4194, 6) in hashes
+        assert encode(37.7749 + 0.015, -122.4194, 6) in hashes
+        assert encode(37.7749 + 0.05, -122.4194, 6) not in hashes
+
+    def test_long_routes_use_coarser_cells(self):
+        """Longer corridors fall back to a coarser precision."""
+        short, _ = corridor_geohashes(37.7749, -122.4194, 37.3382, -121.8863, 5)
+        long, _ = corridor_geohashes(37.7749, -122.4194, 34.0522, -118.2437, 20)
+        assert long < short
+
+    def test_huge_corridor_has_no_cover(self):
+        """Continental corridors are left to the bounding-box predicates."""
+        assert corridor_geohashes(25.0, -125.0, 49.0, -67.0, 50) is None
+
+
+class TestPackageSpatialIndex:
+    """Tests for index maintenance and corridor queries."""
+
+    def test_query_returns_packages_in_corridor(self):
+        """Packages near the route are returned, far ones are not."""
+        index = PackageSpatialIndex(cell_deg=0.05)
+        index.upsert(1, 37.4419, -122.1430, 37.3861, -122.0839)  # Palo Alto -> Mountain View
+        index.upsert(2, 38.5816, -121.4944, 38.5449, -121.7405)  # Sacramento -> Davis
+
+        candidates = index.query_corridor(37.7749, -122.4194, 37.3382, -121.8863, 10)
+
+        assert 1 in candidates
+        assert 2 not in candidates
+
+    def test_dropoff_outside_corridor_excluded(self):
+        """A package is only a candidate if its dropoff is also in the corridor."""
+        index = PackageSpatialIndex(cell_deg=0.05)
+        index.upsert(1, 37.4419, -122.1430, 38.5449, -121.7405)
+
+        candidates = index.query_corridor(37.7749, -122.4194, 37.3382, -121.8863, 10)
+
+        assert candidates == set()
+
+    def test_upsert_moves_package(self):
+        """Re-inserting a package replaces its previous location."""
+        index = PackageSpatialIndex(cell_deg=0.05)
+        index.upsert(1, 38.5816, -121.4944, 38.5449, -121.7405)
+        index.upsert(1, 37.4419, -122.1430, 37.3861, -122.0839)
+
+        assert len(index) == 1
+        assert index.query_corridor(37.7749, -122.4194, 37.3382, -121.8863, 10) == {1}
+
+    def test_remove(self):
+        """Removed packages are no longer returned."""
+        index = PackageSpatialIndex(cell_deg=0.05)
+        index.upsert(1, 37.4419, -122.1430, 37.3861, -122.0839)
+        index.remove(1)
+        index.remove(99)  # Unknown ids are ignored
+
+        assert len(index) == 0
+        assert index.query_corridor(37.7749, -122.4194, 37.3382, -121.8863, 10) == set()
+
+
+class TestIndexSync:
+    """Tests that the shared index follows committed package changes."""
+
+    @pytest.fixture
+    def route(self, factory, courier):
+        return factory.route(courier)
+
+    def test_new_package_is_found(self, db_session, factory, sender, route):
+        """Packages committed after the index was built are picked up."""
+        package_index.ensure_fresh(db_session)
+        package = factory.package(sender)
+
+        found = find_open_packages_near_route(db_session, route)
+
+        assert [p.id for p in found] == [package.id]
+
+    def test_status_change_removes_package(self, db_session, factory, sender, route):
+        """Packages leaving OPEN_FOR_BIDS drop out of the index."""
+        package = factory.package(sender)
+        assert find_open_packages_near_route(db_session, route)
+
+        package.status = PackageStatus.BID_SELECTED
+        db_session.commit()
+
+        assert find_open_packages_near_route(db_session, route) == []
+        assert package.id not in package_index.query_corridor(
+            route.start_lat, route.start_lng, route.end_lat, route.end_lng, 10
+        )
+
+    def test_deactivated_package_removed(self, db_session, factory, sender, route):
+        """Soft-deleted packages drop out of the index."""
+        package = factory.package(sender)
+        assert find_open_packages_near_route(db_session, route)
+
+        package.is_active = False
+        db_session.commit()
+
+        assert find_open_packages_near_route(db_session, route) == []
+
+    def test_rolled_back_change_not_applied(self, db_session, factory, sender, route):
+        """Uncommitted changes do not affect the index."""
+        package = factory.package(sender)
+        assert find_open_packages_near_route(db_session, route)
+
+        package.status = PackageStatus.CANCELED
+        db_session.flush()
+        db_session.rollback()
+
+        assert [p.id for p in find_open_packages_near_route(db_session, route)] == [package.id]
+
+    def test_far_packages_not_loaded(self, db_session, factory, sender, route):
+        """Packages outside the corridor are never hydrated."""
+        near = factory.package(sender)
+        factory.package(sender, (38.5816, -121.4944), (38.5449, -121.7405))
+
+        found = find_open_packages_near_route(db_session, route)
+
+        assert [p.id for p in found] == [near.id]
+
+
+class TestCrossProcessSync:
+    """Tests that the shared indexes follow commits made by other processes."""
+
+    @pytest.fixture
+    def route(self, factory, courier):
+        return factory.route(courier)
+
+    def reopen_elsewhere(self, db_session, package):
+        """Reopen a package the way another process would: no commit hook runs here."""
+        db_session.execute(
+            update(Package).where(Package.id == package.id).values(status=PackageStatus.OPEN_FOR_BIDS)
+        )
+        db_session.commit()
+
+    def indexed(self, route):
+        return package_index.query_corridor(route.start_lat, route.start_lng, route.end_lat, route.end_lng, 10)
+
+    def test_commit_publishes_changes(self, db_session, factory, sender, courier, change_feed):
+        """Committed package and route ids are appended to the feeds."""
+        package = factory.package(sender)
+        route = factory.route(courier)
+
+        assert change_feed.streams[package_changes.stream][-1][1] == {"ids": str(package.id)}
+        assert change_feed.streams[route_changes.stream][-1][1] == {"ids": str(route.id)}
+
+    def test_reopened_package_is_found(self, db_session, factory, sender, route, change_feed):
+        """A package reopened by another process (e.g. the bid deadline job) is indexed on the next query."""
+        package = factory.package(sender, status=PackageStatus.BID_SELECTED)
+        assert find_open_packages_near_route(db_session, route) == []
+
+        self.reopen_elsewhere(db_session, package)
+        assert package.id not in self.indexed(route)
+        package_changes.publish([package.id])
+
+        assert [p.id for p in find_open_packages_near_route(db_session, route)] == [package.id]
+
+    def test_trimmed_feed_rebuilds(self, db_session, factory, sender, route, change_feed):
+        """When entries since the last read were trimmed, the index is rebuilt."""
+        package = factory.package(sender, status=PackageStatus.BID_SELECTED)
+        assert find_open_packages_near_route(db_session, route) == []
+
+        self.reopen_elsewhere(db_session, package)
+        change_feed.streams[package_changes.stream].clear()
+        package_changes.publish([package.id + 1])
+
+        assert [p.id for p in find_open_packages_near_route(db_session, route)] == [package.id]
+
+    def test_unreachable_feed_waits_for_max_age(self, db_session, factory, sender, route, change_feed, monkeypatch):
+        """Without Redis, other processes' changes show up after MATCHING_INDEX_MAX_AGE_SECONDS at the latest."""
+        package = factory.package(sender, status=PackageStatus.BID_SELECTED)
+        assert find_open_packages_near_route(db_session, route) == []
+        monkeypatch.setattr(package_changes, "_unavailable_until", float("inf"))
+
+        self.reopen_elsewhere(db_session, package)
+        package_changes.publish([package.id])
+        assert find_open_packages_near_route(db_session, route) == []
+
+        monkeypatch.setattr(settings, "MATCHING_INDEX_MAX_AGE_SECONDS", -1)
+        assert [p.id for p in find_open_packages_near_route(db_session, route)] == [package.id]
+
+    def test_activated_route_is_found(self, db_session, factory, sender, courier, change_feed):
+        """A route activated by another process is indexed on the next query."""
+        route = factory.route(courier, is_active=False)
+        package = factory.package(sender)
+        route_index.ensure_fresh(db_session)
+        assert route.id not in route_index.query_package(
+            package.pickup_lat, package.pickup_lng, package.dropoff_lat, package.dropoff_lng
+        )
+
+        db_session.execute(update(CourierRoute).where(CourierRoute.id == route.id).values(is_active=True))
+        db_session.commit()
+        route_changes.publish([route.id])
+        route_index.ensure_fresh(db_session)
+
+        assert route.id in route_index.query_package(
+            package.pickup_lat, package.pickup_lng, package.dropoff_lat, package.dropoff_lng
+        )
+
+
+class TestGeohashQueries:
+    """Tests for the geohash columns and the queries using them."""
+
+    def test_columns_follow_coordinates(self, db_session, factory, sender):
+        """Cell columns are filled on insert and updated when a point moves."""
+        package = factory.package(sender, (37.7749, -122.4194), (37.3382, -121.8863))
+        assert package.pickup_geohash_6 == "9q8yyk"
+        assert package.dropoff_geohash_4 == encode(37.3382, -121.8863, 4)
+
+        package.pickup_lat, package.pickup_lng = 40.7128, -74.0060
+        db_session.commit()
+
+        assert package.pickup_geohash_6 == encode(40.7128, -74.0060, 6)
+
+    def test_route_columns(self, db_session, factory, courier):
+        """Routes store the cells of their endpoints."""
+        route = factory.route(courier, (37.7749, -122.4194), (37.3382, -121.8863))
+        assert route.start_geohash_5 == encode(37.7749, -122.4194, 5)
+        assert route.end_geohash_5 == encode(37.3382, -121.8863, 5)
+
+    def test_corridor_query_uses_cells(self, db_session, factory, sender, courier):
+        """The corridor query keeps packages whose cells are in the cover."""
+        route = factory.route(courier, (37.7749, -122.4194), (37.3382, -121.8863))
+        near = factory.package(sender, (37.4419, -122.1430), (37.3861, -122.0839))
+        factory.package(sender, (38.5816, -121.4944), (38.5449, -121.7405))
+
+        found = open_packages_in_corridor_query(db_session, route).all()
+
+        assert [p.id for p in found] == [near.id]
+        assert "pickup_geohash_" in str(open_packages_in_corridor_query(db_session, route))
+
+    def test_packages_near_point(self, db_session, factory, sender):
+        """Only pickups within the radius' cells are returned."""
+        near = factory.package(sender, (37.7800, -122.4100), (37.3382, -121.8863))
+        factory.package(sender, (37.4419, -122.1430), (37.3861, -122.0839))
+
+        found = open_packages_near_point_query(db_session, 37.7749, -122.4194, 2).all()
+
+        assert [p.id for p in found] == [near.id]
+
+    def test_routes_starting_near_point(self, db_session, factory, courier):
+        """Only routes starting within the radius' cells are returned."""
+        near = factory.route(courier, (37.7800, -122.4100), (37.3382, -121.8863))
+        factory.route(courier, (37.3382, -121.8863), (37.7749, -122.4194))
+
+        found = routes_starting_near_point_query(db_session, 37.7749, -122.4194, 2).all()
+
+        assert [r.id for r in found] == [near.id]
@@ -666,6 +666,132 @@ class TestLocationUpdates:
         assert response.status_code == 200
 
 
+class TestLocationBatch:
+    """Tests for uploading several location fixes at once."""
+
+    def _active_session(self, db_session, package):
+        session = TrackingSession(
+            package_id=package.id,
+            courier_id=package.courier_id,
+            is_active=True,
+            started_at=datetime.utcnow() - timedelta(hours=1)
+        )
+        db_session.add(session)
+        db_session.commit()
+        return session
+
+    def test_upload_locations(self, client, courier_user, package_in_transit, db_session):
+        """All fixes are stored and the session moves to the latest one."""
+        session = self._active_session(db_session, package_in_transit)
+        recorded = datetime.utcnow() - timedelta(minutes=10)
+        fixes = [
+            {"latitude": 37.7750 + i * 0.001, "longitude": -122.4195, "timestamp": (recorded + timedelta(minutes=i)).isoformat()}
+            for i in range(5)
+        ]
+
+        response = client.post(
+            f"/api/tracking/sessions/{session.id}/locations",
+            headers=get_auth_header(courier_user),
+            json={"fixes": list(reversed(fixes))}
+        )
+
+        assert response.status_code == 200
+        data = response.json()
+        assert data["accepted"] == 5
+        assert data["location"]["latitude"] == pytest.approx(37.7790)
+        assert data["location"]["distance_remaining_meters"] is not None
+
+        stored = db_session.query(LocationUpdate).filter_by(session_id=session.id).all()
+        assert len(stored) == 5
+        db_session.refresh(session)
+        assert session.last_latitude == pytest.approx(37.7790)
+        assert session.last_location_at == recorded + timedelta(minutes=4)
+
+    def test_upload_older_batch_after_newer_fix(self, client, courier_user, package_in_transit, db_session):
+        """A batch buffered offline and uploaded after a newer live fix is stored without moving the session back."""
+        from app.services.redis_client import get_redis
+        from main import app
+
+        session = self._active_session(db_session, package_in_transit)
+        headers = get_auth_header(courier_user)
+        redis = AsyncMock()
+        redis.get_json.return_value = None
+        app.dependency_overrides[get_redis] = lambda: redis
+
+        response = client.post(
+            f"/api/tracking/sessions/{session.id}/location",
+            headers=headers,
+            json={"latitude": 37.7800, "longitude": -122.4195}
+        )
+        assert response.status_code == 200
+        redis.publish_location_update.reset_mock()
+
+        recorded = datetime.utcnow() - timedelta(minutes=10)
+        response = client.post(
+            f"/api/tracking/sessions/{session.id}/locations",
+            headers=headers,
+            json={"fixes": [
+                {"latitude": 37.7750 + i * 0.001, "longitude": -122.4195, "timestamp": (recorded + timedelta(minutes=i)).isoformat()}
+                for i in range(3)
+            ]}
+        )
+
+        assert response.status_code == 200
+        assert response.json()["accepted"] == 3
+        assert db_session.query(LocationUpdate).filter_by(session_id=session.id).count() == 4
+        db_session.refresh(session)
+        assert session.last_latitude == pytest.approx(37.7800)
+        redis.publish_location_update.assert_not_called()
+
+    def test_upload_locations_future_timestamp(self, client, courier_user, package_in_transit, db_session):
+        """Device times in the future are stored as the time of upload."""
+        session = self._active_session(db_session, package_in_transit)
+
+        response = client.post(
+            f"/api/tracking/sessions/{session.id}/locations",
+            headers=get_auth_header(courier_user),
+            json={"fixes": [{
+                "latitude": 37.7750,
+                "longitude": -122.4195,
+                "timestamp": (datetime.utcnow() + timedelta(days=1)).isoformat()
+            }]}
+        )
+
+        assert response.status_code == 200
+        stored = db_session.query(LocationUpdate).filter_by(session_id=session.id).one()
+        assert stored.timestamp <= datetime.utcnow()
+
+    def test_upload_locations_validation(self, client, courier_user, package_in_transit, db_session):
+        """Empty batches and invalid fixes are rejected without storing anything."""
+        session = self._active_session(db_session, package_in_transit)
+        headers = get_auth_header(courier_user)
+
+        response = client.post(
+            f"/api/tracking/sessions/{session.id}/locations", headers=headers, json={"fixes": []}
+        )
+        assert response.status_code == 422
+
+        response = client.post(
+            f"/api/tracking/sessions/{session.id}/locations",
+            headers=headers,
+            json={"fixes": [{"latitude": 37.7, "longitude": -122.4}, {"latitude": 95.0, "longitude": -122.4}]}
+        )
+        assert response.status_code == 422
+        assert db_session.query(LocationUpdate).filter_by(session_id=session.id).count() == 0
+
+    def test_upload_locations_wrong_courier(self, client, sender_user, package_in_transit, db_session):
+        """Only the session's courier can upload fixes."""
+        session = self._active_session(db_session, package_in_transit)
+
+        response = client.post(
+            f"/api/tracking/sessions/{session.id}/locations",
+            headers=get_auth_header(sender_user),
+            json={"fixes": [{"latitude": 37.7750, "longitude": -122.4195}]}
+        )
+
+        assert response.status_code == 403
+
+
 class TestLocationHistory:
     """Tests for location history functionality."""
 
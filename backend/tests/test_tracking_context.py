@@ -0,0 +1,240 @@
+"""Tests for the cached context of active tracking sessions."""
+import asyncio
+from unittest.mock import AsyncMock, patch
+
+import pytest
+from sqlalchemy import event
+
+from app.config import settings
+from app.models.package import PackageStatus
+from app.models.tracking import TrackingSession
+from app.models.user import User
+from app.services.tracking_context import SessionContext, TrackingContextCache, tracking_context
+from app.services.tracking_service import TrackingService
+
+
+CONTEXT = SessionContext(
+    session_id=7,
+    courier_id=3,
+    package_id=5,
+    dropoff_lat=37.7849,
+    dropoff_lng=-122.4094,
+    share_live_location=True,
+    update_interval_seconds=30,
+)
+
+
+@pytest.fixture
+def package(factory, sender, courier):
+    """A package in transit with its courier."""
+    return factory.package(
+        sender, (37.7749, -122.4194), (37.7849, -122.4094),
+        courier_id=courier.id, status=PackageStatus.IN_TRANSIT
+    )
+
+
+def count_selects(db_session):
+    """Start counting the SELECT statements run on the session's engine."""
+    selects = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith("SELECT"):
+            selects.append(statement)
+
+    event.listen(db_session.get_bind(), "before_cursor_execute", before_cursor_execute)
+    return selects, lambda: event.remove(db_session.get_bind(), "before_cursor_execute", before_cursor_execute)
+
+
+class TestTrackingContextCache:
+    """Tests for the two-layer context cache."""
+
+    def test_local_round_trip(self):
+        """A cached context is returned from the process without Redis."""
+        cache = TrackingContextCache()
+        asyncio.run(cache.put(CONTEXT))
+
+        assert asyncio.run(cache.get(CONTEXT.session_id)) == CONTEXT
+        assert cache.hits == 1 and cache.misses == 0
+
+    def test_local_entry_expires(self):
+        """Local entries are only trusted for the local TTL."""
+        cache = TrackingContextCache()
+        with patch.object(settings, "TRACKING_CONTEXT_LOCAL_TTL_SECONDS", 0):
+            asyncio.run(cache.put(CONTEXT))
+            assert asyncio.run(cache.get(CONTEXT.session_id)) is None
+        assert cache.misses == 1
+
+    def test_local_cache_is_bounded(self):
+        """The least recently used entries are dropped beyond the bound."""
+        cache = TrackingContextCache()
+        with patch.object(settings, "TRACKING_CONTEXT_LOCAL_MAX_ENTRIES", 2):
+            for session_id in (1, 2, 3):
+                asyncio.run(cache.put(CONTEXT._replace(session_id=session_id)))
+
+            assert asyncio.run(cache.get(1)) is None
+            assert asyncio.run(cache.get(3)).session_id == 3
+
+    def test_redis_shares_context_between_workers(self):
+        """A context put with Redis is found by another process's cache."""
+        store = {}
+        redis = AsyncMock()
+        redis.set_json.side_effect = lambda key, value, ttl: store.__setitem__(key, value)
+        redis.get_json.side_effect = lambda key: store.get(key)
+
+        asyncio.run(TrackingContextCache().put(CONTEXT, redis))
+        other = TrackingContextCache()
+
+        assert asyncio.run(other.get(CONTEXT.session_id, redis)) == CONTEXT
+        assert redis.set_json.call_args[0][2] == settings.TRACKING_CONTEXT_TTL_SECONDS
+
+    def test_evict_leaves_tombstone(self):
+        """An evicted session is a miss locally and for other workers."""
+        store = {}
+        redis = AsyncMock()
+        redis.set_json.side_effect = lambda key, value, ttl: store.__setitem__(key, value)
+        redis.get_json.side_effect = lambda key: store.get(key)
+        cache = TrackingContextCache()
+
+        asyncio.run(cache.put(CONTEXT, redis))
+        asyncio.run(cache.evict(CONTEXT.session_id, redis))
+
+        assert asyncio.run(cache.get(CONTEXT.session_id, redis)) is None
+        assert asyncio.run(TrackingContextCache().get(CONTEXT.session_id, redis)) is None
+
+    def test_redis_errors_are_misses(self):
+        """An unavailable Redis degrades to the database, it does not fail updates."""
+        redis = AsyncMock()
+        redis.get_json.side_effect = ConnectionError("redis down")
+
+        assert asyncio.run(TrackingContextCache().get(CONTEXT.session_id, redis)) is None
+
+    def test_disabled(self):
+        """With the cache disabled nothing is stored."""
+        cache = TrackingContextCache()
+        with patch.object(settings, "TRACKING_CONTEXT_CACHE_ENABLED", False):
+            asyncio.run(cache.put(CONTEXT))
+            assert asyncio.run(cache.get(CONTEXT.session_id)) is None
+
+
+class TestCachedLocationUpdates:
+    """Tests for location updates served from the context cache."""
+
+    def test_start_populates_and_end_evicts(self, db_session, package):
+        """Starting a session caches its context; ending it forgets it."""
+        service = TrackingService(db_session)
+        session = asyncio.run(service.start_tracking_session(package.id, package.courier_id))
+
+        context = asyncio.run(tracking_context.get(session.id))
+        assert context == SessionContext.of(session, package)
+
+        asyncio.run(service.end_tracking_session(session.id))
+        assert asyncio.run(tracking_context.get(session.id)) is None
+
+    def test_update_without_selects(self, db_session, package):
+        """With a warm cache a location update validates and computes its ETA without SELECTs."""
+        service = TrackingService(db_session)
+        session = asyncio.run(service.start_tracking_session(package.id, package.courier_id))
+        session_id, courier_id = session.id, package.courier_id
+        db_session.expunge_all()
+
+        selects, stop = count_selects(db_session)
+        try:
+            location, view = asyncio.run(service.record_locations(
+                session_id, [{"latitude": 37.7750, "longitude": -122.4195}], courier_id=courier_id
+            ))
+        finally:
+            stop()
+
+        assert selects == []
+        assert view.distance_remaining_meters > 0
+        stored = db_session.get(TrackingSession, session_id)
+        assert stored.last_latitude == 37.7750
+        assert stored.distance_remaining_meters == pytest.approx(view.distance_remaining_meters)
+
+    def test_cached_context_checks_courier(self, db_session, package):
+        """A cached session still refuses updates from other couriers."""
+        service = TrackingService(db_session)
+        session = asyncio.run(service.start_tracking_session(package.id, package.courier_id))
+
+        with pytest.raises(ValueError, match="not found"):
+            asyncio.run(service.record_locations(
+                session.id, [{"latitude": 37.7750, "longitude": -122.4195}], courier_id=package.sender_id
+            ))
+
+    def test_stale_context_of_ended_session(self, db_session, package):
+        """A session ended by another worker is refused even while still cached here."""
+        service = TrackingService(db_session)
+        session = asyncio.run(service.start_tracking_session(package.id, package.courier_id))
+        session_id = session.id
+        session.is_active = False
+        db_session.commit()
+        db_session.expunge_all()
+
+        with pytest.raises(ValueError, match="not found"):
+            asyncio.run(service.update_location(session_id, 37.7750, -122.4195))
+        assert asyncio.run(tracking_context.get(session_id)) is None
+
+    def test_api_update_with_stale_context(self, client, db_session, package):
+        """A context cached for another courier is evicted everywhere and the update retried."""
+        from app.services.redis_client import get_redis
+        from app.utils.auth import create_access_token
+        from main import app
+
+        courier = db_session.get(User, package.courier_id)
+        headers = {"Authorization": f"Bearer {create_access_token({'sub': courier.email})}"}
+        redis = AsyncMock()
+        redis.get_json.return_value = None
+        app.dependency_overrides[get_redis] = lambda: redis
+        session = asyncio.run(TrackingService(db_session).start_tracking_session(package.id, courier.id))
+        asyncio.run(tracking_context.put(SessionContext.of(session, package)._replace(courier_id=package.sender_id)))
+
+        response = client.post(
+            f"/api/tracking/sessions/{session.id}/location",
+            headers=headers,
+            json={"latitude": 37.7750, "longitude": -122.4195}
+        )
+
+        assert response.status_code == 200
+        tombstone = [c for c in redis.set_json.call_args_list if c[0][0] == f"tracking:context:{session.id}"]
+        assert tombstone and tombstone[0][0][1] == {"ended": True}
+
+    def test_api_refused_retry_is_bad_request(self, client, db_session, package):
+        """An update still refused after the retry is answered with 400, not an error."""
+        from app.services.redis_client import get_redis
+        from app.utils.auth import create_access_token
+        from main import app
+
+        courier = db_session.get(User, package.courier_id)
+        headers = {"Authorization": f"Bearer {create_access_token({'sub': courier.email})}"}
+        app.dependency_overrides[get_redis] = lambda: None
+        session = asyncio.run(TrackingService(db_session).start_tracking_session(package.id, courier.id))
+
+        with patch.object(TrackingService, "record_locations", side_effect=ValueError("ended meanwhile")):
+            response = client.post(
+                f"/api/tracking/sessions/{session.id}/location",
+                headers=headers,
+                json={"latitude": 37.7750, "longitude": -122.4195}
+            )
+
+        assert response.status_code == 400
+
+    def test_api_update_with_cached_context(self, client, db_session, package):
+        """The location endpoint answers from the cached context like from the database."""
+        from app.services.redis_client import get_redis
+        from app.utils.auth import create_access_token
+        from main import app
+
+        courier = db_session.get(User, package.courier_id)
+        headers = {"Authorization": f"Bearer {create_access_token({'sub': courier.email})}"}
+        app.dependency_overrides[get_redis] = lambda: None
+        session = asyncio.run(TrackingService(db_session).start_tracking_session(package.id, courier.id))
+
+        response = client.post(
+            f"/api/tracking/sessions/{session.id}/location",
+            headers=headers,
+            json={"latitude": 37.7750, "longitude": -122.4195}
+        )
+
+        assert response.status_code == 200
+        assert response.json()["estimated_arrival"] is not None
+        assert response.json()["distance_remaining_meters"] > 0
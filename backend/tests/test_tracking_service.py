@@ -376,6 +376,41 @@ class TestLocationUpdates:
         mock_redis.publish_location_update.assert_not_called()
 
 
+class TestLocationBatch:
+    """Tests for recording a batch of location fixes."""
+
+    @pytest.mark.asyncio
+    async def test_update_locations_inserts_once(self, tracking_service, db_session, mock_redis, sample_package):
+        """Fixes are inserted in one statement and the latest one is broadcast once."""
+        session = TrackingSession(
+            id=1, package_id=1, courier_id=2, is_active=True,
+            started_at=datetime.utcnow(), share_live_location=True
+        )
+        db_session.query.return_value.filter.return_value.first.side_effect = [session, sample_package]
+        now = datetime.utcnow()
+        fixes = [
+            {"latitude": 37.7760, "longitude": -122.4190, "timestamp": now},
+            {"latitude": 37.7750, "longitude": -122.4195, "timestamp": now - timedelta(minutes=1)},
+        ]
+
+        latest = await tracking_service.update_locations(1, fixes)
+
+        db_session.execute.assert_called_once()
+        assert len(db_session.execute.call_args[0][1]) == 2
+        db_session.commit.assert_called_once()
+        assert latest.latitude == 37.7760
+        assert session.last_latitude == 37.7760
+        assert session.distance_remaining_meters > 0
+        mock_redis.publish_location_update.assert_called_once()
+        assert mock_redis.publish_location_update.call_args[0][1]["fix_count"] == 2
+
+    @pytest.mark.asyncio
+    async def test_update_locations_empty(self, tracking_service):
+        """An empty batch is rejected."""
+        with pytest.raises(ValueError, match="No location fixes"):
+            await tracking_service.update_locations(1, [])
+
+
 class TestLocationHistory:
     """Tests for location history retrieval."""
 
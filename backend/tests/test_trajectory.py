@@ -0,0 +1,204 @@
+"""Tests for compaction of ended tracking sessions' location history."""
+import asyncio
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+from app.models.package import PackageStatus
+from app.models.tracking import LocationUpdate
+from app.models.user import User
+from app.services.redis_client import get_redis
+from app.services.tracking_service import TrackingService
+from app.services.trajectory import (
+    TRACK_SOURCE,
+    TrackPoint,
+    compact_ended_sessions,
+    compact_session,
+    simplify_track,
+    track_payload,
+    track_points,
+)
+from app.utils.auth import create_access_token
+from main import app
+
+# About 11 m per 0.0001 degrees of latitude
+STEP_DEG = 0.0001
+
+
+@pytest.fixture
+def package(factory, sender, courier):
+    """A delivered package with its courier and sender."""
+    return factory.package(
+        sender, (37.7749, -122.4194), (37.7849, -122.4094),
+        courier_id=courier.id, status=PackageStatus.DELIVERED
+    )
+
+
+def add_session(factory, package, fixes=120, ended_minutes_ago=60, is_active=False):
+    """A session with a straight northbound track, then a turn east, one fix every 10 s."""
+    started = datetime.utcnow() - timedelta(minutes=ended_minutes_ago) - timedelta(seconds=10 * fixes)
+    session = factory.tracking_session(
+        package,
+        is_active=is_active,
+        started_at=started,
+        ended_at=None if is_active else started + timedelta(seconds=10 * fixes)
+    )
+
+    half = fixes // 2
+    factory.db.add_all([
+        LocationUpdate(
+            session_id=session.id,
+            latitude=37.7749 + STEP_DEG * min(i, half),
+            longitude=-122.4194 + STEP_DEG * max(i - half, 0),
+            speed_mps=1.1,
+            timestamp=started + timedelta(seconds=10 * i)
+        )
+        for i in range(fixes)
+    ])
+    factory.db.commit()
+    return session
+
+
+class TestSimplifyTrack:
+    """Tests for the Douglas-Peucker simplification."""
+
+    def test_straight_steady_track_keeps_endpoints(self):
+        """Fixes on a straight line at steady speed reduce to the first and last."""
+        n = 50
+        keep = simplify_track(37.0 + STEP_DEG * np.arange(n), np.full(n, -122.0), 10.0 * np.arange(n), 5)
+        assert list(keep) == [0, n - 1]
+
+    def test_turn_is_kept(self):
+        """The corner of an L-shaped track survives."""
+        lat = [37.0, 37.0 + STEP_DEG * 10, 37.0 + STEP_DEG * 10]
+        lng = [-122.0, -122.0, -122.0 + STEP_DEG * 10]
+        assert list(simplify_track(lat, lng, [0, 10, 20], 5)) == [0, 1, 2]
+
+    def test_stop_is_kept(self):
+        """Standing still on a straight line is kept, not interpolated away."""
+        lat = 37.0 + STEP_DEG * np.array([0, 10, 10, 10, 20])
+        seconds = [0, 10, 310, 610, 620]
+        keep = simplify_track(lat, np.full(5, -122.0), seconds, 5)
+        assert {1, 3} <= set(keep)
+
+    def test_short_tracks(self):
+        """Tracks of up to two fixes are kept as they are."""
+        assert list(simplify_track([], [], [], 5)) == []
+        assert list(simplify_track([37.0, 37.1], [-122.0, -122.0], [0, 1], 5)) == [0, 1]
+
+
+class TestTrackPayload:
+    """Tests for the stored track layout."""
+
+    def test_round_trip(self):
+        """Positions come back to polyline precision and times to the second."""
+        start = datetime(2026, 1, 1, 12, 0, 0)
+        points = [
+            TrackPoint(37.77491, -122.41941, start),
+            TrackPoint(37.78012, -122.41502, start + timedelta(seconds=95)),
+            TrackPoint(37.78493, -122.40944, start + timedelta(seconds=200)),
+        ]
+
+        decoded = track_points(track_payload(points, raw_count=20, tolerance_m=10))
+
+        assert [p.timestamp for p in decoded] == [p.timestamp for p in points]
+        for a, b in zip(decoded, points):
+            assert a.latitude == pytest.approx(b.latitude, abs=1e-5)
+            assert a.longitude == pytest.approx(b.longitude, abs=1e-5)
+
+    def test_missing_or_unknown_track(self):
+        """Sessions without a track, or with a track of another version, have no points."""
+        assert track_points(None) == []
+        assert track_points({"version": 0}) == []
+
+
+class TestCompaction:
+    """Tests for compacting sessions in the database."""
+
+    def test_compact_session(self, db_session, factory, package):
+        """The rows are replaced by a much smaller track on the session."""
+        session = add_session(factory, package)
+
+        removed = compact_session(db_session, session)
+        db_session.commit()
+
+        assert removed == 120
+        assert db_session.query(LocationUpdate).count() == 0
+        assert session.track["raw_count"] == 120
+        points = track_points(session.track)
+        assert 3 <= len(points) <= 12
+        assert points[0].latitude == pytest.approx(37.7749)
+
+    def test_only_ended_sessions_are_compacted(self, db_session, factory, package):
+        """Active and recently ended sessions keep their rows."""
+        ended = add_session(factory, package)
+        active = add_session(factory, package, is_active=True)
+        recent = add_session(factory, package, ended_minutes_ago=1)
+
+        result = compact_ended_sessions(db_session, delay_minutes=10)
+
+        assert result["sessions_compacted"] == 1
+        assert result["locations_removed"] == 120
+        assert ended.track is not None
+        assert active.track is None and recent.track is None
+        assert db_session.query(LocationUpdate).filter_by(session_id=active.id).count() == 120
+
+    def test_late_rows_are_merged(self, db_session, factory, package):
+        """Fixes written after compaction are folded into the existing track."""
+        session = add_session(factory, package)
+        compact_session(db_session, session)
+        db_session.commit()
+        last = track_points(session.track)[-1]
+
+        db_session.add(LocationUpdate(
+            session_id=session.id,
+            latitude=last.latitude + 0.01,
+            longitude=last.longitude,
+            timestamp=last.timestamp + timedelta(seconds=30)
+        ))
+        db_session.commit()
+        compact_session(db_session, session)
+        db_session.commit()
+
+        points = track_points(session.track)
+        assert points[-1].latitude == pytest.approx(last.latitude + 0.01)
+        assert session.track["raw_count"] == 121
+        assert db_session.query(LocationUpdate).count() == 0
+
+
+class TestCompactedHistory:
+    """Tests for serving location history from a compacted track."""
+
+    def test_service_history_from_track(self, db_session, factory, package):
+        """History of a compacted session is served from its track, newest first."""
+        session = add_session(factory, package)
+        compact_session(db_session, session)
+        db_session.commit()
+
+        history = asyncio.run(TrackingService(db_session).get_location_history(session.id, limit=3))
+
+        assert len(history) == 3
+        assert history[0].timestamp > history[1].timestamp > history[2].timestamp
+        assert all(location.id is None and location.source == TRACK_SOURCE for location in history)
+
+    def test_history_endpoint_after_compaction(self, client, db_session, factory, package):
+        """The history endpoint answers for compacted sessions, with since filtering."""
+        session = add_session(factory, package)
+        compact_session(db_session, session)
+        db_session.commit()
+        points = track_points(session.track)
+        sender = db_session.get(User, package.sender_id)
+        headers = {"Authorization": f"Bearer {create_access_token({'sub': sender.email})}"}
+        app.dependency_overrides[get_redis] = lambda: None
+
+        response = client.get(f"/api/tracking/sessions/{session.id}/history", headers=headers)
+        assert response.status_code == 200
+        assert len(response.json()) == len(points)
+        assert response.json()[0]["id"] is None
+
+        since = points[-2].timestamp.isoformat()
+        response = client.get(
+            f"/api/tracking/sessions/{session.id}/history", headers=headers, params={"since": since}
+        )
+        assert len(response.json()) == 2
@@ -1,13 +1,21 @@
 """Tests for WebSocket real-time updates functionality."""
 
+import asyncio
 import pytest
+from datetime import datetime
+from unittest.mock import AsyncMock, MagicMock, patch
 from fastapi.testclient import TestClient
+from sqlalchemy.exc import OperationalError
 from starlette.websockets import WebSocketDisconnect
 
 from app.models.user import User, UserRole
 from app.models.notification import Notification, NotificationType
+from app.models.package import Package, PackageStatus
+from app.models.tracking import LocationUpdate, TrackingSession
+from app.utils.tracking_id import generate_tracking_id
 from app.utils.auth import get_password_hash, create_access_token
 from app.routes.ws import set_test_db_session
+from app.services.tracking_context import SessionContext, tracking_context
 
 
 @pytest.fixture(autouse=True)
@@ -163,6 +171,195 @@ class TestWebSocketMessages:
             assert notification.read is True
 
 
+class TestWebSocketLocationUpdates:
+    """Test courier location updates sent over the WebSocket."""
+
+    @pytest.fixture
+    def courier_session(self, client, db_session):
+        """A courier with an active tracking session, and a mocked Redis."""
+        courier = User(
+            email="wscourier@example.com",
+            hashed_password=get_password_hash("password123"),
+            full_name="WS Courier",
+            role=UserRole.COURIER,
+            is_active=True,
+            is_verified=True,
+            max_deviation_km=5
+        )
+        db_session.add(courier)
+        db_session.commit()
+
+        package = Package(
+            tracking_id=generate_tracking_id(),
+            sender_id=courier.id,
+            courier_id=courier.id,
+            description="WS Package",
+            size="small",
+            weight_kg=1.0,
+            price=10.0,
+            status=PackageStatus.IN_TRANSIT,
+            pickup_address="A",
+            dropoff_address="B",
+            pickup_lat=37.7749,
+            pickup_lng=-122.4194,
+            dropoff_lat=37.7849,
+            dropoff_lng=-122.4094,
+            is_active=True
+        )
+        db_session.add(package)
+        db_session.commit()
+
+        session = TrackingSession(
+            package_id=package.id,
+            courier_id=courier.id,
+            is_active=True,
+            started_at=datetime.utcnow()
+        )
+        db_session.add(session)
+        db_session.commit()
+
+        redis = MagicMock()
+        redis.set_json = AsyncMock()
+        redis.set_courier_location = AsyncMock()
+        redis.publish_location_update = AsyncMock()
+        with patch("app.routes.ws.get_redis", AsyncMock(return_value=redis)):
+            yield {
+                "session": session,
+                "token": create_access_token(data={"sub": courier.email}),
+                "client": client,
+                "redis": redis
+            }
+
+    def test_location_update(self, courier_session, db_session):
+        """A location_update message is stored, broadcast and acknowledged with the ETA."""
+        session = courier_session["session"]
+
+        with courier_session["client"].websocket_connect(f"/api/ws?token={courier_session['token']}") as websocket:
+            websocket.receive_json()
+
+            websocket.send_json({
+                "action": "location_update",
+                "session_id": session.id,
+                "latitude": 37.7750,
+                "longitude": -122.4195,
+                "speed_mps": 5.0
+            })
+            data = websocket.receive_json()
+
+        assert data["event_type"] == "location_ack"
+        assert data["accepted"] == 1
+        assert data["distance_remaining_meters"] > 0
+        assert db_session.query(LocationUpdate).filter_by(session_id=session.id).count() == 1
+        courier_session["redis"].publish_location_update.assert_called_once()
+
+    def test_location_update_batch(self, courier_session, db_session):
+        """A location_update message with fixes records the whole batch."""
+        session = courier_session["session"]
+        fixes = [{"latitude": 37.7750 + i * 0.001, "longitude": -122.4195} for i in range(3)]
+
+        with courier_session["client"].websocket_connect(f"/api/ws?token={courier_session['token']}") as websocket:
+            websocket.receive_json()
+
+            websocket.send_json({"action": "location_update", "session_id": session.id, "fixes": fixes})
+            data = websocket.receive_json()
+
+        assert data["event_type"] == "location_ack"
+        assert data["accepted"] == 3
+        assert db_session.query(LocationUpdate).filter_by(session_id=session.id).count() == 3
+
+    def test_location_update_invalid(self, courier_session, db_session):
+        """Invalid coordinates are answered with an error and nothing is stored."""
+        session = courier_session["session"]
+
+        with courier_session["client"].websocket_connect(f"/api/ws?token={courier_session['token']}") as websocket:
+            websocket.receive_json()
+
+            websocket.send_json({
+                "action": "location_update",
+                "session_id": session.id,
+                "latitude": 95.0,
+                "longitude": -122.4195
+            })
+            data = websocket.receive_json()
+
+        assert data["event_type"] == "error"
+        assert db_session.query(LocationUpdate).count() == 0
+
+    def test_location_update_other_courier(self, courier_session, db_session):
+        """Users cannot send locations for sessions that are not theirs."""
+        other = User(
+            email="wsother@example.com",
+            hashed_password=get_password_hash("password123"),
+            full_name="WS Other",
+            role=UserRole.COURIER,
+            is_active=True,
+            is_verified=True,
+            max_deviation_km=5
+        )
+        db_session.add(other)
+        db_session.commit()
+        token = create_access_token(data={"sub": other.email})
+
+        with courier_session["client"].websocket_connect(f"/api/ws?token={token}") as websocket:
+            websocket.receive_json()
+
+            websocket.send_json({
+                "action": "location_update",
+                "session_id": courier_session["session"].id,
+                "latitude": 37.7750,
+                "longitude": -122.4195
+            })
+            data = websocket.receive_json()
+
+        assert data["event_type"] == "error"
+        assert "No active tracking session" in data["message"]
+        assert db_session.query(LocationUpdate).count() == 0
+
+    def test_location_update_with_stale_context(self, courier_session, db_session):
+        """A context cached for another courier is evicted and the fix recorded, as over HTTP."""
+        session = courier_session["session"]
+        package = db_session.get(Package, session.package_id)
+        stale = SessionContext.of(session, package)._replace(courier_id=session.courier_id + 1000)
+        asyncio.run(tracking_context.put(stale))
+
+        with courier_session["client"].websocket_connect(f"/api/ws?token={courier_session['token']}") as websocket:
+            websocket.receive_json()
+
+            websocket.send_json({
+                "action": "location_update",
+                "session_id": session.id,
+                "latitude": 37.7750,
+                "longitude": -122.4195
+            })
+            data = websocket.receive_json()
+
+        assert data["event_type"] == "location_ack"
+        assert db_session.query(LocationUpdate).filter_by(session_id=session.id).count() == 1
+
+    def test_location_update_database_error(self, courier_session, db_session):
+        """A failed write is answered with an error and the socket stays usable."""
+        session = courier_session["session"]
+        message = {"action": "location_update", "session_id": session.id, "latitude": 37.7750, "longitude": -122.4195}
+
+        with courier_session["client"].websocket_connect(f"/api/ws?token={courier_session['token']}") as websocket:
+            websocket.receive_json()
+
+            with patch(
+                "app.routes.ws.TrackingService.record_locations",
+                AsyncMock(side_effect=OperationalError("INSERT", {}, Exception("database is locked")))
+            ):
+                websocket.send_json(message)
+                error = websocket.receive_json()
+
+            websocket.send_json(message)
+            ack = websocket.receive_json()
+
+        assert error["event_type"] == "error"
+        assert error["message"] == "Location update could not be recorded"
+        assert ack["event_type"] == "location_ack"
+        assert db_session.query(LocationUpdate).filter_by(session_id=session.id).count() == 1
+
+
 class TestConnectionManager:
     """Test the WebSocket connection manager."""
 